@@ -0,0 +1,491 @@
+"""
+Runs a reproducible load test of the API in-process and compares it with a saved baseline.
+
+The application is driven through `httpx.ASGITransport`, with no server or network in between.
+Speech comes from the deterministic engine in `benchmarks.fake_tts`, and the database from the
+in-memory stand-in in `benchmarks.prisma_standin`, which adds a fixed round trip to every query.
+Pass `--database-url` to use the generated Prisma client against a real, migrated database
+instead. Texts are generated from a seed, so every run sends the same requests.
+
+Each scenario sends `--requests` requests, `--concurrency` at a time, and reports latency
+percentiles, throughput, errors and the peak resident memory of the process while it ran:
+
+    short, medium, long   synthesis of distinct texts of about 10, 80 and 500 words
+    repeat                the same medium text again and again, served by the caches
+    ssml                  SSML documents with breaks, prosody and say-as
+    batch                 batches of 16 texts, a quarter of them duplicates
+    stream                streamed synthesis, read to the last byte
+    login                 a storm of logins for a few users, at the configured bcrypt cost
+    audio                 audio lookups and ranged reads of finished clips
+
+    python -m benchmarks.api_suite --requests 100 --output results.json
+    python -m benchmarks.api_suite --save-baseline baseline.json
+    python -m benchmarks.api_suite --baseline baseline.json --tolerance 0.1
+
+With `--baseline`, the run fails with exit status 1 when a scenario's p95 latency or peak memory
+grows, or its throughput drops, by more than the tolerance. Baselines only compare meaningfully
+on the same machine and settings, which are stored with the results.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import secrets
+import sys
+import tempfile
+import threading
+import time
+
+SCENARIOS = (
+    "short",
+    "medium",
+    "long",
+    "repeat",
+    "ssml",
+    "batch",
+    "stream",
+    "login",
+    "audio",
+)
+
+_WORDS = (
+    "the morning train left the station on time while rain fell across quiet streets and "
+    "every passenger watched small towns drift past beside rivers fields and old bridges "
+    "before the city lights appeared beyond the hills"
+).split()
+
+_PASSWORD = "correct horse battery staple"
+
+
+def _sentence(rng, words):
+    picked = [rng.choice(_WORDS) for _ in range(words)]
+    return " ".join(picked).capitalize() + rng.choice([".", ".", ".", "?", "!"])
+
+
+def build_text(seed, words):
+    """
+    Builds a text of about `words` words in sentences of 6 to 20 words, the same for a seed.
+    """
+    rng = random.Random(seed)
+    sentences = []
+    remaining = words
+    while remaining > 0:
+        length = min(remaining, rng.randrange(6, 21))
+        sentences.append(_sentence(rng, length))
+        remaining -= length
+    # A number keeps texts of the same seed family distinct after normalization.
+    return f"Item {seed}. " + " ".join(sentences)
+
+
+def build_ssml(seed):
+    rng = random.Random(seed)
+    return (
+        "<speak>"
+        f"<p><s>{_sentence(rng, 10)}</s><s>{_sentence(rng, 8)}</s></p>"
+        '<break time="300ms"/>'
+        f'<prosody rate="fast" pitch="+10%">{_sentence(rng, 12)}</prosody>'
+        f'<say-as interpret-as="cardinal">{seed}</say-as>'
+        f'<prosody volume="soft">{_sentence(rng, 9)}</prosody>'
+        "</speak>"
+    )
+
+
+class MemorySampler:
+    """
+    Samples the resident set size of this process from a background thread, so peaks can be
+    told apart per scenario; `ru_maxrss` only holds the peak of the whole process.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def current(self):
+        try:
+            with open("/proc/self/statm") as statm:
+                return int(statm.read().split()[1]) * self._page_size
+        except OSError:
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS.
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024
+
+    def reset(self):
+        self.peak = self.current()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.peak = max(self.peak, self.current())
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(
+        len(sorted_values) - 1, max(0, int(fraction * len(sorted_values) + 0.5) - 1)
+    )
+    return sorted_values[index]
+
+
+def _failed(response):
+    # Synthesis reports its failures in the body of a 200 response.
+    if response.headers.get("content-type", "").startswith("application/json"):
+        return response.json().get("success") is False
+    return False
+
+
+class Suite:
+    def __init__(self, client, args):
+        self.client = client
+        self.args = args
+        self.users = []
+        self.clips = []
+
+    async def setup(self):
+        for index in range(self.args.users):
+            email = f"bench{index}@example.com"
+            response = await self.client.post(
+                "/users/register", params={"email": email, "password": _PASSWORD}
+            )
+            response.raise_for_status()
+            user_id = response.json()["user_id"]
+            response = await self.client.post(
+                "/users/login", params={"email": email, "password": _PASSWORD}
+            )
+            response.raise_for_status()
+            token = response.json()["access_token"]
+            self.users.append((user_id, email, {"Authorization": f"Bearer {token}"}))
+        # Clips for the audio scenario go through the job queue, which records them.
+        for index in range(self.args.clips):
+            params = self._params(index, build_text(900000 + index, 40))
+            headers = self._user(index)[2]
+            response = await self.client.post(
+                "/tts/synthesize",
+                params={**params, "asynchronous": True},
+                headers=headers,
+            )
+            response.raise_for_status()
+            self.clips.append((response.json()["request_id"], headers))
+        for request_id, headers in self.clips:
+            while True:
+                response = await self.client.get(
+                    f"/audio/{request_id}", headers=headers
+                )
+                status = response.json()["status"]
+                if status not in ("pending", "running"):
+                    break
+                await asyncio.sleep(0.01)
+            if status != "done":
+                raise RuntimeError(f"Clip {request_id} finished as {status}")
+
+    def _user(self, index):
+        return self.users[index % len(self.users)]
+
+    def _params(self, index, text_input, ssml_input=""):
+        user_id = self._user(index)[0]
+        return {
+            "user_id": user_id,
+            "text_input": text_input,
+            "ssml_input": ssml_input,
+            "voice_type": "female" if index % 2 else "male",
+            "speed": 180,
+            "pitch": 50,
+            "volume": 1.0,
+        }
+
+    async def _synthesize(self, index, text_input, ssml_input=""):
+        return await self.client.post(
+            "/tts/synthesize",
+            params=self._params(index, text_input, ssml_input),
+            headers=self._user(index)[2],
+        )
+
+    async def short(self, index):
+        return await self._synthesize(index, build_text(self._seed(index), 10))
+
+    async def medium(self, index):
+        return await self._synthesize(index, build_text(self._seed(index), 80))
+
+    async def long(self, index):
+        return await self._synthesize(index, build_text(self._seed(index), 500))
+
+    async def repeat(self, index):
+        return await self._synthesize(0, build_text(self.args.seed, 80))
+
+    async def ssml(self, index):
+        return await self._synthesize(index, "", build_ssml(self._seed(index)))
+
+    async def batch(self, index):
+        user_id, _, headers = self._user(index)
+        items = [
+            {
+                "text_input": build_text(self._seed(index) * 16 + item % 12, 30),
+                "voice_type": "male",
+            }
+            for item in range(16)
+        ]
+        return await self.client.post(
+            "/tts/batch",
+            json={"user_id": user_id, "items": items},
+            headers=headers,
+        )
+
+    async def stream(self, index):
+        async with self.client.stream(
+            "POST",
+            "/tts/synthesize/stream",
+            params=self._params(index, build_text(self._seed(index), 120)),
+            headers=self._user(index)[2],
+        ) as response:
+            async for _ in response.aiter_bytes():
+                pass
+        return response
+
+    async def login(self, index):
+        _, email, _ = self._user(index)
+        return await self.client.post(
+            "/users/login", params={"email": email, "password": _PASSWORD}
+        )
+
+    async def audio(self, index):
+        request_id, headers = self.clips[index % len(self.clips)]
+        if index % 2:
+            return await self.client.get(f"/audio/{request_id}", headers=headers)
+        return await self.client.get(
+            f"/audio/{request_id}/content",
+            headers={**headers, "Range": "bytes=0-16383"},
+        )
+
+    def _seed(self, index):
+        # Distinct per run position, scenario and index, and the same on every run.
+        return self.args.seed * 1000003 + self._scenario_offset + index
+
+    async def run(self, name, memory):
+        self._scenario_offset = (SCENARIOS.index(name) + 1) * 100000
+        scenario = getattr(self, name)
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        latencies = []
+        errors = []
+
+        async def one(index):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await scenario(index)
+                except Exception as e:
+                    errors.append(repr(e))
+                    return
+                latencies.append(time.perf_counter() - started)
+                if response.status_code >= 400:
+                    errors.append(f"HTTP {response.status_code}")
+                elif _failed(response):
+                    errors.append(response.json().get("message"))
+
+        memory.reset()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(index) for index in range(self.args.requests)))
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        return {
+            "requests": self.args.requests,
+            "errors": len(errors),
+            "first_error": errors[0] if errors else None,
+            "seconds": round(elapsed, 4),
+            "throughput_rps": round(self.args.requests / elapsed, 2),
+            "p50_ms": round(_percentile(latencies, 0.50) * 1000, 2),
+            "p95_ms": round(_percentile(latencies, 0.95) * 1000, 2),
+            "p99_ms": round(_percentile(latencies, 0.99) * 1000, 2),
+            "peak_rss_mb": round(memory.peak / 1024 / 1024, 1),
+        }
+
+
+def _configure(args, workdir):
+    # Configuration is read at import time, so it is set before importing the project.
+    os.environ.update(
+        {
+            "SPEECH_OUTPUT_DIR": os.path.join(workdir, "speech_outputs"),
+            "TTS_FRAGMENT_CACHE_DIR": os.path.join(workdir, "fragments"),
+            "TTS_ENGINE_FACTORY": "benchmarks.fake_tts:FakeEngine",
+            "TTS_ENGINE_POOL_SIZE": str(args.pool_size),
+            "TTS_EXECUTION_MODE": "thread",
+            "TTS_OUTPUT_FORMAT": args.output_format,
+            "FAKE_TTS_REALTIME_FACTOR": str(args.realtime_factor),
+            "BCRYPT_ROUNDS": str(args.bcrypt_rounds),
+            "RATE_LIMIT_BACKEND": "memory",
+            "RATE_LIMIT_UNITS_PER_MINUTE": "USER=0",
+            "TTS_ADMISSION_MAX_QUEUED": "100000",
+            "TTS_ENGINE_QUEUE_DEPTH": "100000",
+        }
+    )
+    os.environ.setdefault("JWT_SECRET_KEY", secrets.token_hex(32))
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+        return None
+    import benchmarks.prisma_standin
+
+    schema = os.path.join(os.path.dirname(os.path.dirname(__file__)), "schema.prisma")
+    return benchmarks.prisma_standin.install(schema, args.db_latency_ms / 1000)
+
+
+def _environment(args):
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "database": "postgresql" if args.database_url else "stand-in",
+        "settings": {
+            key: getattr(args, key)
+            for key in (
+                "requests",
+                "concurrency",
+                "users",
+                "seed",
+                "pool_size",
+                "output_format",
+                "realtime_factor",
+                "bcrypt_rounds",
+                "db_latency_ms",
+            )
+        },
+    }
+
+
+async def _main(args):
+    import httpx
+    import project.server
+
+    app = project.server.app
+    memory = MemorySampler()
+    memory.start()
+    results = {}
+    try:
+        async with project.server.lifespan(app):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://bench", timeout=None
+            ) as client:
+                suite = Suite(client, args)
+                await suite.setup()
+                for name in args.scenarios:
+                    results[name] = await suite.run(name, memory)
+                    _print_row(name, results[name])
+    finally:
+        memory.stop()
+    return results
+
+
+def _print_header():
+    print(
+        f"{'scenario':<9} {'reqs':>5} {'errs':>5} {'req/s':>8} {'p50 ms':>9} "
+        f"{'p95 ms':>9} {'p99 ms':>9} {'rss MB':>8}"
+    )
+
+
+def _print_row(name, result):
+    print(
+        f"{name:<9} {result['requests']:>5} {result['errors']:>5} "
+        f"{result['throughput_rps']:>8.1f} {result['p50_ms']:>9.1f} "
+        f"{result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f} {result['peak_rss_mb']:>8.1f}"
+    )
+    if result["first_error"]:
+        print(f"          first error: {result['first_error']}")
+
+
+def compare(results, baseline, tolerance):
+    """
+    Lists the regressions of `results` against `baseline`, as printable lines.
+    """
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        checks = (
+            ("p95_ms", current["p95_ms"] > previous["p95_ms"] * (1 + tolerance)),
+            (
+                "throughput_rps",
+                current["throughput_rps"]
+                < previous["throughput_rps"] * (1 - tolerance),
+            ),
+            (
+                "peak_rss_mb",
+                current["peak_rss_mb"] > previous["peak_rss_mb"] * (1 + tolerance),
+            ),
+            ("errors", current["errors"] > previous["errors"]),
+        )
+        for metric, regressed in checks:
+            if regressed:
+                regressions.append(
+                    f"{name}: {metric} {previous[metric]} -> {current[metric]}"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=4)
+    parser.add_argument("--clips", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--output-format", default="wav")
+    parser.add_argument("--realtime-factor", type=float, default=0.02)
+    parser.add_argument("--bcrypt-rounds", type=int, default=10)
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    parser.add_argument("--database-url")
+    parser.add_argument(
+        "--scenarios",
+        type=lambda value: value.split(","),
+        default=list(SCENARIOS),
+        help="Comma-separated subset of: " + ", ".join(SCENARIOS),
+    )
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--save-baseline", help="Write the results as a new baseline")
+    parser.add_argument("--baseline", help="Compare the results with this baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix="tts-bench-") as workdir:
+        database = _configure(args, workdir)
+        _print_header()
+        results = asyncio.run(_main(args))
+    report = {"environment": _environment(args), "scenarios": results}
+    if database is not None:
+        report["environment"]["database_queries"] = database.queries
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w") as file:
+                json.dump(report, file, indent=2)
+                file.write("\n")
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)
+        if baseline["environment"]["settings"] != report["environment"]["settings"]:
+            print("warning: the baseline was recorded with different settings")
+        regressions = compare(results, baseline["scenarios"], args.tolerance)
+        for line in regressions:
+            print(f"regression: {line}")
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions beyond {args.tolerance:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Measures bulk synthesis into a clip bundle against writing one stored file per clip.
+
+Submits `--prompts` short prompts to `/tts/batch` in batches of `--batch-size`, once as before,
+with every clip stored as a file of its own, and once with `bundle` set, so every batch writes
+a single bundle. For both it reports the batch time, the stored files added and how long
+listing the storage takes afterwards, then the time to download every clip: one request per
+clip from `/audio/{id}/content`, against one request per bundle from `/tts/bundles/{id}`.
+`--reads` random clips are finally fetched one at a time from both layouts to compare
+single-clip latency.
+
+The application is driven through its ASGI interface, with the engine from
+`benchmarks.fake_tts` and the database stand-in, as in `benchmarks.api_suite`. Each layout runs
+in a process and storage directory of its own, so neither sees the rows, files or caches of the
+other.
+
+    python -m benchmarks.clip_bundles --prompts 5000 --batch-size 1000
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import statistics
+import tempfile
+import time
+
+
+def _prompts(seed, count):
+    rng = random.Random(seed)
+    words = ["alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel"]
+    return [
+        f"Prompt {seed}-{index}: " + " ".join(rng.choices(words, k=rng.randint(3, 8)))
+        for index in range(count)
+    ]
+
+
+def _count_files(root):
+    return sum(len(files) for _, _, files in os.walk(root))
+
+
+def _list_seconds():
+    import project.audio_storage
+
+    started = time.perf_counter()
+    count = sum(1 for _ in project.audio_storage.audio_storage.list_objects())
+    return time.perf_counter() - started, count
+
+
+async def _synthesize(client, user_id, headers, prompts, batch_size, bundle):
+    results = []
+    bundles = []
+    for start in range(0, len(prompts), batch_size):
+        response = await client.post(
+            "/tts/batch",
+            json={
+                "user_id": user_id,
+                "items": [
+                    {"text_input": text} for text in prompts[start : start + batch_size]
+                ],
+                "bundle": bundle,
+            },
+            headers=headers,
+        )
+        response.raise_for_status()
+        body = response.json()
+        if not body["success"]:
+            raise RuntimeError(body["message"])
+        results.extend(body["results"])
+        if body["bundle_url"]:
+            bundles.append(body["bundle_url"])
+    return results, bundles
+
+
+async def _download(client, headers, urls, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    total = 0
+
+    async def fetch(url):
+        nonlocal total
+        async with semaphore:
+            response = await client.get(url, headers=headers)
+            response.raise_for_status()
+            total += len(response.content)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(fetch(url) for url in urls))
+    return time.perf_counter() - started, total
+
+
+async def _reads(client, headers, results, count, rng):
+    chosen = rng.choices(results, k=count)
+    # Both layouts are read with their AudioOutput lookups cached, as for repeated plays.
+    for result in chosen:
+        response = await client.head(
+            f"/audio/{result['request_id']}/content", headers=headers
+        )
+        response.raise_for_status()
+    samples = []
+    for result in chosen:
+        started = time.perf_counter()
+        response = await client.get(
+            f"/audio/{result['request_id']}/content", headers=headers
+        )
+        response.raise_for_status()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples), max(samples)
+
+
+async def _main(args, bundle):
+    import httpx
+
+    import benchmarks.api_suite
+    import project.config
+    import project.server
+
+    app = project.server.app
+    rng = random.Random(args.seed)
+    async with project.server.lifespan(app):
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://bench",
+            timeout=None,
+        ) as client:
+            suite = benchmarks.api_suite.Suite(client, args)
+            await suite.setup()
+            user_id, _, headers = suite.users[0]
+            prompts = _prompts(args.seed, args.prompts)
+            before = _count_files(project.config.SPEECH_OUTPUT_DIR)
+            started = time.perf_counter()
+            results, bundles = await _synthesize(
+                client, user_id, headers, prompts, args.batch_size, bundle
+            )
+            batch_seconds = time.perf_counter() - started
+            added = _count_files(project.config.SPEECH_OUTPUT_DIR) - before
+            list_seconds, _ = await asyncio.to_thread(_list_seconds)
+            urls = bundles or [
+                f"/audio/{result['request_id']}/content" for result in results
+            ]
+            fetch_seconds, size = await _download(
+                client, headers, urls, args.concurrency
+            )
+            read_p50, read_max = await _reads(client, headers, results, args.reads, rng)
+            print(
+                f"{'bundle' if bundle else 'files':<8} {batch_seconds:>8.2f} "
+                f"{added:>7} {list_seconds * 1000:>8.1f} {len(urls):>8} "
+                f"{fetch_seconds:>8.2f} {size / 1e6:>7.1f} "
+                f"{read_p50 * 1000:>12.2f} {read_max * 1000:>12.2f}",
+                flush=True,
+            )
+
+
+def _run(args, bundle):
+    import benchmarks.api_suite
+
+    with tempfile.TemporaryDirectory() as workdir:
+        benchmarks.api_suite._configure(args, workdir)
+        asyncio.run(_main(args, bundle))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--prompts", type=int, default=5000)
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument(
+        "--concurrency", type=int, default=16, help="downloads in flight at once"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pool-size", type=int, default=4)
+    parser.add_argument("--output-format", default="wav")
+    parser.add_argument(
+        "--realtime-factor",
+        type=float,
+        default=0.0,
+        help="render time of the fake engine, as a share of the audio duration",
+    )
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    args = parser.parse_args()
+    # Settings Suite.setup and the configuration of benchmarks.api_suite expect.
+    args.users = 1
+    args.clips = 0
+    args.requests = 0
+    args.bcrypt_rounds = 4
+    args.database_url = None
+    print(f"{args.prompts} clips in batches of {args.batch_size}, {args.output_format}")
+    print(
+        f"{'layout':<8} {'batch s':>8} {'files':>7} {'list ms':>8} "
+        f"{'requests':>8} {'fetch s':>8} {'MB':>7} {'read p50 ms':>12} "
+        f"{'read max ms':>12}",
+        flush=True,
+    )
+    # Configuration is read at import time, so every layout gets a fresh interpreter.
+    context = multiprocessing.get_context("spawn")
+    for bundle in (False, True):
+        process = context.Process(target=_run, args=(args, bundle))
+        process.start()
+        process.join()
+        if process.exitcode:
+            raise SystemExit(process.exitcode)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Compares deriving voice variants with NumPy post-processing against re-rendering them.
+
+A set of sentences is rendered once per variant, with the variant's speed, pitch and volume set
+on the engine, as the "engine" voice adjustment mode does. It is then rendered once at the base
+rate and every variant is derived from that render with `project.audio_dsp`, as the "dsp" mode
+does. Both passes report the audio produced per second of wall time. With `--memory`, one long
+fragment is also adjusted under tracemalloc to show that peak memory follows the block size,
+not the length of the audio.
+
+The deterministic engine from `benchmarks.fake_tts` is used unless `--engine-factory` names
+another one; pass an empty string for pyttsx3.
+
+    python -m benchmarks.dsp_throughput --sentences 20 --memory
+"""
+
+import argparse
+import itertools
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+_WORDS = (
+    "the quick brown fox jumps over a lazy dog while our team reviews every report "
+    "before shipping new features to customers around the world"
+).split()
+
+_SPEEDS = (150, 180, 220, 260)
+
+_PITCHES = (40, 50, 65)
+
+_VOLUMES = (0.6, 1.0)
+
+
+def build_sentences(count, seed=1):
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(_WORDS) for _ in range(rng.randrange(8, 24))).capitalize()
+        + "."
+        for _ in range(count)
+    ]
+
+
+def _render(engine, sentence, path, speed, pitch, volume):
+    import project.audio_pcm
+
+    for name, value in (("rate", speed), ("pitch", pitch), ("volume", volume)):
+        if value is not None:
+            engine.setProperty(name, value)
+    engine.save_to_file(sentence, path)
+    engine.runAndWait()
+    return project.audio_pcm.read_wav(path)
+
+
+def _rerender(engine, sentences, variants, workdir):
+    import project.audio_pcm
+
+    seconds = 0.0
+    started = time.perf_counter()
+    for speed, pitch, volume in variants:
+        for sentence in sentences:
+            pcm_format, frames = _render(
+                engine,
+                sentence,
+                os.path.join(workdir, "variant.wav"),
+                speed,
+                pitch,
+                volume,
+            )
+            frames = project.audio_pcm.prepare_chunk(pcm_format, frames)
+            seconds += len(frames) / pcm_format.frame_size / pcm_format.frame_rate
+    return time.perf_counter() - started, seconds
+
+
+def _post_process(engine, sentences, variants, workdir):
+    import project.audio_dsp
+    import project.config
+    import project.synthesis_plan
+
+    seconds = 0.0
+    started = time.perf_counter()
+    bases = []
+    for sentence in sentences:
+        pcm_format, frames = _render(
+            engine,
+            sentence,
+            os.path.join(workdir, "base.wav"),
+            project.config.TTS_DSP_BASE_RATE,
+            project.config.TTS_DSP_BASE_PITCH,
+            1.0,
+        )
+        bases.append((pcm_format, project.audio_dsp.prepare_chunk(pcm_format, frames)))
+    for speed, pitch, volume in variants:
+        adjustment = project.audio_dsp.voice_adjustment(
+            speed, pitch, volume, project.synthesis_plan.DEFAULT_PROSODY
+        )
+        for pcm_format, frames in bases:
+            for block in project.audio_dsp.adjust(
+                pcm_format, memoryview(frames), adjustment
+            ):
+                seconds += len(block) / pcm_format.frame_size / pcm_format.frame_rate
+    return time.perf_counter() - started, seconds
+
+
+def _peak_memory(minutes):
+    import numpy
+
+    import project.audio_dsp
+    import project.audio_pcm
+
+    pcm_format = project.audio_pcm.PcmFormat(1, 2, 22050)
+    count = int(minutes * 60 * pcm_format.frame_rate)
+    phase = numpy.arange(count) * (2 * numpy.pi * 180 / pcm_format.frame_rate)
+    frames = (8000 * numpy.sin(phase)).astype("<i2").tobytes()
+    del phase
+    adjustment = project.audio_dsp.VoiceAdjustment(tempo=1.2, pitch=1.1, gain=0.8)
+    tracemalloc.start()
+    produced = 0
+    for block in project.audio_dsp.adjust(pcm_format, memoryview(frames), adjustment):
+        produced += len(block)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(frames), produced, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sentences", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--engine-factory",
+        default="benchmarks.fake_tts:FakeEngine",
+        help='engine factory as "module:attribute"; empty for pyttsx3',
+    )
+    parser.add_argument(
+        "--realtime-factor",
+        type=float,
+        default=0.05,
+        help="render time of the fake engine, as a share of the audio duration",
+    )
+    parser.add_argument(
+        "--memory", action="store_true", help="also measure peak memory"
+    )
+    parser.add_argument("--memory-minutes", type=float, default=10.0)
+    args = parser.parse_args()
+    # Configuration is read at import time, so it is set before importing the project.
+    os.environ["TTS_ENGINE_FACTORY"] = args.engine_factory
+    os.environ["FAKE_TTS_REALTIME_FACTOR"] = str(args.realtime_factor)
+    import project.config
+    import project.engine_pool
+
+    engine = project.engine_pool.create_engine(project.config.TTS_DRIVER_NAME)
+    sentences = build_sentences(args.sentences, args.seed)
+    variants = list(itertools.product(_SPEEDS, _PITCHES, _VOLUMES))
+    print(f"{len(sentences)} sentences, {len(variants)} voice variants")
+    print(f"{'pass':<10} {'seconds':>8} {'audio s':>9} {'x realtime':>11}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, run in (("re-render", _rerender), ("dsp", _post_process)):
+            elapsed, seconds = run(engine, sentences, variants, workdir)
+            print(
+                f"{name:<10} {elapsed:>8.2f} {seconds:>9.1f} {seconds / elapsed:>11.1f}"
+            )
+    if args.memory:
+        size, produced, peak = _peak_memory(args.memory_minutes)
+        print(
+            f"peak memory: {peak / 2**20:,.1f} MiB adjusting {size / 2**20:,.1f} MiB "
+            f"into {produced / 2**20:,.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
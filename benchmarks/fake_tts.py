@@ -0,0 +1,133 @@
+"""
+A deterministic stand-in for a pyttsx3 engine, for benchmarks that must run on any Linux box.
+
+Plug it in with `TTS_ENGINE_FACTORY=benchmarks.fake_tts:FakeEngine`. Each rendered text becomes
+a 16-bit mono WAV whose length follows the word count and speech rate, made of one tone burst
+per word separated by short gaps, with a little silence at both ends like real engines leave.
+The same text and properties always produce the same bytes.
+
+Rendering sleeps for `FAKE_TTS_REALTIME_FACTOR` times the audio duration (0.05 by default, i.e.
+20x faster than real time), standing in for the CPU time of a native engine, which does not
+hold the GIL either.
+"""
+
+import array
+import math
+import os
+import sys
+import time
+import wave
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+FRAME_RATE = 22050
+
+# Silence engines typically leave before and after speech.
+_EDGE_SECONDS = 0.05
+
+# Gap between words, as a share of one word's duration.
+_GAP_SHARE = 0.25
+
+
+@dataclass
+class FakeVoice:
+    id: str
+    name: str
+    languages: List[str] = field(default_factory=list)
+    gender: Optional[str] = None
+    age: Optional[int] = None
+
+
+VOICES = [
+    FakeVoice("fake.male", "Fake Male", ["en-us"], "male"),
+    FakeVoice("fake.female", "Fake Female", ["en-us"], "female"),
+    FakeVoice("fake.neutral", "Fake Neutral", ["en-gb"], "neutral"),
+]
+
+# Tone of each voice, in Hz.
+_VOICE_PITCH = {"fake.male": 140.0, "fake.female": 220.0, "fake.neutral": 180.0}
+
+# (frequency, volume, frames) -> 16-bit samples of one word, shared by all engines.
+_bursts: Dict[Tuple[float, float, int], bytes] = {}
+
+
+def _burst(frequency: float, volume: float, frames: int) -> bytes:
+    key = (round(frequency, 1), round(volume, 3), frames)
+    samples = _bursts.get(key)
+    if samples is None:
+        amplitude = 12000 * max(0.0, min(1.0, volume))
+        values = array.array(
+            "h",
+            (
+                int(
+                    amplitude
+                    * math.sin(math.pi * index / frames)
+                    * math.sin(2 * math.pi * frequency * index / FRAME_RATE)
+                )
+                for index in range(frames)
+            ),
+        )
+        if sys.byteorder == "big":
+            values.byteswap()
+        samples = _bursts[key] = values.tobytes()
+    return samples
+
+
+class FakeEngine:
+    """
+    Implements the part of the pyttsx3 engine interface the engine pool uses.
+    """
+
+    def __init__(self, driver_name: Optional[str] = None):
+        self.realtime_factor = float(os.environ.get("FAKE_TTS_REALTIME_FACTOR", "0.05"))
+        self._properties = {
+            "voices": list(VOICES),
+            "voice": VOICES[0].id,
+            "rate": 200,
+            "volume": 1.0,
+            "pitch": 50,
+        }
+        self._queued: List[Tuple[str, str, dict]] = []
+
+    def getProperty(self, name: str):
+        return self._properties[name]
+
+    def setProperty(self, name: str, value) -> None:
+        if name == "voices":
+            raise KeyError(name)
+        self._properties[name] = value
+
+    def save_to_file(self, text: str, path: str) -> None:
+        self._queued.append((text, path, dict(self._properties)))
+
+    def runAndWait(self) -> None:
+        queued, self._queued = self._queued, []
+        for text, path, properties in queued:
+            seconds = self._render(text, path, properties)
+            time.sleep(seconds * self.realtime_factor)
+
+    def _render(self, text: str, path: str, properties: dict) -> float:
+        words = text.split()
+        rate = max(1.0, float(properties.get("rate") or 200))
+        word_frames = int(FRAME_RATE * 60 / rate / (1 + _GAP_SHARE))
+        gap = bytes(2 * int(word_frames * _GAP_SHARE))
+        edge = bytes(2 * int(FRAME_RATE * _EDGE_SECONDS))
+        frequency = _VOICE_PITCH.get(str(properties.get("voice")), 160.0) * (
+            0.5 + float(properties.get("pitch") or 50) / 100
+        )
+        volume = float(properties.get("volume", 1.0))
+        parts = [edge]
+        for index, word in enumerate(words):
+            # Longer words are spoken a little longer, so the audio follows the text.
+            frames = word_frames * (4 + min(len(word), 12)) // 8
+            parts.append(_burst(frequency, volume, frames))
+            if index < len(words) - 1:
+                parts.append(gap)
+        parts.append(edge)
+        audio = b"".join(parts)
+        with wave.open(path, "wb") as output:
+            output.setnchannels(1)
+            output.setsampwidth(2)
+            output.setframerate(FRAME_RATE)
+            output.writeframes(audio)
+        return len(audio) / 2 / FRAME_RATE
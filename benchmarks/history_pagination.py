@@ -0,0 +1,199 @@
+"""
+Measures reading the TTS request history deep into a table of millions of rows.
+
+Seeds PostgreSQL with `--rows` TTS requests spread over `--users` users, with an AudioOutput
+row for every finished one, then reads pages of one user's history at increasing depths two
+ways: with the keyset cursors of `project.list_tts_history_service`, and with OFFSET, as a
+`skip` on the same queries. Keyset pages cost the same at any depth; OFFSET pages read and throw
+away every row before them. `--drop-index` repeats the keyset pass without the
+(userId, createdAt, id) index, and `--explain` prints the query plan of a deep keyset page.
+
+This needs a real database, since the in-memory stand-in has no indexes: set DATABASE_URL to a
+database whose schema was created with `prisma db push`. Seeded rows belong to users named
+`history-bench-*` and are deleted afterwards unless `--keep` is given; `--reuse` skips seeding
+when they are already there.
+
+    DATABASE_URL=postgresql://... python -m benchmarks.history_pagination --rows 2000000
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+_PREFIX = "history-bench-"
+
+_INDEX = '"TTSRequest_userId_createdAt_id_idx"'
+
+
+async def _seed(db, rows, users):
+    await db.execute_raw(
+        'INSERT INTO "User" (id, email, password, "updatedAt") '
+        f"SELECT '{_PREFIX}' || g, '{_PREFIX}' || g || '@example.com', '', now() "
+        "FROM generate_series(1, $1::int) AS g ON CONFLICT DO NOTHING",
+        users,
+    )
+    # Every user gets an equal share; one request in ten failed and has no audio.
+    await db.execute_raw(
+        'INSERT INTO "TTSRequest" (id, "userId", "textInput", status, "createdAt", "updatedAt") '
+        f"SELECT gen_random_uuid(), '{_PREFIX}' || (1 + g % $2::int), "
+        "'Benchmark sentence number ' || g || '.', "
+        "(CASE WHEN g % 10 = 0 THEN 'FAILED' ELSE 'DONE' END)::\"TTSRequestStatus\", "
+        "now() - g * interval '1 second', now() "
+        "FROM generate_series(1, $1::int) AS g",
+        rows,
+        users,
+    )
+    await db.execute_raw(
+        'INSERT INTO "AudioOutput" (id, "ttsRequestId", "fileType", "filePath") '
+        "SELECT gen_random_uuid(), r.id, 'MP3', 'bench/' || r.id || '.mp3' "
+        'FROM "TTSRequest" r '
+        f"WHERE r.\"userId\" LIKE '{_PREFIX}%' AND r.status = 'DONE'"
+    )
+    await db.execute_raw('ANALYZE "User", "TTSRequest", "AudioOutput"')
+
+
+async def _seeded(db):
+    rows = await db.query_raw(
+        'SELECT count(*)::int AS count FROM "TTSRequest" '
+        f"WHERE \"userId\" LIKE '{_PREFIX}%'"
+    )
+    return rows[0]["count"]
+
+
+async def _cleanup(db):
+    await db.execute_raw(f'DELETE FROM "TTSRequest" WHERE "userId" LIKE \'{_PREFIX}%\'')
+    await db.execute_raw(f"DELETE FROM \"User\" WHERE id LIKE '{_PREFIX}%'")
+
+
+async def _keyset(user_id, page_size, depths):
+    import project.list_tts_history_service
+
+    timings = {}
+    cursor = None
+    page = 0
+    while page <= max(depths):
+        started = time.perf_counter()
+        result = await project.list_tts_history_service.list_tts_history(
+            user_id, page_size, cursor
+        )
+        if page in depths:
+            timings[page] = time.perf_counter() - started
+        cursor = result.next_cursor
+        if cursor is None:
+            break
+        page += 1
+    return timings, cursor
+
+
+async def _offset(user_id, page_size, depths, repeat):
+    import prisma.models
+
+    timings = {}
+    for depth in depths:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            requests = await prisma.models.TTSRequest.prisma().find_many(
+                where={"userId": user_id},
+                order=[{"createdAt": "desc"}, {"id": "desc"}],
+                skip=depth * page_size,
+                take=page_size + 1,
+            )
+            await prisma.models.AudioOutput.prisma().find_many(
+                where={"ttsRequestId": {"in": [request.id for request in requests]}}
+            )
+            samples.append(time.perf_counter() - started)
+        timings[depth] = statistics.median(samples)
+    return timings
+
+
+async def _explain(db, user_id, page_size, cursor):
+    import project.list_tts_history_service
+
+    created_at, id = project.list_tts_history_service.decode_cursor(cursor)
+    plan = await db.query_raw(
+        "EXPLAIN (ANALYZE, BUFFERS) "
+        'SELECT * FROM "TTSRequest" WHERE "userId" = $1 '
+        'AND "createdAt" <= $2::timestamp '
+        'AND ("createdAt" < $2::timestamp OR id < $3) '
+        'ORDER BY "createdAt" DESC, id DESC LIMIT $4::int',
+        user_id,
+        created_at.isoformat(),
+        id,
+        page_size + 1,
+    )
+    for row in plan:
+        print("  " + row["QUERY PLAN"])
+
+
+def _report(name, timings):
+    for depth, seconds in sorted(timings.items()):
+        print(f"{name:<18} {depth:>8} {seconds * 1000:>10.2f}")
+
+
+async def _run(args):
+    import project.database
+
+    db = project.database.create_client()
+    await db.connect()
+    try:
+        seeded = await _seeded(db) if args.reuse else 0
+        if seeded:
+            print(f"reusing {seeded:,} seeded requests")
+        else:
+            await _cleanup(db)
+            started = time.perf_counter()
+            await _seed(db, args.rows, args.users)
+            print(
+                f"seeded {args.rows:,} requests for {args.users:,} users "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+        user_id = f"{_PREFIX}1"
+        depths = sorted(set(args.depths))
+        print(f"{'pass':<18} {'page':>8} {'ms':>10}")
+        timings, cursor = await _keyset(user_id, args.page_size, depths)
+        _report("keyset", timings)
+        _report("offset", await _offset(user_id, args.page_size, depths, args.repeat))
+        if args.explain and cursor:
+            print("plan of the deepest keyset page:")
+            await _explain(db, user_id, args.page_size, cursor)
+        if args.drop_index:
+            await db.execute_raw(f"DROP INDEX IF EXISTS {_INDEX}")
+            try:
+                timings, _ = await _keyset(user_id, args.page_size, depths)
+                _report("keyset, no index", timings)
+            finally:
+                await db.execute_raw(
+                    f'CREATE INDEX {_INDEX} ON "TTSRequest" ("userId", "createdAt", id)'
+                )
+    finally:
+        if not args.keep:
+            await _cleanup(db)
+        await db.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument(
+        "--depths",
+        type=int,
+        nargs="+",
+        default=[0, 10, 50, 100, 190],
+        help="pages to time, counted from the newest",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs of every OFFSET page"
+    )
+    parser.add_argument("--explain", action="store_true")
+    parser.add_argument("--drop-index", action="store_true")
+    parser.add_argument("--reuse", action="store_true")
+    parser.add_argument("--keep", action="store_true")
+    asyncio.run(_run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
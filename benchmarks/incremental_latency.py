@@ -0,0 +1,238 @@
+"""
+Measures the latency of incremental synthesis over a WebSocket against buffering whole texts.
+
+A producer sends a text a word at a time at `--tokens-per-second`, as generated text or live
+captions arrive, to `/tts/synthesize/incremental`, and reads the audio sent back. For every
+session it reports the time from the first token to the first audio byte and from the last
+token to the last audio byte. The same texts are then sent the way producers had to before:
+buffered until the last token, then synthesized with `/tts/synthesize/stream`, where both
+latencies start counting at the last token.
+
+The application runs in-process, driven through its ASGI interface, with the engine from
+`benchmarks.fake_tts` and the database stand-in, as in `benchmarks.api_suite`. The client
+side of the socket holds at most `--buffer-messages` undelivered messages, like a transport
+buffer, and `--read-delay-ms` slows its reading down to show backpressure: the report then
+includes how many text messages the server left unread at most.
+
+    python -m benchmarks.incremental_latency --sessions 5 --words 120
+    python -m benchmarks.incremental_latency --read-delay-ms 200
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import tempfile
+import time
+import urllib.parse
+
+
+class _Session:
+    """
+    The client of one WebSocket session, talking to the ASGI application directly.
+    """
+
+    def __init__(self, app, query, token, buffer_messages, read_delay):
+        self.app = app
+        self.query = query
+        self.token = token
+        self.inbound = asyncio.Queue()
+        self.outbound = asyncio.Queue(maxsize=buffer_messages)
+        self.read_delay = read_delay
+        self.first_byte_at = None
+        self.last_byte_at = None
+        self.audio_bytes = 0
+        self.max_unread = 0
+        self.result = None
+
+    async def run(self, tokens, interval):
+        scope = {
+            "type": "websocket",
+            "asgi": {"version": "3.0"},
+            "scheme": "ws",
+            "path": "/tts/synthesize/incremental",
+            "raw_path": b"/tts/synthesize/incremental",
+            "root_path": "",
+            "query_string": urllib.parse.urlencode(self.query).encode(),
+            "headers": [(b"authorization", f"Bearer {self.token}".encode())],
+            "subprotocols": [],
+            "client": ("127.0.0.1", 50000),
+            "server": ("bench", 80),
+        }
+        await self.inbound.put({"type": "websocket.connect"})
+        app = asyncio.create_task(self.app(scope, self.inbound.get, self.outbound.put))
+        try:
+            message = await self.outbound.get()
+            if message["type"] != "websocket.accept":
+                raise RuntimeError(f"Session refused: {message}")
+            reader = asyncio.create_task(self._read())
+            started = time.perf_counter()
+            for token in tokens:
+                await self._send({"text": token})
+                await asyncio.sleep(interval)
+            last_token_at = time.perf_counter()
+            await self._send({"end": True})
+            await reader
+        finally:
+            await self.inbound.put({"type": "websocket.disconnect", "code": 1000})
+            await app
+        if self.result is None or self.result.get("event") != "done":
+            raise RuntimeError(f"Session failed: {self.result}")
+        return (
+            self.first_byte_at - started,
+            self.last_byte_at - last_token_at,
+            self.max_unread,
+        )
+
+    async def _send(self, message):
+        await self.inbound.put(
+            {"type": "websocket.receive", "text": json.dumps(message)}
+        )
+        self.max_unread = max(self.max_unread, self.inbound.qsize())
+
+    async def _read(self):
+        while True:
+            message = await self.outbound.get()
+            if message["type"] == "websocket.close":
+                return
+            if message.get("bytes"):
+                now = time.perf_counter()
+                self.first_byte_at = self.first_byte_at or now
+                self.last_byte_at = now
+                self.audio_bytes += len(message["bytes"])
+                if self.read_delay:
+                    await asyncio.sleep(self.read_delay)
+            elif message.get("text"):
+                self.result = json.loads(message["text"])
+
+
+def _tokens(text):
+    words = text.split(" ")
+    return [words[0]] + [" " + word for word in words[1:]]
+
+
+async def _buffered(client, params, headers, tokens, interval):
+    # The producer only calls once the whole text has arrived.
+    started = time.perf_counter()
+    await asyncio.sleep(interval * len(tokens))
+    last_token_at = time.perf_counter()
+    first_byte_at = None
+    async with client.stream(
+        "POST", "/tts/synthesize/stream", params=params, headers=headers
+    ) as response:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes():
+            if chunk and first_byte_at is None:
+                first_byte_at = time.perf_counter()
+    return first_byte_at - started, time.perf_counter() - last_token_at
+
+
+def _summary(name, first, tail, unread=None):
+    line = (
+        f"{name:<12} {statistics.median(first) * 1000:>10.0f} "
+        f"{max(first) * 1000:>10.0f} {statistics.median(tail) * 1000:>10.0f} "
+        f"{max(tail) * 1000:>10.0f}"
+    )
+    if unread is not None:
+        line += f" {max(unread):>8}"
+    print(line)
+
+
+async def _main(args):
+    import httpx
+
+    import benchmarks.api_suite
+    import project.server
+
+    app = project.server.app
+    interval = 1 / args.tokens_per_second
+    async with project.server.lifespan(app):
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url="http://bench",
+            timeout=None,
+        ) as client:
+            suite = benchmarks.api_suite.Suite(client, args)
+            await suite.setup()
+            texts = [
+                benchmarks.api_suite.build_text(args.seed * 1000 + index, args.words)
+                for index in range(args.sessions)
+            ]
+            print(
+                f"{args.sessions} sessions of {args.words} words at "
+                f"{args.tokens_per_second:g} words/s"
+            )
+            print(
+                f"{'mode':<12} {'first p50':>10} {'first max':>10} "
+                f"{'tail p50':>10} {'tail max':>10} {'unread':>8}"
+            )
+            first, tail, unread = [], [], []
+            for index, text in enumerate(texts):
+                user_id, _, headers = suite.users[index % len(suite.users)]
+                params = suite._params(index, text)
+                query = {
+                    key: params[key]
+                    for key in ("user_id", "voice_type", "speed", "pitch", "volume")
+                }
+                query["output_format"] = args.output_format
+                session = _Session(
+                    app,
+                    query,
+                    headers["Authorization"].split(" ", 1)[1],
+                    args.buffer_messages,
+                    args.read_delay_ms / 1000,
+                )
+                times = await session.run(_tokens(text), interval)
+                first.append(times[0])
+                tail.append(times[1])
+                unread.append(times[2])
+            _summary("incremental", first, tail, unread)
+            first, tail = [], []
+            for index, text in enumerate(texts):
+                # Texts of their own, so sentences cached by the sessions above do not help.
+                text = benchmarks.api_suite.build_text(
+                    args.seed * 1000 + args.sessions + index, args.words
+                )
+                _, _, headers = suite.users[index % len(suite.users)]
+                params = suite._params(index, text)
+                params["output_format"] = args.output_format
+                times = await _buffered(
+                    client, params, headers, _tokens(text), interval
+                )
+                first.append(times[0])
+                tail.append(times[1])
+            _summary("buffered", first, tail)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--sessions", type=int, default=5)
+    parser.add_argument("--words", type=int, default=120)
+    parser.add_argument("--tokens-per-second", type=float, default=30.0)
+    parser.add_argument("--read-delay-ms", type=float, default=0.0)
+    parser.add_argument("--buffer-messages", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--pool-size", type=int, default=2)
+    parser.add_argument("--output-format", default="wav")
+    parser.add_argument(
+        "--realtime-factor",
+        type=float,
+        default=0.05,
+        help="render time of the fake engine, as a share of the audio duration",
+    )
+    parser.add_argument("--db-latency-ms", type=float, default=1.0)
+    args = parser.parse_args()
+    # Settings Suite.setup and the configuration of benchmarks.api_suite expect.
+    args.users = 1
+    args.clips = 0
+    args.bcrypt_rounds = 4
+    args.database_url = None
+    import benchmarks.api_suite
+
+    with tempfile.TemporaryDirectory() as workdir:
+        benchmarks.api_suite._configure(args, workdir)
+        asyncio.run(_main(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Measures event-loop latency while a storm of password verifications is in progress.
+
+Runs the same burst of bcrypt checks twice: once calling `bcrypt.checkpw` directly on the event
+loop, as login handling used to, and once through `project.password_hashing`, which runs them on
+the bounded hashing pool. A ticker task that wakes every few milliseconds records how late each
+wake-up is; that lateness is what every other request on the worker would see.
+
+    python -m benchmarks.login_storm --logins 50 --rounds 12 --threads 2
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def _ticker(lags, stop, interval):
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - expected))
+
+
+async def _storm(mode, logins, password, hashed):
+    import bcrypt
+    import project.password_hashing
+
+    async def inline():
+        return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+    async def offloaded():
+        return await project.password_hashing.verify_password(password, hashed)
+
+    check = inline if mode == "inline" else offloaded
+    results = await asyncio.gather(*(check() for _ in range(logins)))
+    assert all(results)
+
+
+async def _run(mode, logins, password, hashed, interval):
+    lags = []
+    stop = asyncio.Event()
+    ticker = asyncio.create_task(_ticker(lags, stop, interval))
+    await asyncio.sleep(interval * 2)
+    started = time.perf_counter()
+    await _storm(mode, logins, password, hashed)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await ticker
+    return elapsed, lags
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--logins", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--interval-ms", type=float, default=5.0)
+    args = parser.parse_args()
+    # Configuration is read at import time, so it is set before importing the project.
+    os.environ["BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ["PASSWORD_HASH_THREADS"] = str(args.threads)
+    import bcrypt
+
+    password = "correct horse battery staple"
+    hashed = bcrypt.hashpw(
+        password.encode("utf-8"), bcrypt.gensalt(rounds=args.rounds)
+    ).decode("utf-8")
+    print(
+        f"{args.logins} logins, bcrypt cost {args.rounds}, {args.threads} hashing threads"
+    )
+    print(
+        f"{'mode':<10} {'total s':>8} {'logins/s':>9} "
+        f"{'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}"
+    )
+    for mode in ("inline", "offloaded"):
+        elapsed, lags = asyncio.run(
+            _run(mode, args.logins, password, hashed, args.interval_ms / 1000)
+        )
+        lags_ms = [lag * 1000 for lag in lags] or [0.0]
+        print(
+            f"{mode:<10} {elapsed:>8.2f} {args.logins / elapsed:>9.1f} "
+            f"{statistics.median(lags_ms):>11.1f} {_percentile(lags_ms, 0.99):>11.1f} "
+            f"{max(lags_ms):>11.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Measures text normalization throughput in characters per second on a large generated corpus.
+
+The corpus mixes prose with the tokens normalization rewrites: numbers, dates, times, currency
+amounts, percentages, abbreviations, URLs and e-mail addresses. It is normalized twice, first
+with an empty expansion cache and then with a warm one, and optionally once more under
+tracemalloc to show that peak memory stays close to the size of the input and output.
+
+    python -m benchmarks.normalization_throughput --megabytes 8 --memory
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+_WORDS = (
+    "the quick brown fox jumps over a lazy dog while our team reviews every report "
+    "before shipping new features to customers around the world"
+).split()
+
+
+def _token(rng):
+    kind = rng.randrange(10)
+    if kind == 0:
+        return f"{rng.randrange(1, 10**7):,}"
+    if kind == 1:
+        return f"{rng.randrange(1990, 2031)}-{rng.randrange(1, 13):02}-{rng.randrange(1, 29):02}"
+    if kind == 2:
+        return (
+            f"{rng.randrange(1, 13)}:{rng.randrange(60):02} {rng.choice(['am', 'pm'])}"
+        )
+    if kind == 3:
+        return f"${rng.randrange(1, 5000)}.{rng.randrange(100):02}"
+    if kind == 4:
+        return f"{rng.randrange(100)}.{rng.randrange(10)}%"
+    if kind == 5:
+        return rng.choice(["Dr.", "Mr.", "Mrs.", "Prof.", "e.g.", "vs."])
+    if kind == 6:
+        return f"https://www.example{rng.randrange(50)}.com/docs/{rng.randrange(1000)}"
+    if kind == 7:
+        return f"user{rng.randrange(100)}@example.org"
+    if kind == 8:
+        return f"{rng.randrange(1, 40)}{rng.choice(['st', 'nd', 'rd', 'th'])}"
+    return str(rng.randrange(10000))
+
+
+def build_corpus(megabytes, seed=1):
+    rng = random.Random(seed)
+    target = int(megabytes * 1024 * 1024)
+    parts = []
+    size = 0
+    while size < target:
+        words = [rng.choice(_WORDS) for _ in range(rng.randrange(6, 18))]
+        for _ in range(rng.randrange(1, 4)):
+            words.insert(rng.randrange(len(words) + 1), _token(rng))
+        sentence = " ".join(words).capitalize() + rng.choice([".", ".", "!", "?"])
+        separator = "\n\n" if rng.random() < 0.1 else " "
+        parts.append(sentence + separator)
+        size += len(sentence) + len(separator)
+    return "".join(parts)
+
+
+def _run(normalize_text, corpus):
+    started = time.perf_counter()
+    normalized = normalize_text(corpus)
+    return time.perf_counter() - started, normalized
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--megabytes", type=float, default=8.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--memory", action="store_true", help="also measure peak memory"
+    )
+    args = parser.parse_args()
+    import project.text_normalization
+
+    corpus = build_corpus(args.megabytes, args.seed)
+    print(f"corpus: {len(corpus):,} characters")
+    print(f"{'pass':<6} {'seconds':>8} {'chars/s':>12} {'cache hit %':>12}")
+    project.text_normalization.expand.cache_clear()
+    for name in ("cold", "warm"):
+        before = project.text_normalization.expand.cache_info()
+        elapsed, normalized = _run(project.text_normalization.normalize_text, corpus)
+        after = project.text_normalization.expand.cache_info()
+        lookups = (after.hits + after.misses) - (before.hits + before.misses)
+        hit_rate = 100 * (after.hits - before.hits) / max(1, lookups)
+        print(
+            f"{name:<6} {elapsed:>8.2f} {len(corpus) / elapsed:>12,.0f} {hit_rate:>12.1f}"
+        )
+    print(f"output: {len(normalized):,} characters")
+    if args.memory:
+        del normalized
+        tracemalloc.start()
+        _run(project.text_normalization.normalize_text, corpus)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"peak memory: {peak / 2**20:,.1f} MiB for a {len(corpus) / 2**20:,.1f} MiB input"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,688 @@
+"""
+An in-memory stand-in for the generated Prisma client, so benchmarks run without Postgres or a
+`prisma generate` step.
+
+`install()` reads the models and enums from `schema.prisma` and registers `prisma`,
+`prisma.models`, `prisma.enums` and `prisma.errors` modules exposing the same names as the
+generated client. The model actions the services use are implemented over plain dicts: filters
+with the usual operators, ordering, cursors, grouped sums, `include` of relations, unique
+constraints, `@default` and `@updatedAt` values, and cascading deletes. Every call can be delayed
+by a fixed round trip, so database-bound paths keep a realistic share of request time.
+
+It is a measuring aid, not an emulator: it serializes nothing, does not check types, and
+supports only the query shapes this code base sends.
+"""
+
+import asyncio
+import builtins
+import copy
+import enum
+import itertools
+import re
+import sys
+import types
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+_MODEL = re.compile(r"^model\s+(\w+)\s*\{(.*?)^\}", re.MULTILINE | re.DOTALL)
+_ENUM = re.compile(r"^enum\s+(\w+)\s*\{(.*?)^\}", re.MULTILINE | re.DOTALL)
+_FIELD = re.compile(r"^\s*(\w+)\s+(\w+)(\[\])?(\?)?(.*)$")
+_DEFAULT = re.compile(r"@default\((.*)\)")
+_RELATION_FIELDS = re.compile(r"fields:\s*\[([^\]]*)\]")
+_ON_DELETE = re.compile(r"onDelete:\s*(\w+)")
+_BLOCK_UNIQUE = re.compile(r"@@(?:unique|id)\(\s*\[([^\]]*)\]")
+
+
+@dataclass
+class Field:
+    name: str
+    type: str
+    optional: bool = False
+    is_list: bool = False
+    unique: bool = False
+    default: Optional[str] = None
+    updated_at: bool = False
+    # For relation fields that hold the foreign key: local key field and onDelete action.
+    foreign_key: Optional[str] = None
+    on_delete: Optional[str] = None
+
+
+@dataclass
+class Model:
+    name: str
+    fields: Dict[str, Field] = field(default_factory=dict)
+    # Field tuples that must be unique, including the id.
+    unique: List[Tuple[str, ...]] = field(default_factory=list)
+
+    def is_relation(self, name: str, schema: "Schema") -> bool:
+        return self.fields[name].type in schema.models
+
+
+@dataclass
+class Schema:
+    models: Dict[str, Model]
+    enums: Dict[str, List[str]]
+
+
+def parse_schema(text: str) -> Schema:
+    enums = {
+        name: [line.strip() for line in body.splitlines() if line.strip()]
+        for name, body in _ENUM.findall(text)
+    }
+    models = {}
+    for name, body in _MODEL.findall(text):
+        model = Model(name)
+        for line in body.splitlines():
+            line = line.split("//", 1)[0].rstrip()
+            block = _BLOCK_UNIQUE.search(line)
+            if block:
+                model.unique.append(tuple(f.strip() for f in block.group(1).split(",")))
+                continue
+            match = _FIELD.match(line)
+            if not match or line.strip().startswith("@@"):
+                continue
+            field_name, type_name, is_list, optional, attributes = match.groups()
+            spec = Field(
+                field_name,
+                type_name,
+                optional=bool(optional),
+                is_list=bool(is_list),
+                unique="@unique" in attributes or "@id" in attributes,
+                updated_at="@updatedAt" in attributes,
+            )
+            default = _DEFAULT.search(attributes)
+            if default:
+                spec.default = default.group(1)
+            relation = _RELATION_FIELDS.search(attributes)
+            if relation:
+                spec.foreign_key = relation.group(1).strip()
+                on_delete = _ON_DELETE.search(attributes)
+                spec.on_delete = on_delete.group(1) if on_delete else "Restrict"
+            if spec.unique:
+                model.unique.append((field_name,))
+            model.fields[field_name] = spec
+        models[name] = model
+    return Schema(models, enums)
+
+
+class UniqueViolationError(Exception):
+    """
+    Raised when a write would duplicate a unique field, like the generated client's error.
+    """
+
+
+class RecordNotFoundError(Exception):
+    """
+    Raised when a nested write refers to a record that does not exist.
+    """
+
+
+class Record:
+    """
+    Base of the record classes returned by the stand-in, one per model.
+    """
+
+    def __init__(self, **values: Any):
+        self.__dict__.update(values)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{k}={v!r}" for k, v in self.__dict__.items())
+        return f"{type(self).__name__}({fields})"
+
+    def model_dump(self) -> Dict[str, Any]:
+        return dict(self.__dict__)
+
+
+class Database:
+    """
+    The tables of the stand-in, shared by every model's actions.
+    """
+
+    def __init__(self, schema: Schema, latency_seconds: float = 0.0):
+        self.schema = schema
+        self.latency_seconds = latency_seconds
+        self.tables: Dict[str, Dict[Any, Dict[str, Any]]] = {
+            name: {} for name in schema.models
+        }
+        self.enums = {
+            name: enum.Enum(name, {value: value for value in values}, type=str)
+            for name, values in schema.enums.items()
+        }
+        self.records = {
+            name: type(name, (Record,), {"prisma": classmethod(self._actions_for)})
+            for name in schema.models
+        }
+        self.queries = 0
+        self._sequence = itertools.count()
+        self._batching = False
+
+    def _actions_for(self, record_class: type) -> "Actions":
+        return Actions(self, record_class.__name__)
+
+    async def round_trip(self) -> None:
+        if self._batching:
+            return
+        self.queries += 1
+        await asyncio.sleep(self.latency_seconds)
+
+    async def run_batch(self, writes: List[Tuple[str, str, Dict[str, Any]]]) -> None:
+        """
+        Runs queued writes in one round trip, undoing all of them if any fails.
+        """
+        await self.round_trip()
+        snapshot = {
+            name: {key: dict(row) for key, row in table.items()}
+            for name, table in self.tables.items()
+        }
+        self._batching = True
+        try:
+            for model, action, arguments in writes:
+                await getattr(Actions(self, model), action)(**arguments)
+        except BaseException:
+            for name, table in self.tables.items():
+                table.clear()
+                table.update(snapshot[name])
+            raise
+        finally:
+            self._batching = False
+
+    def clear(self) -> None:
+        for table in self.tables.values():
+            table.clear()
+
+
+class Actions:
+    """
+    The query methods of one model, as returned by `Model.prisma()`.
+    """
+
+    def __init__(self, database: Database, model: str):
+        self._db = database
+        self._model = database.schema.models[model]
+        self._table = database.tables[model]
+
+    # Reads
+
+    async def find_unique(self, where, include=None):
+        await self._db.round_trip()
+        rows = self._filter(where)
+        return self._record(rows[0], include) if rows else None
+
+    async def find_first(self, where=None, order=None, include=None, skip=None):
+        rows = await self._find(where, order, 1, skip, None)
+        return self._record(rows[0], include) if rows else None
+
+    async def find_many(
+        self, where=None, order=None, take=None, skip=None, cursor=None, include=None
+    ):
+        rows = await self._find(where, order, take, skip, cursor)
+        return [self._record(row, include) for row in rows]
+
+    async def count(self, where=None):
+        await self._db.round_trip()
+        return len(self._filter(where))
+
+    async def group_by(
+        self, by, where=None, take=None, skip=None, order=None, sum=None, having=None
+    ):
+        await self._db.round_trip()
+        groups: Dict[Tuple[Any, ...], List[Dict[str, Any]]] = {}
+        for row in self._filter(where):
+            groups.setdefault(tuple(row.get(name) for name in by), []).append(row)
+        results = []
+        for values, rows in groups.items():
+            result: Dict[str, Any] = dict(zip(by, values))
+            if sum:
+                result["_sum"] = {
+                    name: _sum(row.get(name) for row in rows) for name in sum
+                }
+            if all(
+                _compare(result[aggregate][name], condition)
+                for name, aggregates in (having or {}).items()
+                for aggregate, condition in aggregates.items()
+            ):
+                results.append(result)
+        keys = order if isinstance(order, list) else [order] if order else []
+        for key in reversed(keys):
+            ((name, direction),) = key.items()
+            results.sort(key=lambda result: result[name], reverse=direction == "desc")
+        if skip:
+            results = results[skip:]
+        if take is not None:
+            results = results[:take]
+        return results
+
+    async def _find(self, where, order, take, skip, cursor):
+        await self._db.round_trip()
+        rows = _order(self._filter(where), order)
+        if cursor:
+            starts = [i for i, row in enumerate(rows) if _matches_all(row, cursor)]
+            rows = rows[starts[0] :] if starts else []
+        if skip:
+            rows = rows[skip:]
+        if take is not None:
+            rows = rows[:take] if take >= 0 else rows[take:]
+        return rows
+
+    # Writes
+
+    async def create(self, data, include=None):
+        await self._db.round_trip()
+        row = self._insert(data)
+        return self._record(row, include)
+
+    async def create_many(self, data, skip_duplicates=False):
+        await self._db.round_trip()
+        created = 0
+        for item in data:
+            try:
+                self._insert(item)
+            except UniqueViolationError:
+                if not skip_duplicates:
+                    raise
+            else:
+                created += 1
+        return created
+
+    async def update(self, where, data, include=None):
+        await self._db.round_trip()
+        rows = self._filter(where)
+        if not rows:
+            return None
+        return self._record(self._update(rows[0], data), include)
+
+    async def update_many(self, where, data):
+        await self._db.round_trip()
+        rows = self._filter(where)
+        for row in rows:
+            self._update(row, data)
+        return len(rows)
+
+    async def upsert(self, where, data, include=None):
+        await self._db.round_trip()
+        rows = self._filter(where)
+        if rows:
+            row = self._update(rows[0], data["update"])
+        else:
+            row = self._insert({**where, **data["create"]})
+        return self._record(row, include)
+
+    async def delete(self, where, include=None):
+        await self._db.round_trip()
+        rows = self._filter(where)
+        if not rows:
+            return None
+        record = self._record(rows[0], include)
+        self._delete(self._model, rows[0])
+        return record
+
+    async def delete_many(self, where=None):
+        await self._db.round_trip()
+        rows = self._filter(where)
+        for row in rows:
+            self._delete(self._model, row)
+        return len(rows)
+
+    # Implementation
+
+    def _filter(self, where) -> List[Dict[str, Any]]:
+        return [row for row in self._table.values() if _matches(row, where or {})]
+
+    def _insert(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        now = datetime.now(timezone.utc)
+        row: Dict[str, Any] = {}
+        for name, spec in self._model.fields.items():
+            if spec.type in self._db.schema.models:
+                continue
+            if name in data:
+                row[name] = self._value(spec, data[name])
+            elif spec.updated_at:
+                row[name] = now
+            elif spec.default is not None:
+                row[name] = self._default(spec, now)
+            else:
+                row[name] = None
+        for name, value in data.items():
+            spec = self._model.fields.get(name)
+            if spec is not None and spec.foreign_key and isinstance(value, dict):
+                connect = value.get("connect")
+                if connect:
+                    row[spec.foreign_key] = next(iter(connect.values()))
+        self._check_unique(row)
+        row["_seq"] = next(self._db._sequence)
+        self._table[row["_seq"]] = row
+        return row
+
+    def _update(self, row: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+        updated = dict(row)
+        for name, value in data.items():
+            spec = self._model.fields[name]
+            if spec.foreign_key:
+                if isinstance(value, dict) and value.get("connect"):
+                    updated[spec.foreign_key] = next(iter(value["connect"].values()))
+                elif isinstance(value, dict) and value.get("disconnect"):
+                    updated[spec.foreign_key] = None
+                continue
+            if isinstance(value, dict):
+                current = updated.get(name) or 0
+                if "set" in value:
+                    value = value["set"]
+                elif "increment" in value:
+                    value = current + value["increment"]
+                elif "decrement" in value:
+                    value = current - value["decrement"]
+                elif "multiply" in value:
+                    value = current * value["multiply"]
+                elif "divide" in value:
+                    value = current / value["divide"]
+            updated[name] = self._value(spec, value)
+        now = datetime.now(timezone.utc)
+        for name, spec in self._model.fields.items():
+            if spec.updated_at and name not in data:
+                updated[name] = now
+        self._check_unique(updated, ignore=row["_seq"])
+        row.update(updated)
+        return row
+
+    def _delete(self, model: Model, row: Dict[str, Any]) -> None:
+        self._db.tables[model.name].pop(row["_seq"], None)
+        # Apply the onDelete action of every relation pointing at the deleted row.
+        for other in self._db.schema.models.values():
+            for spec in other.fields.values():
+                if spec.type != model.name or not spec.foreign_key:
+                    continue
+                target = _referenced_field(other, spec)
+                dependants = [
+                    dependant
+                    for dependant in list(self._db.tables[other.name].values())
+                    if dependant.get(spec.foreign_key) == row.get(target)
+                ]
+                for dependant in dependants:
+                    if spec.on_delete == "Cascade":
+                        self._delete(other, dependant)
+                    elif spec.on_delete == "SetNull":
+                        dependant[spec.foreign_key] = None
+
+    def _check_unique(self, row: Dict[str, Any], ignore: Optional[int] = None) -> None:
+        for fields in self._model.unique:
+            values = tuple(row.get(name) for name in fields)
+            if any(value is None for value in values):
+                continue
+            for other in self._table.values():
+                if other["_seq"] == ignore:
+                    continue
+                if tuple(other.get(name) for name in fields) == values:
+                    raise UniqueViolationError(
+                        f"Unique constraint failed on the fields: ({', '.join(fields)})"
+                    )
+
+    def _value(self, spec: Field, value: Any) -> Any:
+        enum_class = self._db.enums.get(spec.type)
+        if enum_class is not None and value is not None:
+            return enum_class(value.value if isinstance(value, enum.Enum) else value)
+        return copy.copy(value)
+
+    def _default(self, spec: Field, now: datetime) -> Any:
+        default = spec.default
+        if default.startswith(("dbgenerated", "uuid", "cuid")):
+            return str(uuid.uuid4())
+        if default == "now()":
+            return now
+        if spec.type in self._db.enums:
+            return self._db.enums[spec.type](default)
+        if spec.type == "Boolean":
+            return default == "true"
+        if spec.type in ("Int", "BigInt"):
+            return int(default)
+        if spec.type in ("Float", "Decimal"):
+            return float(default)
+        return default.strip('"')
+
+    def _record(self, row: Dict[str, Any], include: Optional[Dict[str, Any]]) -> Record:
+        values = {k: v for k, v in row.items() if k != "_seq"}
+        for name, spec in self._model.fields.items():
+            if spec.type in self._db.schema.models:
+                values[name] = None
+        for name, option in (include or {}).items():
+            if option:
+                values[name] = self._related(row, self._model.fields[name], option)
+        return self._db.records[self._model.name](**values)
+
+    def _related(self, row: Dict[str, Any], spec: Field, option: Any) -> Any:
+        target = self._db.schema.models[spec.type]
+        actions = Actions(self._db, target.name)
+        nested = option.get("include") if isinstance(option, dict) else None
+        if spec.foreign_key:
+            key = row.get(spec.foreign_key)
+            referenced = _referenced_field(self._model, spec)
+            rows = [r for r in actions._table.values() if r.get(referenced) == key]
+            return actions._record(rows[0], nested) if rows and key else None
+        # The other side holds the foreign key.
+        back = next(
+            f
+            for f in target.fields.values()
+            if f.type == self._model.name and f.foreign_key
+        )
+        referenced = _referenced_field(target, back)
+        rows = [
+            r
+            for r in actions._table.values()
+            if r.get(back.foreign_key) == row[referenced]
+        ]
+        if not spec.is_list:
+            return actions._record(rows[0], nested) if rows else None
+        if isinstance(option, dict):
+            rows = _order(
+                [r for r in rows if _matches(r, option.get("where") or {})],
+                option.get("order_by") or option.get("order"),
+            )
+            if option.get("take") is not None:
+                rows = rows[: option["take"]]
+        return [actions._record(r, nested) for r in rows]
+
+
+def _referenced_field(model: Model, relation: Field) -> str:
+    # Every relation in the schema references the other model's id field.
+    return "id"
+
+
+def _matches_all(row: Dict[str, Any], values: Dict[str, Any]) -> bool:
+    return all(row.get(k) == v for k, v in values.items())
+
+
+def _matches(row: Dict[str, Any], where: Dict[str, Any]) -> bool:
+    for key, condition in where.items():
+        if key == "AND":
+            conditions = condition if isinstance(condition, list) else [condition]
+            if not all(_matches(row, c) for c in conditions):
+                return False
+        elif key == "OR":
+            if not any(_matches(row, c) for c in condition):
+                return False
+        elif key == "NOT":
+            conditions = condition if isinstance(condition, list) else [condition]
+            if any(_matches(row, c) for c in conditions):
+                return False
+        elif isinstance(condition, dict) and key not in row:
+            # A compound unique key such as {"userId_createdAt": {...}}.
+            if not _matches(row, condition):
+                return False
+        elif isinstance(condition, dict):
+            if not _compare(row.get(key), condition):
+                return False
+        elif _plain(row.get(key)) != _plain(condition):
+            return False
+    return True
+
+
+_OPERATORS: Dict[str, Callable[[Any, Any], bool]] = {
+    "equals": lambda value, operand: value == operand,
+    "not": lambda value, operand: value != operand,
+    "in": lambda value, operand: value in operand,
+    "not_in": lambda value, operand: value not in operand,
+    "lt": lambda value, operand: value is not None and value < operand,
+    "lte": lambda value, operand: value is not None and value <= operand,
+    "gt": lambda value, operand: value is not None and value > operand,
+    "gte": lambda value, operand: value is not None and value >= operand,
+    "contains": lambda value, operand: value is not None and operand in value,
+    "startswith": lambda value, operand: value is not None
+    and value.startswith(operand),
+    "endswith": lambda value, operand: value is not None and value.endswith(operand),
+}
+
+
+def _compare(value: Any, condition: Dict[str, Any]) -> bool:
+    value = _plain(value)
+    for operator, operand in condition.items():
+        if operator == "mode":
+            continue
+        if isinstance(operand, list):
+            operand = [_plain(item) for item in operand]
+        else:
+            operand = _plain(operand)
+        if not _OPERATORS[operator](value, operand):
+            return False
+    return True
+
+
+def _sum(values: Iterable[Any]) -> Any:
+    # Like SQL, nulls are skipped and a sum of nothing but nulls is null.
+    present = [value for value in values if value is not None]
+    return builtins.sum(present) if present else None
+
+
+def _plain(value: Any) -> Any:
+    return value.value if isinstance(value, enum.Enum) else value
+
+
+def _order(rows: List[Dict[str, Any]], order: Any) -> List[Dict[str, Any]]:
+    if not order:
+        return sorted(rows, key=lambda row: row["_seq"])
+    keys = order if isinstance(order, list) else [order]
+    rows = sorted(rows, key=lambda row: row["_seq"])
+    for key in reversed(keys):
+        ((name, direction),) = key.items()
+        rows.sort(
+            key=lambda row: (row.get(name) is None, _plain(row.get(name))),
+            reverse=direction == "desc",
+        )
+    return rows
+
+
+class Batch:
+    """
+    Stand-in for `Prisma.batch_()`: writes made through its lowercase model attributes are
+    queued and run atomically, in one round trip, when the block exits.
+    """
+
+    def __init__(self, database: Database):
+        self._db = database
+        self._writes: List[Tuple[str, str, Dict[str, Any]]] = []
+
+    def __getattr__(self, name: str) -> Any:
+        for model in self._db.schema.models:
+            if model.lower() == name:
+                return _BatchActions(self._writes, model)
+        raise AttributeError(name)
+
+    async def __aenter__(self) -> "Batch":
+        return self
+
+    async def __aexit__(self, exc_type: Any, exc: Any, traceback: Any) -> None:
+        if exc_type is None and self._writes:
+            await self._db.run_batch(self._writes)
+
+
+class _BatchActions:
+    def __init__(self, writes: List[Tuple[str, str, Dict[str, Any]]], model: str):
+        self._writes = writes
+        self._model = model
+
+    def __getattr__(self, action: str) -> Any:
+        def queue(**arguments: Any) -> None:
+            self._writes.append((self._model, action, arguments))
+
+        return queue
+
+
+class Prisma:
+    """
+    Stand-in for the generated client class; connecting is a no-op.
+    """
+
+    database: Optional[Database] = None
+
+    def __init__(self, **options: Any):
+        global _registered
+        self.options = options
+        self._connected = False
+        if options.get("auto_register"):
+            _registered = self
+
+    def batch_(self) -> Batch:
+        return Batch(self.database)
+
+    async def connect(self, timeout: Any = None) -> None:
+        self._connected = True
+
+    async def disconnect(self, timeout: Any = None) -> None:
+        self._connected = False
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+
+_registered: Optional[Prisma] = None
+
+
+def get_client() -> Prisma:
+    if _registered is None:
+        raise RuntimeError("No client has been registered")
+    return _registered
+
+
+def install(schema_path: str, latency_seconds: float = 0.0) -> Database:
+    """
+    Registers the stand-in as the `prisma` package. Must run before any module importing
+    `prisma` is imported.
+
+    Args:
+        schema_path (str): Path of `schema.prisma`.
+        latency_seconds (float): Delay added to every query, as a network round trip.
+
+    Returns:
+        Database: The tables, for seeding data and counting queries.
+    """
+    with open(schema_path, encoding="utf-8") as file:
+        schema = parse_schema(file.read())
+    database = Database(schema, latency_seconds)
+    package = types.ModuleType("prisma")
+    package.__path__ = []
+    models = types.ModuleType("prisma.models")
+    enums = types.ModuleType("prisma.enums")
+    errors = types.ModuleType("prisma.errors")
+    for name, record_class in database.records.items():
+        setattr(models, name, record_class)
+    for name, enum_class in database.enums.items():
+        setattr(enums, name, enum_class)
+    errors.UniqueViolationError = UniqueViolationError
+    errors.RecordNotFoundError = RecordNotFoundError
+    errors.PrismaError = Exception
+    Prisma.database = database
+    package.Prisma = Prisma
+    package.get_client = get_client
+    package.models = models
+    package.enums = enums
+    package.errors = errors
+    package.database = database
+    sys.modules.update(
+        {
+            "prisma": package,
+            "prisma.models": models,
+            "prisma.enums": enums,
+            "prisma.errors": errors,
+        }
+    )
+    return database
@@ -1,5 +1,6 @@
 from typing import List
 
+import project.config
 from pydantic import BaseModel
 
 
@@ -25,6 +26,17 @@ class APIIntegrationDetailsResponse(BaseModel):
     supported_endpoints: List[APIEndpointDetail]
 
 
+def _rate_limit_info() -> str:
+    budgets = ", ".join(
+        f"{role} {units:g}" if units > 0 else f"{role} unlimited"
+        for role, units in project.config.RATE_LIMIT_UNITS_PER_MINUTE.items()
+    )
+    return (
+        f"Synthesis units per minute by role: {budgets}. Each request costs 1 unit plus 1 per "
+        f"{project.config.RATE_LIMIT_CHARS_PER_UNIT} characters of input."
+    )
+
+
 def api_integration_details() -> APIIntegrationDetailsResponse:
     """
     Returns API integration capabilities and documentation links.
@@ -50,6 +62,6 @@ def api_integration_details() -> APIIntegrationDetailsResponse:
         api_version="1.0",
         documentation_url="https://speakease.api/docs",
         auth_required=True,
-        rate_limit_info="60 requests per minute",
+        rate_limit_info=_rate_limit_info(),
         supported_endpoints=example_endpoints,
     )
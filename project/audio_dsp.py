@@ -0,0 +1,318 @@
+import math
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional
+
+import project.audio_pcm
+import project.config
+import project.synthesis_plan
+
+# Frames converted and processed at a time, which bounds the working memory of a render.
+BLOCK_FRAMES = 8192
+
+# Length of the windows time-stretching cuts the signal into. Long enough to hold a couple of
+# pitch periods of a low voice.
+STRETCH_WINDOW_MS = 30
+
+# How far a window may be moved from its nominal position to line up with the previous one.
+STRETCH_SEEK_MS = 10
+
+# Limits of the adjustments derived from a base render; beyond them artifacts dominate.
+_TEMPO_RANGE = (0.25, 4.0)
+
+_PITCH_RANGE = (0.5, 2.0)
+
+
+@dataclass(frozen=True)
+class VoiceAdjustment:
+    """
+    Changes applied to a base render: `tempo` speeds speech up (above 1) or slows it down
+    without changing its pitch, `pitch` scales its pitch without changing its duration, and
+    `gain` scales its amplitude.
+    """
+
+    tempo: float = 1.0
+    pitch: float = 1.0
+    gain: float = 1.0
+
+    @property
+    def is_identity(self) -> bool:
+        return self == _IDENTITY
+
+
+_IDENTITY = VoiceAdjustment()
+
+
+def enabled() -> bool:
+    """
+    Whether voice parameters are applied by post-processing base renders instead of by the
+    engine.
+
+    Raises:
+        ValueError: If `TTS_VOICE_ADJUSTMENT` names an unknown mode.
+    """
+    mode = project.config.TTS_VOICE_ADJUSTMENT
+    if mode not in ("engine", "dsp"):
+        raise ValueError(f"Unknown voice adjustment mode {mode!r}")
+    return mode == "dsp"
+
+
+def voice_adjustment(
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+    prosody: project.synthesis_plan.Prosody,
+) -> VoiceAdjustment:
+    """
+    Maps requested voice parameters onto the changes that turn a base render into them.
+
+    Base renders are made at `TTS_DSP_BASE_RATE` words per minute with the engine's own pitch
+    and volume, so a speed is applied as its ratio to that rate and a pitch as its ratio to
+    `TTS_DSP_BASE_PITCH`. Unset or zero values leave the base unchanged, as the engine does.
+
+    Args:
+        speed (Optional[float]): Requested speech rate, in words per minute.
+        pitch (Optional[float]): Requested pitch.
+        volume (Optional[float]): Requested volume, from 0 to 1.
+        prosody (project.synthesis_plan.Prosody): Prosody of the plan segment.
+
+    Returns:
+        VoiceAdjustment: The tempo, pitch and gain changes.
+    """
+    tempo = (speed / project.config.TTS_DSP_BASE_RATE if speed else 1.0) * prosody.rate
+    ratio = (
+        pitch / project.config.TTS_DSP_BASE_PITCH if pitch else 1.0
+    ) * prosody.pitch
+    gain = (volume if volume else 1.0) * prosody.volume
+    return VoiceAdjustment(
+        tempo=min(max(tempo, _TEMPO_RANGE[0]), _TEMPO_RANGE[1]),
+        pitch=min(max(ratio, _PITCH_RANGE[0]), _PITCH_RANGE[1]),
+        gain=min(max(gain, 0.0), 1.0),
+    )
+
+
+def prepare_chunk(pcm_format: project.audio_pcm.PcmFormat, frames: bytes) -> bytes:
+    """
+    Prepares a base render like `project.audio_pcm.prepare_chunk`, vectorized, and normalizes
+    its peak to `TTS_DSP_PEAK_DBFS` so every variant derived from it starts at the same level.
+
+    Only 16-bit PCM is processed; other sample widths are returned unchanged.
+    """
+    if pcm_format.sample_width != 2 or not frames:
+        return frames
+    np = _numpy()
+    channels = pcm_format.channels
+    samples = np.frombuffer(frames, dtype="<i2", count=len(frames) // 2)
+    loud = np.flatnonzero(
+        np.abs(samples.astype(np.int32)) > project.audio_pcm.SILENCE_THRESHOLD
+    )
+    if not len(loud):
+        return b""
+    first = loud[0] - loud[0] % channels
+    last = loud[-1] - loud[-1] % channels
+    margin = pcm_format.frames_for_ms(project.audio_pcm.TRIM_MARGIN_MS) * channels
+    start = max(0, first - margin)
+    end = min(len(samples), last + channels + margin)
+    block = samples[start:end].reshape(-1, channels).astype(np.float32)
+    peak = float(np.abs(block).max())
+    block *= 32767 * 10 ** (project.config.TTS_DSP_PEAK_DBFS / 20) / peak
+    fade = min(
+        pcm_format.frames_for_ms(project.audio_pcm.EDGE_FADE_MS), len(block) // 2
+    )
+    if fade:
+        ramp = (np.arange(fade, dtype=np.float32) / fade)[:, None]
+        block[:fade] *= ramp
+        block[len(block) - fade :] *= ramp[::-1]
+    return _to_pcm(np, block)
+
+
+def adjust(
+    pcm_format: project.audio_pcm.PcmFormat,
+    frames: memoryview,
+    adjustment: VoiceAdjustment,
+) -> Iterator[bytes]:
+    """
+    Applies an adjustment to prepared frames, block by block.
+
+    The time-stretch keeps pitch by overlapping windows of the input (WSOLA), each moved by up
+    to `STRETCH_SEEK_MS` to where it best lines up with the previous one. A pitch change is a
+    stretch by the inverse ratio followed by resampling back to the original duration. Only
+    `BLOCK_FRAMES` of input and the few windows in flight are held at once.
+
+    Only 16-bit PCM is processed; other sample widths are returned unchanged.
+
+    Args:
+        pcm_format (project.audio_pcm.PcmFormat): Layout of `frames`.
+        frames (memoryview): Prepared frames, such as a memory-mapped fragment.
+        adjustment (VoiceAdjustment): The changes to apply.
+
+    Yields:
+        bytes: Consecutive blocks of adjusted frames.
+    """
+    if pcm_format.sample_width != 2 or adjustment.is_identity:
+        if len(frames):
+            yield bytes(frames)
+        return
+    np = _numpy()
+    channels = pcm_format.channels
+    stages = []
+    if adjustment.tempo != adjustment.pitch:
+        stages.append(
+            _TimeStretcher(np, pcm_format, adjustment.tempo / adjustment.pitch)
+        )
+    if adjustment.pitch != 1.0:
+        stages.append(_Resampler(np, channels, adjustment.pitch))
+    block_bytes = BLOCK_FRAMES * pcm_format.frame_size
+    usable = len(frames) - len(frames) % pcm_format.frame_size
+    if not usable:
+        return
+    for offset in range(0, usable, block_bytes):
+        raw = frames[offset : min(offset + block_bytes, usable)]
+        block = np.frombuffer(raw, dtype="<i2").reshape(-1, channels).astype(np.float32)
+        for stage in stages:
+            block = stage.process(block)
+        if len(block):
+            yield _to_pcm(np, block * adjustment.gain)
+    block = np.zeros((0, channels), dtype=np.float32)
+    for stage in stages:
+        block = stage.process(block) if len(block) else block
+        block = np.concatenate([block, stage.flush()])
+    if len(block):
+        yield _to_pcm(np, block * adjustment.gain)
+
+
+class _TimeStretcher:
+    """
+    Streaming WSOLA: emits one window hop of output for every `tempo` hops of input.
+    """
+
+    def __init__(self, np: Any, pcm_format: project.audio_pcm.PcmFormat, tempo: float):
+        self._np = np
+        channels = pcm_format.channels
+        self._window = max(4, pcm_format.frames_for_ms(STRETCH_WINDOW_MS) // 2 * 2)
+        self._hop = self._window // 2
+        self._seek = pcm_format.frames_for_ms(STRETCH_SEEK_MS)
+        self._analysis_hop = self._hop * tempo
+        # A periodic Hann window, whose copies one hop apart sum to one.
+        self._shape = np.hanning(self._window + 1)[:-1].astype(np.float32)[:, None]
+        self._buffer = np.zeros((0, channels), dtype=np.float32)
+        # Input frame index of the first buffered frame.
+        self._offset = 0
+        self._position = 0.0
+        self._previous: Optional[int] = None
+        self._tail = np.zeros((self._hop, channels), dtype=np.float32)
+        self._consumed = 0
+
+    def process(self, block: Any) -> Any:
+        np = self._np
+        self._buffer = np.concatenate([self._buffer, block])
+        self._consumed += len(block)
+        return self._emit(self._offset + len(self._buffer))
+
+    def flush(self) -> Any:
+        np = self._np
+        # Pad so the windows covering the end of the input can be cut, then stop once the
+        # nominal position passes it.
+        padding = self._window + 2 * self._seek + self._hop
+        self._buffer = np.concatenate(
+            [
+                self._buffer,
+                np.zeros((padding, self._buffer.shape[1]), dtype=np.float32),
+            ]
+        )
+        output = self._emit(self._consumed)
+        return np.concatenate([output, self._tail])
+
+    def _emit(self, available: int) -> Any:
+        np = self._np
+        outputs = []
+        while self._position < available:
+            nominal = int(round(self._position))
+            start = self._start(nominal)
+            if start is None:
+                break
+            window = self._frames(start, self._window) * self._shape
+            outputs.append(self._tail + window[: self._hop])
+            self._tail = window[self._hop :]
+            self._previous = start
+            self._position += self._analysis_hop
+        self._discard()
+        if not outputs:
+            return np.zeros((0, self._buffer.shape[1]), dtype=np.float32)
+        return np.concatenate(outputs)
+
+    def _start(self, nominal: int) -> Optional[int]:
+        np = self._np
+        end = self._offset + len(self._buffer)
+        if self._previous is None:
+            return nominal if nominal + self._window <= end else None
+        natural = self._previous + self._hop
+        low = max(self._offset, nominal - self._seek)
+        high = nominal + self._seek
+        if max(high, natural) + self._window > end:
+            return None
+        template = self._frames(natural, self._hop).sum(axis=1)
+        region = self._frames(low, high - low + self._hop).sum(axis=1)
+        scores = np.correlate(region, template, mode="valid")
+        energy = np.cumsum(np.concatenate([[0.0], region * region]))
+        scores = scores / np.sqrt(energy[self._hop :] - energy[: -self._hop] + 1e-6)
+        return low + int(np.argmax(scores))
+
+    def _frames(self, start: int, count: int) -> Any:
+        index = start - self._offset
+        return self._buffer[index : index + count]
+
+    def _discard(self) -> None:
+        keep = int(self._position) - self._seek
+        if self._previous is not None:
+            keep = min(keep, self._previous + self._hop)
+        drop = min(max(0, keep - self._offset), len(self._buffer))
+        if drop:
+            self._buffer = self._buffer[drop:]
+            self._offset += drop
+
+
+class _Resampler:
+    """
+    Streaming linear-interpolation resampler reading `ratio` input frames per output frame.
+
+    It does not filter before decimating, which is inaudible on speech within the octave
+    `voice_adjustment` allows.
+    """
+
+    def __init__(self, np: Any, channels: int, ratio: float):
+        self._np = np
+        self._ratio = ratio
+        self._buffer = np.zeros((0, channels), dtype=np.float32)
+        self._position = 0.0
+
+    def process(self, block: Any) -> Any:
+        np = self._np
+        buffer = np.concatenate([self._buffer, block])
+        count = max(0, math.ceil((len(buffer) - 1 - self._position) / self._ratio))
+        positions = self._position + np.arange(count) * self._ratio
+        index = positions.astype(np.int64)
+        weight = (positions - index).astype(np.float32)[:, None]
+        output = buffer[index] * (1 - weight) + buffer[index + 1] * weight
+        position = self._position + count * self._ratio
+        drop = min(int(position), len(buffer))
+        self._buffer = buffer[drop:]
+        self._position = position - drop
+        return output
+
+    def flush(self) -> Any:
+        np = self._np
+        return self.process(np.zeros((1, self._buffer.shape[1]), dtype=np.float32))
+
+
+def _to_pcm(np: Any, block: Any) -> bytes:
+    return np.clip(np.rint(block), -32768, 32767).astype("<i2").tobytes()
+
+
+def _numpy() -> Any:
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError(
+            "The dsp voice adjustment mode requires the numpy package"
+        ) from None
+    return numpy
@@ -0,0 +1,313 @@
+import abc
+import asyncio
+import concurrent.futures
+import os
+import subprocess
+import tempfile
+import wave
+from typing import AsyncIterator, Dict, List
+
+import project.audio_pcm
+import project.config
+import project.tracing
+
+# Frames read from the rendered WAV and written to the encoder per block.
+_BLOCK_FRAMES = 16384
+
+_RAW_SAMPLE_FORMATS = {1: "u8", 2: "s16le", 3: "s24le", 4: "s32le"}
+
+
+class AudioEncodingError(Exception):
+    """
+    Raised when rendered audio cannot be encoded to the requested format.
+    """
+
+
+class AudioEncoder(abc.ABC):
+    """
+    Converts rendered engine output into a delivery format.
+
+    `format` is the name used in configuration and requests, and `file_type` is the matching
+    `AudioFileType` enum value recorded on AudioOutput rows.
+    """
+
+    format: str
+    file_type: str
+    extension: str
+    mime_type: str
+
+    @abc.abstractmethod
+    def encode_file(self, source_path: str, dest_path: str) -> None:
+        """
+        Encodes the engine output at `source_path` into `dest_path`, consuming the source file
+        on success. Blocking.
+        """
+
+    @abc.abstractmethod
+    def transcode_stream(
+        self,
+        pcm_format: project.audio_pcm.PcmFormat,
+        pcm_chunks: AsyncIterator[bytes],
+    ) -> AsyncIterator[bytes]:
+        """
+        Encodes a stream of PCM frames as they arrive.
+        """
+
+
+class WavEncoder(AudioEncoder):
+    """
+    Delivers the engine's PCM output as WAV without re-encoding it.
+    """
+
+    format = "wav"
+    file_type = "WAV"
+    extension = ".wav"
+    mime_type = "audio/wav"
+
+    def encode_file(self, source_path: str, dest_path: str) -> None:
+        if _is_wav(source_path):
+            os.replace(source_path, dest_path)
+            return
+        _run_ffmpeg(["-i", source_path, "-c:a", "pcm_s16le", "-f", "wav"], dest_path)
+        os.remove(source_path)
+
+    async def transcode_stream(
+        self,
+        pcm_format: project.audio_pcm.PcmFormat,
+        pcm_chunks: AsyncIterator[bytes],
+    ) -> AsyncIterator[bytes]:
+        yield project.audio_pcm.streaming_wav_header(pcm_format)
+        async for chunk in pcm_chunks:
+            yield chunk
+
+
+class FfmpegEncoder(AudioEncoder):
+    """
+    Encodes with an ffmpeg codec, feeding PCM through a pipe so the audio is never copied in full.
+    """
+
+    def __init__(
+        self,
+        format: str,
+        file_type: str,
+        extension: str,
+        mime_type: str,
+        codec: str,
+        container: str,
+        bitrate: str,
+    ):
+        self.format = format
+        self.file_type = file_type
+        self.extension = extension
+        self.mime_type = mime_type
+        self.codec = codec
+        self.container = container
+        self.bitrate = bitrate
+
+    def _output_args(self) -> List[str]:
+        return ["-c:a", self.codec, "-b:a", self.bitrate, "-f", self.container]
+
+    def encode_file(self, source_path: str, dest_path: str) -> None:
+        if not _is_wav(source_path):
+            _run_ffmpeg(["-i", source_path, *self._output_args()], dest_path)
+            os.remove(source_path)
+            return
+        with wave.open(source_path, "rb") as wav:
+            pcm_format = project.audio_pcm.PcmFormat(
+                channels=wav.getnchannels(),
+                sample_width=wav.getsampwidth(),
+                frame_rate=wav.getframerate(),
+            )
+            with tempfile.TemporaryFile() as stderr:
+                process = subprocess.Popen(
+                    _ffmpeg_command(
+                        [*_raw_input_args(pcm_format), *self._output_args()],
+                        dest_path,
+                    ),
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    stderr=stderr,
+                )
+                try:
+                    while True:
+                        frames = wav.readframes(_BLOCK_FRAMES)
+                        if not frames:
+                            break
+                        process.stdin.write(frames)
+                except BrokenPipeError:
+                    # ffmpeg exited early; its exit status and stderr explain why.
+                    pass
+                finally:
+                    try:
+                        process.stdin.close()
+                    except BrokenPipeError:
+                        pass
+                    returncode = process.wait()
+                if returncode != 0:
+                    stderr.seek(0)
+                    raise AudioEncodingError(
+                        f"ffmpeg failed to encode {self.format}: "
+                        f"{stderr.read().decode(errors='replace').strip()}"
+                    )
+        os.remove(source_path)
+
+    async def transcode_stream(
+        self,
+        pcm_format: project.audio_pcm.PcmFormat,
+        pcm_chunks: AsyncIterator[bytes],
+    ) -> AsyncIterator[bytes]:
+        process = await asyncio.create_subprocess_exec(
+            *_ffmpeg_command(
+                [*_raw_input_args(pcm_format), *self._output_args()], "pipe:1"
+            ),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+
+        async def feed() -> None:
+            try:
+                async for chunk in pcm_chunks:
+                    process.stdin.write(chunk)
+                    await process.stdin.drain()
+            finally:
+                process.stdin.close()
+
+        # Feeding and reading run concurrently so neither side of the pipe can fill up and stall.
+        feeder = asyncio.create_task(feed())
+        try:
+            while True:
+                data = await process.stdout.read(65536)
+                if not data:
+                    break
+                yield data
+            await feeder
+            if await process.wait() != 0:
+                raise AudioEncodingError(f"ffmpeg failed to encode {self.format}")
+        finally:
+            feeder.cancel()
+            await asyncio.gather(feeder, return_exceptions=True)
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+
+
+def _is_wav(path: str) -> bool:
+    with open(path, "rb") as f:
+        header = f.read(12)
+    return header[:4] == b"RIFF" and header[8:12] == b"WAVE"
+
+
+def _raw_input_args(pcm_format: project.audio_pcm.PcmFormat) -> List[str]:
+    sample_format = _RAW_SAMPLE_FORMATS.get(pcm_format.sample_width)
+    if sample_format is None:
+        raise AudioEncodingError(
+            f"Unsupported sample width: {pcm_format.sample_width} bytes"
+        )
+    return [
+        "-f",
+        sample_format,
+        "-ar",
+        str(pcm_format.frame_rate),
+        "-ac",
+        str(pcm_format.channels),
+        "-i",
+        "pipe:0",
+    ]
+
+
+def _ffmpeg_command(args: List[str], output: str) -> List[str]:
+    return [
+        project.config.FFMPEG_BINARY,
+        "-hide_banner",
+        "-loglevel",
+        "error",
+        "-y",
+        *args,
+        output,
+    ]
+
+
+def _run_ffmpeg(args: List[str], dest_path: str) -> None:
+    result = subprocess.run(
+        _ffmpeg_command(args, dest_path),
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+    )
+    if result.returncode != 0:
+        raise AudioEncodingError(
+            f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}"
+        )
+
+
+_encoders: Dict[str, AudioEncoder] = {}
+
+
+def register_encoder(encoder: AudioEncoder) -> None:
+    """
+    Makes an encoder available under its `format` name, replacing any existing one.
+    """
+    _encoders[encoder.format] = encoder
+
+
+def get_encoder(format: str) -> AudioEncoder:
+    """
+    Returns the encoder registered for an output format.
+
+    Raises:
+        ValueError: If no encoder is registered for `format`.
+    """
+    try:
+        return _encoders[format.lower()]
+    except KeyError:
+        raise ValueError(
+            f"Unsupported output format {format!r}, expected one of: {', '.join(sorted(_encoders))}"
+        ) from None
+
+
+def default_encoder() -> AudioEncoder:
+    return get_encoder(project.config.TTS_OUTPUT_FORMAT)
+
+
+register_encoder(WavEncoder())
+
+register_encoder(
+    FfmpegEncoder(
+        format="mp3",
+        file_type="MP3",
+        extension=".mp3",
+        mime_type="audio/mpeg",
+        codec="libmp3lame",
+        container="mp3",
+        bitrate=project.config.TTS_MP3_BITRATE,
+    )
+)
+
+register_encoder(
+    FfmpegEncoder(
+        format="opus",
+        file_type="OPUS",
+        extension=".opus",
+        mime_type="audio/ogg",
+        codec="libopus",
+        container="ogg",
+        bitrate=project.config.TTS_OPUS_BITRATE,
+    )
+)
+
+encode_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=project.config.TTS_ENCODER_THREADS,
+    thread_name_prefix="tts-encoder",
+)
+
+
+async def encode_file(encoder: AudioEncoder, source_path: str, dest_path: str) -> None:
+    """
+    Encodes a rendered file on the encoder thread pool, so the engine worker that produced it is
+    already free to render the next job.
+    """
+    with project.tracing.stage("encode"):
+        await asyncio.get_running_loop().run_in_executor(
+            encode_executor, encoder.encode_file, source_path, dest_path
+        )
@@ -0,0 +1,220 @@
+import email.utils
+import hashlib
+import mmap
+import os
+import re
+from typing import BinaryIO, Mapping, Optional, Tuple
+
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+# Bytes handed to the server per send when it cannot take the file descriptor directly.
+_SEND_BLOCK_BYTES = 256 * 1024
+
+_BYTE_RANGE = re.compile(r"^bytes=\s*(\d*)\s*-\s*(\d*)\s*$")
+
+
+class _RangeNotSatisfiable(Exception):
+    pass
+
+
+class AudioFileResponse(Response):
+    """
+    Sends an open file, or one byte range of it, without reading it into memory.
+
+    If the ASGI server offers the `http.response.zerocopysend` extension the file descriptor is
+    passed to it for `sendfile`; otherwise the file is memory-mapped and sent in slices.
+    The response takes ownership of `file` and closes it once sent.
+    """
+
+    def __init__(
+        self,
+        file: BinaryIO,
+        offset: int,
+        length: int,
+        status_code: int,
+        headers: Mapping[str, str],
+        media_type: Optional[str] = None,
+    ):
+        self.file = file
+        self.offset = offset
+        self.length = length
+        super().__init__(
+            status_code=status_code,
+            headers={**headers, "content-length": str(length)},
+            media_type=media_type,
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": self.status_code,
+                    "headers": self.raw_headers,
+                }
+            )
+            if scope["method"] == "HEAD" or self.length == 0:
+                await send({"type": "http.response.body", "body": b""})
+            elif "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send(
+                    {
+                        "type": "http.response.zerocopysend",
+                        "file": self.file,
+                        "offset": self.offset,
+                        "count": self.length,
+                    }
+                )
+            else:
+                await self._send_mapped(send)
+        finally:
+            self.file.close()
+        if self.background is not None:
+            await self.background()
+
+    async def _send_mapped(self, send: Send) -> None:
+        end = self.offset + self.length
+        with mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position = self.offset
+            while position < end:
+                block_end = min(position + _SEND_BLOCK_BYTES, end)
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": mapped[position:block_end],
+                        "more_body": block_end < end,
+                    }
+                )
+                position = block_end
+
+
+def file_response(
+    file: BinaryIO,
+    request_headers: Mapping[str, str],
+    media_type: str,
+    cache_control: str,
+    offset: int = 0,
+    length: Optional[int] = None,
+    etag: Optional[str] = None,
+) -> Response:
+    """
+    Builds the response to a GET or HEAD of an open file, or of the `length` bytes at `offset`
+    in it, honouring conditional request headers and a single `Range`.
+
+    Returns `304 Not Modified` when `If-None-Match` or `If-Modified-Since` shows the client's
+    copy is current, `206 Partial Content` for a satisfiable range, `416` for an unsatisfiable
+    one, and the whole file otherwise. Multiple ranges are answered with the whole file, which
+    the HTTP specification allows.
+
+    Args:
+        file (BinaryIO): The file to send, opened for binary reading. The returned response
+            owns it.
+        request_headers (Mapping[str, str]): Headers of the request, keyed case-insensitively.
+        media_type (str): Content type of the file.
+        cache_control (str): Value of the `Cache-Control` header.
+        offset (int): Start of the bytes to send within the file.
+        length (Optional[int]): Number of bytes to send; up to the end of the file if None.
+        etag (Optional[str]): Entity tag of those bytes, derived from the file's metadata when
+            not given.
+
+    Returns:
+        Response: The response to send.
+    """
+    stat = os.fstat(file.fileno())
+    etag = etag or entity_tag(stat)
+    headers = {
+        "accept-ranges": "bytes",
+        "cache-control": cache_control,
+        "etag": etag,
+        "last-modified": email.utils.formatdate(stat.st_mtime, usegmt=True),
+    }
+    if _not_modified(request_headers, etag, stat.st_mtime):
+        file.close()
+        return Response(status_code=304, headers=headers)
+
+    size = stat.st_size - offset if length is None else length
+    byte_range = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if byte_range and (if_range is None or if_range.strip() == etag):
+        try:
+            parsed = _parse_range(byte_range, size)
+        except _RangeNotSatisfiable:
+            file.close()
+            return Response(
+                status_code=416,
+                headers={**headers, "content-range": f"bytes */{size}"},
+            )
+        if parsed is not None:
+            start, end = parsed
+            return AudioFileResponse(
+                file,
+                offset=offset + start,
+                length=end - start,
+                status_code=206,
+                headers={**headers, "content-range": f"bytes {start}-{end - 1}/{size}"},
+                media_type=media_type,
+            )
+    return AudioFileResponse(
+        file,
+        offset=offset,
+        length=size,
+        status_code=200,
+        headers=headers,
+        media_type=media_type,
+    )
+
+
+def entity_tag(stat: os.stat_result) -> str:
+    """
+    Strong ETag for a stored file. Stored files are replaced by rename, never rewritten in
+    place, so the inode, size and modification time together identify the content.
+    """
+    digest = hashlib.sha1(
+        f"{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}".encode()
+    ).hexdigest()
+    return f'"{digest[:24]}"'
+
+
+def _not_modified(request_headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence over If-Modified-Since and uses weak comparison.
+        tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+        return "*" in tags or etag in tags
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return since is not None and int(mtime) <= since.timestamp()
+    return False
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parses a single `bytes=` range into a half-open `(start, end)` interval within the file.
+
+    Returns None for headers that should be ignored, such as other units or multiple ranges.
+
+    Raises:
+        _RangeNotSatisfiable: If the range lies outside the file.
+    """
+    match = _BYTE_RANGE.match(header)
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            raise _RangeNotSatisfiable()
+        return max(size - suffix, 0), size
+    start = int(first)
+    if last and int(last) < start:
+        return None
+    end = min(int(last) + 1, size) if last else size
+    if start >= size:
+        raise _RangeNotSatisfiable()
+    return start, end
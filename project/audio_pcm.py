@@ -0,0 +1,250 @@
+import array
+import struct
+import sys
+import wave
+from dataclasses import dataclass
+from typing import Iterator, List, Tuple
+
+# Samples quieter than this (on the 16-bit scale) count as silence when trimming.
+SILENCE_THRESHOLD = 500
+
+# Silence kept in front of and after speech when trimming, so soft onsets are not clipped.
+TRIM_MARGIN_MS = 15
+
+# Length of the fade applied to both ends of a chunk to avoid clicks at joins.
+EDGE_FADE_MS = 5
+
+# Overlap of two chunks joined without a pause between them.
+CROSSFADE_MS = 10
+
+# Longest piece of silence generated at once, so long pauses never sit in memory whole.
+SILENCE_BLOCK_MS = 1000
+
+
+@dataclass(frozen=True)
+class PcmFormat:
+    """
+    Layout of interleaved little-endian PCM frames.
+    """
+
+    channels: int
+    sample_width: int
+    frame_rate: int
+
+    @property
+    def frame_size(self) -> int:
+        return self.channels * self.sample_width
+
+    def frames_for_ms(self, ms: float) -> int:
+        return int(self.frame_rate * ms / 1000)
+
+
+def read_wav(path: str) -> Tuple[PcmFormat, bytes]:
+    """
+    Reads a WAV file into its format and raw PCM frames.
+
+    Raises:
+        ValueError: If the file is not a PCM WAV file.
+    """
+    try:
+        with wave.open(path, "rb") as wav:
+            pcm_format = PcmFormat(
+                channels=wav.getnchannels(),
+                sample_width=wav.getsampwidth(),
+                frame_rate=wav.getframerate(),
+            )
+            return pcm_format, wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError) as e:
+        raise ValueError(f"{path} is not a PCM WAV file: {e}") from None
+
+
+def silence(pcm_format: PcmFormat, ms: float) -> bytes:
+    """
+    Returns `ms` milliseconds of digital silence.
+    """
+    return bytes(pcm_format.frames_for_ms(ms) * pcm_format.frame_size)
+
+
+def iter_silence(pcm_format: PcmFormat, ms: float) -> Iterator[bytes]:
+    """
+    Yields `ms` milliseconds of digital silence in blocks of at most `SILENCE_BLOCK_MS`.
+    """
+    remaining = pcm_format.frames_for_ms(ms)
+    block_frames = pcm_format.frames_for_ms(SILENCE_BLOCK_MS)
+    block = bytes(min(remaining, block_frames) * pcm_format.frame_size)
+    while remaining >= block_frames:
+        yield block
+        remaining -= block_frames
+    if remaining:
+        yield block[: remaining * pcm_format.frame_size]
+
+
+def streaming_wav_header(pcm_format: PcmFormat) -> bytes:
+    """
+    Builds a WAV header for a stream whose length is not known in advance.
+
+    The RIFF and data sizes are set to the maximum value, which players treat as "read until
+    the end of the stream".
+    """
+    byte_rate = pcm_format.frame_rate * pcm_format.frame_size
+    return (
+        b"RIFF"
+        + struct.pack("<I", 0xFFFFFFFF)
+        + b"WAVEfmt "
+        + struct.pack(
+            "<IHHIIHH",
+            16,
+            1,
+            pcm_format.channels,
+            pcm_format.frame_rate,
+            byte_rate,
+            pcm_format.frame_size,
+            pcm_format.sample_width * 8,
+        )
+        + b"data"
+        + struct.pack("<I", 0xFFFFFFFF)
+    )
+
+
+def prepare_chunk(pcm_format: PcmFormat, frames: bytes) -> bytes:
+    """
+    Trims leading and trailing silence from a rendered chunk and fades its edges so that
+    chunks can be joined, with explicit pauses between them, without audible clicks.
+
+    Only 16-bit PCM is processed; other sample widths are returned unchanged.
+    """
+    if pcm_format.sample_width != 2 or not frames:
+        return frames
+    samples = _to_samples(frames)
+    channels = pcm_format.channels
+    first, last = _speech_bounds(samples, channels)
+    if first is None:
+        return b""
+    margin = pcm_format.frames_for_ms(TRIM_MARGIN_MS) * channels
+    start = max(0, first - margin)
+    end = min(len(samples), last + channels + margin)
+    samples = samples[start:end]
+    _fade_edges(samples, channels, pcm_format.frames_for_ms(EDGE_FADE_MS))
+    return _from_samples(samples)
+
+
+class PcmJoiner:
+    """
+    Joins prepared chunks into one stream of frames.
+
+    Chunks that follow each other without a pause are crossfaded over `CROSSFADE_MS`, so the
+    end of each chunk is held back until it is known what comes next. Only 16-bit PCM is
+    crossfaded; other sample widths are joined as they are.
+    """
+
+    def __init__(self, pcm_format: PcmFormat, crossfade_ms: float = CROSSFADE_MS):
+        self.pcm_format = pcm_format
+        self._overlap = (
+            pcm_format.frames_for_ms(crossfade_ms) * pcm_format.frame_size
+            if pcm_format.sample_width == 2
+            else 0
+        )
+        self._tail = b""
+
+    def add(self, frames: bytes) -> bytes:
+        """
+        Appends a chunk and returns the frames that are final so far.
+        """
+        frames = memoryview(frames)
+        parts: List[bytes] = []
+        overlap = min(len(self._tail), len(frames), self._overlap)
+        overlap -= overlap % self.pcm_format.frame_size
+        if overlap:
+            parts.append(self._tail[:-overlap])
+            parts.append(
+                _crossfade(self.pcm_format, self._tail[-overlap:], frames[:overlap])
+            )
+            frames = frames[overlap:]
+        else:
+            parts.append(self._tail)
+        held = min(len(frames), self._overlap)
+        held -= held % self.pcm_format.frame_size
+        parts.append(frames[: len(frames) - held])
+        self._tail = bytes(frames[len(frames) - held :])
+        return b"".join(parts)
+
+    def extend(self, frames: bytes) -> bytes:
+        """
+        Continues the current chunk with more of its frames and returns the frames that are
+        final so far.
+        """
+        frames = self._tail + bytes(frames)
+        held = min(len(frames), self._overlap)
+        held -= held % self.pcm_format.frame_size
+        self._tail = frames[len(frames) - held :]
+        return frames[: len(frames) - held]
+
+    def pause(self, ms: float) -> Iterator[bytes]:
+        """
+        Ends the current chunk with `ms` milliseconds of silence, yielding the frames held back
+        and then the silence a block at a time.
+        """
+        frames, self._tail = self._tail, b""
+        if frames:
+            yield frames
+        yield from iter_silence(self.pcm_format, ms)
+
+    def finish(self) -> bytes:
+        """
+        Returns the frames still held back.
+        """
+        frames, self._tail = self._tail, b""
+        return frames
+
+
+def _crossfade(pcm_format: PcmFormat, tail: bytes, head: bytes) -> bytes:
+    fading_out = _to_samples(tail)
+    fading_in = _to_samples(head)
+    channels = pcm_format.channels
+    frames = len(fading_out) // channels
+    for frame in range(frames):
+        gain = (frame + 1) / (frames + 1)
+        for channel in range(channels):
+            index = frame * channels + channel
+            mixed = fading_out[index] * (1 - gain) + fading_in[index] * gain
+            fading_out[index] = max(-32768, min(32767, int(mixed)))
+    return _from_samples(fading_out)
+
+
+def _to_samples(frames: bytes) -> array.array:
+    samples = array.array("h")
+    samples.frombytes(frames[: len(frames) - len(frames) % 2])
+    if sys.byteorder == "big":
+        samples.byteswap()
+    return samples
+
+
+def _from_samples(samples: array.array) -> bytes:
+    if sys.byteorder == "big":
+        samples = array.array("h", samples)
+        samples.byteswap()
+    return samples.tobytes()
+
+
+def _speech_bounds(samples: array.array, channels: int):
+    first = next((i for i, s in enumerate(samples) if abs(s) > SILENCE_THRESHOLD), None)
+    if first is None:
+        return None, None
+    last = next(
+        i
+        for i in range(len(samples) - 1, first - 1, -1)
+        if abs(samples[i]) > SILENCE_THRESHOLD
+    )
+    return first - first % channels, last - last % channels
+
+
+def _fade_edges(samples: array.array, channels: int, fade_frames: int) -> None:
+    frames = len(samples) // channels
+    fade_frames = min(fade_frames, frames // 2)
+    for frame in range(fade_frames):
+        gain = frame / fade_frames
+        head = frame * channels
+        tail = (frames - 1 - frame) * channels
+        for channel in range(channels):
+            samples[head + channel] = int(samples[head + channel] * gain)
+            samples[tail + channel] = int(samples[tail + channel] * gain)
@@ -0,0 +1,647 @@
+import asyncio
+import itertools
+import logging
+import os
+import shutil
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import prisma
+import prisma.enums
+import prisma.models
+import project.audio_encoding
+import project.audio_storage
+import project.clip_bundles
+import project.config
+import project.engine_pool
+import project.list_tts_history_service
+import project.metrics
+import project.retrieve_audio_file_service
+import project.synthesis_cache
+import project.synthesis_jobs
+import project.tracing
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+deleted_requests = project.metrics.registry.counter(
+    "tts_retention_deleted_requests_total",
+    "TTS requests deleted by the retention task, by reason.",
+    labels=("reason",),
+)
+
+deleted_files = project.metrics.registry.counter(
+    "tts_retention_deleted_files_total",
+    "Stored audio files deleted by the retention task.",
+)
+
+freed_bytes = project.metrics.registry.counter(
+    "tts_retention_freed_bytes_total",
+    "Bytes of stored audio deleted by the retention task.",
+)
+
+transcoded_files = project.metrics.registry.counter(
+    "tts_retention_transcoded_files_total",
+    "Cold WAV outputs transcoded to the compressed archive format.",
+)
+
+pass_seconds = project.metrics.registry.histogram(
+    "tts_retention_pass_seconds",
+    "Duration of retention passes.",
+)
+
+
+class RetentionReport(BaseModel):
+    """
+    What one retention pass deleted and transcoded.
+    """
+
+    started_at: datetime
+    seconds: float = 0.0
+    expired_requests: int = 0
+    quota_requests: int = 0
+    dangling_requests: int = 0
+    orphaned_requests: int = 0
+    scanned_files: int = 0
+    deleted_files: int = 0
+    freed_bytes: int = 0
+    transcoded_files: int = 0
+
+
+class RetentionStats(BaseModel):
+    """
+    Progress of the retention task since the server started.
+    """
+
+    enabled: bool
+    passes: int
+    deferred_passes: int
+    last_pass: Optional[RetentionReport] = None
+
+
+class RetentionTask:
+    """
+    Deletes expired audio and the rows and files that no longer belong together, a bounded
+    amount at a time.
+
+    Each pass, in order:
+
+    - deletes TTS requests older than `retention_seconds`, with their AudioOutput rows;
+    - records the audio size of up to `batch_size` finished requests not measured yet, sums
+      every user's sizes in one grouped query, and checks up to `batch_size` of the users over
+      `user_quota_bytes`, deleting their oldest requests beyond it;
+    - checks a batch of AudioOutput rows for missing files, and deletes the requests whose audio
+      is gone or whose user was deleted;
+    - scans the next `batch_size` stored files, deleting those no AudioOutput row refers to that
+      the synthesis cache either does not hold or has not used within `retention_seconds`;
+    - transcodes up to `cold_per_pass` WAV outputs unused for `cold_after_seconds` to
+      `cold_format`, if set, and deletes the WAV files transcoded at least `grace_seconds` ago.
+
+    Deleted requests only release their files when nothing else refers to them, as renders are
+    shared through the synthesis cache, and a clip bundle is deleted with the last request
+    whose audio it holds. Cursors carry each step over to the next pass, so every
+    row and file is visited in turn without any pass reading all of them.
+
+    Passes are deferred while synthesis jobs are waiting for an engine, so retention work only
+    uses the database, disk and encoder threads when live synthesis leaves them idle.
+    """
+
+    def __init__(
+        self,
+        storage: project.audio_storage.AudioStorage,
+        cache: project.synthesis_cache.SynthesisCache,
+        retention_seconds: float,
+        user_quota_bytes: int,
+        interval_seconds: float,
+        batch_size: int,
+        grace_seconds: float,
+        cold_format: str = "",
+        cold_after_seconds: float = 7 * 24 * 3600,
+        cold_per_pass: int = 4,
+    ):
+        self.storage = storage
+        self.cache = cache
+        self.retention_seconds = retention_seconds
+        self.user_quota_bytes = user_quota_bytes
+        self.interval_seconds = interval_seconds
+        self.batch_size = max(1, batch_size)
+        self.grace_seconds = grace_seconds
+        self.cold_format = cold_format
+        self.cold_after_seconds = cold_after_seconds
+        self.cold_per_pass = cold_per_pass
+        self.passes = 0
+        self.deferred_passes = 0
+        self.last_report: Optional[RetentionReport] = None
+        self._scan: Optional[Iterator[project.audio_storage.StoredObject]] = None
+        self._quota_cursor: Optional[str] = None
+        self._dangling_cursor: Optional[str] = None
+        self._cold_cursor: Optional[str] = None
+        # Transcoded WAV files -> when their rows moved to the archived copy. Readers that
+        # looked the old location up just before may still be fetching it.
+        self._retired: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval_seconds > 0
+
+    def stats(self) -> RetentionStats:
+        return RetentionStats(
+            enabled=self.enabled,
+            passes=self.passes,
+            deferred_passes=self.deferred_passes,
+            last_pass=self.last_report,
+        )
+
+    async def start(self) -> None:
+        """
+        Starts running passes in the background every `interval_seconds`, if enabled.
+        """
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(
+                self._run_forever(), name="tts-audio-retention"
+            )
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            if _synthesis_backlog():
+                self.deferred_passes += 1
+                continue
+            try:
+                await self.run_pass()
+            except Exception:
+                logger.exception("Audio retention pass failed")
+
+    async def run_pass(self) -> RetentionReport:
+        """
+        Runs one bounded pass of every retention step.
+
+        Returns:
+            RetentionReport: What the pass deleted and transcoded.
+        """
+        async with self._lock:
+            report = RetentionReport(started_at=datetime.now(timezone.utc))
+            started = time.perf_counter()
+            if self.retention_seconds > 0:
+                await self._expire_requests(report)
+            if self.user_quota_bytes > 0:
+                await self._enforce_quotas(report)
+            await self._delete_dangling(report)
+            await self._scan_storage(report)
+            if self.cold_format:
+                await self._transcode_cold(report)
+            report.seconds = round(time.perf_counter() - started, 4)
+            pass_seconds.observe(report.seconds)
+            self.passes += 1
+            self.last_report = report
+        if report.deleted_files or report.transcoded_files:
+            logger.info(
+                "Audio retention deleted %d files (%d bytes) and transcoded %d",
+                report.deleted_files,
+                report.freed_bytes,
+                report.transcoded_files,
+            )
+        return report
+
+    async def _expire_requests(self, report: RetentionReport) -> None:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.retention_seconds)
+        with project.tracing.query("TTSRequest.find_many"):
+            requests = await prisma.models.TTSRequest.prisma().find_many(
+                where={"createdAt": {"lt": cutoff}},
+                order={"createdAt": "asc"},
+                take=self.batch_size,
+                include={"AudioOutput": True},
+            )
+        report.expired_requests += await self._delete_requests(
+            requests, "expired", report
+        )
+
+    async def _enforce_quotas(self, report: RetentionReport) -> None:
+        await self._measure_requests()
+        # A file shared by several requests of a user is summed once per request, so the sums
+        # are an upper bound of the usage `_over_quota` counts and no user over quota is missed.
+        with project.tracing.query("TTSRequest.group_by"):
+            users = await prisma.models.TTSRequest.prisma().group_by(
+                by=["userId"],
+                where={
+                    "status": prisma.enums.TTSRequestStatus.DONE,
+                    "userId": (
+                        {"gt": self._quota_cursor}
+                        if self._quota_cursor
+                        else {"not": None}
+                    ),
+                },
+                sum={"audioBytes": True},
+                having={"audioBytes": {"_sum": {"gt": self.user_quota_bytes}}},
+                order={"userId": "asc"},
+                take=self.batch_size,
+            )
+        self._quota_cursor = (
+            users[-1]["userId"] if len(users) == self.batch_size else None
+        )
+        for user in users:
+            over = await self._over_quota(user["userId"])
+            report.quota_requests += await self._delete_requests(over, "quota", report)
+
+    async def _measure_requests(self) -> None:
+        with project.tracing.query("TTSRequest.find_many"):
+            requests = await prisma.models.TTSRequest.prisma().find_many(
+                where={
+                    "status": prisma.enums.TTSRequestStatus.DONE,
+                    "audioBytes": None,
+                },
+                take=self.batch_size,
+                include={"AudioOutput": True},
+            )
+        if not requests:
+            return
+        sizes = await self._file_sizes(
+            {
+                request.AudioOutput.filePath
+                for request in requests
+                if request.AudioOutput
+            }
+        )
+        # Audio that is gone counts as empty; the dangling step deletes its request.
+        with project.tracing.query("TTSRequest.update"):
+            async with prisma.get_client().batch_() as batcher:
+                for request in requests:
+                    batcher.ttsrequest.update(
+                        where={"id": request.id},
+                        data={
+                            "audioBytes": (
+                                sizes.get(request.AudioOutput.filePath, 0)
+                                if request.AudioOutput
+                                else 0
+                            )
+                        },
+                    )
+
+    async def _over_quota(self, user_id: str) -> List[prisma.models.TTSRequest]:
+        # The history is read newest first a page at a time through the (userId, createdAt, id)
+        # index, and reading stops once `batch_size` requests past the quota are found; the
+        # next pass deletes the following ones.
+        counted: Set[str] = set()
+        used = 0
+        over: List[prisma.models.TTSRequest] = []
+        after = None
+        while True:
+            with project.tracing.query("TTSRequest.find_many"):
+                requests = await prisma.models.TTSRequest.prisma().find_many(
+                    where=project.list_tts_history_service.page_filter(user_id, after),
+                    order=[{"createdAt": "desc"}, {"id": "desc"}],
+                    take=self.batch_size,
+                    include={"AudioOutput": True},
+                )
+            finished = [request for request in requests if request.AudioOutput]
+            # Keep the newest requests that fit; a file shared by several requests counts once.
+            for request in finished:
+                name = request.AudioOutput.filePath
+                if name not in counted:
+                    counted.add(name)
+                    used += request.audioBytes or 0
+                if used > self.user_quota_bytes:
+                    over.append(request)
+            if len(over) >= self.batch_size or len(requests) < self.batch_size:
+                return over[: self.batch_size]
+            after = (requests[-1].createdAt, requests[-1].id)
+
+    async def _delete_dangling(self, report: RetentionReport) -> None:
+        where = {"id": {"gt": self._dangling_cursor}} if self._dangling_cursor else {}
+        with project.tracing.query("AudioOutput.find_many"):
+            outputs = await prisma.models.AudioOutput.prisma().find_many(
+                where=where, order={"id": "asc"}, take=self.batch_size
+            )
+        self._dangling_cursor = (
+            outputs[-1].id if len(outputs) == self.batch_size else None
+        )
+        # Files the cache holds exist; only the others need a look at storage.
+        unknown = {
+            output.filePath
+            for output in outputs
+            if self.cache.entry_size(output.filePath) is None
+        }
+        missing = await asyncio.to_thread(self._missing, unknown)
+        dangling = [
+            output.ttsRequestId for output in outputs if output.filePath in missing
+        ]
+        if dangling:
+            with project.tracing.query("TTSRequest.delete_many"):
+                deleted = await prisma.models.TTSRequest.prisma().delete_many(
+                    where={"id": {"in": dangling}}
+                )
+            _forget_locations(dangling)
+            deleted_requests.inc(deleted, reason="missing_audio")
+            report.dangling_requests += deleted
+        # Deleting a user keeps their requests with an empty userId; nobody can read them.
+        with project.tracing.query("TTSRequest.find_many"):
+            orphaned = await prisma.models.TTSRequest.prisma().find_many(
+                where={"userId": None},
+                take=self.batch_size,
+                include={"AudioOutput": True},
+            )
+        report.orphaned_requests += await self._delete_requests(
+            orphaned, "orphaned", report
+        )
+
+    async def _scan_storage(self, report: RetentionReport) -> None:
+        objects = await asyncio.to_thread(self._next_objects)
+        report.scanned_files += len(objects)
+        now = time.time()
+        settled = [o for o in objects if now - o.mtime >= self.grace_seconds]
+        referenced = await _referenced_files({o.name for o in settled})
+        victims = []
+        for stored in settled:
+            if stored.name in referenced or stored.name in self._retired:
+                continue
+            if self.cache.entry_size(stored.name) is not None:
+                # Unreferenced renders stay while the cache serves them.
+                if self.retention_seconds <= 0:
+                    continue
+                if now - stored.last_used < self.retention_seconds:
+                    continue
+                self.cache.discard(stored.name)
+            victims.append(stored.name)
+        await self._delete_files(victims, report)
+
+    async def _transcode_cold(self, report: RetentionReport) -> None:
+        await self._delete_retired(report)
+        encoder = project.audio_encoding.get_encoder(self.cold_format)
+        if encoder.file_type == prisma.enums.AudioFileType.WAV.value:
+            return
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.cold_after_seconds)
+        where = {
+            "fileType": prisma.enums.AudioFileType.WAV,
+            "createdAt": {"lt": cutoff},
+        }
+        previous = self._cold_cursor
+        if previous:
+            where["id"] = {"gt": previous}
+        with project.tracing.query("AudioOutput.find_many"):
+            outputs = await prisma.models.AudioOutput.prisma().find_many(
+                where=where, order={"id": "asc"}, take=self.batch_size
+            )
+        self._cold_cursor = outputs[-1].id if len(outputs) == self.batch_size else None
+        # Clips stay in their bundle in the format it was written in.
+        names = list(
+            dict.fromkeys(
+                output.filePath
+                for output in outputs
+                if project.clip_bundles.parse_clip_ref(output.filePath) is None
+            )
+        )
+        for name in names:
+            if report.transcoded_files >= self.cold_per_pass or _synthesis_backlog():
+                # Come back to this batch next time; finished outputs are no longer WAV.
+                self._cold_cursor = previous
+                break
+            stored = await asyncio.to_thread(self.storage.stat, name)
+            if (
+                stored is None
+                or time.time() - stored.last_used < self.cold_after_seconds
+            ):
+                continue
+            try:
+                archived = await self._transcode(name, encoder)
+            except Exception as e:
+                logger.warning("Could not transcode cold output %s: %s", name, e)
+                continue
+            with project.tracing.query("AudioOutput.find_many"):
+                moved = await prisma.models.AudioOutput.prisma().find_many(
+                    where={"filePath": name}
+                )
+            with project.tracing.query(
+                "AudioOutput.update_many+TTSRequest.update_many"
+            ):
+                async with prisma.get_client().batch_() as batcher:
+                    batcher.audiooutput.update_many(
+                        where={"filePath": name},
+                        data={
+                            "filePath": archived.name,
+                            "fileType": prisma.enums.AudioFileType(encoder.file_type),
+                        },
+                    )
+                    batcher.ttsrequest.update_many(
+                        where={"id": {"in": [output.ttsRequestId for output in moved]}},
+                        data={"audioBytes": archived.size},
+                    )
+            _forget_locations(output.ttsRequestId for output in moved)
+            self.cache.discard(name)
+            self._retired[name] = time.time()
+            transcoded_files.inc()
+            report.transcoded_files += 1
+
+    async def _delete_retired(self, report: RetentionReport) -> None:
+        # Retired files not deleted before a restart are left to the storage scan.
+        now = time.time()
+        due = {
+            name
+            for name, retired in self._retired.items()
+            if now - retired >= self.grace_seconds
+        }
+        if not due:
+            return
+        for name in due:
+            del self._retired[name]
+        # A request rendered since may have been handed the same file again.
+        referenced = await _referenced_files(due)
+        await self._delete_files(
+            [
+                name
+                for name in due
+                if name not in referenced and self.cache.entry_size(name) is None
+            ],
+            report,
+        )
+
+    async def _transcode(
+        self, name: str, encoder: project.audio_encoding.AudioEncoder
+    ) -> project.audio_storage.StoredObject:
+        key = name.rsplit("/", 1)[-1].split(".", 1)[0]
+        scratch = os.path.join(self.cache.scratch_dir, f"{key}.{uuid.uuid4().hex}")
+        source_path = f"{scratch}.wav"
+        dest_path = f"{scratch}{encoder.extension}"
+        try:
+            await asyncio.to_thread(self._copy_out, name, source_path)
+            await asyncio.get_running_loop().run_in_executor(
+                project.audio_encoding.encode_executor,
+                encoder.encode_file,
+                source_path,
+                dest_path,
+            )
+            # A name the synthesis cache does not claim, as no request renders this directly.
+            return await asyncio.to_thread(
+                self.storage.store,
+                dest_path,
+                project.audio_storage.shard_name(f"{key}.cold", encoder.extension),
+            )
+        finally:
+            for path in (source_path, dest_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _copy_out(self, name: str, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.storage.local_copy(name) as source:
+            shutil.copyfile(source, path)
+
+    async def _delete_requests(
+        self,
+        requests: List[prisma.models.TTSRequest],
+        reason: str,
+        report: RetentionReport,
+    ) -> int:
+        if not requests:
+            return 0
+        ids = [request.id for request in requests]
+        names = {
+            project.clip_bundles.stored_name(request.AudioOutput.filePath)
+            for request in requests
+            if request.AudioOutput
+        }
+        # AudioOutput rows go with their requests.
+        with project.tracing.query("TTSRequest.delete_many"):
+            deleted = await prisma.models.TTSRequest.prisma().delete_many(
+                where={"id": {"in": ids}}
+            )
+        _forget_locations(ids)
+        deleted_requests.inc(deleted, reason=reason)
+        referenced = await _referenced_files(names)
+        await self._delete_files(
+            [
+                name
+                for name in names
+                if name not in referenced and self.cache.entry_size(name) is None
+            ],
+            report,
+        )
+        return deleted
+
+    async def _delete_files(self, names: List[str], report: RetentionReport) -> None:
+        if not names:
+            return
+        count, size = await asyncio.to_thread(self._remove, names)
+        deleted_files.inc(count)
+        freed_bytes.inc(size)
+        report.deleted_files += count
+        report.freed_bytes += size
+
+    async def _file_sizes(self, names: Set[str]) -> Dict[str, int]:
+        sizes = {}
+        unknown = []
+        for name in names:
+            size = self.cache.entry_size(name)
+            if size is None:
+                unknown.append(name)
+            else:
+                sizes[name] = size
+        sizes.update(await asyncio.to_thread(self._stat_sizes, unknown))
+        return sizes
+
+    def _stat_sizes(self, names: List[str]) -> Dict[str, int]:
+        sizes = {}
+        for name in names:
+            if project.clip_bundles.parse_clip_ref(name) is not None:
+                # A bundled clip counts with its own size, not the bundle's.
+                located = project.clip_bundles.locate_clip(self.storage, name)
+                if located is not None:
+                    sizes[name] = located[1].length
+                continue
+            stored = self.storage.stat(name)
+            if stored is not None:
+                sizes[name] = stored.size
+        return sizes
+
+    def _missing(self, names: Set[str]) -> Set[str]:
+        return {
+            name
+            for name in names
+            if self.storage.stat(project.clip_bundles.stored_name(name)) is None
+            or (
+                project.clip_bundles.parse_clip_ref(name) is not None
+                and project.clip_bundles.locate_clip(self.storage, name) is None
+            )
+        }
+
+    def _remove(self, names: List[str]) -> Tuple[int, int]:
+        count = size = 0
+        for name in names:
+            stored = self.storage.stat(name)
+            if stored is None:
+                continue
+            self.storage.delete(name)
+            if name.endswith(project.clip_bundles.BUNDLE_EXTENSION):
+                project.clip_bundles.forget_reader(
+                    self.storage.local_path(name) or name
+                )
+            count += 1
+            size += stored.size
+        return count, size
+
+    def _next_objects(self) -> List[project.audio_storage.StoredObject]:
+        if self._scan is None:
+            self._scan = self.storage.list_objects()
+        objects = list(itertools.islice(self._scan, self.batch_size))
+        if len(objects) < self.batch_size:
+            # The scan reached the end; the next pass starts over.
+            self._scan = None
+        return objects
+
+
+async def _referenced_files(names: Set[str]) -> Set[str]:
+    # A bundle is referenced while any of its clips is.
+    bundles = [
+        name for name in names if name.endswith(project.clip_bundles.BUNDLE_EXTENSION)
+    ]
+    files = [name for name in names if name not in bundles]
+    referenced = set()
+    if files:
+        with project.tracing.query("AudioOutput.find_many"):
+            outputs = await prisma.models.AudioOutput.prisma().find_many(
+                where={"filePath": {"in": files}}
+            )
+        referenced.update(output.filePath for output in outputs)
+    for name in bundles:
+        with project.tracing.query("AudioOutput.find_first"):
+            clip = await prisma.models.AudioOutput.prisma().find_first(
+                where={"bundleId": project.clip_bundles.bundle_id_of(name)}
+            )
+        if clip is not None:
+            referenced.add(name)
+    return referenced
+
+
+def _forget_locations(request_ids: Iterable[str]) -> None:
+    for request_id in request_ids:
+        project.retrieve_audio_file_service.audio_output_cache.invalidate(request_id)
+
+
+def _synthesis_backlog() -> bool:
+    return (
+        project.engine_pool.engine_pool.queued() > 0
+        or project.synthesis_jobs.job_scheduler.backend.qsize() > 0
+    )
+
+
+retention_task = RetentionTask(
+    storage=project.audio_storage.audio_storage,
+    cache=project.synthesis_cache.synthesis_cache,
+    retention_seconds=project.config.AUDIO_RETENTION_SECONDS,
+    user_quota_bytes=project.config.AUDIO_USER_QUOTA_BYTES,
+    interval_seconds=project.config.AUDIO_GC_INTERVAL_SECONDS,
+    batch_size=project.config.AUDIO_GC_BATCH_SIZE,
+    grace_seconds=project.config.AUDIO_GC_GRACE_SECONDS,
+    cold_format=project.config.AUDIO_COLD_TRANSCODE_FORMAT,
+    cold_after_seconds=project.config.AUDIO_COLD_AFTER_SECONDS,
+    cold_per_pass=project.config.AUDIO_COLD_TRANSCODES_PER_PASS,
+)
@@ -0,0 +1,357 @@
+import abc
+import contextlib
+import errno
+import hashlib
+import hmac
+import mimetypes
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+import project.config
+
+mimetypes.add_type("audio/ogg", ".opus")
+
+
+@dataclass
+class StoredObject:
+    """
+    Metadata of a stored audio file. `name` is its backend-independent relative path, `mtime`
+    changes only when the content is written, and `last_used` is refreshed by `touch` where the
+    backend supports it.
+    """
+
+    name: str
+    size: int
+    mtime: float
+    last_used: float
+
+
+def shard_name(key: str, extension: str) -> str:
+    """
+    Builds the storage name for a content key, spreading files over two levels of
+    subdirectories taken from the key so no single directory grows too large.
+
+    Args:
+        key (str): A hex digest or other id with at least four characters.
+        extension (str): File extension including the dot.
+
+    Returns:
+        str: A relative name such as `ab/cd/abcd1234....mp3`.
+    """
+    return f"{key[:2]}/{key[2:4]}/{key}{extension}"
+
+
+class AudioStorage(abc.ABC):
+    """
+    Where encoded audio files live once rendered.
+
+    Methods perform blocking I/O; async callers run them with `asyncio.to_thread`.
+    """
+
+    @abc.abstractmethod
+    def store(self, local_path: str, name: str) -> StoredObject:
+        """
+        Moves a finished local file into storage under `name`, replacing any existing object
+        atomically. The local file is consumed.
+        """
+
+    @abc.abstractmethod
+    def stat(self, name: str) -> Optional[StoredObject]:
+        """
+        Returns metadata for `name`, or None if it does not exist.
+        """
+
+    @abc.abstractmethod
+    def touch(self, name: str) -> bool:
+        """
+        Marks `name` as recently used where the backend supports it.
+
+        Returns:
+            bool: False if the object no longer exists.
+        """
+
+    @abc.abstractmethod
+    def delete(self, name: str) -> None:
+        """
+        Removes `name`. Missing objects are ignored.
+        """
+
+    @abc.abstractmethod
+    def list_objects(self) -> Iterator[StoredObject]:
+        """
+        Iterates over every stored audio file.
+        """
+
+    @abc.abstractmethod
+    def url_for(self, name: str) -> str:
+        """
+        Returns a URL a client can download `name` from.
+        """
+
+    @abc.abstractmethod
+    def local_copy(self, name: str) -> "contextlib.AbstractContextManager[str]":
+        """
+        Context manager yielding a local file path with the contents of `name`.
+        """
+
+    def local_path(self, name: str) -> Optional[str]:
+        """
+        Returns the path `name` can be read from directly, or None if the backend is remote.
+        """
+        return None
+
+
+def url_signature(key: str, name: str, expires: int) -> str:
+    """
+    Signs the download URL of `name` valid until the Unix time `expires`.
+    """
+    message = f"{name}\n{expires}".encode("utf-8")
+    return hmac.new(key.encode("utf-8"), message, hashlib.sha256).hexdigest()
+
+
+def check_url_signature(key: str, name: str, expires: int, signature: str) -> bool:
+    """
+    Whether `signature` was made by `url_signature` for `name` and has not expired yet.
+    """
+    if expires < time.time():
+        return False
+    return hmac.compare_digest(url_signature(key, name, expires), signature)
+
+
+class LocalAudioStorage(AudioStorage):
+    """
+    Stores audio files under a directory on the local filesystem.
+
+    Download URLs carry an expiry time and an HMAC of the name, as presigned S3 URLs do: names
+    are content hashes of the synthesized input, so anyone who knows a text could otherwise
+    work out the URL of another user's audio.
+    """
+
+    def __init__(
+        self, root: str, base_url: str, signing_key: str, url_expires_seconds: int
+    ):
+        self.root = root
+        self.base_url = base_url
+        self.signing_key = signing_key
+        self.url_expires_seconds = url_expires_seconds
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, *name.split("/"))
+
+    @staticmethod
+    def _stored(name: str, stat: os.stat_result) -> StoredObject:
+        return StoredObject(
+            name=name,
+            size=stat.st_size,
+            mtime=stat.st_mtime,
+            last_used=max(stat.st_atime, stat.st_mtime),
+        )
+
+    def store(self, local_path: str, name: str) -> StoredObject:
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(local_path, path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # The source is on another filesystem: copy next to the destination first so the
+            # final rename is still atomic.
+            temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            try:
+                shutil.copyfile(local_path, temp_path)
+                os.replace(temp_path, path)
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(temp_path)
+                raise
+            os.remove(local_path)
+        return self._stored(name, os.stat(path))
+
+    def stat(self, name: str) -> Optional[StoredObject]:
+        try:
+            return self._stored(name, os.stat(self._path(name)))
+        except FileNotFoundError:
+            return None
+
+    def touch(self, name: str) -> bool:
+        path = self._path(name)
+        try:
+            # Only the access time moves, so the modification time keeps identifying the
+            # content for HTTP validators.
+            os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def delete(self, name: str) -> None:
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._path(name))
+
+    def list_objects(self) -> Iterator[StoredObject]:
+        if not os.path.isdir(self.root):
+            return
+        for first in _shard_dirs(self.root):
+            for second in _shard_dirs(os.path.join(self.root, first)):
+                directory = os.path.join(self.root, first, second)
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file() and not entry.name.endswith(".tmp"):
+                            yield self._stored(
+                                f"{first}/{second}/{entry.name}", entry.stat()
+                            )
+
+    def url_for(self, name: str) -> str:
+        expires = int(time.time()) + self.url_expires_seconds
+        signature = url_signature(self.signing_key, name, expires)
+        return f"{self.base_url}{name}?expires={expires}&signature={signature}"
+
+    @contextlib.contextmanager
+    def local_copy(self, name: str) -> Iterator[str]:
+        yield self._path(name)
+
+    def local_path(self, name: str) -> Optional[str]:
+        return self._path(name)
+
+
+class S3AudioStorage(AudioStorage):
+    """
+    Stores audio files in an S3-compatible bucket.
+
+    `endpoint_url` points the client at any S3-compatible service, such as a local MinIO or moto
+    server. Requires the optional `boto3` package.
+    """
+
+    def __init__(
+        self,
+        bucket: str,
+        prefix: str = "",
+        endpoint_url: Optional[str] = None,
+        region_name: Optional[str] = None,
+        public_base_url: Optional[str] = None,
+        url_expires_seconds: int = 3600,
+        client=None,
+    ):
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError(
+                    "The s3 audio storage backend requires the boto3 package"
+                ) from None
+            client = boto3.client(
+                "s3", endpoint_url=endpoint_url, region_name=region_name
+            )
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        self.public_base_url = public_base_url
+        self.url_expires_seconds = url_expires_seconds
+
+    def _key(self, name: str) -> str:
+        return f"{self.prefix}{name}"
+
+    def store(self, local_path: str, name: str) -> StoredObject:
+        content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+        # A single PUT only becomes visible once complete, so readers never see a partial file.
+        self.client.upload_file(
+            local_path,
+            self.bucket,
+            self._key(name),
+            ExtraArgs={"ContentType": content_type},
+        )
+        stored = self.stat(name)
+        os.remove(local_path)
+        return stored
+
+    def stat(self, name: str) -> Optional[StoredObject]:
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+        except self.client.exceptions.ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                return None
+            raise
+        mtime = head["LastModified"].timestamp()
+        return StoredObject(
+            name=name, size=head["ContentLength"], mtime=mtime, last_used=mtime
+        )
+
+    def touch(self, name: str) -> bool:
+        # Objects cannot be touched without rewriting them; recency is tracked in memory only.
+        return self.stat(name) is not None
+
+    def delete(self, name: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+    def list_objects(self) -> Iterator[StoredObject]:
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get("Contents", []):
+                mtime = item["LastModified"].timestamp()
+                yield StoredObject(
+                    name=item["Key"][len(self.prefix) :],
+                    size=item["Size"],
+                    mtime=mtime,
+                    last_used=mtime,
+                )
+
+    def url_for(self, name: str) -> str:
+        if self.public_base_url:
+            return f"{self.public_base_url}{name}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._key(name)},
+            ExpiresIn=self.url_expires_seconds,
+        )
+
+    @contextlib.contextmanager
+    def local_copy(self, name: str) -> Iterator[str]:
+        suffix = os.path.splitext(name)[1]
+        with tempfile.NamedTemporaryFile(suffix=suffix) as f:
+            self.client.download_fileobj(self.bucket, self._key(name), f)
+            f.flush()
+            yield f.name
+
+
+def _shard_dirs(directory: str) -> Iterator[str]:
+    with os.scandir(directory) as entries:
+        names = [
+            entry.name
+            for entry in entries
+            if entry.is_dir()
+            and len(entry.name) == 2
+            and all(c in "0123456789abcdef" for c in entry.name)
+        ]
+    return iter(sorted(names))
+
+
+def create_audio_storage() -> AudioStorage:
+    """
+    Builds the storage backend selected by `AUDIO_STORAGE_BACKEND`.
+    """
+    backend = project.config.AUDIO_STORAGE_BACKEND
+    if backend == "local":
+        return LocalAudioStorage(
+            root=project.config.SPEECH_OUTPUT_DIR,
+            base_url=project.config.AUDIO_STORAGE_BASE_URL,
+            signing_key=project.config.AUDIO_URL_SIGNING_KEY,
+            url_expires_seconds=project.config.AUDIO_URL_EXPIRES_SECONDS,
+        )
+    if backend == "s3":
+        return S3AudioStorage(
+            bucket=project.config.S3_BUCKET,
+            prefix=project.config.S3_PREFIX,
+            endpoint_url=project.config.S3_ENDPOINT_URL,
+            region_name=project.config.S3_REGION,
+            public_base_url=project.config.S3_PUBLIC_BASE_URL,
+            url_expires_seconds=project.config.S3_URL_EXPIRES_SECONDS,
+        )
+    raise ValueError(f"Unknown audio storage backend {backend!r}")
+
+
+audio_storage = create_audio_storage()
@@ -0,0 +1,336 @@
+import asyncio
+import hmac
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import prisma
+import prisma.models
+import project.config
+import project.metrics
+import project.tracing
+import project.ttl_cache
+from fastapi import Depends, HTTPException, WebSocket, WebSocketException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from jose import JWTError, jwt
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "HS256"
+
+# Keys that must never sign tokens: unset, and the placeholder earlier versions shipped with.
+_UNSAFE_SECRET_KEYS = frozenset({"", "YOUR_SECRET_KEY_HERE"})
+
+# Revocations written shortly before the previous refresh may only become visible after it, so
+# each refresh re-reads this much history.
+_REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+class AuthStats(BaseModel):
+    """
+    Cost of authenticating requests and the state of the token caches.
+    """
+
+    verification_latency: project.metrics.LatencySnapshot
+    claims_cache_hits: int
+    claims_cache_misses: int
+    revoked_tokens: int
+    revocations_synced_at: Optional[datetime] = None
+
+
+@dataclass(frozen=True)
+class AuthenticatedUser:
+    """
+    The caller of a request, as identified by a verified access token.
+    """
+
+    user_id: str
+    email: str
+    token_id: str
+    expires_at: float
+    role: str = "USER"
+
+
+class RevocationIndex:
+    """
+    The ids of revoked access tokens that have not expired yet, kept in memory.
+
+    Tokens are checked against this index instead of the database. A background task reads the
+    AccessToken rows revoked since the previous refresh every `refresh_seconds`, so a revocation
+    made by another server process takes effect within that interval; revocations made through
+    this process take effect at once.
+    """
+
+    def __init__(self, refresh_seconds: float):
+        self.refresh_seconds = refresh_seconds
+        self._revoked: Dict[str, float] = {}
+        self._synced_at: Optional[datetime] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._revoked)
+
+    @property
+    def synced_at(self) -> Optional[datetime]:
+        return self._synced_at
+
+    def is_revoked(self, token_id: str) -> bool:
+        return token_id in self._revoked
+
+    def add(self, token_id: str, expires_at: float) -> None:
+        self._revoked[token_id] = expires_at
+
+    async def refresh(self) -> None:
+        """
+        Reads the revocations made since the last refresh, or all current ones on the first.
+        """
+        started = datetime.now(timezone.utc)
+        where = {"revokedAt": {"not": None}, "expiresAt": {"gt": started}}
+        if self._synced_at is not None:
+            where["updatedAt"] = {"gte": self._synced_at - _REFRESH_OVERLAP}
+        with project.tracing.query("AccessToken.find_many"):
+            tokens = await prisma.models.AccessToken.prisma().find_many(where=where)
+        for token in tokens:
+            self._revoked[token.id] = token.expiresAt.timestamp()
+        now = time.time()
+        for token_id in [i for i, expires in self._revoked.items() if expires <= now]:
+            del self._revoked[token_id]
+        self._synced_at = started
+
+    async def _refresh_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Failed to refresh the token revocation index")
+
+    async def start(self) -> None:
+        """
+        Loads the current revocations and starts refreshing them in the background.
+        """
+        await self.refresh()
+        self._task = asyncio.create_task(self._refresh_forever())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+
+revocation_index = RevocationIndex(
+    refresh_seconds=project.config.AUTH_REVOCATION_REFRESH_SECONDS
+)
+
+# Verified tokens, kept until they expire, so repeated requests skip signature checks.
+claims_cache: project.ttl_cache.TTLCache[AuthenticatedUser] = (
+    project.ttl_cache.TTLCache(
+        maxsize=project.config.AUTH_CLAIMS_CACHE_SIZE,
+        ttl=project.config.ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+    )
+)
+
+project.metrics.register_cache("auth_claims", claims_cache.counters)
+
+verification_latency = project.metrics.LatencyTracker(
+    histogram=project.metrics.registry.histogram(
+        "tts_auth_verification_seconds",
+        "Time taken to authenticate a request from its bearer token.",
+    )
+)
+
+
+def _unauthorized(detail: str) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+def verify_token(token: str) -> AuthenticatedUser:
+    """
+    Verifies an access token locally, without a database query.
+
+    Args:
+        token (str): The encoded JWT from the `Authorization` header.
+
+    Returns:
+        AuthenticatedUser: The user the token was issued to.
+
+    Raises:
+        HTTPException: 401 if the token is malformed, expired, forged or revoked.
+    """
+    user = claims_cache.get(token)
+    if user is None:
+        try:
+            claims = jwt.decode(
+                token, project.config.JWT_SECRET_KEY, algorithms=[ALGORITHM]
+            )
+        except JWTError:
+            raise _unauthorized("Invalid or expired token") from None
+        if not claims.get("uid") or not claims.get("jti") or not claims.get("exp"):
+            raise _unauthorized("Invalid or expired token")
+        user = AuthenticatedUser(
+            user_id=claims["uid"],
+            email=claims.get("sub", ""),
+            token_id=claims["jti"],
+            expires_at=float(claims["exp"]),
+            role=claims.get("role", "USER"),
+        )
+        claims_cache.set(token, user, ttl=user.expires_at - time.time())
+    elif user.expires_at <= time.time():
+        raise _unauthorized("Invalid or expired token")
+    if revocation_index.is_revoked(user.token_id):
+        raise _unauthorized("Token has been revoked")
+    return user
+
+
+_bearer = HTTPBearer(auto_error=False)
+
+
+async def authenticated_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer),
+) -> AuthenticatedUser:
+    """
+    FastAPI dependency returning the caller of a request from its bearer token.
+
+    Raises:
+        HTTPException: 401 if no valid token was sent.
+    """
+    started = time.perf_counter()
+    try:
+        if credentials is None:
+            raise _unauthorized("Not authenticated")
+        return verify_token(credentials.credentials)
+    finally:
+        verification_latency.observe(time.perf_counter() - started)
+
+
+async def websocket_user(websocket: WebSocket) -> AuthenticatedUser:
+    """
+    FastAPI dependency returning the caller of a WebSocket session, from the bearer token in
+    its `Authorization` header or, since browsers cannot set that header on a WebSocket, its
+    `access_token` query parameter.
+
+    Raises:
+        WebSocketException: Policy violation (1008), refusing the session, if no valid token
+            was sent.
+    """
+    started = time.perf_counter()
+    try:
+        scheme, _, token = websocket.headers.get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token:
+            token = websocket.query_params.get("access_token", "")
+        if not token:
+            raise WebSocketException(
+                code=status.WS_1008_POLICY_VIOLATION, reason="Not authenticated"
+            )
+        try:
+            return verify_token(token)
+        except HTTPException as e:
+            raise WebSocketException(
+                code=status.WS_1008_POLICY_VIOLATION, reason=e.detail
+            ) from None
+    finally:
+        verification_latency.observe(time.perf_counter() - started)
+
+
+def check_secret_key() -> None:
+    """
+    Refuses to run with a token signing key anyone could know. Tokens are trusted on their
+    signature alone, roles included, so such a key would let anyone act as an administrator.
+
+    Raises:
+        RuntimeError: If `JWT_SECRET_KEY` is unset or still the placeholder.
+    """
+    if project.config.JWT_SECRET_KEY.strip() in _UNSAFE_SECRET_KEYS:
+        raise RuntimeError(
+            "JWT_SECRET_KEY must be set to a long random value, "
+            "e.g. the output of `openssl rand -hex 32`"
+        )
+
+
+def ensure_user(user: AuthenticatedUser, user_id: str) -> None:
+    """
+    Rejects a request that acts on behalf of a user other than the caller.
+
+    Raises:
+        HTTPException: 403 if `user_id` is not the authenticated user.
+    """
+    if user.user_id != user_id:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not allowed to act for another user",
+        )
+
+
+def ensure_admin(user: AuthenticatedUser) -> None:
+    """
+    Rejects a request from a caller without the ADMIN role.
+
+    Raises:
+        HTTPException: 403 if the caller is not an administrator.
+    """
+    if user.role != "ADMIN":
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Administrator role required",
+        )
+
+
+def can_read(user: AuthenticatedUser, owner_id: Optional[str]) -> bool:
+    """
+    Whether the caller may read a resource belonging to `owner_id`: their own, or anyone's
+    for administrators.
+    """
+    return user.role == "ADMIN" or (owner_id is not None and owner_id == user.user_id)
+
+
+async def metrics_scraper(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(_bearer),
+) -> None:
+    """
+    FastAPI dependency admitting a metrics scrape. When `METRICS_TOKEN` is set, the scraper must
+    send it as its bearer token; user access tokens are not accepted.
+
+    Raises:
+        HTTPException: 401 if the token is missing or wrong.
+    """
+    expected = project.config.METRICS_TOKEN
+    if not expected:
+        return
+    if credentials is None or not hmac.compare_digest(
+        credentials.credentials.encode("utf-8"), expected.encode("utf-8")
+    ):
+        raise _unauthorized("Invalid metrics token")
+
+
+async def revoke_token(user: AuthenticatedUser) -> None:
+    """
+    Revokes the access token a request was made with, effective immediately in this process
+    and within one refresh interval in others.
+    """
+    with project.tracing.query("AccessToken.update_many"):
+        await prisma.models.AccessToken.prisma().update_many(
+            where={"id": user.token_id},
+            data={"revokedAt": datetime.now(timezone.utc)},
+        )
+    revocation_index.add(user.token_id, user.expires_at)
+
+
+def auth_stats() -> AuthStats:
+    """
+    Returns token verification latency and cache statistics.
+    """
+    return AuthStats(
+        verification_latency=verification_latency.snapshot(),
+        claims_cache_hits=claims_cache.hits,
+        claims_cache_misses=claims_cache.misses,
+        revoked_tokens=len(revocation_index),
+        revocations_synced_at=revocation_index.synced_at,
+    )
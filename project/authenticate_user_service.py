@@ -1,8 +1,16 @@
+import asyncio
+import hashlib
+import logging
+import uuid
 from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
 
 import prisma
 import prisma.models
-from bcrypt import checkpw
+import project.auth
+import project.config
+import project.password_hashing
+import project.tracing
 from jose import jwt
 from pydantic import BaseModel
 
@@ -17,11 +25,71 @@ class AuthenticateUserResponse(BaseModel):
     expires_in: int
 
 
-SECRET_KEY = "YOUR_SECRET_KEY_HERE"
+class LogoutResponse(BaseModel):
+    """
+    Confirms that the access token used for the request has been revoked.
+    """
+
+    success: bool
+    message: str
+
+
+SECRET_KEY = project.config.JWT_SECRET_KEY
+
+ALGORITHM = project.auth.ALGORITHM
+
+ACCESS_TOKEN_EXPIRE_MINUTES = project.config.ACCESS_TOKEN_EXPIRE_MINUTES
+
+logger = logging.getLogger(__name__)
+
+# Credential checks in progress, keyed by email and a digest of the password, so a burst of
+# identical login attempts costs one database lookup and one bcrypt verification.
+_logins_in_flight: Dict[
+    Tuple[str, bytes], "asyncio.Task[Optional[prisma.models.User]]"
+] = {}
+
+
+async def _verify_credentials(
+    email: str, password: str
+) -> Optional[prisma.models.User]:
+    with project.tracing.query("User.find_unique"):
+        user = await prisma.models.User.prisma().find_unique(where={"email": email})
+    if user is None or not await project.password_hashing.verify_password(
+        password, user.password
+    ):
+        return None
+    if project.password_hashing.needs_rehash(user.password):
+        try:
+            password_hash = await project.password_hashing.hash_password(password)
+            with project.tracing.query("User.update"):
+                await prisma.models.User.prisma().update(
+                    where={"id": user.id}, data={"password": password_hash}
+                )
+        except Exception:
+            logger.exception("Failed to rehash the password of user %s", user.id)
+    return user
+
+
+async def check_credentials(email: str, password: str) -> Optional[prisma.models.User]:
+    """
+    Returns the user if the password matches, sharing the check with any identical attempt
+    already in progress.
 
-ALGORITHM = "HS256"
+    Args:
+        email (str): The user's email address as registered.
+        password (str): The password to check.
 
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
+    Returns:
+        Optional[prisma.models.User]: The user, or None if the email or password is wrong.
+    """
+    key = (email, hashlib.sha256(password.encode("utf-8")).digest())
+    task = _logins_in_flight.get(key)
+    if task is None:
+        task = asyncio.create_task(_verify_credentials(email, password))
+        _logins_in_flight[key] = task
+        task.add_done_callback(lambda _: _logins_in_flight.pop(key, None))
+    # Shielded so one caller disconnecting does not cancel the check for the others.
+    return await asyncio.shield(task)
 
 
 async def authenticate_user(email: str, password: str) -> AuthenticateUserResponse:
@@ -30,6 +98,9 @@ async def authenticate_user(email: str, password: str) -> AuthenticateUserRespon
 
     This function finds a user by their email, verifies the provided password against the hashed
     password stored in the database, and generates a JWT access token if authentication is successful.
+    Each token carries the user id and the id of the AccessToken row recorded for it, which is
+    what revocation refers to. Verification runs off the event loop, concurrent identical attempts share one check, and
+    hashes made at an outdated bcrypt cost are replaced on a successful login.
 
     Args:
         email (str): The user's email address as registered.
@@ -38,12 +109,28 @@ async def authenticate_user(email: str, password: str) -> AuthenticateUserRespon
     Returns:
         AuthenticateUserResponse: Response model for user authentication, including the access token on successful authentication.
     """
-    user = await prisma.models.User.prisma().find_unique(where={"email": email})
-    if user and checkpw(password.encode("utf-8"), user.password.encode("utf-8")):
+    user = await check_credentials(email, password)
+    if user:
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        token_id = str(uuid.uuid4())
         token = create_access_token(
-            data={"sub": user.email}, expires_delta=access_token_expires
+            data={
+                "sub": user.email,
+                "uid": user.id,
+                "jti": token_id,
+                "role": user.role.value,
+            },
+            expires_delta=access_token_expires,
         )
+        with project.tracing.query("AccessToken.create"):
+            await prisma.models.AccessToken.prisma().create(
+                data={
+                    "id": token_id,
+                    "userId": user.id,
+                    "token": token,
+                    "expiresAt": datetime.utcnow() + access_token_expires,
+                }
+            )
         return AuthenticateUserResponse(
             access_token=token,
             token_type="bearer",
@@ -77,3 +164,17 @@ def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
+
+
+async def logout_user(user: project.auth.AuthenticatedUser) -> LogoutResponse:
+    """
+    Revokes the access token the request was authenticated with.
+
+    Args:
+        user (project.auth.AuthenticatedUser): The caller, as identified by their token.
+
+    Returns:
+        LogoutResponse: Confirmation that the token can no longer be used.
+    """
+    await project.auth.revoke_token(user)
+    return LogoutResponse(success=True, message="Access token revoked")
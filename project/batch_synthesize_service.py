@@ -0,0 +1,309 @@
+import asyncio
+import contextlib
+import os
+import uuid
+from typing import Dict, List, Optional, Union
+
+import prisma
+import prisma.enums
+import project.audio_encoding
+import project.audio_storage
+import project.clip_bundles
+import project.config
+import project.speech_rendering
+import project.synthesis_cache
+import project.synthesis_records
+import project.voice_profiles
+from pydantic import BaseModel
+
+
+class BatchSynthesisItem(BaseModel):
+    """
+    One clip to synthesize as part of a batch, with its own input and voice parameters.
+    """
+
+    text_input: Optional[str] = None
+    ssml_input: Optional[str] = None
+    voice_type: Optional[str] = None
+    speed: Optional[float] = None
+    pitch: Optional[float] = None
+    volume: Optional[float] = None
+
+
+class BatchSynthesisRequest(BaseModel):
+    """
+    A batch of clips to synthesize on behalf of a single user. With `bundle`, the clips are
+    written to one clip bundle instead of a file each.
+    """
+
+    user_id: str
+    items: List[BatchSynthesisItem]
+    bundle: bool = False
+
+
+class BatchSynthesisItemResult(BaseModel):
+    """
+    Outcome of a single batch item, in the same position as the item in the request.
+    """
+
+    success: bool
+    message: str
+    request_id: str
+    audio_file_path: str
+    file_type: Optional[str] = None
+    bundle_index: Optional[int] = None
+
+
+class BatchSynthesisResponse(BaseModel):
+    """
+    Per-item results of a batch synthesis, along with how many distinct clips had to be rendered.
+    """
+
+    success: bool
+    message: str
+    unique_items: int
+    results: List[BatchSynthesisItemResult]
+    bundle_id: Optional[str] = None
+    bundle_url: Optional[str] = None
+
+
+def _with_voice_profile(
+    item: BatchSynthesisItem,
+    profile: Optional[project.voice_profiles.VoiceSettings],
+) -> BatchSynthesisItem:
+    voice_type, speed, pitch, volume = project.voice_profiles.apply_voice_profile(
+        profile, item.voice_type, item.speed, item.pitch, item.volume
+    )
+    return item.model_copy(
+        update={
+            "voice_type": voice_type,
+            "speed": speed,
+            "pitch": pitch,
+            "volume": volume,
+        }
+    )
+
+
+def _append_stored(bundle: project.clip_bundles.BundleWriter, name: str) -> int:
+    with project.audio_storage.audio_storage.local_copy(name) as path:
+        return bundle.append_file(path)
+
+
+def _store_bundle(
+    bundle: project.clip_bundles.BundleWriter, name: str
+) -> project.audio_storage.StoredObject:
+    bundle.finish()
+    return project.audio_storage.audio_storage.store(bundle.path, name)
+
+
+async def _render_into_bundle(
+    bundle: project.clip_bundles.BundleWriter, key: str, item: BatchSynthesisItem
+) -> int:
+    # A render the synthesis cache already holds is copied rather than rendered again.
+    cached = await project.synthesis_cache.synthesis_cache.lookup(key)
+    if cached is not None:
+        with contextlib.suppress(FileNotFoundError):
+            return await asyncio.to_thread(_append_stored, bundle, cached)
+    encoder = project.audio_encoding.default_encoder()
+    scratch_path = os.path.join(
+        project.config.SPEECH_SCRATCH_DIR,
+        f"{key}.{uuid.uuid4().hex}{encoder.extension}",
+    )
+    try:
+        await project.speech_rendering.render_speech_file(
+            scratch_path,
+            item.text_input if item.text_input else item.ssml_input,
+            item.voice_type,
+            item.speed,
+            item.pitch,
+            item.volume,
+            wait_for_capacity=True,
+            ssml=not item.text_input,
+        )
+        return await asyncio.to_thread(bundle.append_file, scratch_path)
+    finally:
+        if os.path.exists(scratch_path):
+            os.remove(scratch_path)
+
+
+async def batch_synthesize_speech(
+    request: BatchSynthesisRequest,
+) -> BatchSynthesisResponse:
+    """
+    Converts many text inputs to speech in one call.
+
+    Identical items (same normalized input and voice parameters) are rendered once. Distinct items
+    are rendered concurrently on the engine pool, with voice parameters an item leaves out taken
+    from the user's voice profile, and the TTSRequest and AudioOutput rows for the
+    whole batch are written with one bulk insert each, in a single transaction, once rendering
+    has finished.
+
+    With `request.bundle`, each distinct clip is appended to a single clip bundle as soon as it
+    renders, and its scratch file removed, so a batch of any size adds one stored file rather
+    than one per clip, and clips the synthesis cache holds are copied in. Every AudioOutput row
+    then points at its clip in the bundle, which `GET /audio/{id}/content` serves as a byte
+    range of the bundle, and `GET /tts/bundles/{bundle_id}` downloads the whole bundle at once.
+    Bundles need the local audio storage backend.
+
+    Args:
+        request (BatchSynthesisRequest): The user making the request and the clips to synthesize.
+
+    Returns:
+        BatchSynthesisResponse: Per-item success or error and audio file paths, in request order,
+        and the id of the clip bundle if one was written.
+    """
+    if len(request.items) > project.config.TTS_BATCH_MAX_ITEMS:
+        return BatchSynthesisResponse(
+            success=False,
+            message=f"A batch may contain at most {project.config.TTS_BATCH_MAX_ITEMS} items",
+            unique_items=0,
+            results=[],
+        )
+    profile = await project.voice_profiles.get_voice_profile(request.user_id)
+    keys: List[Optional[str]] = []
+    unique: Dict[str, BatchSynthesisItem] = {}
+    for item in request.items:
+        text = item.text_input if item.text_input else item.ssml_input
+        if not text:
+            keys.append(None)
+            continue
+        item = _with_voice_profile(item, profile)
+        key = project.synthesis_cache.cache_key(
+            text,
+            item.voice_type,
+            item.speed,
+            item.pitch,
+            item.volume,
+            project.audio_encoding.default_encoder().format,
+            ssml=not item.text_input,
+        )
+        keys.append(key)
+        unique.setdefault(key, item)
+
+    encoder = project.audio_encoding.default_encoder()
+    bundle: Optional[project.clip_bundles.BundleWriter] = None
+    bundle_id = uuid.uuid4().hex
+    bundle_name = project.clip_bundles.bundle_name(bundle_id)
+    if request.bundle:
+        if project.audio_storage.audio_storage.local_path(bundle_name) is None:
+            return BatchSynthesisResponse(
+                success=False,
+                message="Clip bundles need the local audio storage backend",
+                unique_items=0,
+                results=[],
+            )
+        bundle = await asyncio.to_thread(
+            project.clip_bundles.BundleWriter,
+            os.path.join(
+                project.config.SPEECH_SCRATCH_DIR,
+                f"{bundle_id}{project.clip_bundles.BUNDLE_EXTENSION}",
+            ),
+            encoder.file_type,
+        )
+
+    semaphore = asyncio.Semaphore(project.config.TTS_BATCH_CONCURRENCY)
+
+    async def render(
+        key: str, item: BatchSynthesisItem
+    ) -> Union[project.speech_rendering.RenderedAudio, int]:
+        async with semaphore:
+            if bundle is not None:
+                return await _render_into_bundle(bundle, key, item)
+            return await project.speech_rendering.render_speech(
+                item.text_input if item.text_input else item.ssml_input,
+                item.voice_type,
+                item.speed,
+                item.pitch,
+                item.volume,
+                wait_for_capacity=True,
+                ssml=not item.text_input,
+            )
+
+    try:
+        outcomes = await asyncio.gather(
+            *(render(key, item) for key, item in unique.items()),
+            return_exceptions=True,
+        )
+        if bundle is not None:
+            if len(bundle):
+                await asyncio.to_thread(_store_bundle, bundle, bundle_name)
+            else:
+                await asyncio.to_thread(bundle.abort)
+                bundle = None
+    except BaseException:
+        if bundle is not None:
+            await asyncio.to_thread(bundle.abort)
+        raise
+    rendered = dict(zip(unique.keys(), outcomes))
+
+    results: List[BatchSynthesisItemResult] = []
+    tts_requests = []
+    audio_outputs = []
+    for item, key in zip(request.items, keys):
+        request_id = str(uuid.uuid4())
+        outcome = rendered[key] if key else ValueError("No text to synthesize")
+        if isinstance(outcome, BaseException):
+            result = BatchSynthesisItemResult(
+                success=False,
+                message=str(outcome),
+                request_id=request_id,
+                audio_file_path="",
+            )
+        elif isinstance(outcome, int):
+            result = BatchSynthesisItemResult(
+                success=True,
+                message="Speech synthesis succeeded",
+                request_id=request_id,
+                audio_file_path=project.clip_bundles.clip_ref(bundle_name, outcome),
+                file_type=encoder.file_type,
+                bundle_index=outcome,
+            )
+            audio_outputs.append(
+                project.synthesis_records.bundled_output_row(
+                    request_id, bundle_id, outcome, encoder.file_type
+                )
+            )
+        else:
+            result = BatchSynthesisItemResult(
+                success=True,
+                message="Speech synthesis succeeded",
+                request_id=request_id,
+                audio_file_path=outcome.name,
+                file_type=outcome.file_type,
+            )
+            audio_outputs.append(
+                project.synthesis_records.output_row(request_id, outcome)
+            )
+        results.append(result)
+        tts_requests.append(
+            {
+                "id": request_id,
+                "userId": request.user_id,
+                "textInput": item.text_input or "",
+                "ssmlInput": item.ssml_input,
+                "voiceProfileId": profile.profile_id if profile else None,
+                "status": (
+                    prisma.enums.TTSRequestStatus.DONE
+                    if result.success
+                    else prisma.enums.TTSRequestStatus.FAILED
+                ),
+                "errorMessage": None if result.success else result.message,
+            }
+        )
+    records = project.synthesis_records.SynthesisRecords()
+    records.create_requests(tts_requests)
+    records.create_outputs(audio_outputs)
+    await records.commit()
+    failures = sum(1 for result in results if not result.success)
+    return BatchSynthesisResponse(
+        success=failures == 0,
+        message=(
+            "Batch synthesis succeeded"
+            if failures == 0
+            else f"{failures} of {len(results)} items failed"
+        ),
+        unique_items=len(unique),
+        results=results,
+        bundle_id=bundle_id if bundle is not None else None,
+        bundle_url=f"/tts/bundles/{bundle_id}" if bundle is not None else None,
+    )
@@ -0,0 +1,284 @@
+import hashlib
+import mmap
+import os
+import re
+import struct
+import threading
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import project.audio_storage
+import project.config
+import project.ttl_cache
+
+# A bundle is a header, the encoded clips back to back, their index and a trailer pointing at
+# the index. All integers are little-endian.
+#
+#   header   magic "TTSCLIPB", format version (u32), file type of the clips (8 bytes, ASCII,
+#            NUL-padded), 4 bytes reserved
+#   clips    each one a complete audio file in that format
+#   index    per clip: offset (u64), length (u32), SHA-256 of the clip (32 bytes)
+#   trailer  offset of the index (u64), number of clips (u32), 4 bytes reserved, magic
+_MAGIC = b"TTSCLIPB"
+_VERSION = 1
+_HEADER = struct.Struct("<8sI8s4x")
+_ENTRY = struct.Struct("<QI32s")
+_TRAILER = struct.Struct("<QI4x8s")
+
+# Bytes copied per read when a clip is appended.
+_COPY_BLOCK_BYTES = 1024 * 1024
+
+BUNDLE_EXTENSION = ".ttsb"
+
+# AudioOutput paths of bundled clips: the bundle's storage name and the clip's position.
+_CLIP_REF = re.compile(r"^(.+\.ttsb)#(\d+)$")
+
+
+@dataclass(frozen=True)
+class Clip:
+    """
+    Where one clip lies in its bundle, and the SHA-256 digest of its bytes.
+    """
+
+    offset: int
+    length: int
+    sha256: bytes
+
+    @property
+    def etag(self) -> str:
+        """
+        Strong ETag for the clip, taken from its content.
+        """
+        return f'"{self.sha256.hex()[:24]}"'
+
+
+def bundle_name(bundle_id: str) -> str:
+    """
+    Returns the storage name of the bundle with the given hex id.
+    """
+    return project.audio_storage.shard_name(bundle_id, BUNDLE_EXTENSION)
+
+
+def bundle_id_of(name: str) -> str:
+    """
+    Returns the id of the bundle stored as `name`.
+    """
+    return name.rsplit("/", 1)[-1].removesuffix(BUNDLE_EXTENSION)
+
+
+def clip_ref(name: str, index: int) -> str:
+    """
+    Builds the AudioOutput path of clip `index` of the bundle stored as `name`.
+    """
+    return f"{name}#{index}"
+
+
+def parse_clip_ref(file_path: str) -> Optional[Tuple[str, int]]:
+    """
+    Splits the AudioOutput path of a bundled clip into the bundle's storage name and the clip's
+    index, or returns None for the path of a file of its own.
+    """
+    match = _CLIP_REF.match(file_path)
+    if match is None:
+        return None
+    return match.group(1), int(match.group(2))
+
+
+def stored_name(file_path: str) -> str:
+    """
+    Returns the storage name of the object holding the audio at an AudioOutput path: the
+    bundle for bundled clips, the path itself otherwise.
+    """
+    ref = parse_clip_ref(file_path)
+    return ref[0] if ref else file_path
+
+
+class BundleWriter:
+    """
+    Writes a bundle to a local file, appending clips in the order they are added and the index
+    once all are in. The file is not a valid bundle until `finish` returns.
+
+    Methods perform blocking I/O; `append_file` may be called from several threads at once.
+    """
+
+    def __init__(self, path: str, file_type: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._clips: List[Clip] = []
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(_MAGIC, _VERSION, file_type.encode("ascii")))
+
+    def __len__(self) -> int:
+        return len(self._clips)
+
+    def append_file(self, source_path: str) -> int:
+        """
+        Appends the contents of a local file as the next clip.
+
+        Returns:
+            int: The index of the clip in the bundle.
+        """
+        with open(source_path, "rb") as source, self._lock:
+            offset = self._file.tell()
+            digest = hashlib.sha256()
+            length = 0
+            while block := source.read(_COPY_BLOCK_BYTES):
+                digest.update(block)
+                self._file.write(block)
+                length += len(block)
+            self._clips.append(Clip(offset, length, digest.digest()))
+            return len(self._clips) - 1
+
+    def finish(self) -> None:
+        """
+        Writes the index and trailer and closes the file.
+        """
+        with self._lock:
+            index_offset = self._file.tell()
+            self._file.write(
+                b"".join(
+                    _ENTRY.pack(clip.offset, clip.length, clip.sha256)
+                    for clip in self._clips
+                )
+            )
+            self._file.write(_TRAILER.pack(index_offset, len(self._clips), _MAGIC))
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def abort(self) -> None:
+        """
+        Closes and removes an unfinished bundle.
+        """
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BundleReader:
+    """
+    Reads the index and clips of a bundle through a read-only memory map of the file.
+
+    Bundles are never modified once written, so a reader stays valid for as long as it is open,
+    even after the file is deleted.
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _HEADER.size + _TRAILER.size:
+                raise ValueError(f"{path} is not a clip bundle")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, file_type = _HEADER.unpack_from(self._map, 0)
+        index_offset, count, end_magic = _TRAILER.unpack_from(
+            self._map, size - _TRAILER.size
+        )
+        if (
+            magic != _MAGIC
+            or end_magic != _MAGIC
+            or version != _VERSION
+            or index_offset + count * _ENTRY.size + _TRAILER.size != size
+        ):
+            self._map.close()
+            raise ValueError(f"{path} is not a clip bundle")
+        self.file_type = file_type.rstrip(b"\0").decode("ascii")
+        self._index_offset = index_offset
+        self._count = count
+
+    def __len__(self) -> int:
+        return self._count
+
+    def clip(self, index: int) -> Clip:
+        """
+        Returns the position of clip `index`.
+
+        Raises:
+            IndexError: If the bundle has no such clip.
+        """
+        if not 0 <= index < self._count:
+            raise IndexError(f"Bundle has no clip {index}")
+        offset, length, sha256 = _ENTRY.unpack_from(
+            self._map, self._index_offset + index * _ENTRY.size
+        )
+        return Clip(offset, length, sha256)
+
+    def data(self, index: int) -> memoryview:
+        """
+        Returns the bytes of clip `index` as a view of the mapped file, without copying them.
+        """
+        clip = self.clip(index)
+        return memoryview(self._map)[clip.offset : clip.offset + clip.length]
+
+    def close(self) -> None:
+        self._map.close()
+
+
+# Bundles are written once, so open readers only need to be dropped to bound the number of maps.
+_readers: project.ttl_cache.TTLCache[BundleReader] = project.ttl_cache.TTLCache(
+    maxsize=project.config.AUDIO_BUNDLE_OPEN_READERS, ttl=float("inf")
+)
+_readers_lock = threading.Lock()
+
+
+def open_reader(path: str) -> BundleReader:
+    """
+    Returns a reader for the bundle at a local path, reusing an open one when there is one.
+    Evicted readers are closed once nothing uses them any more.
+
+    Raises:
+        FileNotFoundError: If there is no file at `path`.
+        ValueError: If the file is not a bundle.
+    """
+    with _readers_lock:
+        reader = _readers.get(path)
+    if reader is None:
+        reader = BundleReader(path)
+        with _readers_lock:
+            _readers.set(path, reader)
+    return reader
+
+
+def forget_reader(path: str) -> None:
+    """
+    Drops the open reader of a deleted bundle, if there is one.
+    """
+    with _readers_lock:
+        _readers.invalidate(path)
+
+
+def locate_clip(
+    storage: project.audio_storage.AudioStorage, file_path: str, blocking: bool = True
+) -> Optional[Tuple[str, Clip]]:
+    """
+    Finds a bundled clip by its AudioOutput path. Bundles are only read from storage backends
+    with local files.
+
+    Args:
+        storage (project.audio_storage.AudioStorage): The storage holding the bundle.
+        file_path (str): The AudioOutput path, as built by `clip_ref`.
+        blocking (bool): Whether to open the bundle if it is not open yet, which performs
+            blocking I/O. Without it, bundles that are not open are reported as not found.
+
+    Returns:
+        Optional[Tuple[str, Clip]]: The local path of the bundle and the clip's position in
+        it, or None if the path names no clip of an existing, readable bundle.
+    """
+    ref = parse_clip_ref(file_path)
+    if ref is None:
+        return None
+    name, index = ref
+    path = storage.local_path(name)
+    if path is None:
+        return None
+    try:
+        if blocking:
+            reader = open_reader(path)
+        else:
+            with _readers_lock:
+                reader = _readers.get(path)
+            if reader is None:
+                return None
+        return path, reader.clip(index)
+    except (FileNotFoundError, IndexError, ValueError):
+        return None
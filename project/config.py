@@ -0,0 +1,354 @@
+import os
+
+# Size of the Prisma query engine's connection pool. Empty keeps Prisma's default of twice the
+# number of CPUs plus one.
+DB_CONNECTION_LIMIT = os.environ.get("DB_CONNECTION_LIMIT", "")
+
+# Seconds a query waits for a free pooled connection before failing.
+DB_POOL_TIMEOUT_SECONDS = float(os.environ.get("DB_POOL_TIMEOUT_SECONDS", "10"))
+
+# Seconds allowed for opening a database connection, and for the client to connect at startup.
+DB_CONNECT_TIMEOUT_SECONDS = float(os.environ.get("DB_CONNECT_TIMEOUT_SECONDS", "10"))
+
+# Seconds the client waits for the query engine to answer one query.
+DB_QUERY_TIMEOUT_SECONDS = float(os.environ.get("DB_QUERY_TIMEOUT_SECONDS", "30"))
+
+# Directory that generated audio files are written to.
+SPEECH_OUTPUT_DIR = os.environ.get("SPEECH_OUTPUT_DIR", "speech_outputs")
+
+# pyttsx3 driver to load for every engine worker. Empty selects the platform default.
+TTS_DRIVER_NAME = os.environ.get("TTS_DRIVER_NAME") or None
+
+# Callable creating the engine of each worker, as "module:attribute", called with the driver
+# name. Empty uses pyttsx3. pyttsx3 only loads drivers bundled with it, so this is how engines
+# such as the deterministic one used by the benchmarks are plugged in.
+TTS_ENGINE_FACTORY = os.environ.get("TTS_ENGINE_FACTORY", "")
+
+# Number of long-lived engine workers. Most pyttsx3 drivers wrap a native library with
+# process-wide state, so more than one in-process worker is only safe for drivers that allow it;
+# in process mode, set it to the number of cores.
+TTS_ENGINE_POOL_SIZE = int(os.environ.get("TTS_ENGINE_POOL_SIZE", "1"))
+
+# Where engines run: "thread" keeps them on threads of the server process, "process" gives each
+# engine its own worker process so renders use every core and a crashed or hung engine can be
+# replaced.
+TTS_EXECUTION_MODE = os.environ.get("TTS_EXECUTION_MODE", "thread")
+
+# In process mode, seconds a render may take before its worker process is killed and replaced.
+TTS_JOB_TIMEOUT_SECONDS = float(os.environ.get("TTS_JOB_TIMEOUT_SECONDS", "120"))
+
+# In process mode, jobs after which a worker process is replaced, bounding leaks in native
+# drivers. Zero keeps workers for the lifetime of the server.
+TTS_PROCESS_MAX_JOBS = int(os.environ.get("TTS_PROCESS_MAX_JOBS", "1000"))
+
+# Number of users whose VoiceProfile is kept in memory, and for how long. Updates made through
+# this server take effect at once; the TTL bounds staleness across multiple server processes.
+VOICE_PROFILE_CACHE_SIZE = int(os.environ.get("VOICE_PROFILE_CACHE_SIZE", "10000"))
+
+VOICE_PROFILE_CACHE_TTL_SECONDS = float(
+    os.environ.get("VOICE_PROFILE_CACHE_TTL_SECONDS", "300")
+)
+
+# Maximum number of synthesis jobs waiting for a free engine worker.
+TTS_ENGINE_QUEUE_DEPTH = int(os.environ.get("TTS_ENGINE_QUEUE_DEPTH", "32"))
+
+# Share of the engines each UserRole gets while users compete for them, as ROLE=WEIGHT pairs.
+# Every user is a flow of the fair queue with their role's weight; unlisted roles get the USER
+# weight.
+TTS_SCHEDULER_WEIGHTS = {
+    role.strip(): float(weight)
+    for role, weight in (
+        entry.split("=", 1)
+        for entry in os.environ.get(
+            "TTS_SCHEDULER_WEIGHTS",
+            "USER=1,CONTENTCREATOR=1,EDUCATOR=2,DEVELOPER=2,ADMIN=4",
+        ).split(",")
+        if entry.strip()
+    )
+}
+
+# Multiplier of the weight of background work (asynchronous jobs and batches), so a user's
+# interactive requests overtake their own queued work.
+TTS_SCHEDULER_BACKGROUND_SHARE = float(
+    os.environ.get("TTS_SCHEDULER_BACKGROUND_SHARE", "0.25")
+)
+
+# Seconds of slack left before its deadline at which a job skips the fair-queueing order.
+TTS_SCHEDULER_URGENT_SLACK_SECONDS = float(
+    os.environ.get("TTS_SCHEDULER_URGENT_SLACK_SECONDS", "1")
+)
+
+# Engine seconds per character of input assumed until renders have been measured.
+TTS_SCHEDULER_SECONDS_PER_CHAR = float(
+    os.environ.get("TTS_SCHEDULER_SECONDS_PER_CHAR", "0.005")
+)
+
+# Byte budget for the content-addressed synthesis cache. Zero disables caching.
+TTS_CACHE_MAX_BYTES = int(os.environ.get("TTS_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+# Renders evicted from the synthesis cache within this many seconds of being written are left
+# to the retention task rather than deleted, as the request they were made for may not have
+# recorded its AudioOutput row yet.
+TTS_CACHE_RELEASE_GRACE_SECONDS = float(
+    os.environ.get("TTS_CACHE_RELEASE_GRACE_SECONDS", "60")
+)
+
+# Byte budget for the sentence fragment cache, which keeps rendered sentences as raw PCM so
+# documents sharing sentences only render the new ones. Zero disables it.
+TTS_FRAGMENT_CACHE_MAX_BYTES = int(
+    os.environ.get("TTS_FRAGMENT_CACHE_MAX_BYTES", str(256 * 1024 * 1024))
+)
+
+# Local directory for the fragment cache. Fragments are memory-mapped, so keep it on local disk.
+TTS_FRAGMENT_CACHE_DIR = os.environ.get(
+    "TTS_FRAGMENT_CACHE_DIR", os.path.join(SPEECH_OUTPUT_DIR, ".fragments")
+)
+
+# How requested speed, pitch and volume are applied: "engine" passes them to the engine on every
+# render; "dsp" renders each sentence once at a base rate and derives every variant from it with
+# NumPy post-processing, so pitch works on drivers that ignore it and cached sentences are
+# shared across voice settings. The dsp mode requires the optional numpy package.
+TTS_VOICE_ADJUSTMENT = os.environ.get("TTS_VOICE_ADJUSTMENT", "engine")
+
+# In dsp mode, the speech rate in words per minute of base renders, which requested speeds are
+# relative to.
+TTS_DSP_BASE_RATE = float(os.environ.get("TTS_DSP_BASE_RATE", "200"))
+
+# In dsp mode, the pitch value that leaves a voice unchanged; other pitches are applied as their
+# ratio to it.
+TTS_DSP_BASE_PITCH = float(os.environ.get("TTS_DSP_BASE_PITCH", "50"))
+
+# In dsp mode, the peak level in dBFS that base renders are normalized to before the requested
+# volume is applied.
+TTS_DSP_PEAK_DBFS = float(os.environ.get("TTS_DSP_PEAK_DBFS", "-1"))
+
+# Maximum number of asynchronous synthesis jobs waiting to be picked up.
+TTS_JOB_QUEUE_DEPTH = int(os.environ.get("TTS_JOB_QUEUE_DEPTH", "1000"))
+
+# Number of asynchronous synthesis jobs rendered at the same time.
+TTS_JOB_CONCURRENCY = int(
+    os.environ.get("TTS_JOB_CONCURRENCY", str(TTS_ENGINE_POOL_SIZE))
+)
+
+# Seconds between refreshes of the heartbeat of the jobs a process holds, and how long a job
+# may go without one before any process fails it as abandoned by a process that stopped.
+TTS_JOB_HEARTBEAT_SECONDS = float(os.environ.get("TTS_JOB_HEARTBEAT_SECONDS", "15"))
+
+TTS_JOB_LEASE_SECONDS = float(os.environ.get("TTS_JOB_LEASE_SECONDS", "60"))
+
+# Number of chunks rendered ahead of the one being streamed.
+TTS_STREAM_LOOKAHEAD = int(os.environ.get("TTS_STREAM_LOOKAHEAD", "4"))
+
+# Sentences of an incremental synthesis session waiting to be rendered before the server stops
+# reading its text, so a client that sends faster than it reads audio is slowed down.
+TTS_INCREMENTAL_MAX_PENDING_SEGMENTS = int(
+    os.environ.get("TTS_INCREMENTAL_MAX_PENDING_SEGMENTS", "16")
+)
+
+# Characters of text an incremental synthesis session holds back waiting for a sentence to
+# end. Plain text beyond it is cut into a segment where it stands; SSML that runs on for longer
+# closes the session with an error.
+TTS_INCREMENTAL_MAX_BUFFER_CHARS = int(
+    os.environ.get("TTS_INCREMENTAL_MAX_BUFFER_CHARS", "4096")
+)
+
+# Seconds an incremental synthesis session may go without a message before it is closed.
+TTS_INCREMENTAL_IDLE_TIMEOUT_SECONDS = float(
+    os.environ.get("TTS_INCREMENTAL_IDLE_TIMEOUT_SECONDS", "120")
+)
+
+# Number of segments of one SSML document rendered at once.
+TTS_SEGMENT_CONCURRENCY = int(
+    os.environ.get("TTS_SEGMENT_CONCURRENCY", str(TTS_STREAM_LOOKAHEAD))
+)
+
+# Number of parsed synthesis plans kept in memory, and for how long.
+SSML_PLAN_CACHE_SIZE = int(os.environ.get("SSML_PLAN_CACHE_SIZE", "1000"))
+
+SSML_PLAN_CACHE_TTL_SECONDS = float(
+    os.environ.get("SSML_PLAN_CACHE_TTL_SECONDS", "600")
+)
+
+# Number of expanded tokens (numbers, dates, URLs...) remembered by text normalization.
+TEXT_NORMALIZATION_CACHE_SIZE = int(
+    os.environ.get("TEXT_NORMALIZATION_CACHE_SIZE", "65536")
+)
+
+# Largest number of items accepted in one batch synthesis request.
+TTS_BATCH_MAX_ITEMS = int(os.environ.get("TTS_BATCH_MAX_ITEMS", "10000"))
+
+# Number of distinct batch items handed to the engine pool at once. Defaults to half the engine
+# queue so that a large batch leaves room for interactive requests.
+TTS_BATCH_CONCURRENCY = int(
+    os.environ.get("TTS_BATCH_CONCURRENCY", str(max(1, TTS_ENGINE_QUEUE_DEPTH // 2)))
+)
+
+# Delivery format for rendered audio: "mp3", "opus" or "wav".
+TTS_OUTPUT_FORMAT = os.environ.get("TTS_OUTPUT_FORMAT", "mp3")
+
+TTS_MP3_BITRATE = os.environ.get("TTS_MP3_BITRATE", "64k")
+
+TTS_OPUS_BITRATE = os.environ.get("TTS_OPUS_BITRATE", "32k")
+
+# Threads that encode rendered audio while the engine workers move on to the next job.
+TTS_ENCODER_THREADS = int(os.environ.get("TTS_ENCODER_THREADS", "2"))
+
+FFMPEG_BINARY = os.environ.get("FFMPEG_BINARY", "ffmpeg")
+
+# Key that signs access tokens. Must be set to a long random value; the server does not start
+# without one.
+JWT_SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "")
+
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+
+# Number of verified access tokens whose claims are kept in memory until they expire.
+AUTH_CLAIMS_CACHE_SIZE = int(os.environ.get("AUTH_CLAIMS_CACHE_SIZE", "10000"))
+
+# Seconds between reads of newly revoked access tokens, i.e. how long a revocation made by
+# another server process can take to be enforced here.
+AUTH_REVOCATION_REFRESH_SECONDS = float(
+    os.environ.get("AUTH_REVOCATION_REFRESH_SECONDS", "5")
+)
+
+# Rate limit budget per UserRole, in cost units per minute, as ROLE=UNITS pairs. A request
+# costs one unit plus one per RATE_LIMIT_CHARS_PER_UNIT characters of input, and a full bucket
+# holds one minute's budget. Zero means unlimited; unlisted roles get the USER budget.
+RATE_LIMIT_UNITS_PER_MINUTE = {
+    role.strip(): float(units)
+    for role, units in (
+        entry.split("=", 1)
+        for entry in os.environ.get(
+            "RATE_LIMIT_UNITS_PER_MINUTE",
+            "USER=60,CONTENTCREATOR=240,EDUCATOR=240,DEVELOPER=240,ADMIN=0",
+        ).split(",")
+        if entry.strip()
+    )
+}
+
+RATE_LIMIT_CHARS_PER_UNIT = int(os.environ.get("RATE_LIMIT_CHARS_PER_UNIT", "100"))
+
+# Where rate limit buckets live: "memory" (per server process) or "redis" (shared by all
+# processes, requires the redis package and RATE_LIMIT_REDIS_URL).
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory")
+
+RATE_LIMIT_REDIS_URL = os.environ.get(
+    "RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0"
+)
+
+# Synthesis requests are refused with 429 while this many jobs wait for an engine.
+TTS_ADMISSION_MAX_QUEUED = int(
+    os.environ.get(
+        "TTS_ADMISSION_MAX_QUEUED", str(max(1, TTS_ENGINE_QUEUE_DEPTH * 3 // 4))
+    )
+)
+
+# bcrypt cost factor for new password hashes. Users logging in with a hash of a different cost
+# are rehashed transparently, so this can be raised at any time.
+BCRYPT_ROUNDS = int(os.environ.get("BCRYPT_ROUNDS", "12"))
+
+# Threads that hash and verify passwords, bounding how much CPU a burst of logins can take.
+PASSWORD_HASH_THREADS = int(os.environ.get("PASSWORD_HASH_THREADS", "2"))
+
+# Where renders are written before they are encoded and moved into storage. Keep it on the same
+# filesystem as SPEECH_OUTPUT_DIR so the move is a rename.
+SPEECH_SCRATCH_DIR = os.environ.get(
+    "SPEECH_SCRATCH_DIR", os.path.join(SPEECH_OUTPUT_DIR, ".scratch")
+)
+
+# Audio storage backend: "local" (files under SPEECH_OUTPUT_DIR) or "s3".
+AUDIO_STORAGE_BACKEND = os.environ.get("AUDIO_STORAGE_BACKEND", "local")
+
+# Prefix for download URLs of locally stored audio. The default is the API's own /files route;
+# point it at a CDN or static file server that fronts SPEECH_OUTPUT_DIR to offload downloads.
+AUDIO_STORAGE_BASE_URL = os.environ.get("AUDIO_STORAGE_BASE_URL", "/files/")
+
+# Key that signs download URLs of locally stored audio, and how long those URLs stay valid. A
+# server fronting SPEECH_OUTPUT_DIR in place of the /files route has to check the signature
+# itself. Defaults to the access token key.
+AUDIO_URL_SIGNING_KEY = os.environ.get("AUDIO_URL_SIGNING_KEY") or JWT_SECRET_KEY
+
+AUDIO_URL_EXPIRES_SECONDS = int(os.environ.get("AUDIO_URL_EXPIRES_SECONDS", "3600"))
+
+S3_BUCKET = os.environ.get("S3_BUCKET", "")
+
+S3_PREFIX = os.environ.get("S3_PREFIX", "speech_outputs")
+
+# Set to the address of MinIO, moto or another S3-compatible service; empty uses AWS.
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL") or None
+
+S3_REGION = os.environ.get("S3_REGION") or None
+
+# Public or CDN base URL for the bucket. Empty hands out presigned URLs instead.
+S3_PUBLIC_BASE_URL = os.environ.get("S3_PUBLIC_BASE_URL") or None
+
+S3_URL_EXPIRES_SECONDS = int(os.environ.get("S3_URL_EXPIRES_SECONDS", "3600"))
+
+# Max-Age clients and proxies may cache served audio for. Stored audio never changes in place.
+AUDIO_CACHE_MAX_AGE_SECONDS = int(
+    os.environ.get("AUDIO_CACHE_MAX_AGE_SECONDS", "86400")
+)
+
+# Number of clip bundles kept open and memory-mapped for serving their clips.
+AUDIO_BUNDLE_OPEN_READERS = int(os.environ.get("AUDIO_BUNDLE_OPEN_READERS", "256"))
+
+# Number of request id to AudioOutput lookups kept in memory, and for how long, so repeated
+# plays of the same request do not query the database.
+AUDIO_LOOKUP_CACHE_SIZE = int(os.environ.get("AUDIO_LOOKUP_CACHE_SIZE", "10000"))
+
+AUDIO_LOOKUP_CACHE_TTL_SECONDS = float(
+    os.environ.get("AUDIO_LOOKUP_CACHE_TTL_SECONDS", "600")
+)
+
+# Default and largest number of past TTS requests returned per page of history.
+TTS_HISTORY_PAGE_SIZE = int(os.environ.get("TTS_HISTORY_PAGE_SIZE", "50"))
+
+TTS_HISTORY_MAX_PAGE_SIZE = int(os.environ.get("TTS_HISTORY_MAX_PAGE_SIZE", "200"))
+
+# Characters of each request's input included in its history entry.
+TTS_HISTORY_PREVIEW_CHARS = int(os.environ.get("TTS_HISTORY_PREVIEW_CHARS", "200"))
+
+# Age after which TTS requests and their audio are deleted, and after which stored audio nobody
+# has used or referenced is removed. Zero keeps them forever.
+AUDIO_RETENTION_SECONDS = float(
+    os.environ.get("AUDIO_RETENTION_SECONDS", str(30 * 24 * 3600))
+)
+
+# Bytes of audio each user may keep; their oldest requests are deleted beyond it. Zero means
+# unlimited.
+AUDIO_USER_QUOTA_BYTES = int(os.environ.get("AUDIO_USER_QUOTA_BYTES", "0"))
+
+# Seconds between retention passes. Zero disables the retention task.
+AUDIO_GC_INTERVAL_SECONDS = float(os.environ.get("AUDIO_GC_INTERVAL_SECONDS", "60"))
+
+# Rows read or deleted per query, files scanned and users checked against their quota in one
+# retention pass, bounding the I/O a pass can cause.
+AUDIO_GC_BATCH_SIZE = int(os.environ.get("AUDIO_GC_BATCH_SIZE", "500"))
+
+# Unreferenced files younger than this are never removed, as their AudioOutput rows may still be
+# about to be written.
+AUDIO_GC_GRACE_SECONDS = float(os.environ.get("AUDIO_GC_GRACE_SECONDS", "3600"))
+
+# Format cold WAV outputs are transcoded to, such as "mp3" or "opus". Empty disables it.
+AUDIO_COLD_TRANSCODE_FORMAT = os.environ.get("AUDIO_COLD_TRANSCODE_FORMAT", "")
+
+# Time since a WAV output was last used after which it counts as cold.
+AUDIO_COLD_AFTER_SECONDS = float(
+    os.environ.get("AUDIO_COLD_AFTER_SECONDS", str(7 * 24 * 3600))
+)
+
+# Cold outputs transcoded per retention pass, on the shared encoder threads.
+AUDIO_COLD_TRANSCODES_PER_PASS = int(
+    os.environ.get("AUDIO_COLD_TRANSCODES_PER_PASS", "4")
+)
+
+# Bearer token Prometheus must send to scrape /metrics. Empty leaves the endpoint open, for
+# deployments where it is only reachable from inside the cluster.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "")
+
+# Sampling interval of the per-request profiler, and the longest it samples one request.
+PROFILER_INTERVAL_MS = float(os.environ.get("PROFILER_INTERVAL_MS", "5"))
+
+PROFILER_MAX_SECONDS = float(os.environ.get("PROFILER_MAX_SECONDS", "30"))
+
+# Number of armed request ids, and of finished profiles, kept for download.
+PROFILER_KEEP = int(os.environ.get("PROFILER_KEEP", "16"))
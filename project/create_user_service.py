@@ -1,6 +1,8 @@
-import bcrypt
 import prisma
+import prisma.errors
 import prisma.models
+import project.password_hashing
+import project.tracing
 from pydantic import BaseModel
 
 
@@ -19,7 +21,9 @@ async def create_user(email: str, password: str) -> CreateUserResponse:
     Registers a new user with email and password.
 
     This function takes an email and password as input and attempts to create a new user in the database.
-    The password is hashed for security before it is stored. It checks if the email is unique and if so, creates the user.
+    The password is hashed for security before it is stored, on the password hashing pool so the
+    event loop is not blocked. The insert relies on the unique index on the email, so a taken
+    email costs one round trip and concurrent sign-ups with the same email cannot both succeed.
 
     Args:
         email (str): The email address for the new user account. It must be unique across the system.
@@ -33,21 +37,18 @@ async def create_user(email: str, password: str) -> CreateUserResponse:
         create_user("newuser@example.com", "password123")
         > CreateUserResponse(user_id="some-unique-uuid", email="newuser@example.com", message="User successfully created.")
     """
-    existing_user = await prisma.models.User.prisma().find_unique(
-        where={"email": email}
-    )
-    if existing_user:
+    hashed_password = await project.password_hashing.hash_password(password)
+    try:
+        with project.tracing.query("User.create"):
+            new_user = await prisma.models.User.prisma().create(
+                data={"email": email, "password": hashed_password}
+            )
+    except prisma.errors.UniqueViolationError:
         return CreateUserResponse(
             user_id="",
             email="",
             message="Email already exists. Please choose a different email.",
         )
-    hashed_password = bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode(
-        "utf-8"
-    )
-    new_user = await prisma.models.User.prisma().create(
-        data={"email": email, "password": hashed_password}
-    )
     return CreateUserResponse(
         user_id=new_user.id, email=new_user.email, message="User successfully created."
     )
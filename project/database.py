@@ -0,0 +1,56 @@
+import os
+import urllib.parse
+from typing import Any, Dict
+
+import project.config
+from prisma import Prisma
+
+
+def pooled_url(url: str) -> str:
+    """
+    Adds the configured connection pool parameters to a PostgreSQL connection URL.
+
+    Parameters already present in the URL are kept, so a deployment can still tune one
+    database through its URL alone.
+
+    Args:
+        url (str): The connection URL, such as DATABASE_URL.
+
+    Returns:
+        str: The URL with `connection_limit`, `pool_timeout` and `connect_timeout` set.
+    """
+    parts = urllib.parse.urlsplit(url)
+    query = dict(urllib.parse.parse_qsl(parts.query, keep_blank_values=True))
+    settings = {
+        "pool_timeout": f"{project.config.DB_POOL_TIMEOUT_SECONDS:g}",
+        "connect_timeout": f"{project.config.DB_CONNECT_TIMEOUT_SECONDS:g}",
+    }
+    if project.config.DB_CONNECTION_LIMIT:
+        settings["connection_limit"] = project.config.DB_CONNECTION_LIMIT
+    for name, value in settings.items():
+        query.setdefault(name, value)
+    return urllib.parse.urlunsplit(
+        parts._replace(query=urllib.parse.urlencode(query, safe="/:"))
+    )
+
+
+def create_client() -> Prisma:
+    """
+    Creates the shared Prisma client with the configured pool size and timeouts.
+
+    The pool settings travel in the datasource URL, so they apply when DATABASE_URL is set in
+    the process environment, as docker-compose does. Otherwise Prisma reads the URL from `.env`
+    unchanged.
+
+    Returns:
+        Prisma: A registered, not yet connected client.
+    """
+    options: Dict[str, Any] = {
+        "auto_register": True,
+        "connect_timeout": int(project.config.DB_CONNECT_TIMEOUT_SECONDS),
+        "http": {"timeout": project.config.DB_QUERY_TIMEOUT_SECONDS},
+    }
+    url = os.environ.get("DATABASE_URL")
+    if url:
+        options["datasource"] = {"url": pooled_url(url)}
+    return Prisma(**options)
@@ -0,0 +1,671 @@
+import asyncio
+import concurrent.futures
+import importlib
+import logging
+import multiprocessing
+import multiprocessing.connection
+import queue
+import signal
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+import project.config
+import project.metrics
+import project.synthesis_scheduler
+import project.tracing
+import project.voice_catalog
+import pyttsx3
+
+logger = logging.getLogger(__name__)
+
+service_seconds = project.metrics.registry.histogram(
+    "tts_engine_service_seconds",
+    "Time an engine worker spends on one job, excluding the wait in the queue.",
+)
+
+# Stage name -> seconds, as measured by the worker that rendered a job.
+StageTimings = Dict[str, float]
+
+
+class EnginePoolError(Exception):
+    """
+    Base error for failures to hand a job to the engine pool.
+    """
+
+
+class EnginePoolFullError(EnginePoolError):
+    """
+    Raised when the synthesis queue is at its configured depth.
+    """
+
+
+class EnginePoolClosedError(EnginePoolError):
+    """
+    Raised when a job is submitted to a pool that is not running.
+    """
+
+
+class EngineWorkerError(Exception):
+    """
+    Raised when an engine worker process fails a job, crashes or exceeds the job timeout.
+    """
+
+
+@dataclass
+class SynthesisJob:
+    """
+    A single render request for an engine worker.
+    """
+
+    text: str
+    output_path: str
+    voice_type: Optional[str] = None
+    speed: Optional[float] = None
+    pitch: Optional[float] = None
+    volume: Optional[float] = None
+    # SSML prosody, as multipliers of the rate, pitch and volume the job would otherwise get.
+    rate_scale: float = 1.0
+    pitch_scale: float = 1.0
+    volume_scale: float = 1.0
+    # Who the job is for, taken from the request that queues it when not set.
+    workload: Optional[project.synthesis_scheduler.Workload] = None
+
+
+class _EngineWorker(threading.Thread):
+    """
+    Owns one pyttsx3 engine for its whole lifetime and renders jobs taken from the pool queue.
+
+    pyttsx3 drivers are bound to the thread that created them, so the engine is created, used
+    and torn down on this thread only.
+    """
+
+    def __init__(
+        self,
+        jobs: queue.Queue,
+        driver_name: Optional[str],
+        index: int,
+        service_time: project.metrics.LatencyTracker,
+    ):
+        super().__init__(name=f"tts-engine-{index}", daemon=True)
+        self._jobs = jobs
+        self._service_time = service_time
+        self._driver_name = driver_name
+        self.ready = threading.Event()
+        self.init_error: Optional[BaseException] = None
+        self.busy = False
+
+    def run(self) -> None:
+        started = time.perf_counter()
+        try:
+            engine, catalog, defaults = _open_engine(self._driver_name)
+        except Exception as e:
+            self.init_error = e
+            self.ready.set()
+            return
+        project.tracing.record("engine_init", time.perf_counter() - started)
+        self.ready.set()
+        while True:
+            item = self._jobs.get()
+            if item is None:
+                break
+            job, future, queued_at = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                project.synthesis_scheduler.check_deadline(job)
+            except project.synthesis_scheduler.SynthesisDeadlineError as e:
+                future.set_exception(e)
+                continue
+            self.busy = True
+            started = time.perf_counter()
+            try:
+                timings = _render(engine, catalog, defaults, job)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                timings["engine_acquire"] = started - queued_at
+                future.set_result((job.output_path, timings))
+            finally:
+                self._service_time.observe(time.perf_counter() - started)
+                project.synthesis_scheduler.cost_model.observe(
+                    len(job.text), time.perf_counter() - started
+                )
+                self.busy = False
+
+
+def create_engine(driver_name: Optional[str]) -> pyttsx3.Engine:
+    """
+    Creates an engine with the factory named by `TTS_ENGINE_FACTORY`, or a pyttsx3 engine when
+    none is configured.
+    """
+    factory = project.config.TTS_ENGINE_FACTORY
+    if not factory:
+        return pyttsx3.Engine(driver_name)
+    module_name, _, attribute = factory.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)(driver_name)
+
+
+def _open_engine(
+    driver_name: Optional[str],
+) -> Tuple[pyttsx3.Engine, project.voice_catalog.VoiceCatalog, Dict[str, Any]]:
+    engine = create_engine(driver_name)
+    catalog = project.voice_catalog.VoiceCatalog(engine.getProperty("voices") or [])
+    defaults = {}
+    for name in ("voice", "rate", "volume", "pitch"):
+        try:
+            defaults[name] = engine.getProperty(name)
+        except (KeyError, NotImplementedError):
+            pass
+    return engine, catalog, defaults
+
+
+def _render(
+    engine: pyttsx3.Engine,
+    catalog: project.voice_catalog.VoiceCatalog,
+    defaults: Dict[str, Any],
+    job: SynthesisJob,
+) -> StageTimings:
+    """
+    Renders one job and returns how long selecting the voice and each engine call took.
+    """
+    started = time.perf_counter()
+    properties = dict(defaults)
+    voice = catalog.resolve(job.voice_type)
+    if voice is not None:
+        properties["voice"] = voice.id
+    if job.speed:
+        properties["rate"] = int(job.speed)
+    if job.pitch:
+        properties["pitch"] = job.pitch
+    if job.volume:
+        properties["volume"] = job.volume
+    if job.rate_scale != 1.0 and properties.get("rate"):
+        properties["rate"] = max(1, int(properties["rate"] * job.rate_scale))
+    if job.pitch_scale != 1.0 and properties.get("pitch"):
+        properties["pitch"] = properties["pitch"] * job.pitch_scale
+    if job.volume_scale != 1.0 and properties.get("volume") is not None:
+        properties["volume"] = min(1.0, properties["volume"] * job.volume_scale)
+    # Every property is written on every job so settings never leak from the previous one.
+    for name, value in properties.items():
+        if value is not None:
+            engine.setProperty(name, value)
+    configured = time.perf_counter()
+    engine.save_to_file(job.text, job.output_path)
+    rendering = time.perf_counter()
+    engine.runAndWait()
+    return {
+        "engine_voice": configured - started,
+        "engine_save_to_file": rendering - configured,
+        "engine_run_and_wait": time.perf_counter() - rendering,
+    }
+
+
+class EnginePool:
+    """
+    A fixed set of pre-initialized pyttsx3 engines fed from a bounded job queue.
+
+    Rendering happens on the worker threads, so awaiting `synthesize` never blocks the event loop.
+    Queued jobs are handed out in weighted fair order across users and roles rather than first
+    come, first served.
+    """
+
+    def __init__(self, size: int, queue_depth: int, driver_name: Optional[str] = None):
+        self.size = size
+        self.queue_depth = queue_depth
+        self.driver_name = driver_name
+        self._jobs: queue.Queue = project.synthesis_scheduler.FairJobQueue(
+            queue_depth, project.synthesis_scheduler.create_scheduler()
+        )
+        self._workers: List[_EngineWorker] = []
+        self._running = False
+        # Time workers spend rendering one job, excluding the wait in the queue.
+        self.service_time = project.metrics.LatencyTracker(histogram=service_seconds)
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def queued(self) -> int:
+        """
+        Returns the number of jobs waiting for a free worker.
+        """
+        return self._jobs.qsize()
+
+    def workers(self) -> int:
+        """
+        Returns the number of workers with a working engine.
+        """
+        return len(self._workers)
+
+    def busy(self) -> int:
+        """
+        Returns the number of workers rendering a job right now.
+        """
+        return sum(1 for worker in self._workers if worker.busy)
+
+    async def start(self) -> None:
+        """
+        Starts the workers and waits until each has initialized its engine.
+
+        Raises:
+            EnginePoolError: If no worker could initialize an engine.
+        """
+        if self._running:
+            return
+        workers = [
+            _EngineWorker(self._jobs, self.driver_name, index, self.service_time)
+            for index in range(self.size)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            await asyncio.to_thread(worker.ready.wait)
+        self._workers = [worker for worker in workers if worker.init_error is None]
+        for worker in workers:
+            if worker.init_error is not None:
+                logger.error(
+                    "TTS engine worker %s failed to start: %s",
+                    worker.name,
+                    worker.init_error,
+                )
+        if not self._workers:
+            raise EnginePoolError("No TTS engine worker could be started")
+        self._running = True
+
+    async def stop(self) -> None:
+        """
+        Lets the workers finish the jobs already queued, then shuts them down.
+        """
+        if not self._running:
+            return
+        self._running = False
+        for _ in self._workers:
+            await asyncio.to_thread(self._jobs.put, None)
+        for worker in self._workers:
+            await asyncio.to_thread(worker.join)
+        self._workers = []
+
+    async def synthesize(self, job: SynthesisJob) -> str:
+        """
+        Queues a job and waits for a worker to render it.
+
+        Args:
+            job (SynthesisJob): The text, output path and voice parameters to render.
+
+        Returns:
+            str: The path of the rendered audio file.
+
+        Raises:
+            EnginePoolClosedError: If the pool has not been started or is shutting down.
+            EnginePoolFullError: If the queue already holds `queue_depth` jobs.
+            project.synthesis_scheduler.SynthesisDeadlineError: If the job cannot be rendered
+                before the deadline of its request.
+        """
+        if not self._running:
+            raise EnginePoolClosedError("Speech synthesis is not available")
+        if job.workload is None:
+            job.workload = project.synthesis_scheduler.current()
+        project.synthesis_scheduler.check_deadline(job)
+        future: concurrent.futures.Future = concurrent.futures.Future()
+        try:
+            self._jobs.put_nowait((job, future, time.perf_counter()))
+        except queue.Full:
+            raise EnginePoolFullError(
+                "Speech synthesis queue is full, please retry later"
+            ) from None
+        output_path, timings = await asyncio.wrap_future(future)
+        _record_timings(timings)
+        return output_path
+
+
+def _process_worker_main(
+    connection: multiprocessing.connection.Connection, driver_name: Optional[str]
+) -> None:
+    """
+    Entry point of an engine worker process: owns one engine and renders the jobs sent over
+    `connection`, replying with the output path and stage timings or an error message. Audio
+    never crosses the pipe; it is written to the job's output path on the shared filesystem.
+    """
+    # The server shuts workers down itself; a terminal Ctrl-C must not kill them mid-render.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    started = time.perf_counter()
+    try:
+        engine, catalog, defaults = _open_engine(driver_name)
+    except Exception as e:
+        connection.send(("error", f"{type(e).__name__}: {e}"))
+        return
+    connection.send(("ready", time.perf_counter() - started))
+    while True:
+        try:
+            job = connection.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        try:
+            timings = _render(engine, catalog, defaults, job)
+        except Exception as e:
+            connection.send(("error", f"{type(e).__name__}: {e}"))
+        else:
+            connection.send(("done", (job.output_path, timings)))
+
+
+class _EngineProcess:
+    """
+    Parent-side handle of one engine worker process and its end of the job pipe.
+    """
+
+    def __init__(
+        self,
+        context: multiprocessing.context.BaseContext,
+        name: str,
+        driver_name: Optional[str],
+    ):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_process_worker_main,
+            args=(child_connection, driver_name),
+            name=name,
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+        self.jobs_done = 0
+
+    def receive(self, timeout: float) -> Tuple[str, Any]:
+        """
+        Waits for the next reply from the worker. Blocking.
+
+        Raises:
+            EngineWorkerError: If the worker exits or does not reply within `timeout` seconds.
+        """
+        try:
+            if not self.connection.poll(timeout):
+                raise EngineWorkerError(
+                    f"Speech synthesis timed out after {timeout:g} seconds"
+                )
+            return self.connection.recv()
+        except (EOFError, OSError):
+            self.process.join(1)
+            raise EngineWorkerError(
+                f"Speech engine process exited with code {self.process.exitcode}"
+            ) from None
+
+    def close(self, grace_seconds: float) -> None:
+        """
+        Asks the worker to exit and kills it if it has not within `grace_seconds`. Blocking.
+        """
+        try:
+            self.connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(grace_seconds)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+class ProcessEnginePool:
+    """
+    Renders on a fixed set of worker processes, each owning one pyttsx3 engine.
+
+    Separate processes sidestep both the GIL and drivers that keep process-wide state, so renders
+    can use every core. Only the job parameters are sent to a worker; the audio is handed back
+    through the job's output file. A worker that crashes, exceeds `job_timeout` or has rendered
+    `max_jobs_per_process` jobs is replaced with a fresh process.
+
+    Has the same interface as `EnginePool`.
+    """
+
+    def __init__(
+        self,
+        size: int,
+        queue_depth: int,
+        job_timeout: float,
+        max_jobs_per_process: int = 0,
+        driver_name: Optional[str] = None,
+    ):
+        self.size = size
+        self.queue_depth = queue_depth
+        self.driver_name = driver_name
+        self.job_timeout = job_timeout
+        self.max_jobs_per_process = max_jobs_per_process
+        # Processes are spawned rather than forked: the server process runs threads and an
+        # event loop that must not be duplicated into the workers.
+        self._context = multiprocessing.get_context("spawn")
+        self._jobs: Optional[asyncio.Queue] = None
+        self._slots: List[asyncio.Task] = []
+        self._busy = 0
+        self._running = False
+        # Time workers spend rendering one job, excluding the wait in the queue.
+        self.service_time = project.metrics.LatencyTracker(histogram=service_seconds)
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def queued(self) -> int:
+        """
+        Returns the number of jobs waiting for a free worker.
+        """
+        return self._jobs.qsize() if self._jobs is not None else 0
+
+    def workers(self) -> int:
+        """
+        Returns the number of worker slots, each running or respawning a process.
+        """
+        return len(self._slots)
+
+    def busy(self) -> int:
+        """
+        Returns the number of workers rendering a job right now.
+        """
+        return self._busy
+
+    async def _spawn(self, index: int) -> _EngineProcess:
+        worker = await asyncio.to_thread(
+            _EngineProcess, self._context, f"tts-engine-{index}", self.driver_name
+        )
+        try:
+            kind, value = await asyncio.to_thread(worker.receive, self.job_timeout)
+        except EngineWorkerError as e:
+            await asyncio.to_thread(worker.close, 0)
+            raise EnginePoolError(f"TTS engine process failed to start: {e}") from None
+        if kind != "ready":
+            await asyncio.to_thread(worker.close, 0)
+            raise EnginePoolError(f"TTS engine process failed to start: {value}")
+        project.tracing.record("engine_init", value)
+        return worker
+
+    async def start(self) -> None:
+        """
+        Starts the worker processes and waits until each has initialized its engine.
+
+        Raises:
+            EnginePoolError: If no worker could initialize an engine.
+        """
+        if self._running:
+            return
+        results = await asyncio.gather(
+            *(self._spawn(index) for index in range(self.size)),
+            return_exceptions=True,
+        )
+        workers = []
+        for result in results:
+            if isinstance(result, BaseException):
+                logger.error("%s", result)
+            else:
+                workers.append(result)
+        if not workers:
+            raise EnginePoolError("No TTS engine process could be started")
+        self._jobs = project.synthesis_scheduler.AsyncFairJobQueue(
+            self.queue_depth, project.synthesis_scheduler.create_scheduler()
+        )
+        self._slots = [
+            asyncio.create_task(self._serve(index, worker))
+            for index, worker in enumerate(workers)
+        ]
+        self._running = True
+
+    async def stop(self) -> None:
+        """
+        Lets the workers finish the jobs already queued, then shuts them down.
+        """
+        if not self._running:
+            return
+        self._running = False
+        for _ in self._slots:
+            await self._jobs.put(None)
+        await asyncio.gather(*self._slots, return_exceptions=True)
+        self._slots = []
+
+    async def _serve(self, index: int, worker: Optional[_EngineProcess]) -> None:
+        try:
+            while True:
+                item = await self._jobs.get()
+                if item is None:
+                    break
+                job, future, queued_at = item
+                if future.cancelled():
+                    continue
+                try:
+                    project.synthesis_scheduler.check_deadline(job)
+                except project.synthesis_scheduler.SynthesisDeadlineError as e:
+                    future.set_exception(e)
+                    continue
+                if worker is None:
+                    try:
+                        worker = await self._spawn(index)
+                    except EnginePoolError as e:
+                        future.set_exception(e)
+                        continue
+                started = time.perf_counter()
+                self._busy += 1
+                try:
+                    await asyncio.to_thread(worker.connection.send, job)
+                    kind, value = await asyncio.to_thread(
+                        worker.receive, self.job_timeout
+                    )
+                except (EngineWorkerError, OSError) as e:
+                    logger.warning("Recycling TTS engine process %s: %s", index, e)
+                    await asyncio.to_thread(worker.close, 0)
+                    worker = None
+                    if not future.done():
+                        future.set_exception(
+                            e
+                            if isinstance(e, EngineWorkerError)
+                            else EngineWorkerError(str(e))
+                        )
+                    continue
+                finally:
+                    self._busy -= 1
+                self.service_time.observe(time.perf_counter() - started)
+                project.synthesis_scheduler.cost_model.observe(
+                    len(job.text), time.perf_counter() - started
+                )
+                if not future.done():
+                    if kind == "done":
+                        output_path, timings = value
+                        timings["engine_acquire"] = started - queued_at
+                        future.set_result((output_path, timings))
+                    else:
+                        future.set_exception(EngineWorkerError(value))
+                worker.jobs_done += 1
+                if (
+                    self.max_jobs_per_process
+                    and worker.jobs_done >= self.max_jobs_per_process
+                ):
+                    await asyncio.to_thread(worker.close, self.job_timeout)
+                    worker = None
+        finally:
+            if worker is not None:
+                await asyncio.to_thread(worker.close, self.job_timeout)
+
+    async def synthesize(self, job: SynthesisJob) -> str:
+        """
+        Queues a job and waits for a worker process to render it.
+
+        Args:
+            job (SynthesisJob): The text, output path and voice parameters to render.
+
+        Returns:
+            str: The path of the rendered audio file.
+
+        Raises:
+            EnginePoolClosedError: If the pool has not been started or is shutting down.
+            EnginePoolFullError: If the queue already holds `queue_depth` jobs.
+            EngineWorkerError: If the worker failed, crashed or timed out on this job.
+            project.synthesis_scheduler.SynthesisDeadlineError: If the job cannot be rendered
+                before the deadline of its request.
+        """
+        if not self._running:
+            raise EnginePoolClosedError("Speech synthesis is not available")
+        if job.workload is None:
+            job.workload = project.synthesis_scheduler.current()
+        project.synthesis_scheduler.check_deadline(job)
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._jobs.put_nowait((job, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            raise EnginePoolFullError(
+                "Speech synthesis queue is full, please retry later"
+            ) from None
+        output_path, timings = await future
+        _record_timings(timings)
+        return output_path
+
+
+def _record_timings(timings: StageTimings) -> None:
+    # Recorded by the caller rather than the worker, so the stages land in the trace of the
+    # request the job was rendered for.
+    for stage, seconds in timings.items():
+        project.tracing.record(stage, seconds)
+
+
+def create_engine_pool() -> "EnginePool | ProcessEnginePool":
+    """
+    Builds the engine pool selected by `TTS_EXECUTION_MODE`.
+    """
+    mode = project.config.TTS_EXECUTION_MODE
+    if mode == "thread":
+        return EnginePool(
+            size=project.config.TTS_ENGINE_POOL_SIZE,
+            queue_depth=project.config.TTS_ENGINE_QUEUE_DEPTH,
+            driver_name=project.config.TTS_DRIVER_NAME,
+        )
+    if mode == "process":
+        return ProcessEnginePool(
+            size=project.config.TTS_ENGINE_POOL_SIZE,
+            queue_depth=project.config.TTS_ENGINE_QUEUE_DEPTH,
+            job_timeout=project.config.TTS_JOB_TIMEOUT_SECONDS,
+            max_jobs_per_process=project.config.TTS_PROCESS_MAX_JOBS,
+            driver_name=project.config.TTS_DRIVER_NAME,
+        )
+    raise ValueError(f"Unknown TTS execution mode {mode!r}")
+
+
+engine_pool = create_engine_pool()
+
+project.metrics.registry.gauge_callback(
+    "tts_engine_queue_depth",
+    "Synthesis jobs waiting for a free engine worker.",
+    lambda: {(): engine_pool.queued()},
+)
+project.metrics.registry.gauge_callback(
+    "tts_engine_workers",
+    "Engine workers with a working engine.",
+    lambda: {(): engine_pool.workers()},
+)
+project.metrics.registry.gauge_callback(
+    "tts_engine_busy_workers",
+    "Engine workers rendering a job right now.",
+    lambda: {(): engine_pool.busy()},
+)
+project.metrics.registry.gauge_callback(
+    "tts_engine_pool_occupancy_ratio",
+    "Share of engine workers rendering a job right now.",
+    lambda: {(): engine_pool.busy() / max(1, engine_pool.workers())},
+)
@@ -0,0 +1,423 @@
+import asyncio
+import contextlib
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import struct
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+import project.audio_dsp
+import project.audio_pcm
+import project.config
+import project.metrics
+import project.single_flight
+import project.synthesis_plan
+import project.tracing
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+_FRAGMENT_FILE = re.compile(r"^([0-9a-f]{64})\.pcm$")
+
+# Magic, channels, sample width and frame rate, followed by the raw frames.
+_HEADER = struct.Struct("<4sHHI")
+
+_MAGIC = b"PCMF"
+
+
+class FragmentCacheStats(BaseModel):
+    """
+    Counters describing how well the sentence fragment cache is serving repeated sentences.
+    """
+
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size_bytes: int
+    max_bytes: int
+
+
+class FragmentCacheReport(BaseModel):
+    """
+    How many of one request's sentences were served from the fragment cache, and the size of
+    the cache at the time.
+    """
+
+    hits: int
+    misses: int
+    hit_ratio: float
+    cache_entries: int
+    cache_size_bytes: int
+
+
+@dataclass
+class FragmentUsage:
+    """
+    Fragment cache hits and misses of a single request.
+    """
+
+    hits: int = 0
+    misses: int = 0
+
+    def report(self, cache: "FragmentCache") -> FragmentCacheReport:
+        lookups = self.hits + self.misses
+        return FragmentCacheReport(
+            hits=self.hits,
+            misses=self.misses,
+            hit_ratio=round(self.hits / lookups, 4) if lookups else 0.0,
+            cache_entries=len(cache),
+            cache_size_bytes=cache.size_bytes,
+        )
+
+
+class Fragment:
+    """
+    The prepared PCM of one rendered sentence: an open cache file, or the frames themselves
+    when the fragment is not cached.
+
+    The cache file is opened as soon as the fragment is handed out, so it stays readable even
+    if the cache evicts it before it is used. `adjustment` holds voice changes still to be
+    applied to the frames, for fragments rendered as a base for post-processing.
+    """
+
+    def __init__(
+        self,
+        pcm_format: project.audio_pcm.PcmFormat,
+        file: Optional[BinaryIO] = None,
+        frames: Optional[bytes] = None,
+        adjustment: Optional[project.audio_dsp.VoiceAdjustment] = None,
+    ):
+        self.pcm_format = pcm_format
+        self._file = file
+        self._frames = frames
+        self.adjustment = adjustment
+
+    def adjusted(self, adjustment: project.audio_dsp.VoiceAdjustment) -> "Fragment":
+        """
+        Returns the fragment with voice changes to apply as it is read, taking over its file.
+        """
+        return Fragment(self.pcm_format, self._file, self._frames, adjustment)
+
+    @contextlib.contextmanager
+    def open(self) -> Iterator[memoryview]:
+        """
+        Context manager yielding the frames, once. Cached fragments are memory-mapped, so they
+        are paged in from disk as they are read instead of being loaded whole.
+        """
+        if self._file is None:
+            yield memoryview(self._frames or b"")
+            return
+        try:
+            if os.fstat(self._file.fileno()).st_size <= _HEADER.size:
+                yield memoryview(b"")
+                return
+            with mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                frames = view[_HEADER.size :]
+                try:
+                    yield frames
+                finally:
+                    # The caller may still hold the view; the map cannot close until it is
+                    # released.
+                    frames.release()
+                    view.release()
+        finally:
+            self.close()
+
+    def read(self) -> bytes:
+        with self.open() as frames:
+            return bytes(frames)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+
+def fragment_key(
+    sentence: str,
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+    prosody: project.synthesis_plan.Prosody,
+    base: bool = False,
+) -> str:
+    """
+    Builds the cache key of a sentence rendered with the given voice parameters.
+
+    Args:
+        sentence (str): The normalized sentence, as handed to the engine.
+        voice_type (Optional[str]): Voice the sentence is rendered with.
+        speed (Optional[float]): Requested speech rate.
+        pitch (Optional[float]): Requested pitch.
+        volume (Optional[float]): Requested volume.
+        prosody (project.synthesis_plan.Prosody): Prosody of the plan segment.
+        base (bool): Whether the fragment is a normalized base render for post-processing.
+
+    Returns:
+        str: A hex SHA-256 digest identifying the fragment.
+    """
+    fields = [
+        1,
+        project.config.TTS_DRIVER_NAME,
+        sentence,
+        voice_type or None,
+        float(speed) if speed else None,
+        float(pitch) if pitch else None,
+        float(volume) if volume else None,
+        [prosody.rate, prosody.pitch, prosody.volume],
+    ]
+    if base:
+        fields.append(["dsp", project.config.TTS_DSP_PEAK_DBFS])
+    material = json.dumps(fields, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _write_fragment(
+    path: str, pcm_format: project.audio_pcm.PcmFormat, frames: bytes
+) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    scratch_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(scratch_path, "wb") as file:
+            file.write(
+                _HEADER.pack(
+                    _MAGIC,
+                    pcm_format.channels,
+                    pcm_format.sample_width,
+                    pcm_format.frame_rate,
+                )
+            )
+            file.write(frames)
+        os.replace(scratch_path, path)
+    finally:
+        if os.path.exists(scratch_path):
+            os.remove(scratch_path)
+    return _HEADER.size + len(frames)
+
+
+def _read_format(path: str) -> Optional[project.audio_pcm.PcmFormat]:
+    with open(path, "rb") as file:
+        header = file.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None
+    magic, channels, sample_width, frame_rate = _HEADER.unpack(header)
+    if magic != _MAGIC:
+        return None
+    return project.audio_pcm.PcmFormat(channels, sample_width, frame_rate)
+
+
+class FragmentCache:
+    """
+    An LRU cache of rendered sentences, stored as raw PCM files on local disk.
+
+    Fragments are kept trimmed and edge-faded, ready to be joined, and are memory-mapped when
+    read, so only the index lives in memory. The index is rebuilt from the directory at
+    startup, using file modification times as the recency order.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # Cache key -> (size, PCM format), least recently used first.
+        self._entries: "OrderedDict[str, Tuple[int, project.audio_pcm.PcmFormat]]" = (
+            OrderedDict()
+        )
+        self._size_bytes = 0
+        self._in_flight: project.single_flight.SingleFlight[
+            Tuple[project.audio_pcm.PcmFormat, bytes]
+        ] = project.single_flight.SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @property
+    def size_bytes(self) -> int:
+        return self._size_bytes
+
+    def stats(self) -> FragmentCacheStats:
+        return FragmentCacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self._entries),
+            size_bytes=self._size_bytes,
+            max_bytes=self.max_bytes,
+        )
+
+    def counters(self) -> project.metrics.CacheCounters:
+        return project.metrics.CacheCounters(
+            hits=self.hits,
+            misses=self.misses,
+            entries=len(self._entries),
+            size_bytes=self._size_bytes,
+        )
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.pcm")
+
+    def contains(self, key: str) -> bool:
+        """
+        Whether a fragment is cached, without counting a hit or changing its recency.
+        """
+        return key in self._entries
+
+    def rebuild_index(self) -> None:
+        """
+        Replaces the in-memory index with the fragments found on disk.
+
+        This performs blocking I/O and is meant to run once at startup, off the event loop.
+        """
+        if not self.enabled:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        found = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                match = _FRAGMENT_FILE.match(name)
+                pcm_format = _read_format(path) if match else None
+                if pcm_format is None:
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                found.append((stat.st_mtime, match.group(1), stat.st_size, pcm_format))
+        found.sort(key=lambda entry: entry[0])
+        self._entries = OrderedDict(
+            (key, (size, pcm_format)) for _, key, size, pcm_format in found
+        )
+        self._size_bytes = sum(size for _, _, size, _ in found)
+        for key in self._evict():
+            self._remove(key)
+        logger.info(
+            "Fragment cache index rebuilt with %d entries (%d bytes)",
+            len(self._entries),
+            self._size_bytes,
+        )
+
+    async def get_or_render(
+        self,
+        key: str,
+        render: Callable[[], Awaitable[Tuple[project.audio_pcm.PcmFormat, bytes]]],
+        usage: Optional[FragmentUsage] = None,
+    ) -> Fragment:
+        """
+        Returns the cached fragment for `key`, rendering it once if it is missing.
+
+        Concurrent misses for the same key share a single render, which carries on for the
+        others if the caller that started it is cancelled.
+
+        Args:
+            key (str): The fragment key from `fragment_key`.
+            render (Callable[[], Awaitable[Tuple[project.audio_pcm.PcmFormat, bytes]]]):
+                Renders the sentence to prepared PCM.
+            usage (Optional[FragmentUsage]): Per-request counters to update.
+
+        Returns:
+            Fragment: The rendered sentence. Its file must be read or closed by the caller.
+        """
+        fragment = self._lookup(key)
+        if fragment is not None:
+            self.hits += 1
+            if usage is not None:
+                usage.hits += 1
+            return fragment
+        if not self.enabled:
+            self.misses += 1
+            if usage is not None:
+                usage.misses += 1
+            pcm_format, frames = await render()
+            return Fragment(pcm_format, frames=frames)
+        if key in self._in_flight:
+            self.hits += 1
+            if usage is not None:
+                usage.hits += 1
+        else:
+            self.misses += 1
+            if usage is not None:
+                usage.misses += 1
+        pcm_format, frames = await self._in_flight.run(
+            key, lambda: self._render_and_add(key, render)
+        )
+        # Every caller opens the file itself; the rendered frames only serve them if it is
+        # already gone again.
+        return self._lookup(key) or Fragment(pcm_format, frames=frames)
+
+    async def _render_and_add(
+        self,
+        key: str,
+        render: Callable[[], Awaitable[Tuple[project.audio_pcm.PcmFormat, bytes]]],
+    ) -> Tuple[project.audio_pcm.PcmFormat, bytes]:
+        pcm_format, frames = await render()
+        with project.tracing.stage("fragment_write"):
+            size = await asyncio.to_thread(
+                _write_fragment, self.path(key), pcm_format, frames
+            )
+        victims = self._add(key, size, pcm_format)
+        if victims:
+            await asyncio.to_thread(self._remove_all, victims)
+        return pcm_format, frames
+
+    def _lookup(self, key: str) -> Optional[Fragment]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        try:
+            file = open(self.path(key), "rb")
+        except FileNotFoundError:
+            self._size_bytes -= self._entries.pop(key)[0]
+            return None
+        self._entries.move_to_end(key)
+        return Fragment(entry[1], file=file)
+
+    def _add(
+        self, key: str, size: int, pcm_format: project.audio_pcm.PcmFormat
+    ) -> List[str]:
+        if key in self._entries:
+            self._size_bytes -= self._entries.pop(key)[0]
+        self._entries[key] = (size, pcm_format)
+        self._size_bytes += size
+        return self._evict()
+
+    def _evict(self) -> List[str]:
+        victims = []
+        while self._size_bytes > self.max_bytes and self._entries:
+            key, (size, _) = self._entries.popitem(last=False)
+            self._size_bytes -= size
+            victims.append(key)
+            self.evictions += 1
+        return victims
+
+    def _remove(self, key: str) -> None:
+        # Readers that have the file mapped keep their view of it.
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self.path(key))
+
+    def _remove_all(self, keys: List[str]) -> None:
+        for key in keys:
+            if key not in self._entries:
+                self._remove(key)
+
+
+fragment_cache = FragmentCache(
+    directory=project.config.TTS_FRAGMENT_CACHE_DIR,
+    max_bytes=project.config.TTS_FRAGMENT_CACHE_MAX_BYTES,
+)
+
+project.metrics.register_cache("fragment", fragment_cache.counters)
@@ -0,0 +1,167 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+import prisma
+import prisma.enums
+import prisma.models
+import project.audio_encoding
+import project.config
+import project.tracing
+from pydantic import BaseModel
+
+
+class TTSHistoryAudio(BaseModel):
+    """
+    Where the finished audio of a past TTS request can be downloaded, and in which format.
+    """
+
+    file_url: str
+    file_type: str
+    mime_type: str
+
+
+class TTSHistoryEntry(BaseModel):
+    """
+    One past TTS request with the start of its input, its status and, once done, its audio.
+    """
+
+    id: str
+    text_preview: str
+    ssml: bool
+    status: str
+    error: Optional[str] = None
+    created_at: datetime
+    audio: Optional[TTSHistoryAudio] = None
+
+
+class TTSHistoryResponse(BaseModel):
+    """
+    A page of a user's TTS requests, newest first, and the cursor of the next page if there is one.
+    """
+
+    entries: List[TTSHistoryEntry]
+    next_cursor: Optional[str] = None
+
+
+def encode_cursor(created_at: datetime, id: str) -> str:
+    """
+    Encodes the position after a history entry as an opaque cursor.
+    """
+    payload = json.dumps([created_at.isoformat(), id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Reads the position a cursor from `encode_cursor` points after.
+
+    Raises:
+        ValueError: If the cursor was not made by `encode_cursor`.
+    """
+    try:
+        payload = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, id = json.loads(payload)
+        return datetime.fromisoformat(created_at), str(id)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise ValueError("Invalid history cursor") from None
+
+
+def page_filter(
+    user_id: str, after: Optional[Tuple[datetime, str]] = None
+) -> Dict[str, Any]:
+    """
+    Builds the filter for a user's requests that come after `after`, the (createdAt, id) of
+    the last one read, when they are ordered newest first.
+    """
+    where: Dict[str, Any] = {"userId": user_id}
+    if after:
+        created_at, id = after
+        # (createdAt, id) < (created_at, id), spelled so the bound on createdAt is a plain
+        # range condition on the (userId, createdAt, id) index and only ties are filtered.
+        where["createdAt"] = {"lte": created_at}
+        where["OR"] = [{"createdAt": {"lt": created_at}}, {"id": {"lt": id}}]
+    return where
+
+
+def _audio(audio_output: prisma.models.AudioOutput) -> TTSHistoryAudio:
+    encoder = project.audio_encoding.get_encoder(audio_output.fileType.value)
+    return TTSHistoryAudio(
+        file_url=f"/audio/{audio_output.ttsRequestId}/content",
+        file_type=encoder.file_type,
+        mime_type=encoder.mime_type,
+    )
+
+
+async def list_tts_history(
+    user_id: str, limit: Optional[int] = None, cursor: Optional[str] = None
+) -> TTSHistoryResponse:
+    """
+    Lists a user's past TTS requests, newest first, a page at a time.
+
+    Pages are read by keyset pagination on (userId, createdAt, id): each page starts right
+    after the last entry of the previous one, found through the composite index, so reading
+    page 1000 costs the same as reading page 1 and requests created meanwhile neither shift
+    nor repeat entries. One extra row is read to tell whether another page follows. The
+    AudioOutput rows of the whole page are then fetched in a single query instead of one per
+    request.
+
+    Args:
+        user_id (str): The user whose requests are listed.
+        limit (Optional[int]): Entries per page, capped at `TTS_HISTORY_MAX_PAGE_SIZE`;
+            `TTS_HISTORY_PAGE_SIZE` when not set.
+        cursor (Optional[str]): The `next_cursor` of the previous page, or None for the first.
+
+    Returns:
+        TTSHistoryResponse: The page of entries and the cursor of the next page.
+
+    Raises:
+        ValueError: If `cursor` is not a cursor returned by this function.
+    """
+    limit = min(
+        max(1, limit or project.config.TTS_HISTORY_PAGE_SIZE),
+        project.config.TTS_HISTORY_MAX_PAGE_SIZE,
+    )
+    with project.tracing.query("TTSRequest.find_many"):
+        requests = await prisma.models.TTSRequest.prisma().find_many(
+            where=page_filter(user_id, decode_cursor(cursor) if cursor else None),
+            order=[{"createdAt": "desc"}, {"id": "desc"}],
+            take=limit + 1,
+        )
+    more = len(requests) > limit
+    requests = requests[:limit]
+    outputs: Dict[str, prisma.models.AudioOutput] = {}
+    finished = [
+        request.id
+        for request in requests
+        if request.status == prisma.enums.TTSRequestStatus.DONE
+    ]
+    if finished:
+        with project.tracing.query("AudioOutput.find_many"):
+            for audio_output in await prisma.models.AudioOutput.prisma().find_many(
+                where={"ttsRequestId": {"in": finished}}
+            ):
+                outputs[audio_output.ttsRequestId] = audio_output
+    preview = project.config.TTS_HISTORY_PREVIEW_CHARS
+    entries = []
+    for request in requests:
+        audio_output = outputs.get(request.id)
+        entries.append(
+            TTSHistoryEntry(
+                id=request.id,
+                text_preview=(request.textInput or request.ssmlInput or "")[:preview],
+                # Plain-text requests store an empty SSML input, and text wins when both are set.
+                ssml=not request.textInput and bool(request.ssmlInput),
+                status=request.status.value.lower(),
+                error=request.errorMessage,
+                created_at=request.createdAt,
+                audio=_audio(audio_output) if audio_output else None,
+            )
+        )
+    last = requests[-1] if more else None
+    return TTSHistoryResponse(
+        entries=entries,
+        next_cursor=encode_cursor(last.createdAt, last.id) if last else None,
+    )
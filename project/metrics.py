@@ -0,0 +1,388 @@
+import bisect
+import collections
+import math
+import threading
+from typing import Callable, Deque, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pydantic import BaseModel
+
+# Content type of the Prometheus text exposition format.
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds, in seconds, of the latency histogram buckets: from sub-millisecond cache hits to
+# renders of long documents.
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+LabelValues = Tuple[str, ...]
+
+# Samples of a callback metric: label values -> value.
+Samples = Dict[LabelValues, float]
+
+
+class LatencySnapshot(BaseModel):
+    """
+    Summary of recently observed latencies, in seconds.
+    """
+
+    count: int
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+
+    def _label_values(self, labels: Dict[str, str]) -> LabelValues:
+        if set(labels) != set(self.labels):
+            raise ValueError(
+                f"{self.name} takes labels {self.labels}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labels)
+
+    def expose(self) -> List[str]:
+        lines = [
+            f"# HELP {self.name} {_escape_help(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        lines.extend(self._sample_lines())
+        return lines
+
+    def _sample_lines(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """
+    A monotonically increasing count, per combination of label values.
+    """
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._label_values(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _sample_lines(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        return [
+            _sample(self.name, self.labels, key, value)
+            for key, value in sorted(values.items())
+        ]
+
+
+class Histogram(_Metric):
+    """
+    Observations counted into cumulative buckets, per combination of label values.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        # Label values -> (count per bucket, the last one for +Inf; sum).
+        self._series: Dict[LabelValues, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._label_values(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][index] += 1
+            series[1][0] += value
+
+    def _sample_lines(self) -> List[str]:
+        with self._lock:
+            series = {key: (list(c), s[0]) for key, (c, s) in self._series.items()}
+        lines = []
+        for key, (counts, total) in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(
+                    _sample(
+                        f"{self.name}_bucket",
+                        self.labels + ("le",),
+                        key + (_format_value(bound),),
+                        cumulative,
+                    )
+                )
+            lines.append(_sample(f"{self.name}_sum", self.labels, key, total))
+            lines.append(_sample(f"{self.name}_count", self.labels, key, cumulative))
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """
+    A gauge or counter whose samples are read from a callback when the metrics are scraped, for
+    values the application already keeps, such as queue sizes and cache counters.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        kind: str,
+        callback: Callable[[], Samples],
+        labels: Sequence[str] = (),
+    ):
+        super().__init__(name, documentation, labels)
+        self.kind = kind
+        self._callback = callback
+
+    def _sample_lines(self) -> List[str]:
+        return [
+            _sample(self.name, self.labels, key, value)
+            for key, value in sorted(self._callback().items())
+        ]
+
+
+class MetricsRegistry:
+    """
+    The metrics exposed on `/metrics`, in registration order.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(
+        self, name: str, documentation: str, labels: Sequence[str] = ()
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labels: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def gauge_callback(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Samples],
+        labels: Sequence[str] = (),
+    ) -> CallbackMetric:
+        return self._register(
+            CallbackMetric(name, documentation, "gauge", callback, labels)
+        )
+
+    def counter_callback(
+        self,
+        name: str,
+        documentation: str,
+        callback: Callable[[], Samples],
+        labels: Sequence[str] = (),
+    ) -> CallbackMetric:
+        return self._register(
+            CallbackMetric(name, documentation, "counter", callback, labels)
+        )
+
+    def expose(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class CacheCounters(BaseModel):
+    """
+    The counters of one cache, as exported to the cache metrics.
+    """
+
+    hits: int
+    misses: int
+    entries: int
+    size_bytes: Optional[int] = None
+
+
+_caches: Dict[str, Callable[[], CacheCounters]] = {}
+
+
+def register_cache(name: str, counters: Callable[[], CacheCounters]) -> None:
+    """
+    Exports a cache's hit, miss and size counters under `cache="<name>"`.
+    """
+    _caches[name] = counters
+
+
+def _cache_samples(field: str) -> Callable[[], Samples]:
+    def collect() -> Samples:
+        samples = {}
+        for name, counters in list(_caches.items()):
+            value = getattr(counters(), field)
+            if value is not None:
+                samples[(name,)] = value
+        return samples
+
+    return collect
+
+
+def _cache_hit_ratios() -> Samples:
+    samples = {}
+    for name, counters in list(_caches.items()):
+        current = counters()
+        lookups = current.hits + current.misses
+        samples[(name,)] = current.hits / lookups if lookups else 0.0
+    return samples
+
+
+registry.counter_callback(
+    "tts_cache_hits_total",
+    "Lookups answered by the cache.",
+    _cache_samples("hits"),
+    labels=("cache",),
+)
+registry.counter_callback(
+    "tts_cache_misses_total",
+    "Lookups the cache could not answer.",
+    _cache_samples("misses"),
+    labels=("cache",),
+)
+registry.gauge_callback(
+    "tts_cache_hit_ratio",
+    "Share of lookups answered by the cache since the server started.",
+    _cache_hit_ratios,
+    labels=("cache",),
+)
+registry.gauge_callback(
+    "tts_cache_entries",
+    "Entries held by the cache.",
+    _cache_samples("entries"),
+    labels=("cache",),
+)
+registry.gauge_callback(
+    "tts_cache_size_bytes",
+    "Bytes held by the cache, for caches that track their size.",
+    _cache_samples("size_bytes"),
+    labels=("cache",),
+)
+
+
+class LatencyTracker:
+    """
+    Keeps the most recent latency observations and summarizes them as percentiles.
+
+    Observations are also added to `histogram`, when given, so the same latencies are exported
+    on `/metrics` over the whole lifetime of the server.
+    """
+
+    def __init__(self, window: int = 1024, histogram: Optional[Histogram] = None):
+        self._samples: Deque[float] = collections.deque(maxlen=window)
+        self._count = 0
+        self._histogram = histogram
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._count += 1
+        if self._histogram is not None:
+            self._histogram.observe(seconds)
+
+    def recent_mean(self) -> float:
+        """
+        Returns the mean of the observations in the window, or zero if there are none.
+        """
+        samples = list(self._samples)
+        return sum(samples) / len(samples) if samples else 0.0
+
+    def snapshot(self) -> LatencySnapshot:
+        samples = sorted(self._samples)
+        if not samples:
+            return LatencySnapshot(
+                count=self._count, mean=0.0, p50=0.0, p95=0.0, p99=0.0
+            )
+        return LatencySnapshot(
+            count=self._count,
+            mean=sum(samples) / len(samples),
+            p50=_percentile(samples, 0.50),
+            p95=_percentile(samples, 0.95),
+            p99=_percentile(samples, 0.99),
+        )
+
+
+def _percentile(sorted_samples: list, fraction: float) -> float:
+    index = max(0, math.ceil(fraction * len(sorted_samples)) - 1)
+    return sorted_samples[index]
+
+
+def _sample(name: str, labels: Iterable[str], values: LabelValues, value: float) -> str:
+    pairs = ",".join(
+        f'{label}="{_escape_label(v)}"' for label, v in zip(labels, values)
+    )
+    if not pairs:
+        return f"{name} {_format_value(value)}"
+    return f"{name}{{{pairs}}} {_format_value(value)}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _escape_help(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n")
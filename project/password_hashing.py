@@ -0,0 +1,72 @@
+import asyncio
+import concurrent.futures
+
+import bcrypt
+import project.config
+import project.tracing
+
+# bcrypt runs its key derivation without holding the GIL, so these threads hash in parallel
+# while the event loop keeps serving other requests.
+hash_executor = concurrent.futures.ThreadPoolExecutor(
+    max_workers=project.config.PASSWORD_HASH_THREADS,
+    thread_name_prefix="password-hash",
+)
+
+
+def _hash(password: bytes, rounds: int) -> str:
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+
+
+def _verify(password: bytes, hashed: bytes) -> bool:
+    try:
+        return bcrypt.checkpw(password, hashed)
+    except ValueError:
+        # Not a bcrypt hash, e.g. a corrupted or legacy value.
+        return False
+
+
+async def hash_password(password: str) -> str:
+    """
+    Hashes a password with bcrypt at the configured `BCRYPT_ROUNDS` cost, on the hashing pool.
+
+    Args:
+        password (str): The plain text password.
+
+    Returns:
+        str: The bcrypt hash to store.
+    """
+    with project.tracing.stage("password_hash"):
+        return await asyncio.get_running_loop().run_in_executor(
+            hash_executor,
+            _hash,
+            password.encode("utf-8"),
+            project.config.BCRYPT_ROUNDS,
+        )
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    """
+    Checks a password against a stored bcrypt hash, on the hashing pool.
+
+    Args:
+        password (str): The plain text password to check.
+        hashed (str): The stored hash.
+
+    Returns:
+        bool: Whether the password matches.
+    """
+    with project.tracing.stage("password_verify"):
+        return await asyncio.get_running_loop().run_in_executor(
+            hash_executor, _verify, password.encode("utf-8"), hashed.encode("utf-8")
+        )
+
+
+def needs_rehash(hashed: str) -> bool:
+    """
+    Whether a stored hash was made at a cost other than the configured `BCRYPT_ROUNDS`.
+    """
+    parts = hashed.split("$")
+    try:
+        return int(parts[2]) != project.config.BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
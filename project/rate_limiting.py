@@ -0,0 +1,208 @@
+import abc
+import math
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import project.auth
+import project.config
+import project.engine_pool
+from fastapi import HTTPException, status
+
+# Atomically refills a bucket stored as a Redis hash and takes `cost` tokens from it, using the
+# server clock so every worker agrees on time. Returns the seconds to wait, or 0 if admitted.
+_REDIS_CONSUME_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= math.min(cost, capacity) then
+  tokens = tokens - cost
+else
+  wait = (math.min(cost, capacity) - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('EXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1)
+return tostring(wait)
+"""
+
+
+# Number of in-memory buckets above which idle ones are dropped.
+_MAX_MEMORY_BUCKETS = 100_000
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """
+    A token bucket: holds up to `capacity` cost units and refills at `refill_per_second`.
+    """
+
+    capacity: float
+    refill_per_second: float
+
+
+class RateLimitBackend(abc.ABC):
+    """
+    Where token bucket state lives. Shared backends let every server process enforce one budget.
+    """
+
+    @abc.abstractmethod
+    async def consume(self, key: str, cost: float, limit: RateLimit) -> float:
+        """
+        Takes `cost` units from the bucket `key` if it holds enough.
+
+        A bucket that is full admits any cost, going into debt for costs above its capacity,
+        so a single large request is never locked out for good.
+
+        Returns:
+            float: 0 if the cost was taken, otherwise the seconds until it could be.
+        """
+
+
+class InMemoryRateLimitBackend(RateLimitBackend):
+    """
+    Buckets kept in the server process, so each uvicorn worker enforces its own budget.
+    """
+
+    def __init__(self) -> None:
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    async def consume(self, key: str, cost: float, limit: RateLimit) -> float:
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (limit.capacity, now))
+        tokens = min(limit.capacity, tokens + (now - updated) * limit.refill_per_second)
+        required = min(cost, limit.capacity)
+        if tokens < required:
+            self._buckets[key] = (tokens, now)
+            return (required - tokens) / limit.refill_per_second
+        self._buckets[key] = (tokens - cost, now)
+        if len(self._buckets) > _MAX_MEMORY_BUCKETS:
+            self._prune(now)
+        return 0.0
+
+    def _prune(self, now: float) -> None:
+        # Buckets idle this long have refilled and are indistinguishable from new ones.
+        for key in [
+            k for k, (_, updated) in self._buckets.items() if now - updated > 3600
+        ]:
+            del self._buckets[key]
+
+
+class RedisRateLimitBackend(RateLimitBackend):
+    """
+    Buckets kept in Redis and updated by a server-side script, so all server processes share
+    them. Requires the optional `redis` package.
+    """
+
+    def __init__(self, url: str, prefix: str = "tts:ratelimit:", client=None):
+        if client is None:
+            try:
+                import redis.asyncio
+            except ImportError:
+                raise RuntimeError(
+                    "The redis rate limit backend requires the redis package"
+                ) from None
+            client = redis.asyncio.Redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+        self._consume = client.register_script(_REDIS_CONSUME_SCRIPT)
+
+    async def consume(self, key: str, cost: float, limit: RateLimit) -> float:
+        wait = await self._consume(
+            keys=[f"{self.prefix}{key}"],
+            args=[limit.capacity, limit.refill_per_second, cost],
+        )
+        return float(wait)
+
+
+def create_rate_limit_backend() -> RateLimitBackend:
+    """
+    Builds the backend selected by `RATE_LIMIT_BACKEND`.
+    """
+    backend = project.config.RATE_LIMIT_BACKEND
+    if backend == "memory":
+        return InMemoryRateLimitBackend()
+    if backend == "redis":
+        return RedisRateLimitBackend(project.config.RATE_LIMIT_REDIS_URL)
+    raise ValueError(f"Unknown rate limit backend {backend!r}")
+
+
+rate_limit_backend = create_rate_limit_backend()
+
+
+def request_cost(characters: int, requests: int = 1) -> float:
+    """
+    Cost of a synthesis request in rate limit units: one per request plus one per
+    `RATE_LIMIT_CHARS_PER_UNIT` characters of input, so long texts use up the budget faster.
+    """
+    return requests + characters / project.config.RATE_LIMIT_CHARS_PER_UNIT
+
+
+def role_limit(role: str) -> Optional[RateLimit]:
+    """
+    The bucket every user of `role` gets, or None if the role is not limited. Roles missing
+    from `RATE_LIMIT_UNITS_PER_MINUTE` get the USER budget.
+    """
+    budgets = project.config.RATE_LIMIT_UNITS_PER_MINUTE
+    per_minute = budgets.get(role, budgets.get("USER", 0.0))
+    if per_minute <= 0:
+        return None
+    return RateLimit(capacity=per_minute, refill_per_second=per_minute / 60)
+
+
+def _too_many_requests(detail: str, retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+def _check_admission() -> None:
+    pool = project.engine_pool.engine_pool
+    queued = pool.queued()
+    if queued < project.config.TTS_ADMISSION_MAX_QUEUED:
+        return
+    # Roughly how long the backlog takes to drain at the recent render speed.
+    drain_seconds = queued * pool.service_time.recent_mean() / max(1, pool.size)
+    raise _too_many_requests(
+        "Speech synthesis is overloaded, please retry later", drain_seconds
+    )
+
+
+async def admit(user: project.auth.AuthenticatedUser, cost: float) -> None:
+    """
+    Lets a synthesis request through, or rejects it with 429 and a `Retry-After` header.
+
+    Requests are refused while the engine queue holds `TTS_ADMISSION_MAX_QUEUED` jobs or more,
+    and when the caller's token bucket, sized by their role, cannot cover `cost`.
+
+    Args:
+        user (project.auth.AuthenticatedUser): The caller.
+        cost (float): The request's cost from `request_cost`.
+
+    Raises:
+        HTTPException: 429 if the request must be retried later.
+    """
+    _check_admission()
+    limit = role_limit(user.role)
+    if limit is None:
+        return
+    wait = await rate_limit_backend.consume(f"{user.role}:{user.user_id}", cost, limit)
+    if wait > 0:
+        raise _too_many_requests("Rate limit exceeded", wait)
+
+
+async def close() -> None:
+    """
+    Releases the connection of a shared backend, if any.
+    """
+    client = getattr(rate_limit_backend, "client", None)
+    if client is not None:
+        await client.aclose()
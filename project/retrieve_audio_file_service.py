@@ -1,43 +1,150 @@
+from dataclasses import dataclass
 from typing import Optional
 
 import prisma
 import prisma.enums
 import prisma.models
+import project.audio_encoding
+import project.auth
+import project.config
+import project.metrics
+import project.tracing
+import project.ttl_cache
 from pydantic import BaseModel
 
 
 class RetrieveAudioFileResponse(BaseModel):
     """
-    Response model containing the URL or direct stream of the requested MP3 audio file.
+    Response model containing the URL or direct stream of the requested audio file, along with the processing status of the request.
     """
 
     file_url: str
     file_type: str
     mime_type: str
+    status: str
+    error: Optional[str] = None
 
 
-async def retrieve_audio_file(id: str) -> RetrieveAudioFileResponse:
+@dataclass
+class AudioOutputLocation:
     """
-    Provides access to download the generated MP3 file.
+    Where the finished audio of a TTS request is stored, in which format, and whose request
+    it is.
+    """
+
+    file_path: str
+    file_type: str
+    user_id: Optional[str]
+
+
+# AudioOutput rows are written once when a request finishes, so found locations can be reused.
+# Requests without output yet are never cached, since they may finish at any moment.
+audio_output_cache: project.ttl_cache.TTLCache[AudioOutputLocation] = (
+    project.ttl_cache.TTLCache(
+        maxsize=project.config.AUDIO_LOOKUP_CACHE_SIZE,
+        ttl=project.config.AUDIO_LOOKUP_CACHE_TTL_SECONDS,
+    )
+)
+
+project.metrics.register_cache("audio_output", audio_output_cache.counters)
+
+
+def _remember_audio_output(
+    id: str, audio_output: prisma.models.AudioOutput, user_id: Optional[str]
+) -> AudioOutputLocation:
+    location = AudioOutputLocation(
+        file_path=audio_output.filePath,
+        file_type=audio_output.fileType.value,
+        user_id=user_id,
+    )
+    audio_output_cache.set(id, location)
+    return location
+
+
+async def find_audio_output(id: str) -> Optional[AudioOutputLocation]:
+    """
+    Looks up the stored audio of a TTS request, from memory when it was looked up recently.
+
+    Args:
+        id (str): Unique identifier of the TTSRequest.
+
+    Returns:
+        Optional[AudioOutputLocation]: The stored audio, or None if the request has no output.
+    """
+    location = audio_output_cache.get(id)
+    if location is not None:
+        return location
+    with project.tracing.query("AudioOutput.find_unique"):
+        audio_output = await prisma.models.AudioOutput.prisma().find_unique(
+            where={"ttsRequestId": id}, include={"TTSRequest": True}
+        )
+    if audio_output is None:
+        return None
+    user_id = audio_output.TTSRequest.userId if audio_output.TTSRequest else None
+    return _remember_audio_output(id, audio_output, user_id)
+
+
+def _finished_response(
+    id: str, location: AudioOutputLocation
+) -> RetrieveAudioFileResponse:
+    encoder = project.audio_encoding.get_encoder(location.file_type)
+    return RetrieveAudioFileResponse(
+        file_url=f"/audio/{id}/content",
+        file_type=encoder.file_type,
+        mime_type=encoder.mime_type,
+        status=prisma.enums.TTSRequestStatus.DONE.value.lower(),
+    )
+
+
+def _not_found() -> RetrieveAudioFileResponse:
+    return RetrieveAudioFileResponse(
+        file_url="", file_type="", mime_type="", status="not_found"
+    )
+
+
+async def retrieve_audio_file(
+    id: str, user: project.auth.AuthenticatedUser
+) -> RetrieveAudioFileResponse:
+    """
+    Provides access to download the generated audio file.
 
     This function retrieves information about an audio file generated from a TTS request.
-    It uses the TTSRequest ID to find the corresponding AudioOutput entry in the database,
-    and constructs a response with the URL where the MP3 file can be accessed.
+    It uses the TTSRequest ID to find the request and its AudioOutput entry in the database,
+    reports whether the request is pending, running, done or failed, and for finished requests
+    constructs a response with the URL where the audio file can be accessed and its real format.
+    Finished requests are answered from the AudioOutput lookup cache when possible.
 
     Args:
         id (str): Unique identifier for the TTSRequest to retrieve the audio file for.
+        user (project.auth.AuthenticatedUser): The caller, who must own the request or be an
+            administrator. Requests of other users are reported as not found.
 
     Returns:
-        RetrieveAudioFileResponse: Response model containing the URL or direct stream of the requested MP3 audio file.
-    """
-    audio_output: Optional[
-        prisma.models.AudioOutput
-    ] = await prisma.models.AudioOutput.prisma().find_unique(where={"ttsRequestId": id})
-    if audio_output and audio_output.fileType == prisma.enums.AudioFileType.MP3:
-        basePath = "http://localhost/files/"
-        file_url = f"{basePath}{audio_output.filePath}"
-        return RetrieveAudioFileResponse(
-            file_url=file_url, file_type="MP3", mime_type="audio/mpeg"
+        RetrieveAudioFileResponse: Response model containing the URL or direct stream of the requested audio file.
+    """
+    location = audio_output_cache.get(id)
+    if location is not None:
+        if not project.auth.can_read(user, location.user_id):
+            return _not_found()
+        return _finished_response(id, location)
+    with project.tracing.query("TTSRequest.find_unique"):
+        tts_request: Optional[
+            prisma.models.TTSRequest
+        ] = await prisma.models.TTSRequest.prisma().find_unique(
+            where={"id": id}, include={"AudioOutput": True}
+        )
+    if tts_request is None or not project.auth.can_read(user, tts_request.userId):
+        return _not_found()
+    audio_output = tts_request.AudioOutput
+    if audio_output:
+        return _finished_response(
+            id, _remember_audio_output(id, audio_output, tts_request.userId)
         )
     else:
-        return RetrieveAudioFileResponse(file_url="", file_type="", mime_type="")
+        return RetrieveAudioFileResponse(
+            file_url="",
+            file_type="",
+            mime_type="",
+            status=tts_request.status.value.lower(),
+            error=tts_request.errorMessage,
+        )
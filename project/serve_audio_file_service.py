@@ -0,0 +1,182 @@
+import asyncio
+import mimetypes
+import re
+from typing import Mapping, Optional
+
+import prisma.models
+import project.audio_encoding
+import project.audio_file_response
+import project.audio_storage
+import project.auth
+import project.clip_bundles
+import project.config
+import project.retrieve_audio_file_service
+import project.tracing
+from fastapi.responses import JSONResponse, RedirectResponse, Response
+
+# Names the cache gives stored audio, as produced by `audio_storage.shard_name`.
+_STORED_NAME = re.compile(r"^[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.[a-z0-9]+$")
+
+# Ids of clip bundles, as produced by batch synthesis.
+_BUNDLE_ID = re.compile(r"^[0-9a-f]{32}$")
+
+_BUNDLE_MEDIA_TYPE = "application/octet-stream"
+
+
+def _not_found(message: str) -> Response:
+    return JSONResponse(content={"error": message}, status_code=404)
+
+
+def _serve_stored(
+    name: str, media_type: str, request_headers: Mapping[str, str]
+) -> Response:
+    storage = project.audio_storage.audio_storage
+    path = storage.local_path(name)
+    if path is None:
+        # Remote backends serve ranges and validators themselves; send the client there.
+        return RedirectResponse(storage.url_for(name), status_code=307)
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return _not_found("Audio file not found")
+    return project.audio_file_response.file_response(
+        file,
+        request_headers,
+        media_type=media_type,
+        cache_control=f"public, max-age={project.config.AUDIO_CACHE_MAX_AGE_SECONDS}",
+    )
+
+
+async def _serve_clip(
+    file_path: str, media_type: str, request_headers: Mapping[str, str]
+) -> Response:
+    storage = project.audio_storage.audio_storage
+    # The index of an open bundle is read from memory; only opening one needs a thread.
+    located = project.clip_bundles.locate_clip(
+        storage, file_path, blocking=False
+    ) or await asyncio.to_thread(project.clip_bundles.locate_clip, storage, file_path)
+    if located is None:
+        return _not_found("Audio file not found")
+    path, clip = located
+    try:
+        file = open(path, "rb")
+    except FileNotFoundError:
+        return _not_found("Audio file not found")
+    # The clip's bytes are sent straight from the bundle file, as a window of it.
+    return project.audio_file_response.file_response(
+        file,
+        request_headers,
+        media_type=media_type,
+        cache_control=f"public, max-age={project.config.AUDIO_CACHE_MAX_AGE_SECONDS}",
+        offset=clip.offset,
+        length=clip.length,
+        etag=clip.etag,
+    )
+
+
+async def serve_audio_file(
+    id: str, user: project.auth.AuthenticatedUser, request_headers: Mapping[str, str]
+) -> Response:
+    """
+    Sends the audio bytes of a finished TTS request.
+
+    The AudioOutput lookup is served from memory for recently played requests, and the file is
+    sent with `ETag`, `Last-Modified` and `Accept-Ranges` so players can seek with `Range`
+    requests and revalidate with `If-None-Match` or `If-Modified-Since`. Clips of a bundle are
+    sent as their byte range of the memory-mapped bundle file.
+
+    Args:
+        id (str): Unique identifier of the TTSRequest.
+        user (project.auth.AuthenticatedUser): The caller, who must own the request or be an
+            administrator.
+        request_headers (Mapping[str, str]): Headers of the incoming request.
+
+    Returns:
+        Response: The audio, a partial or not-modified response, a redirect to remote storage,
+        or a 404 error if the request has no audio or belongs to another user.
+    """
+    location = await project.retrieve_audio_file_service.find_audio_output(id)
+    if location is None or not project.auth.can_read(user, location.user_id):
+        return _not_found("No audio output for this request")
+    encoder = project.audio_encoding.get_encoder(location.file_type)
+    if project.clip_bundles.parse_clip_ref(location.file_path) is not None:
+        return await _serve_clip(location.file_path, encoder.mime_type, request_headers)
+    return _serve_stored(location.file_path, encoder.mime_type, request_headers)
+
+
+async def serve_stored_audio_file(
+    name: str, expires: int, signature: str, request_headers: Mapping[str, str]
+) -> Response:
+    """
+    Sends a stored audio file by the signed URL handed out in `file_url` by
+    `POST /tts/synthesize`. Needs no database access.
+
+    Args:
+        name (str): The storage name, such as `ab/cd/abcd....mp3`.
+        expires (int): Unix time the URL is valid until.
+        signature (str): The URL's signature from `audio_storage.url_signature`.
+        request_headers (Mapping[str, str]): Headers of the incoming request.
+
+    Returns:
+        Response: The audio, a partial or not-modified response, a redirect to remote storage,
+        or a 404 error for unknown names and URLs that are not validly signed.
+    """
+    if not _STORED_NAME.match(name) or not project.audio_storage.check_url_signature(
+        project.config.AUDIO_URL_SIGNING_KEY, name, expires, signature
+    ):
+        return _not_found("Audio file not found")
+    media_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+    return _serve_stored(name, media_type, request_headers)
+
+
+async def clip_bundle_owner(bundle_id: str) -> Optional[str]:
+    """
+    Returns the user whose batch wrote a clip bundle, or None if no request has a clip in it.
+    """
+    with project.tracing.query("AudioOutput.find_first"):
+        audio_output = await prisma.models.AudioOutput.prisma().find_first(
+            where={"bundleId": bundle_id}, include={"TTSRequest": True}
+        )
+    if audio_output is None or audio_output.TTSRequest is None:
+        return None
+    return audio_output.TTSRequest.userId
+
+
+async def serve_clip_bundle(
+    bundle_id: str,
+    user: project.auth.AuthenticatedUser,
+    request_headers: Mapping[str, str],
+) -> Response:
+    """
+    Sends a whole clip bundle written by batch synthesis, so all of its clips are downloaded in
+    one request. Ranges are supported, so an interrupted download can be resumed.
+
+    The file holds the encoded clips back to back followed by a binary index of their offsets,
+    lengths and SHA-256 digests, as described in `project.clip_bundles`; the `bundle_index` of
+    each batch result is its clip's position in that index.
+
+    Args:
+        bundle_id (str): The `bundle_id` of the batch synthesis response.
+        user (project.auth.AuthenticatedUser): The caller, who must own the bundle or be an
+            administrator.
+        request_headers (Mapping[str, str]): Headers of the incoming request.
+
+    Returns:
+        Response: The bundle, a partial or not-modified response, a redirect to remote
+        storage, or a 404 error for unknown bundles and those of other users.
+    """
+    if not _BUNDLE_ID.match(bundle_id):
+        return _not_found("Clip bundle not found")
+    owner = await clip_bundle_owner(bundle_id)
+    if owner is None or not project.auth.can_read(user, owner):
+        return _not_found("Clip bundle not found")
+    response = _serve_stored(
+        project.clip_bundles.bundle_name(bundle_id),
+        _BUNDLE_MEDIA_TYPE,
+        request_headers,
+    )
+    if response.status_code in (200, 206):
+        response.headers["content-disposition"] = (
+            f'attachment; filename="{bundle_id}{project.clip_bundles.BUNDLE_EXTENSION}"'
+        )
+    return response
@@ -1,28 +1,64 @@
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from typing import Optional
 
 import project.api_integration_details_service
+import project.audio_encoding
+import project.audio_retention
+import project.auth
 import project.authenticate_user_service
+import project.batch_synthesize_service
 import project.create_user_service
+import project.database
+import project.engine_pool
+import project.fragment_cache
+import project.list_tts_history_service
+import project.metrics
+import project.rate_limiting
 import project.retrieve_audio_file_service
+import project.serve_audio_file_service
+import project.stream_incremental_speech_service
+import project.stream_speech_service
+import project.synthesis_cache
+import project.synthesis_jobs
+import project.synthesis_scheduler
 import project.synthesize_speech_service
+import project.tracing
 import project.update_user_profile_service
 import project.update_voice_profile_service
-from fastapi import FastAPI
-from fastapi.encoders import jsonable_encoder
-from fastapi.responses import Response
-from prisma import Prisma
+from fastapi import (
+    Depends,
+    FastAPI,
+    HTTPException,
+    Request,
+    WebSocket,
+    WebSocketException,
+    status,
+)
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 logger = logging.getLogger(__name__)
 
-db_client = Prisma(auto_register=True)
+db_client = project.database.create_client()
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    project.auth.check_secret_key()
     await db_client.connect()
+    await project.auth.revocation_index.start()
+    await asyncio.to_thread(project.synthesis_cache.synthesis_cache.rebuild_index)
+    await asyncio.to_thread(project.fragment_cache.fragment_cache.rebuild_index)
+    await project.engine_pool.engine_pool.start()
+    await project.synthesis_jobs.job_scheduler.start()
+    await project.audio_retention.retention_task.start()
     yield
+    await project.audio_retention.retention_task.stop()
+    await project.synthesis_jobs.job_scheduler.stop()
+    await project.engine_pool.engine_pool.stop()
+    await project.auth.revocation_index.stop()
+    await project.rate_limiting.close()
     await db_client.disconnect()
 
 
@@ -32,6 +68,8 @@ app = FastAPI(
     description="The project entails building an endpoint that can accept plain text or SSML formatted input, convert this input into natural-sounding speech audio utilizing Python libraries, and allow the customization of various voice parameters such as voice type, speed, pitch, volume, and potentially other parameters like strategic pauses for enhanced clarity and emotional impact. The preferred Python package for the text-to-speech conversion process is pyttsx3 due to its offline capabilities and extensive customization features, including voice type (neutral preferred), rate (speed), and volume adjustments. Additionally, the generated audio file should be available in MP3 format, which suits the user's needs. Essential insights and requirements gathered from the interview process include the importance of customization in the text-to-speech process to create a more engaging and natural auditory experience. Libraries such as gTTS and SpeechRecognition were also identified as relevant for text-to-speech and speech-to-text conversions but were not selected due to the project's specific requirements and the need for offline functionality.",
 )
 
+app.add_middleware(project.tracing.TracingMiddleware)
+
 
 @app.post(
     "/tts/synthesize",
@@ -40,29 +78,338 @@ app = FastAPI(
 async def api_post_synthesize_speech(
     user_id: str,
     text_input: str,
-    ssml_input: Optional[str],
-    voice_type: Optional[str],
-    speed: Optional[float],
-    pitch: Optional[float],
-    volume: Optional[float],
+    ssml_input: Optional[str] = None,
+    voice_type: Optional[str] = None,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    volume: Optional[float] = None,
+    asynchronous: bool = False,
+    deadline_ms: Optional[int] = None,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
 ) -> project.synthesize_speech_service.SynthesizeSpeechResponse | Response:
     """
     Converts text input to speech audio with customized voice parameters.
+
+    A synchronous request may set `deadline_ms`; its render is then prioritized as the deadline
+    nears, and abandoned if it cannot finish in time.
     """
+    project.auth.ensure_user(user, user_id)
+    await project.rate_limiting.admit(
+        user,
+        project.rate_limiting.request_cost(
+            len(text_input or "") + len(ssml_input or "")
+        ),
+    )
+    project.synthesis_scheduler.assign(
+        user, deadline_ms=None if asynchronous else deadline_ms
+    )
     try:
-        res = project.synthesize_speech_service.synthesize_speech(
-            user_id, text_input, ssml_input, voice_type, speed, pitch, volume
+        res = await project.synthesize_speech_service.synthesize_speech(
+            user_id,
+            text_input,
+            ssml_input,
+            voice_type,
+            speed,
+            pitch,
+            volume,
+            asynchronous,
         )
         return res
     except Exception as e:
         logger.exception("Error processing request")
         res = dict()
         res["error"] = str(e)
-        return Response(
-            content=jsonable_encoder(res),
-            status_code=500,
-            media_type="application/json",
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.post(
+    "/tts/batch",
+    response_model=project.batch_synthesize_service.BatchSynthesisResponse,
+)
+async def api_post_batch_synthesize_speech(
+    request: project.batch_synthesize_service.BatchSynthesisRequest,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.batch_synthesize_service.BatchSynthesisResponse | Response:
+    """
+    Converts a batch of text inputs to speech and reports a result for each item.
+    """
+    project.auth.ensure_user(user, request.user_id)
+    await project.rate_limiting.admit(
+        user,
+        project.rate_limiting.request_cost(
+            sum(
+                len(item.text_input or "") + len(item.ssml_input or "")
+                for item in request.items
+            ),
+            requests=len(request.items),
+        ),
+    )
+    project.synthesis_scheduler.assign(user, interactive=False)
+    try:
+        res = await project.batch_synthesize_service.batch_synthesize_speech(request)
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.post("/tts/synthesize/stream")
+async def api_post_stream_speech(
+    user_id: str,
+    text_input: str,
+    ssml_input: Optional[str] = None,
+    voice_type: Optional[str] = None,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    volume: Optional[float] = None,
+    output_format: str = "wav",
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> Response:
+    """
+    Converts text input to speech and streams the audio sentence by sentence.
+    """
+    project.auth.ensure_user(user, user_id)
+    try:
+        project.audio_encoding.get_encoder(output_format)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    await project.rate_limiting.admit(
+        user,
+        project.rate_limiting.request_cost(
+            len(text_input or "") + len(ssml_input or "")
+        ),
+    )
+    project.synthesis_scheduler.assign(user)
+    try:
+        stream = await project.stream_speech_service.stream_speech(
+            user_id,
+            text_input,
+            ssml_input,
+            voice_type,
+            speed,
+            pitch,
+            volume,
+            output_format,
+        )
+        headers = {}
+        if stream.fragments is not None:
+            fragments = stream.fragments
+            headers["X-Fragment-Cache"] = (
+                f"hits={fragments.hits}, misses={fragments.misses}, "
+                f"hit-ratio={fragments.hit_ratio}, entries={fragments.cache_entries}, "
+                f"bytes={fragments.cache_size_bytes}"
+            )
+        return StreamingResponse(
+            stream.chunks, media_type=stream.media_type, headers=headers
+        )
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.websocket("/tts/synthesize/incremental")
+async def api_ws_incremental_speech(
+    websocket: WebSocket,
+    user_id: str,
+    voice_type: Optional[str] = None,
+    speed: Optional[float] = None,
+    pitch: Optional[float] = None,
+    volume: Optional[float] = None,
+    output_format: str = "wav",
+    ssml: bool = False,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.websocket_user),
+) -> None:
+    """
+    Converts text arriving a few tokens at a time to speech, sending audio back as each
+    sentence renders.
+    """
+    try:
+        project.auth.ensure_user(user, user_id)
+        await project.rate_limiting.admit(user, project.rate_limiting.request_cost(0))
+    except HTTPException as e:
+        raise WebSocketException(
+            code=status.WS_1008_POLICY_VIOLATION, reason=e.detail
+        ) from None
+    try:
+        project.audio_encoding.get_encoder(output_format)
+    except ValueError as e:
+        raise WebSocketException(
+            code=status.WS_1008_POLICY_VIOLATION, reason=str(e)
+        ) from None
+    project.synthesis_scheduler.assign(user)
+    try:
+        await project.stream_incremental_speech_service.stream_incremental_speech(
+            websocket,
+            user,
+            user_id,
+            voice_type,
+            speed,
+            pitch,
+            volume,
+            output_format,
+            ssml,
+        )
+    except Exception as e:
+        logger.exception("Error processing request")
+        await project.stream_incremental_speech_service.close_with_error(
+            websocket, status.WS_1011_INTERNAL_ERROR, str(e)
+        )
+
+
+@app.get(
+    "/tts/stream/stats",
+    response_model=project.stream_speech_service.StreamingStats,
+)
+async def api_get_streaming_stats(
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.stream_speech_service.StreamingStats | Response:
+    """
+    Reports first-chunk latency and stream duration percentiles for streamed synthesis.
+    """
+    try:
+        res = project.stream_speech_service.streaming_stats()
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.get(
+    "/tts/history",
+    response_model=project.list_tts_history_service.TTSHistoryResponse,
+)
+async def api_get_tts_history(
+    user_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.list_tts_history_service.TTSHistoryResponse | Response:
+    """
+    Lists a user's past TTS requests and their audio, newest first. Pass the `next_cursor` of
+    a page as `cursor` to read the next one. Administrators may list any user's history.
+    """
+    if user.user_id != user_id:
+        project.auth.ensure_admin(user)
+    try:
+        res = await project.list_tts_history_service.list_tts_history(
+            user_id, limit, cursor
         )
+        return res
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.get(
+    "/tts/incremental/stats",
+    response_model=project.stream_incremental_speech_service.IncrementalStats,
+)
+async def api_get_incremental_stats(
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.stream_incremental_speech_service.IncrementalStats | Response:
+    """
+    Reports first-audio and last-token-to-last-byte latency percentiles for incremental
+    synthesis.
+    """
+    try:
+        res = project.stream_incremental_speech_service.incremental_stats()
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.get(
+    "/tts/cache/stats",
+    response_model=project.synthesis_cache.SynthesisCacheStats,
+)
+async def api_get_synthesis_cache_stats(
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.synthesis_cache.SynthesisCacheStats | Response:
+    """
+    Reports hit, miss and size counters for the synthesis cache.
+    """
+    try:
+        res = project.synthesis_cache.synthesis_cache.stats()
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.get(
+    "/tts/fragments/stats",
+    response_model=project.fragment_cache.FragmentCacheStats,
+)
+async def api_get_fragment_cache_stats(
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.fragment_cache.FragmentCacheStats | Response:
+    """
+    Reports hit, miss and size counters for the sentence fragment cache.
+    """
+    try:
+        res = project.fragment_cache.fragment_cache.stats()
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.get(
+    "/tts/retention/stats",
+    response_model=project.audio_retention.RetentionStats,
+)
+async def api_get_retention_stats(
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.audio_retention.RetentionStats | Response:
+    """
+    Reports what the audio retention task has deleted and transcoded.
+    """
+    try:
+        res = project.audio_retention.retention_task.stats()
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.post(
+    "/tts/retention/run",
+    response_model=project.audio_retention.RetentionReport,
+)
+async def api_post_run_retention(
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.audio_retention.RetentionReport | Response:
+    """
+    Runs one audio retention pass now, without waiting for the background schedule.
+    """
+    project.auth.ensure_admin(user)
+    try:
+        res = await project.audio_retention.retention_task.run_pass()
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
 
 
 @app.post(
@@ -81,11 +428,7 @@ async def api_post_create_user(
         logger.exception("Error processing request")
         res = dict()
         res["error"] = str(e)
-        return Response(
-            content=jsonable_encoder(res),
-            status_code=500,
-            media_type="application/json",
-        )
+        return JSONResponse(content=res, status_code=500)
 
 
 @app.post(
@@ -105,18 +448,121 @@ async def api_post_authenticate_user(
         logger.exception("Error processing request")
         res = dict()
         res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.post(
+    "/users/logout",
+    response_model=project.authenticate_user_service.LogoutResponse,
+)
+async def api_post_logout_user(
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.authenticate_user_service.LogoutResponse | Response:
+    """
+    Revokes the access token used for this request.
+    """
+    try:
+        res = await project.authenticate_user_service.logout_user(user)
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.get(
+    "/auth/stats",
+    response_model=project.auth.AuthStats,
+)
+async def api_get_auth_stats(
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.auth.AuthStats | Response:
+    """
+    Returns access token verification latency and cache statistics.
+    """
+    try:
+        res = project.auth.auth_stats()
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def api_get_metrics(
+    _: None = Depends(project.auth.metrics_scraper),
+) -> Response:
+    """
+    Exposes pipeline stage histograms, queue depths, pool occupancy and cache counters in the
+    Prometheus text format.
+    """
+    try:
         return Response(
-            content=jsonable_encoder(res),
-            status_code=500,
-            media_type="application/json",
+            content=project.metrics.registry.expose(),
+            media_type=project.metrics.CONTENT_TYPE,
         )
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.post(
+    "/debug/profile/{request_id}",
+    response_model=project.tracing.ProfileArmResponse,
+)
+async def api_post_arm_profile(
+    request_id: str,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.tracing.ProfileArmResponse | Response:
+    """
+    Profiles the next request sent with this id in its `X-Request-ID` header.
+    """
+    project.auth.ensure_admin(user)
+    try:
+        res = project.tracing.request_profiles.arm(request_id)
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.get("/debug/profile/{request_id}")
+async def api_get_profile(
+    request_id: str,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> Response:
+    """
+    Downloads the sampled stacks of a profiled request, in the folded flame graph format.
+    """
+    project.auth.ensure_admin(user)
+    try:
+        folded = project.tracing.request_profiles.result(request_id)
+        if folded is None:
+            return JSONResponse(
+                content={"error": "No profile for this request"}, status_code=404
+            )
+        return Response(content=folded, media_type="text/plain")
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
 
 
 @app.get(
     "/api/integration/details",
     response_model=project.api_integration_details_service.APIIntegrationDetailsResponse,
 )
-async def api_get_api_integration_details() -> project.api_integration_details_service.APIIntegrationDetailsResponse | Response:
+async def api_get_api_integration_details(
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> project.api_integration_details_service.APIIntegrationDetailsResponse | Response:
     """
     Returns API integration capabilities and documentation links.
     """
@@ -127,11 +573,7 @@ async def api_get_api_integration_details() -> project.api_integration_details_s
         logger.exception("Error processing request")
         res = dict()
         res["error"] = str(e)
-        return Response(
-            content=jsonable_encoder(res),
-            status_code=500,
-            media_type="application/json",
-        )
+        return JSONResponse(content=res, status_code=500)
 
 
 @app.get(
@@ -140,22 +582,83 @@ async def api_get_api_integration_details() -> project.api_integration_details_s
 )
 async def api_get_retrieve_audio_file(
     id: str,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
 ) -> project.retrieve_audio_file_service.RetrieveAudioFileResponse | Response:
     """
-    Provides access to download the generated MP3 file.
+    Provides access to download the generated MP3 file. Only the requesting user and
+    administrators can see a request.
     """
     try:
-        res = await project.retrieve_audio_file_service.retrieve_audio_file(id)
+        res = await project.retrieve_audio_file_service.retrieve_audio_file(id, user)
         return res
     except Exception as e:
         logger.exception("Error processing request")
         res = dict()
         res["error"] = str(e)
-        return Response(
-            content=jsonable_encoder(res),
-            status_code=500,
-            media_type="application/json",
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.api_route("/audio/{id}/content", methods=["GET", "HEAD"])
+async def api_get_audio_file_content(
+    id: str,
+    request: Request,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> Response:
+    """
+    Serves the audio bytes of a finished request, with support for Range and conditional requests.
+    Only the requesting user and administrators can download it.
+    """
+    try:
+        res = await project.serve_audio_file_service.serve_audio_file(
+            id, user, request.headers
+        )
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.api_route("/tts/bundles/{bundle_id}", methods=["GET", "HEAD"])
+async def api_get_clip_bundle(
+    bundle_id: str,
+    request: Request,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
+) -> Response:
+    """
+    Downloads every clip of a bundled batch synthesis as one file, with support for Range and
+    conditional requests.
+    """
+    try:
+        res = await project.serve_audio_file_service.serve_clip_bundle(
+            bundle_id, user, request.headers
+        )
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
+
+
+@app.api_route("/files/{name:path}", methods=["GET", "HEAD"])
+async def api_get_stored_audio_file(
+    name: str, request: Request, expires: int = 0, signature: str = ""
+) -> Response:
+    """
+    Serves a stored audio file by the signed URL returned from synthesis.
+    """
+    try:
+        res = await project.serve_audio_file_service.serve_stored_audio_file(
+            name, expires, signature, request.headers
         )
+        return res
+    except Exception as e:
+        logger.exception("Error processing request")
+        res = dict()
+        res["error"] = str(e)
+        return JSONResponse(content=res, status_code=500)
 
 
 @app.post(
@@ -163,11 +666,17 @@ async def api_get_retrieve_audio_file(
     response_model=project.update_voice_profile_service.VoiceCustomizationResponse,
 )
 async def api_post_update_voice_profile(
-    user_id: str, voice_type: str, speed: float, pitch: float, volume: float
+    user_id: str,
+    voice_type: str,
+    speed: float,
+    pitch: float,
+    volume: float,
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
 ) -> project.update_voice_profile_service.VoiceCustomizationResponse | Response:
     """
     Saves or updates a user's voice customization preferences.
     """
+    project.auth.ensure_user(user, user_id)
     try:
         res = await project.update_voice_profile_service.update_voice_profile(
             user_id, voice_type, speed, pitch, volume
@@ -177,11 +686,7 @@ async def api_post_update_voice_profile(
         logger.exception("Error processing request")
         res = dict()
         res["error"] = str(e)
-        return Response(
-            content=jsonable_encoder(res),
-            status_code=500,
-            media_type="application/json",
-        )
+        return JSONResponse(content=res, status_code=500)
 
 
 @app.put(
@@ -194,10 +699,12 @@ async def api_put_update_user_profile(
     username: Optional[str],
     voice_profile: Optional[str],
     password: Optional[str],
+    user: project.auth.AuthenticatedUser = Depends(project.auth.authenticated_user),
 ) -> project.update_user_profile_service.UserProfileUpdateResponse | Response:
     """
     Updates user profile information.
     """
+    project.auth.ensure_user(user, id)
     try:
         res = await project.update_user_profile_service.update_user_profile(
             id, email, username, voice_profile, password
@@ -207,8 +714,4 @@ async def api_put_update_user_profile(
         logger.exception("Error processing request")
         res = dict()
         res["error"] = str(e)
-        return Response(
-            content=jsonable_encoder(res),
-            status_code=500,
-            media_type="application/json",
-        )
+        return JSONResponse(content=res, status_code=500)
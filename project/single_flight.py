@@ -0,0 +1,56 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class _Flight(Generic[T]):
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: "asyncio.Task[T]"):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[T]):
+    """
+    Shares one run of some work among the concurrent callers asking for the same key.
+
+    The work runs in a task of its own rather than in the caller that started it, so a caller
+    that is cancelled, for instance because its client disconnected, only stops waiting and the
+    others still get the result. The work itself is cancelled once every caller waiting on it
+    has been.
+    """
+
+    def __init__(self) -> None:
+        self._flights: Dict[Hashable, _Flight[T]] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    async def run(self, key: Hashable, work: Callable[[], Awaitable[T]]) -> T:
+        """
+        Returns the result of the work in flight for `key`, starting `work()` if there is none.
+
+        Raises:
+            Exception: Whatever the shared work raised, for every caller waiting on it.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight(asyncio.create_task(work()))
+            self._flights[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                # Nobody wants the result any more. Callers arriving from now on start afresh
+                # instead of joining work that is being cancelled.
+                self._forget(key, flight)
+                flight.task.cancel()
+
+    def _forget(self, key: Hashable, flight: _Flight[T]) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
@@ -0,0 +1,450 @@
+import asyncio
+import collections
+import os
+import uuid
+import wave
+from dataclasses import dataclass
+from typing import Deque, List, Optional, Tuple
+
+import project.audio_dsp
+import project.audio_encoding
+import project.audio_pcm
+import project.config
+import project.engine_pool
+import project.fragment_cache
+import project.synthesis_cache
+import project.synthesis_plan
+import project.text_normalization
+import project.tracing
+
+# Delay before retrying a render the engine pool had no room for.
+_POOL_FULL_RETRY_SECONDS = 0.5
+
+
+@dataclass
+class RenderedAudio:
+    """
+    A rendered and encoded audio file, by its storage name, and the format it was actually
+    encoded to.
+    """
+
+    name: str
+    file_type: str
+    mime_type: str
+    fragments: Optional[project.fragment_cache.FragmentCacheReport] = None
+
+
+async def render_speech(
+    text: str,
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+    wait_for_capacity: bool = False,
+    output_format: Optional[str] = None,
+    ssml: bool = False,
+) -> RenderedAudio:
+    """
+    Renders text or SSML to an encoded audio file, reusing a cached render when one exists.
+
+    The input is turned into its synthesis plan and every sentence is rendered on its own,
+    through the sentence fragment cache, so a document that shares sentences with earlier ones
+    only renders the new sentences. The fragments are joined with the plan's pauses, or
+    crossfaded where there is none, and the result is encoded on the encoder thread pool.
+
+    Args:
+        text (str): The plain text or SSML input to render.
+        voice_type (Optional[str]): Specifies the desired voice type for the output speech.
+        speed (Optional[float]): Defines the rate of speech output.
+        pitch (Optional[float]): Adjusts the pitch of the speech output.
+        volume (Optional[float]): Controls the volume of the generated speech.
+        wait_for_capacity (bool): Retry until the engine queue has room instead of failing with
+            `EnginePoolFullError`. Meant for background work that has no client waiting on it.
+        output_format (Optional[str]): Delivery format, defaulting to `TTS_OUTPUT_FORMAT`.
+        ssml (bool): Whether `text` is an SSML document.
+
+    Returns:
+        RenderedAudio: The storage name of the encoded audio file, its real format, and how
+        many of its sentences came from the fragment cache.
+
+    Raises:
+        ValueError: If `text` is SSML that is not well-formed, or there is nothing to say.
+    """
+    encoder = (
+        project.audio_encoding.get_encoder(output_format)
+        if output_format
+        else project.audio_encoding.default_encoder()
+    )
+    key = project.synthesis_cache.cache_key(
+        text, voice_type, speed, pitch, volume, encoder.format, ssml=ssml
+    )
+    usage = project.fragment_cache.FragmentUsage()
+
+    async def render(output_path: str) -> None:
+        await render_speech_file(
+            output_path,
+            text,
+            voice_type,
+            speed,
+            pitch,
+            volume,
+            wait_for_capacity=wait_for_capacity,
+            output_format=encoder.format,
+            ssml=ssml,
+            usage=usage,
+        )
+
+    name = await project.synthesis_cache.synthesis_cache.get_or_render(
+        key, encoder.extension, render
+    )
+    return RenderedAudio(
+        name=name,
+        file_type=encoder.file_type,
+        mime_type=encoder.mime_type,
+        fragments=usage.report(project.fragment_cache.fragment_cache),
+    )
+
+
+async def render_speech_file(
+    output_path: str,
+    text: str,
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+    wait_for_capacity: bool = False,
+    output_format: Optional[str] = None,
+    ssml: bool = False,
+    usage: Optional[project.fragment_cache.FragmentUsage] = None,
+) -> None:
+    """
+    Renders text or SSML to an encoded audio file at a local path, like `render_speech` but
+    without going through the synthesis cache or storage.
+
+    Args:
+        output_path (str): Where to write the encoded audio.
+        text (str): The plain text or SSML input to render.
+        voice_type (Optional[str]): Specifies the desired voice type for the output speech.
+        speed (Optional[float]): Defines the rate of speech output.
+        pitch (Optional[float]): Adjusts the pitch of the speech output.
+        volume (Optional[float]): Controls the volume of the generated speech.
+        wait_for_capacity (bool): Retry until the engine queue has room instead of failing with
+            `EnginePoolFullError`.
+        output_format (Optional[str]): Delivery format, defaulting to `TTS_OUTPUT_FORMAT`.
+        ssml (bool): Whether `text` is an SSML document.
+        usage (Optional[project.fragment_cache.FragmentUsage]): Counts the sentences served
+            from the fragment cache, if given.
+
+    Raises:
+        ValueError: If `text` is SSML that is not well-formed, or there is nothing to say.
+    """
+    encoder = (
+        project.audio_encoding.get_encoder(output_format)
+        if output_format
+        else project.audio_encoding.default_encoder()
+    )
+    with project.tracing.stage("plan"):
+        plan = (
+            project.synthesis_plan.plan_input(None, text)
+            if ssml
+            else project.synthesis_plan.plan_input(text, None)
+        )
+    segments = project.synthesis_plan.segments(plan)
+    if not segments:
+        raise ValueError("No text to synthesize")
+    wav_path = f"{output_path}.render"
+    renderer = FragmentRenderer(
+        segments,
+        voice_type,
+        speed,
+        pitch,
+        volume,
+        lookahead=project.config.TTS_SEGMENT_CONCURRENCY,
+        wait_for_capacity=wait_for_capacity,
+        usage=usage,
+    )
+    try:
+        await _write_plan(plan, renderer, wav_path)
+        await project.audio_encoding.encode_file(encoder, wav_path, output_path)
+    finally:
+        await renderer.close()
+        if os.path.exists(wav_path):
+            os.remove(wav_path)
+
+
+def fragment_key(
+    segment: project.synthesis_plan.SpeechSegment,
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+) -> Tuple[str, str]:
+    """
+    Returns the normalized sentence of a plan segment and its fragment cache key.
+
+    When voice parameters are applied by post-processing, the key is that of the segment's
+    base render, which every speed, pitch and volume shares.
+    """
+    with project.tracing.stage("normalize"):
+        sentence = project.text_normalization.normalize_sentence(segment.text)
+    if project.audio_dsp.enabled():
+        key = project.fragment_cache.fragment_key(
+            sentence,
+            segment.prosody.voice or voice_type,
+            project.config.TTS_DSP_BASE_RATE,
+            None,
+            None,
+            project.synthesis_plan.DEFAULT_PROSODY,
+            base=True,
+        )
+        return sentence, key
+    key = project.fragment_cache.fragment_key(
+        sentence,
+        segment.prosody.voice or voice_type,
+        speed,
+        pitch,
+        volume,
+        segment.prosody,
+    )
+    return sentence, key
+
+
+async def render_fragment(
+    segment: project.synthesis_plan.SpeechSegment,
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+    wait_for_capacity: bool = False,
+    usage: Optional[project.fragment_cache.FragmentUsage] = None,
+) -> project.fragment_cache.Fragment:
+    """
+    Renders one plan segment to prepared PCM, or takes it from the fragment cache.
+
+    The segment is normalized before it reaches the engine, and its render is trimmed of
+    leading and trailing silence and faded at the edges so it can be joined to others. When
+    voice parameters are applied by post-processing, the engine renders the segment at the
+    base rate only, and the returned fragment carries the changes to apply as it is joined.
+
+    Args:
+        segment (project.synthesis_plan.SpeechSegment): The sentence and its prosody.
+        voice_type (Optional[str]): Voice for segments whose prosody does not choose one.
+        speed (Optional[float]): Defines the rate of speech output.
+        pitch (Optional[float]): Adjusts the pitch of the speech output.
+        volume (Optional[float]): Controls the volume of the generated speech.
+        wait_for_capacity (bool): Retry until the engine queue has room.
+        usage (Optional[project.fragment_cache.FragmentUsage]): Per-request cache counters.
+
+    Returns:
+        project.fragment_cache.Fragment: The prepared frames. The caller must read or close it.
+    """
+    sentence, key = fragment_key(segment, voice_type, speed, pitch, volume)
+    prosody = segment.prosody
+    post_processed = project.audio_dsp.enabled()
+    output_path = os.path.join(
+        project.config.SPEECH_SCRATCH_DIR, f"{key}.{uuid.uuid4().hex}.wav"
+    )
+    if post_processed:
+        job = project.engine_pool.SynthesisJob(
+            text=sentence,
+            output_path=output_path,
+            voice_type=prosody.voice or voice_type,
+            speed=project.config.TTS_DSP_BASE_RATE,
+        )
+    else:
+        job = project.engine_pool.SynthesisJob(
+            text=sentence,
+            output_path=output_path,
+            voice_type=prosody.voice or voice_type,
+            speed=speed,
+            pitch=pitch,
+            volume=volume,
+            rate_scale=prosody.rate,
+            pitch_scale=prosody.pitch,
+            volume_scale=prosody.volume,
+        )
+
+    async def render() -> Tuple[project.audio_pcm.PcmFormat, bytes]:
+        try:
+            await _synthesize(job, wait_for_capacity)
+            return await asyncio.to_thread(_load_prepared, job.output_path)
+        finally:
+            if os.path.exists(job.output_path):
+                os.remove(job.output_path)
+
+    fragment = await project.fragment_cache.fragment_cache.get_or_render(
+        key, render, usage
+    )
+    if not post_processed:
+        return fragment
+    adjustment = project.audio_dsp.voice_adjustment(speed, pitch, volume, prosody)
+    return fragment if adjustment.is_identity else fragment.adjusted(adjustment)
+
+
+class FragmentRenderer:
+    """
+    Renders plan segments in order while keeping up to `lookahead` of them in flight.
+    """
+
+    def __init__(
+        self,
+        segments: List[project.synthesis_plan.SpeechSegment],
+        voice_type: Optional[str],
+        speed: Optional[float],
+        pitch: Optional[float],
+        volume: Optional[float],
+        lookahead: int,
+        wait_for_capacity: bool = False,
+        usage: Optional[project.fragment_cache.FragmentUsage] = None,
+    ):
+        self._segments = segments
+        self._voice = (voice_type, speed, pitch, volume)
+        self._lookahead = lookahead
+        self._wait_for_capacity = wait_for_capacity
+        self._usage = usage
+        self._scheduled = 0
+        self._tasks: Deque[asyncio.Task] = collections.deque()
+
+    def append(self, segment: project.synthesis_plan.SpeechSegment) -> None:
+        """
+        Adds a segment after the current ones, for input that is still arriving, and starts
+        rendering it if the lookahead allows.
+        """
+        self._segments.append(segment)
+        self._fill()
+
+    async def next(self) -> project.fragment_cache.Fragment:
+        """
+        Returns the next segment's fragment, which the caller must read or close.
+        """
+        self._fill()
+        return await self._tasks.popleft()
+
+    async def close(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for task in self._tasks:
+            if not task.cancelled() and task.exception() is None:
+                task.result().close()
+        self._tasks.clear()
+
+    def _fill(self) -> None:
+        while (
+            self._scheduled < len(self._segments) and len(self._tasks) < self._lookahead
+        ):
+            segment = self._segments[self._scheduled]
+            self._tasks.append(
+                asyncio.create_task(
+                    render_fragment(
+                        segment,
+                        *self._voice,
+                        wait_for_capacity=self._wait_for_capacity,
+                        usage=self._usage,
+                    )
+                )
+            )
+            self._scheduled += 1
+
+
+def join_fragment(
+    joiner: project.audio_pcm.PcmJoiner, fragment: project.fragment_cache.Fragment
+) -> bytes:
+    """
+    Reads a fragment into a joiner, applying its voice changes block by block, and returns the
+    frames that are final so far.
+    """
+    with fragment.open() as frames:
+        if fragment.adjustment is None:
+            return joiner.add(frames)
+        parts: List[bytes] = []
+        with project.tracing.stage("pcm_dsp"):
+            for block in project.audio_dsp.adjust(
+                fragment.pcm_format, frames, fragment.adjustment
+            ):
+                parts.append(joiner.extend(block) if parts else joiner.add(block))
+        return b"".join(parts) if parts else joiner.add(b"")
+
+
+async def _synthesize(
+    job: project.engine_pool.SynthesisJob, wait_for_capacity: bool
+) -> None:
+    while True:
+        try:
+            await project.engine_pool.engine_pool.synthesize(job)
+            return
+        except project.engine_pool.EnginePoolFullError:
+            if not wait_for_capacity:
+                raise
+            await asyncio.sleep(_POOL_FULL_RETRY_SECONDS)
+
+
+def _load_prepared(path: str) -> Tuple[project.audio_pcm.PcmFormat, bytes]:
+    with project.tracing.stage("pcm_prepare"):
+        pcm_format, frames = project.audio_pcm.read_wav(path)
+        if project.audio_dsp.enabled():
+            return pcm_format, project.audio_dsp.prepare_chunk(pcm_format, frames)
+        return pcm_format, project.audio_pcm.prepare_chunk(pcm_format, frames)
+
+
+async def _write_plan(
+    plan: project.synthesis_plan.SynthesisPlan,
+    renderer: FragmentRenderer,
+    output_path: str,
+) -> None:
+    # Fragments are consumed in order as they complete, so at most `lookahead` of them are
+    # open at once however long the document is. Pauses are generated as silent frames.
+    wav = None
+    joiner = None
+    pause_ms = 0
+    try:
+        for item in plan:
+            if isinstance(item, project.synthesis_plan.Silence):
+                pause_ms += item.ms
+                continue
+            fragment = await renderer.next()
+            if joiner is None:
+                joiner = project.audio_pcm.PcmJoiner(fragment.pcm_format)
+                wav = await asyncio.to_thread(
+                    _open_wav, output_path, fragment.pcm_format
+                )
+            elif fragment.pcm_format != joiner.pcm_format:
+                fragment.close()
+                raise ValueError("Rendered segments have inconsistent audio formats")
+            await asyncio.to_thread(_append_fragment, wav, joiner, fragment, pause_ms)
+            pause_ms = 0
+        if wav is not None:
+            # A break after the last sentence still lengthens the audio.
+            if pause_ms:
+                await asyncio.to_thread(_write_pause, wav, joiner, pause_ms)
+            await asyncio.to_thread(wav.writeframes, joiner.finish())
+    finally:
+        if wav is not None:
+            wav.close()
+
+
+def _append_fragment(
+    wav: wave.Wave_write,
+    joiner: project.audio_pcm.PcmJoiner,
+    fragment: project.fragment_cache.Fragment,
+    pause_ms: int,
+) -> None:
+    with project.tracing.stage("pcm_join"):
+        if pause_ms:
+            _write_pause(wav, joiner, pause_ms)
+        wav.writeframes(join_fragment(joiner, fragment))
+
+
+def _write_pause(
+    wav: wave.Wave_write, joiner: project.audio_pcm.PcmJoiner, pause_ms: int
+) -> None:
+    for frames in joiner.pause(pause_ms):
+        wav.writeframes(frames)
+
+
+def _open_wav(path: str, pcm_format: project.audio_pcm.PcmFormat) -> wave.Wave_write:
+    wav = wave.open(path, "wb")
+    wav.setnchannels(pcm_format.channels)
+    wav.setsampwidth(pcm_format.sample_width)
+    wav.setframerate(pcm_format.frame_rate)
+    return wav
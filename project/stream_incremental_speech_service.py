@@ -0,0 +1,364 @@
+import asyncio
+import collections
+import time
+from typing import AsyncIterator, Deque, Optional, Union
+
+import project.audio_encoding
+import project.audio_pcm
+import project.auth
+import project.config
+import project.fragment_cache
+import project.metrics
+import project.rate_limiting
+import project.speech_rendering
+import project.synthesis_plan
+import project.voice_profiles
+from fastapi import HTTPException, WebSocket, WebSocketDisconnect, status
+from pydantic import BaseModel
+from starlette.websockets import WebSocketState
+
+
+class IncrementalStats(BaseModel):
+    """
+    Latency figures for incremental synthesis: time from the first text of a session to its
+    first audio, and from its last text to its last audio byte.
+    """
+
+    first_audio_latency: project.metrics.LatencySnapshot
+    tail_latency: project.metrics.LatencySnapshot
+
+
+first_audio_latency = project.metrics.LatencyTracker(
+    histogram=project.metrics.registry.histogram(
+        "tts_incremental_first_audio_seconds",
+        "Time from the first text of an incremental synthesis session to its first audio.",
+    )
+)
+
+tail_latency = project.metrics.LatencyTracker(
+    histogram=project.metrics.registry.histogram(
+        "tts_incremental_tail_seconds",
+        "Time from the last text of an incremental synthesis session to its last audio byte.",
+    )
+)
+
+read_paused_seconds = project.metrics.registry.counter(
+    "tts_incremental_read_paused_seconds_total",
+    "Time incremental synthesis sessions stopped reading text because audio was not read.",
+)
+
+
+def incremental_stats() -> IncrementalStats:
+    """
+    Returns latency percentiles for recent incremental synthesis sessions.
+
+    Returns:
+        IncrementalStats: First-audio and last-token-to-last-byte latency summaries.
+    """
+    return IncrementalStats(
+        first_audio_latency=first_audio_latency.snapshot(),
+        tail_latency=tail_latency.snapshot(),
+    )
+
+
+# Marks the end of the text in the queue of plan items.
+_END = None
+
+_Planner = Union[project.synthesis_plan.TextPlanner, project.synthesis_plan.SsmlPlanner]
+
+
+class _Session:
+    def __init__(
+        self,
+        websocket: WebSocket,
+        user: project.auth.AuthenticatedUser,
+        renderer: project.speech_rendering.FragmentRenderer,
+        planner: _Planner,
+    ):
+        self.websocket = websocket
+        self.user = user
+        self.renderer = renderer
+        self.planner = planner
+        self.queue: asyncio.Queue[Optional[project.synthesis_plan.PlanItem]] = (
+            asyncio.Queue(maxsize=project.config.TTS_INCREMENTAL_MAX_PENDING_SEGMENTS)
+        )
+        # Items taken from the queue, whose segments are scheduled, but not yet joined. Only
+        # as many segments as the renderer works ahead on are taken, so that the queue fills
+        # up when the client reads slowly.
+        self.pending: Deque[project.synthesis_plan.PlanItem] = collections.deque()
+        self.pending_segments = 0
+        self.ended = False
+        self.segments = 0
+        self.first_text_at: Optional[float] = None
+        self.last_text_at: Optional[float] = None
+
+    async def read(self) -> None:
+        """
+        Reads text messages until the client ends its input, planning sentences as they
+        complete. While the queue of planned items is full the socket is not read.
+        """
+        while True:
+            message = await asyncio.wait_for(
+                self.websocket.receive_json(),
+                project.config.TTS_INCREMENTAL_IDLE_TIMEOUT_SECONDS,
+            )
+            if not isinstance(message, dict):
+                raise ValueError("Messages must be JSON objects")
+            text = message.get("text") or ""
+            if not isinstance(text, str):
+                raise ValueError("text must be a string")
+            if text:
+                self.last_text_at = time.perf_counter()
+                if self.first_text_at is None:
+                    self.first_text_at = self.last_text_at
+                await self._plan(self.planner.feed(text))
+            if message.get("end"):
+                await self._plan(self.planner.close())
+                await self.queue.put(_END)
+                return
+            if message.get("flush"):
+                # Whatever was sent so far is read as complete; later text starts afresh.
+                await self._plan(self.planner.close())
+                self.planner = type(self.planner)(
+                    project.config.TTS_INCREMENTAL_MAX_BUFFER_CHARS
+                )
+
+    async def _plan(self, items: list) -> None:
+        for item in items:
+            if isinstance(item, project.synthesis_plan.SpeechSegment):
+                await project.rate_limiting.admit(
+                    self.user,
+                    project.rate_limiting.request_cost(len(item.text), requests=0),
+                )
+            if self.queue.full():
+                paused = time.perf_counter()
+                await self.queue.put(item)
+                read_paused_seconds.inc(time.perf_counter() - paused)
+            else:
+                self.queue.put_nowait(item)
+
+    async def write(self, encoder: project.audio_encoding.AudioEncoder) -> None:
+        """
+        Sends the audio of the planned sentences as they render. Each send waits until the
+        transport has room, and no more is rendered than the renderer's lookahead meanwhile.
+        """
+        first = await self._first_fragment()
+        if first is None:
+            return
+        chunks = encoder.transcode_stream(first.pcm_format, self._pcm(first))
+        sent_first = False
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                await self.websocket.send_bytes(chunk)
+                if not sent_first:
+                    sent_first = True
+                    first_audio_latency.observe(
+                        time.perf_counter() - self.first_text_at
+                    )
+        finally:
+            await chunks.aclose()
+
+    async def _first_fragment(self) -> Optional[project.fragment_cache.Fragment]:
+        while True:
+            item = await self.queue.get()
+            if item is _END:
+                self.ended = True
+                return None
+            if isinstance(item, project.synthesis_plan.SpeechSegment):
+                self.segments += 1
+                self.renderer.append(item)
+                return await self.renderer.next()
+
+    def _take_queued(self) -> None:
+        while (
+            not self.ended
+            and not self.queue.empty()
+            and self.pending_segments < project.config.TTS_STREAM_LOOKAHEAD
+        ):
+            self._accept(self.queue.get_nowait())
+
+    async def _wait_queued(self) -> None:
+        self._accept(await self.queue.get())
+        self._take_queued()
+
+    def _accept(self, item: Optional[project.synthesis_plan.PlanItem]) -> None:
+        if item is _END:
+            self.ended = True
+            return
+        if isinstance(item, project.synthesis_plan.SpeechSegment):
+            self.segments += 1
+            self.pending_segments += 1
+            self.renderer.append(item)
+        self.pending.append(item)
+
+    async def _pcm(
+        self, first: project.fragment_cache.Fragment
+    ) -> AsyncIterator[bytes]:
+        joiner = project.audio_pcm.PcmJoiner(first.pcm_format)
+        fragment: Optional[project.fragment_cache.Fragment] = first
+        pause_ms = 0
+        try:
+            while True:
+                if fragment is None:
+                    self._take_queued()
+                    if not self.pending:
+                        if self.ended:
+                            break
+                        # Nothing more to say yet: the end of the last sentence is not held
+                        # back for a crossfade the next one may never need.
+                        tail = joiner.finish()
+                        if tail:
+                            yield tail
+                        await self._wait_queued()
+                        continue
+                    item = self.pending.popleft()
+                    if isinstance(item, project.synthesis_plan.Silence):
+                        pause_ms += item.ms
+                        continue
+                    self.pending_segments -= 1
+                    fragment = await self.renderer.next()
+                    if fragment.pcm_format != joiner.pcm_format:
+                        raise ValueError(
+                            "Rendered chunks have inconsistent audio formats"
+                        )
+                if pause_ms:
+                    for frames in joiner.pause(pause_ms):
+                        yield frames
+                    pause_ms = 0
+                frames = await asyncio.to_thread(
+                    project.speech_rendering.join_fragment, joiner, fragment
+                )
+                fragment = None
+                yield frames
+            if pause_ms:
+                for frames in joiner.pause(pause_ms):
+                    yield frames
+            yield joiner.finish()
+        finally:
+            if fragment is not None:
+                fragment.close()
+
+
+async def stream_incremental_speech(
+    websocket: WebSocket,
+    user: project.auth.AuthenticatedUser,
+    user_id: str,
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+    output_format: str = "wav",
+    ssml: bool = False,
+) -> None:
+    """
+    Runs an incremental synthesis session: text arrives over a WebSocket a few tokens at a
+    time, and audio goes back as each sentence renders.
+
+    The client sends JSON messages `{"text": "..."}` with the next piece of text, optionally
+    with `"flush": true` to have the text so far read as complete, or `"end": true` after the
+    last piece. Sentence boundaries are detected as the text arrives, as in
+    `project.text_segmentation`, or at `<s>`, `<p>` and `<break>` for SSML, and completed
+    sentences are rendered right away, up to `TTS_STREAM_LOOKAHEAD` at a time, through the
+    sentence fragment cache. The audio is sent as binary messages in `output_format`, joined
+    with the plan's pauses like streamed synthesis; WAV has the lowest latency since encoders
+    hold some audio back. The session ends with a JSON message
+    `{"event": "done", ...}` reporting its latencies, or `{"event": "error", ...}`.
+
+    Backpressure runs end to end: audio is only rendered and encoded as fast as the client
+    reads it, and once `TTS_INCREMENTAL_MAX_PENDING_SEGMENTS` sentences wait for rendering
+    the server stops reading text until they drain. Every sentence is charged to the caller's
+    rate limit as it completes, and no more than `TTS_INCREMENTAL_MAX_BUFFER_CHARS` of text
+    waits for a sentence to end: plain text past it is cut into a sentence of its own, and SSML
+    closes the session. Voice parameters left out are taken from the user's voice profile.
+
+    Args:
+        websocket (WebSocket): The session's socket, not yet accepted.
+        user (project.auth.AuthenticatedUser): The caller.
+        user_id (str): The user the speech is synthesized for.
+        voice_type (Optional[str]): Specifies the desired voice type for the output speech.
+        speed (Optional[float]): Defines the rate of speech output.
+        pitch (Optional[float]): Adjusts the pitch of the speech output.
+        volume (Optional[float]): Controls the volume of the generated speech.
+        output_format (str): Format to stream: "wav", or any registered encoder such as "mp3".
+        ssml (bool): Whether the text is an SSML document.
+    """
+    encoder = project.audio_encoding.get_encoder(output_format)
+    voice_type, speed, pitch, volume = await project.voice_profiles.resolve_voice(
+        user_id, voice_type, speed, pitch, volume
+    )
+    await websocket.accept()
+    renderer = project.speech_rendering.FragmentRenderer(
+        [],
+        voice_type,
+        speed,
+        pitch,
+        volume,
+        lookahead=project.config.TTS_STREAM_LOOKAHEAD,
+    )
+    planner = (
+        project.synthesis_plan.SsmlPlanner(
+            project.config.TTS_INCREMENTAL_MAX_BUFFER_CHARS
+        )
+        if ssml
+        else project.synthesis_plan.TextPlanner(
+            project.config.TTS_INCREMENTAL_MAX_BUFFER_CHARS
+        )
+    )
+    session = _Session(websocket, user, renderer, planner)
+    error: Optional[BaseException] = None
+    try:
+        async with asyncio.TaskGroup() as tasks:
+            tasks.create_task(session.read())
+            tasks.create_task(session.write(encoder))
+    except BaseExceptionGroup as group:
+        error = group.exceptions[0]
+    finally:
+        await renderer.close()
+    if isinstance(error, WebSocketDisconnect):
+        return
+    if isinstance(error, TimeoutError):
+        await close_with_error(
+            websocket, status.WS_1008_POLICY_VIOLATION, "Session idle for too long"
+        )
+        return
+    if isinstance(error, (ValueError, HTTPException)):
+        await close_with_error(
+            websocket,
+            status.WS_1008_POLICY_VIOLATION,
+            error.detail if isinstance(error, HTTPException) else str(error),
+        )
+        return
+    if error is not None:
+        raise error
+    tail = (
+        time.perf_counter() - session.last_text_at
+        if session.last_text_at is not None
+        else 0.0
+    )
+    if session.segments:
+        tail_latency.observe(tail)
+    await websocket.send_json(
+        {
+            "event": "done",
+            "segments": session.segments,
+            "tail_latency_ms": round(tail * 1000, 1),
+        }
+    )
+    await websocket.close()
+
+
+async def close_with_error(websocket: WebSocket, code: int, error: str) -> None:
+    """
+    Reports an error to the client of a session and closes it, if it is still open.
+    """
+    if websocket.application_state != WebSocketState.CONNECTED:
+        if websocket.application_state == WebSocketState.CONNECTING:
+            await websocket.close(code=code, reason=error[:120])
+        return
+    try:
+        await websocket.send_json({"event": "error", "error": error})
+        await websocket.close(code=code, reason=error[:120])
+    except (WebSocketDisconnect, RuntimeError):
+        pass
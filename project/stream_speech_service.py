@@ -0,0 +1,194 @@
+import asyncio
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional
+
+import project.audio_encoding
+import project.audio_pcm
+import project.config
+import project.fragment_cache
+import project.metrics
+import project.speech_rendering
+import project.synthesis_plan
+import project.tracing
+import project.voice_profiles
+from pydantic import BaseModel
+
+
+class StreamingStats(BaseModel):
+    """
+    Latency figures for streamed synthesis: time until the first audio chunk is ready, and time
+    until the whole stream has been sent.
+    """
+
+    first_chunk_latency: project.metrics.LatencySnapshot
+    stream_duration: project.metrics.LatencySnapshot
+
+
+@dataclass
+class SpeechStream:
+    """
+    Encoded audio chunks for a streamed synthesis, with the media type to send them as.
+    """
+
+    media_type: str
+    chunks: AsyncIterator[bytes]
+    fragments: Optional[project.fragment_cache.FragmentCacheReport] = None
+
+
+first_chunk_latency = project.metrics.LatencyTracker(
+    histogram=project.metrics.registry.histogram(
+        "tts_stream_first_chunk_seconds",
+        "Time from a streaming request to its first audio chunk.",
+    )
+)
+
+stream_duration = project.metrics.LatencyTracker(
+    histogram=project.metrics.registry.histogram(
+        "tts_stream_duration_seconds",
+        "Time from a streaming request to its last audio chunk.",
+    )
+)
+
+
+def streaming_stats() -> StreamingStats:
+    """
+    Returns latency percentiles for recent streamed synthesis requests.
+
+    Returns:
+        StreamingStats: First-chunk latency and total stream duration summaries.
+    """
+    return StreamingStats(
+        first_chunk_latency=first_chunk_latency.snapshot(),
+        stream_duration=stream_duration.snapshot(),
+    )
+
+
+async def stream_speech(
+    user_id: str,
+    text_input: str,
+    ssml_input: Optional[str],
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+    output_format: str = "wav",
+) -> SpeechStream:
+    """
+    Converts text input to speech and streams the audio as it is rendered.
+
+    The input is turned into a synthesis plan of sentence segments and pauses, SSML markup
+    included, and the segments are rendered ahead of playback in parallel on the engine pool,
+    or taken from the sentence fragment cache. Segments are trimmed and faded at the edges; the
+    plan's pauses are inserted between them as generated silence and segments without a pause
+    between them are crossfaded, so joins neither click nor lose pauses. The joined PCM is sent
+    as WAV or transcoded on the fly to the requested format. The first chunk is rendered before
+    this function returns, so rendering errors surface before a response has started. Voice
+    parameters left out of the request are taken from the user's voice profile.
+
+    Args:
+        user_id (str): The unique identifier for the user making the request.
+        text_input (str): The plain text input to be converted into speech.
+        ssml_input (Optional[str]): The SSML formatted input, used when no plain text is given.
+        voice_type (Optional[str]): Specifies the desired voice type for the output speech.
+        speed (Optional[float]): Defines the rate of speech output.
+        pitch (Optional[float]): Adjusts the pitch of the speech output.
+        volume (Optional[float]): Controls the volume of the generated speech.
+        output_format (str): Format to stream: "wav", or any registered encoder such as "mp3".
+
+    Returns:
+        SpeechStream: The encoded audio in reading order, its media type, and how many of its
+        sentences were already in the fragment cache.
+    """
+    encoder = project.audio_encoding.get_encoder(output_format)
+    started = time.perf_counter()
+    voice_type, speed, pitch, volume = await project.voice_profiles.resolve_voice(
+        user_id, voice_type, speed, pitch, volume
+    )
+    with project.tracing.stage("plan"):
+        plan = project.synthesis_plan.plan_input(text_input, ssml_input)
+    segments = project.synthesis_plan.segments(plan)
+    if not segments:
+        raise ValueError("No text to synthesize")
+    fragments = _probe_fragments(segments, voice_type, speed, pitch, volume)
+    renderer = project.speech_rendering.FragmentRenderer(
+        segments,
+        voice_type,
+        speed,
+        pitch,
+        volume,
+        lookahead=project.config.TTS_STREAM_LOOKAHEAD,
+    )
+    try:
+        first = await renderer.next()
+    except BaseException:
+        await renderer.close()
+        raise
+    first_chunk_latency.observe(time.perf_counter() - started)
+    pcm_chunks = _stream_pcm(renderer, plan, first, started)
+    return SpeechStream(
+        media_type=encoder.mime_type,
+        chunks=encoder.transcode_stream(first.pcm_format, pcm_chunks),
+        fragments=fragments,
+    )
+
+
+def _probe_fragments(
+    segments: List[project.synthesis_plan.SpeechSegment],
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+) -> project.fragment_cache.FragmentCacheReport:
+    # A streamed response's headers go out before its sentences are rendered, so the report
+    # says which of them are cached when the stream starts.
+    cache = project.fragment_cache.fragment_cache
+    usage = project.fragment_cache.FragmentUsage()
+    for segment in segments:
+        _, key = project.speech_rendering.fragment_key(
+            segment, voice_type, speed, pitch, volume
+        )
+        if cache.contains(key):
+            usage.hits += 1
+        else:
+            usage.misses += 1
+    return usage.report(cache)
+
+
+async def _stream_pcm(
+    renderer: project.speech_rendering.FragmentRenderer,
+    plan: project.synthesis_plan.SynthesisPlan,
+    first: project.fragment_cache.Fragment,
+    started: float,
+) -> AsyncIterator[bytes]:
+    joiner = project.audio_pcm.PcmJoiner(first.pcm_format)
+    fragment: Optional[project.fragment_cache.Fragment] = first
+    pause_ms = 0
+    try:
+        for item in plan:
+            if isinstance(item, project.synthesis_plan.Silence):
+                pause_ms += item.ms
+                continue
+            if fragment is None:
+                fragment = await renderer.next()
+                if fragment.pcm_format != joiner.pcm_format:
+                    fragment.close()
+                    raise ValueError("Rendered chunks have inconsistent audio formats")
+            if pause_ms:
+                for frames in joiner.pause(pause_ms):
+                    yield frames
+                pause_ms = 0
+            frames = await asyncio.to_thread(
+                project.speech_rendering.join_fragment, joiner, fragment
+            )
+            fragment = None
+            yield frames
+        if pause_ms:
+            for frames in joiner.pause(pause_ms):
+                yield frames
+        yield joiner.finish()
+    finally:
+        if fragment is not None:
+            fragment.close()
+        await renderer.close()
+        stream_duration.observe(time.perf_counter() - started)
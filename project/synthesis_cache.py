@@ -0,0 +1,360 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import prisma.models
+import project.audio_dsp
+import project.audio_storage
+import project.config
+import project.metrics
+import project.single_flight
+import project.tracing
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+_CACHE_FILE_PATTERN = re.compile(r"^([0-9a-f]{64})\.[a-z0-9]+$")
+
+_WHITESPACE = re.compile(r"\s+")
+
+_SSML_INTER_TAG_WHITESPACE = re.compile(r">\s+<")
+
+
+class SynthesisCacheStats(BaseModel):
+    """
+    Counters describing how well the synthesis cache is serving repeated requests.
+    """
+
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size_bytes: int
+    max_bytes: int
+
+
+def normalize_input(text: str) -> str:
+    """
+    Canonicalizes text or SSML so that inputs which render identically share a cache key.
+
+    Args:
+        text (str): Plain text or an SSML document.
+
+    Returns:
+        str: The input in NFC form with runs of whitespace collapsed and whitespace between
+             SSML tags removed.
+    """
+    text = unicodedata.normalize("NFC", text)
+    text = _SSML_INTER_TAG_WHITESPACE.sub("><", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def cache_key(
+    text: str,
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+    output_format: str,
+    ssml: bool = False,
+) -> str:
+    """
+    Builds the content address for a render from its input, voice parameters and output format.
+
+    Args:
+        text (str): Plain text or SSML to be rendered.
+        voice_type (Optional[str]): Requested voice type.
+        speed (Optional[float]): Requested speech rate.
+        pitch (Optional[float]): Requested pitch.
+        volume (Optional[float]): Requested volume.
+        output_format (str): Delivery format the audio is encoded to.
+        ssml (bool): Whether `text` is an SSML document rendered through its synthesis plan.
+
+    Returns:
+        str: A hex SHA-256 digest identifying the rendered audio.
+    """
+    fields = [
+        # Layout version, raised whenever the same input starts rendering differently.
+        7,
+        project.config.TTS_DRIVER_NAME,
+        normalize_input(text),
+        voice_type or None,
+        float(speed) if speed else None,
+        float(pitch) if pitch else None,
+        float(volume) if volume else None,
+        output_format,
+    ]
+    if ssml:
+        fields.append("ssml")
+    if project.audio_dsp.enabled():
+        fields.append("dsp")
+    material = json.dumps(fields, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class SynthesisCache:
+    """
+    An LRU index of rendered audio stored under its cache key in the audio storage backend.
+
+    The index lives in memory and is rebuilt from the stored objects at startup, using their
+    last-used times as the recency order. Hits refresh that time where the backend supports it,
+    so the order survives restarts.
+
+    Renders are shared with the AudioOutput rows of the requests they were made for, so
+    eviction only deletes files no AudioOutput row refers to and that are old enough for their
+    row to have been written. Evicted files that are kept leave the cache's budget and are deleted by the retention task once their
+    requests are gone.
+    """
+
+    def __init__(
+        self,
+        storage: project.audio_storage.AudioStorage,
+        scratch_dir: str,
+        max_bytes: int,
+        release_grace_seconds: float,
+    ):
+        self.storage = storage
+        self.scratch_dir = scratch_dir
+        self.max_bytes = max_bytes
+        self.release_grace_seconds = release_grace_seconds
+        # Cache key -> (size, storage name), least recently used first.
+        self._entries: "OrderedDict[str, Tuple[int, str]]" = OrderedDict()
+        self._size_bytes = 0
+        self._in_flight: project.single_flight.SingleFlight[str] = (
+            project.single_flight.SingleFlight()
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def stats(self) -> SynthesisCacheStats:
+        return SynthesisCacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self._entries),
+            size_bytes=self._size_bytes,
+            max_bytes=self.max_bytes,
+        )
+
+    def counters(self) -> project.metrics.CacheCounters:
+        return project.metrics.CacheCounters(
+            hits=self.hits,
+            misses=self.misses,
+            entries=len(self._entries),
+            size_bytes=self._size_bytes,
+        )
+
+    def entry_size(self, name: str) -> Optional[int]:
+        """
+        Returns the size of the cached render stored as `name`, or None if the cache does not
+        hold it.
+        """
+        entry = self._entries.get(_key_of(name))
+        if entry is None or entry[1] != name:
+            return None
+        return entry[0]
+
+    def discard(self, name: str) -> bool:
+        """
+        Drops the render stored as `name` from the index without deleting it, handing it over
+        to the caller.
+
+        Returns:
+            bool: Whether the cache held it.
+        """
+        key = _key_of(name)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] != name:
+            return False
+        self._forget(key)
+        return True
+
+    def rebuild_index(self) -> None:
+        """
+        Replaces the in-memory index with the cached renders found in storage.
+
+        Leftover scratch files from an interrupted process are removed. Entries beyond the
+        budget are only dropped from the index; the retention task deletes their files once
+        nothing refers to them. This performs blocking I/O and is meant to run once at startup,
+        off the event loop.
+        """
+        shutil.rmtree(self.scratch_dir, ignore_errors=True)
+        os.makedirs(self.scratch_dir, exist_ok=True)
+        found = []
+        for stored in self.storage.list_objects():
+            match = _CACHE_FILE_PATTERN.match(stored.name.rsplit("/", 1)[-1])
+            if match:
+                found.append(
+                    (stored.last_used, match.group(1), stored.size, stored.name)
+                )
+        found.sort()
+        self._entries = OrderedDict((key, (size, name)) for _, key, size, name in found)
+        self._size_bytes = sum(size for _, _, size, _ in found)
+        self._evict()
+        logger.info(
+            "Synthesis cache index rebuilt with %d entries (%d bytes)",
+            len(self._entries),
+            self._size_bytes,
+        )
+
+    async def lookup(self, key: str) -> Optional[str]:
+        """
+        Returns the storage name of a cached render and marks it as recently used.
+
+        Args:
+            key (str): The cache key from `cache_key`.
+
+        Returns:
+            Optional[str]: The storage name, or None if the key is not cached.
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        name = entry[1]
+        with project.tracing.stage("storage_lookup"):
+            found = await asyncio.to_thread(self.storage.touch, name)
+        if not found:
+            if self._entries.get(key) == entry:
+                self._forget(key)
+            return None
+        if key in self._entries:
+            self._entries.move_to_end(key)
+        return name
+
+    async def get_or_render(
+        self, key: str, extension: str, render: Callable[[str], Awaitable[object]]
+    ) -> str:
+        """
+        Returns the cached audio for `key`, rendering it once if it is missing.
+
+        Concurrent misses for the same key share a single render, which carries on for the
+        others if the caller that started it is cancelled. The render callback writes to a
+        scratch file which is moved into storage only once it completes.
+
+        Args:
+            key (str): The cache key from `cache_key`.
+            extension (str): File extension of the encoded audio, including the dot.
+            render (Callable[[str], Awaitable[object]]): Renders audio to the given local path.
+
+        Returns:
+            str: The storage name of the audio file.
+        """
+        if not self.enabled:
+            self.misses += 1
+            stored = await self._render_into_storage(key, extension, render)
+            return stored.name
+        name = await self.lookup(key)
+        if name is not None:
+            self.hits += 1
+            return name
+        if key in self._in_flight:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return await self._in_flight.run(
+            key, lambda: self._render_and_add(key, extension, render)
+        )
+
+    async def _render_and_add(
+        self, key: str, extension: str, render: Callable[[str], Awaitable[object]]
+    ) -> str:
+        stored = await self._render_into_storage(key, extension, render)
+        await self._add(key, stored)
+        return stored.name
+
+    async def _render_into_storage(
+        self, key: str, extension: str, render: Callable[[str], Awaitable[object]]
+    ) -> project.audio_storage.StoredObject:
+        scratch_path = os.path.join(
+            self.scratch_dir, f"{key}.{uuid.uuid4().hex}{extension}"
+        )
+        try:
+            await render(scratch_path)
+            with project.tracing.stage("storage_write"):
+                return await asyncio.to_thread(
+                    self.storage.store,
+                    scratch_path,
+                    project.audio_storage.shard_name(key, extension),
+                )
+        finally:
+            if os.path.exists(scratch_path):
+                os.remove(scratch_path)
+
+    async def _add(self, key: str, stored: project.audio_storage.StoredObject) -> None:
+        if key in self._entries:
+            self._forget(key)
+        self._entries[key] = (stored.size, stored.name)
+        self._size_bytes += stored.size
+        victims = self._evict(keep=key)
+        if victims:
+            await self._release(victims)
+
+    async def _release(self, names: List[str]) -> None:
+        # Finished requests may still point at evicted renders; those files stay for them.
+        with project.tracing.query("AudioOutput.find_many"):
+            outputs = await prisma.models.AudioOutput.prisma().find_many(
+                where={"filePath": {"in": names}}
+            )
+        referenced = {output.filePath for output in outputs}
+        unreferenced = [name for name in names if name not in referenced]
+        if unreferenced:
+            await asyncio.to_thread(self._delete_settled, unreferenced)
+
+    def _delete_settled(self, names: List[str]) -> None:
+        # A fresh render may have been handed to a request that has not written its AudioOutput
+        # row yet. Those files are left to the retention task, which waits out its own grace.
+        now = time.time()
+        for name in names:
+            stored = self.storage.stat(name)
+            if stored is not None and now - stored.mtime >= self.release_grace_seconds:
+                self.storage.delete(name)
+
+    def _forget(self, key: str) -> Tuple[int, str]:
+        entry = self._entries.pop(key)
+        self._size_bytes -= entry[0]
+        return entry
+
+    def _evict(self, keep: Optional[str] = None) -> List[str]:
+        victims = []
+        while self._size_bytes > self.max_bytes and self._entries:
+            key = next(iter(self._entries))
+            if key == keep:
+                # The newest entry alone exceeds the budget; keep serving it until the next
+                # insertion pushes it out.
+                if len(self._entries) == 1:
+                    break
+                self._entries.move_to_end(key)
+                continue
+            _, name = self._forget(key)
+            victims.append(name)
+            self.evictions += 1
+        return victims
+
+
+def _key_of(name: str) -> str:
+    match = _CACHE_FILE_PATTERN.match(name.rsplit("/", 1)[-1])
+    return match.group(1) if match else ""
+
+
+synthesis_cache = SynthesisCache(
+    storage=project.audio_storage.audio_storage,
+    scratch_dir=project.config.SPEECH_SCRATCH_DIR,
+    max_bytes=project.config.TTS_CACHE_MAX_BYTES,
+    release_grace_seconds=project.config.TTS_CACHE_RELEASE_GRACE_SECONDS,
+)
+
+project.metrics.register_cache("synthesis", synthesis_cache.counters)
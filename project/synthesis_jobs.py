@@ -0,0 +1,263 @@
+import abc
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Set
+
+import prisma
+import prisma.enums
+import prisma.models
+import project.config
+import project.metrics
+import project.speech_rendering
+import project.synthesis_records
+import project.synthesis_scheduler
+import project.tracing
+
+logger = logging.getLogger(__name__)
+
+
+class JobQueueError(Exception):
+    """
+    Base error for failures to queue a synthesis job.
+    """
+
+
+class JobQueueFullError(JobQueueError):
+    """
+    Raised when the job queue backend cannot accept another job.
+    """
+
+
+@dataclass
+class QueuedSynthesis:
+    """
+    A synthesis job waiting to be rendered for an existing TTSRequest row.
+
+    Only plain values are stored so that a broker-backed queue can serialize it as-is.
+    """
+
+    request_id: str
+    text: str
+    voice_type: Optional[str] = None
+    speed: Optional[float] = None
+    pitch: Optional[float] = None
+    volume: Optional[float] = None
+    ssml: bool = False
+    user_id: str = ""
+    role: str = "USER"
+
+
+class JobQueueBackend(abc.ABC):
+    """
+    Transport between the endpoint that queues synthesis jobs and the scheduler that runs them.
+    """
+
+    @abc.abstractmethod
+    async def put(self, job: QueuedSynthesis) -> None:
+        """
+        Adds a job to the queue.
+
+        Raises:
+            JobQueueFullError: If the backend cannot take another job.
+        """
+
+    @abc.abstractmethod
+    async def get(self) -> QueuedSynthesis:
+        """
+        Waits for and removes the next job.
+        """
+
+    @abc.abstractmethod
+    def qsize(self) -> int:
+        """
+        Returns the number of jobs waiting to be picked up.
+        """
+
+
+class InMemoryJobQueueBackend(JobQueueBackend):
+    """
+    A bounded FIFO kept in the server process.
+    """
+
+    def __init__(self, maxsize: int):
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+
+    async def put(self, job: QueuedSynthesis) -> None:
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobQueueFullError(
+                "Speech synthesis job queue is full, please retry later"
+            ) from None
+
+    async def get(self) -> QueuedSynthesis:
+        return await self._queue.get()
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+
+class SynthesisJobScheduler:
+    """
+    Runs queued synthesis jobs in the background and records their progress on the TTSRequest row.
+
+    Each job moves from PENDING to RUNNING and then to DONE, with an AudioOutput row pointing at
+    the rendered file written in the same transaction, or to FAILED with the error message.
+
+    Several processes may run schedulers against the same database. Each one refreshes the
+    `heartbeatAt` of the jobs it holds every `heartbeat_seconds`, and fails PENDING and RUNNING
+    jobs whose heartbeat is older than `lease_seconds`: those were held by a process that has
+    stopped, and since voice parameters of queued jobs are not persisted they cannot be resumed.
+    """
+
+    def __init__(
+        self,
+        backend: JobQueueBackend,
+        concurrency: int,
+        heartbeat_seconds: float,
+        lease_seconds: float,
+    ):
+        self.backend = backend
+        self.concurrency = concurrency
+        self.heartbeat_seconds = heartbeat_seconds
+        self.lease_seconds = lease_seconds
+        self._tasks: List[asyncio.Task] = []
+        # Requests of jobs queued or running in this process.
+        self._held: Set[str] = set()
+
+    async def start(self) -> None:
+        """
+        Fails jobs abandoned by stopped processes and starts the consumer and heartbeat tasks.
+        """
+        if self._tasks:
+            return
+        await self._fail_abandoned()
+        self._tasks = [
+            asyncio.create_task(self._consume(), name=f"tts-job-consumer-{index}")
+            for index in range(self.concurrency)
+        ]
+        self._tasks.append(
+            asyncio.create_task(self._keep_alive(), name="tts-job-heartbeat")
+        )
+
+    async def stop(self) -> None:
+        """
+        Cancels the consumer tasks. Jobs still queued are failed on the next start.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def enqueue(self, job: QueuedSynthesis) -> None:
+        """
+        Hands a job to the queue backend.
+
+        Args:
+            job (QueuedSynthesis): The job to render for an already created TTSRequest row.
+
+        Raises:
+            JobQueueFullError: If the backend cannot take another job.
+        """
+        await self.backend.put(job)
+        self._held.add(job.request_id)
+
+    async def _keep_alive(self) -> None:
+        while True:
+            await asyncio.sleep(self.heartbeat_seconds)
+            try:
+                await self._beat()
+                await self._fail_abandoned()
+            except Exception:
+                logger.exception("Synthesis job heartbeat failed")
+
+    async def _beat(self) -> None:
+        if not self._held:
+            return
+        with project.tracing.query("TTSRequest.update_many"):
+            await prisma.models.TTSRequest.prisma().update_many(
+                where={"id": {"in": list(self._held)}},
+                data={"heartbeatAt": datetime.now(timezone.utc)},
+            )
+
+    async def _fail_abandoned(self) -> None:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.lease_seconds)
+        with project.tracing.query("TTSRequest.update_many"):
+            await prisma.models.TTSRequest.prisma().update_many(
+                where={
+                    "status": {
+                        "in": [
+                            prisma.enums.TTSRequestStatus.PENDING,
+                            prisma.enums.TTSRequestStatus.RUNNING,
+                        ]
+                    },
+                    "heartbeatAt": {"lt": cutoff},
+                },
+                data={
+                    "status": prisma.enums.TTSRequestStatus.FAILED,
+                    "errorMessage": "Interrupted by the server process running it stopping",
+                },
+            )
+
+    async def _consume(self) -> None:
+        while True:
+            job = await self.backend.get()
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(
+                    "Synthesis job %s could not be recorded", job.request_id
+                )
+            finally:
+                self._held.discard(job.request_id)
+
+    async def _run(self, job: QueuedSynthesis) -> None:
+        records = project.synthesis_records.SynthesisRecords()
+        with project.tracing.query("TTSRequest.update"):
+            await prisma.models.TTSRequest.prisma().update(
+                where={"id": job.request_id},
+                data={
+                    "status": prisma.enums.TTSRequestStatus.RUNNING,
+                    "heartbeatAt": datetime.now(timezone.utc),
+                },
+            )
+        workload = project.synthesis_scheduler.Workload(
+            user_id=job.user_id, role=job.role, interactive=False
+        )
+        try:
+            # Clients have already been told the job is pending, so wait for room in the
+            # engine queue rather than failing when interactive requests have filled it.
+            with project.synthesis_scheduler.running_as(workload):
+                rendered = await project.speech_rendering.render_speech(
+                    job.text,
+                    job.voice_type,
+                    job.speed,
+                    job.pitch,
+                    job.volume,
+                    wait_for_capacity=True,
+                    ssml=job.ssml,
+                )
+        except Exception as e:
+            logger.warning("Synthesis job %s failed: %s", job.request_id, e)
+            records.fail_request(job.request_id, str(e))
+        else:
+            records.finish_request(job.request_id, rendered)
+        await records.commit()
+
+
+job_scheduler = SynthesisJobScheduler(
+    backend=InMemoryJobQueueBackend(maxsize=project.config.TTS_JOB_QUEUE_DEPTH),
+    concurrency=project.config.TTS_JOB_CONCURRENCY,
+    heartbeat_seconds=project.config.TTS_JOB_HEARTBEAT_SECONDS,
+    lease_seconds=project.config.TTS_JOB_LEASE_SECONDS,
+)
+
+project.metrics.registry.gauge_callback(
+    "tts_job_queue_depth",
+    "Asynchronous synthesis jobs waiting to be picked up.",
+    lambda: {(): job_scheduler.backend.qsize()},
+)
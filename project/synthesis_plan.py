@@ -0,0 +1,516 @@
+import hashlib
+import re
+import xml.etree.ElementTree as ET
+from dataclasses import dataclass, replace
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import project.config
+import project.metrics
+import project.text_segmentation
+import project.ttl_cache
+
+_XML_LANG = "{http://www.w3.org/XML/1998/namespace}lang"
+
+_BREAK_STRENGTH_MS = {
+    "none": 0,
+    "x-weak": 100,
+    "weak": 200,
+    "medium": 400,
+    "strong": 700,
+    "x-strong": 1000,
+}
+
+_BREAK_TIME = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ms|s)\s*$")
+
+# Longest single `<break>`, as in common SSML engines, and the most silence one document may
+# add in all; longer pauses are shortened so markup alone cannot produce hours of audio.
+MAX_BREAK_MS = 10_000
+
+MAX_DOCUMENT_SILENCE_MS = 300_000
+
+_RATE_KEYWORDS = {
+    "x-slow": 0.5,
+    "slow": 0.75,
+    "medium": 1.0,
+    "default": 1.0,
+    "fast": 1.25,
+    "x-fast": 1.5,
+}
+
+_PITCH_KEYWORDS = {
+    "x-low": 0.7,
+    "low": 0.85,
+    "medium": 1.0,
+    "default": 1.0,
+    "high": 1.15,
+    "x-high": 1.3,
+}
+
+_VOLUME_KEYWORDS = {
+    "silent": 0.0,
+    "x-soft": 0.25,
+    "soft": 0.5,
+    "medium": 1.0,
+    "default": 1.0,
+    "loud": 1.5,
+    "x-loud": 2.0,
+}
+
+# Rate and volume multipliers for `<emphasis level="...">`.
+_EMPHASIS = {
+    "strong": (0.9, 1.25),
+    "moderate": (0.95, 1.1),
+    "none": (1.0, 1.0),
+    "reduced": (1.05, 0.8),
+}
+
+_NUMBER = r"([+-]?\d+(?:\.\d+)?)"
+
+_PERCENT = re.compile(rf"^{_NUMBER}%$")
+
+_SEMITONES = re.compile(rf"^{_NUMBER}st$")
+
+_DECIBELS = re.compile(rf"^{_NUMBER}dB$", re.IGNORECASE)
+
+_PLAIN_NUMBER = re.compile(rf"^{_NUMBER}$")
+
+# Elements whose content is metadata rather than something to speak.
+_UNSPOKEN = frozenset({"desc", "lexicon", "meta", "metadata"})
+
+
+@dataclass(frozen=True)
+class Prosody:
+    """
+    Voice settings for a segment, as multipliers of the request's own rate, pitch and volume,
+    and an optional voice replacing the requested one.
+    """
+
+    rate: float = 1.0
+    pitch: float = 1.0
+    volume: float = 1.0
+    voice: Optional[str] = None
+
+    @property
+    def is_default(self) -> bool:
+        return self == DEFAULT_PROSODY
+
+
+DEFAULT_PROSODY = Prosody()
+
+
+@dataclass(frozen=True)
+class SpeechSegment:
+    """
+    Text rendered by one engine call with the given prosody.
+    """
+
+    text: str
+    prosody: Prosody = DEFAULT_PROSODY
+
+
+@dataclass(frozen=True)
+class Silence:
+    """
+    A pause of `ms` milliseconds, generated as silent frames instead of being rendered.
+    """
+
+    ms: int
+
+
+PlanItem = Union[SpeechSegment, Silence]
+
+# A synthesis plan: speech segments and pauses in reading order. Consecutive pauses are merged
+# and the plan never ends with a pause.
+SynthesisPlan = Tuple[PlanItem, ...]
+
+# Plans of recent documents, so a repeated request does not parse its input again.
+plan_cache: project.ttl_cache.TTLCache[SynthesisPlan] = project.ttl_cache.TTLCache(
+    maxsize=project.config.SSML_PLAN_CACHE_SIZE,
+    ttl=project.config.SSML_PLAN_CACHE_TTL_SECONDS,
+)
+
+project.metrics.register_cache("synthesis_plan", plan_cache.counters)
+
+
+def _relative(value: str, keywords: Dict[str, float]) -> Optional[float]:
+    if value in keywords:
+        return keywords[value]
+    match = _PERCENT.match(value)
+    if match:
+        number = float(match.group(1))
+        # "+10%" changes the inherited value, "80%" replaces it.
+        return 1 + number / 100 if value[0] in "+-" else number / 100
+    return None
+
+
+def _rate(value: str) -> float:
+    value = value.strip()
+    scale = _relative(value, _RATE_KEYWORDS)
+    if scale is None:
+        match = _PLAIN_NUMBER.match(value)
+        scale = float(match.group(1)) if match else 1.0
+    return scale
+
+
+def _pitch(value: str) -> float:
+    value = value.strip()
+    scale = _relative(value, _PITCH_KEYWORDS)
+    if scale is None:
+        match = _SEMITONES.match(value)
+        # Hertz values cannot be mapped onto engine properties and are ignored.
+        scale = 2 ** (float(match.group(1)) / 12) if match else 1.0
+    return scale
+
+
+def _volume(value: str) -> float:
+    value = value.strip()
+    scale = _relative(value, _VOLUME_KEYWORDS)
+    if scale is None:
+        match = _DECIBELS.match(value)
+        if match:
+            return 10 ** (float(match.group(1)) / 20)
+        match = _PLAIN_NUMBER.match(value)
+        scale = float(match.group(1)) / 100 if match else 1.0
+    return scale
+
+
+def _clamp(value: float) -> float:
+    return round(min(4.0, max(0.0, value)), 3)
+
+
+def _child_prosody(prosody: Prosody, tag: str, element: ET.Element) -> Prosody:
+    if tag == "prosody":
+        return replace(
+            prosody,
+            rate=_clamp(prosody.rate * _rate(element.get("rate", ""))),
+            pitch=_clamp(prosody.pitch * _pitch(element.get("pitch", ""))),
+            volume=_clamp(prosody.volume * _volume(element.get("volume", ""))),
+        )
+    if tag == "emphasis":
+        rate, volume = _EMPHASIS.get(element.get("level", "moderate"), (1.0, 1.0))
+        return replace(
+            prosody,
+            rate=_clamp(prosody.rate * rate),
+            volume=_clamp(prosody.volume * volume),
+        )
+    if tag == "voice":
+        voice = element.get("name") or element.get("gender") or element.get(_XML_LANG)
+        if voice:
+            return replace(prosody, voice=voice)
+    return prosody
+
+
+def _break_ms(element: ET.Element) -> int:
+    match = _BREAK_TIME.match(element.get("time", ""))
+    if match:
+        value = float(match.group(1))
+        return min(MAX_BREAK_MS, int(value * 1000 if match.group(2) == "s" else value))
+    return _BREAK_STRENGTH_MS.get(element.get("strength", "medium"), 400)
+
+
+def _say_as(element: ET.Element, text: str) -> str:
+    interpret_as = element.get("interpret-as", "")
+    if interpret_as in ("characters", "spell-out", "verbatim"):
+        return " ".join(character for character in text if not character.isspace())
+    if interpret_as == "telephone":
+        return " ".join(character for character in text if character.isalnum())
+    return text
+
+
+class _Frame:
+    __slots__ = ("element", "tag", "prosody", "last_child", "capture")
+
+    def __init__(
+        self,
+        element: ET.Element,
+        tag: str,
+        prosody: Prosody,
+        capture: Optional[List[str]],
+    ):
+        self.element = element
+        self.tag = tag
+        self.prosody = prosody
+        self.last_child: Optional[ET.Element] = None
+        self.capture = capture
+
+
+class SsmlPlanner:
+    """
+    Turns an SSML document into a synthesis plan while it is being read.
+
+    Text is fed in pieces of any size, and each call returns the plan items that are complete
+    so far. Elements are discarded as soon as they have been handled, so memory stays flat
+    however long the document is.
+
+    Supported markup: `<p>` and `<s>` end with a paragraph or sentence pause, `<break>` becomes
+    silence, `<prosody>`, `<emphasis>` and `<voice>` set the prosody of the text they contain,
+    `<say-as interpret-as="characters|telephone">` spells its content out and `<sub>` is read
+    as its alias. Other elements are read as their text content.
+
+    With `max_buffer_chars` set, a document that runs on for more than that many characters
+    without completing an item is rejected, as the parser would have to hold all of it.
+    """
+
+    def __init__(self, max_buffer_chars: Optional[int] = None):
+        self.max_buffer_chars = max_buffer_chars
+        self._unplanned_chars = 0
+        self._parser = ET.XMLPullParser(events=("start", "end"))
+        self._stack: List[_Frame] = []
+        self._buffer: List[str] = []
+        self._buffer_prosody = DEFAULT_PROSODY
+        self._pending_silence = 0
+        self._silence_left = MAX_DOCUMENT_SILENCE_MS
+        # Whether a `<break>` has come since the last segment, and whether any segment has.
+        self._break_pending = False
+        self._spoken = False
+        self._items: List[PlanItem] = []
+
+    def feed(self, data: str) -> List[PlanItem]:
+        """
+        Parses the next piece of the document.
+
+        Returns:
+            List[PlanItem]: Items completed by this piece.
+
+        Raises:
+            ValueError: If the document is not well-formed XML, or runs on for longer than
+                `max_buffer_chars` without completing an item.
+        """
+        try:
+            self._parser.feed(data)
+            self._handle_events()
+        except ET.ParseError as e:
+            raise ValueError(f"Invalid SSML input: {e}") from None
+        items = self._take()
+        if items:
+            self._unplanned_chars = 0
+        else:
+            self._unplanned_chars += len(data)
+            if self.max_buffer_chars and self._unplanned_chars > self.max_buffer_chars:
+                raise ValueError(
+                    f"SSML input ran on for more than {self.max_buffer_chars} characters "
+                    "without a sentence boundary"
+                )
+        return items
+
+    def close(self) -> List[PlanItem]:
+        """
+        Finishes the document and returns the remaining items. A trailing pause is dropped
+        unless it comes from a `<break>`.
+
+        Raises:
+            ValueError: If the document is incomplete or not well-formed XML.
+        """
+        try:
+            self._parser.close()
+            self._handle_events()
+        except ET.ParseError as e:
+            raise ValueError(f"Invalid SSML input: {e}") from None
+        self._flush()
+        if self._break_pending and self._spoken:
+            self._add_silence()
+        self._pending_silence = 0
+        return self._take()
+
+    def _take(self) -> List[PlanItem]:
+        items, self._items = self._items, []
+        return items
+
+    def _handle_events(self) -> None:
+        for event, element in self._parser.read_events():
+            if event == "start":
+                self._start(element)
+            else:
+                self._end(element)
+
+    def _start(self, element: ET.Element) -> None:
+        tag = element.tag.rsplit("}", 1)[-1]
+        prosody = DEFAULT_PROSODY
+        capture = None
+        if self._stack:
+            parent = self._stack[-1]
+            self._parent_text(parent)
+            if parent.last_child is not None:
+                # Only the previous sibling's tail was still needed.
+                parent.element.remove(parent.last_child)
+                parent.last_child = None
+            prosody = _child_prosody(parent.prosody, tag, element)
+            capture = parent.capture
+        if tag in ("sub", "say-as") or tag in _UNSPOKEN:
+            capture = []
+        if tag == "p" or tag == "s":
+            self._flush()
+        elif tag == "break":
+            self._flush()
+            self._pause(_break_ms(element))
+            self._break_pending = True
+        self._stack.append(_Frame(element, tag, prosody, capture))
+
+    def _end(self, element: ET.Element) -> None:
+        frame = self._stack.pop()
+        self._parent_text(frame)
+        del element[:]
+        if self._stack:
+            self._stack[-1].last_child = element
+        if frame.tag == "sub":
+            self._text(element.get("alias", "".join(frame.capture)), frame.prosody)
+        elif frame.tag == "say-as":
+            self._text(_say_as(element, "".join(frame.capture)), frame.prosody)
+        elif frame.tag == "p":
+            self._flush()
+            self._pause(project.text_segmentation.PARAGRAPH_PAUSE_MS)
+        elif frame.tag == "s":
+            self._flush()
+            self._pause(project.text_segmentation.SENTENCE_PAUSE_MS)
+
+    def _parent_text(self, frame: _Frame) -> None:
+        # Text up to the current event: the element's own text before its first child, or the
+        # tail of the child that closed last.
+        if frame.last_child is None:
+            text = frame.element.text
+        else:
+            text = frame.last_child.tail
+        if text:
+            if frame.capture is not None:
+                frame.capture.append(text)
+            else:
+                self._text(text, frame.prosody)
+
+    def _text(self, text: str, prosody: Prosody) -> None:
+        if self._stack and self._stack[-1].capture is not None:
+            self._stack[-1].capture.append(text)
+            return
+        if prosody != self._buffer_prosody:
+            self._flush()
+            self._buffer_prosody = prosody
+        self._buffer.append(text)
+
+    def _pause(self, ms: int) -> None:
+        self._pending_silence = max(self._pending_silence, ms)
+
+    def _add_silence(self) -> None:
+        ms = min(self._pending_silence, self._silence_left)
+        self._pending_silence = 0
+        if ms:
+            self._silence_left -= ms
+            self._items.append(Silence(ms))
+
+    def _flush(self) -> None:
+        text = "".join(self._buffer)
+        self._buffer = []
+        chunks = project.text_segmentation.split_text(text)
+        for index, chunk in enumerate(chunks):
+            if self._pending_silence:
+                self._add_silence()
+            self._items.append(SpeechSegment(chunk.text, self._buffer_prosody))
+            self._break_pending = False
+            self._spoken = True
+            if index < len(chunks) - 1:
+                self._pause(chunk.pause_ms)
+
+
+class TextPlanner:
+    """
+    Turns plain text into a synthesis plan while it is being read, with the same interface as
+    `SsmlPlanner`.
+
+    Each sentence becomes a segment as soon as the boundary ending it has arrived; the pause
+    after it is returned just before the next segment, once the text between them is known.
+    """
+
+    def __init__(self, max_buffer_chars: Optional[int] = None):
+        self._splitter = project.text_segmentation.SentenceSplitter(max_buffer_chars)
+
+    def feed(self, data: str) -> List[PlanItem]:
+        """
+        Splits the next piece of the text.
+
+        Returns:
+            List[PlanItem]: Items completed by this piece.
+        """
+        return self._items(self._splitter.feed(data))
+
+    def close(self) -> List[PlanItem]:
+        """
+        Finishes the text and returns the remaining items.
+        """
+        return self._items(self._splitter.close())
+
+    def _items(
+        self, chunks: List[project.text_segmentation.TextChunk]
+    ) -> List[PlanItem]:
+        items: List[PlanItem] = []
+        for chunk in chunks:
+            if chunk.pause_ms:
+                items.append(Silence(chunk.pause_ms))
+            items.append(SpeechSegment(chunk.text))
+        return items
+
+
+def iter_ssml_plan(pieces: Iterable[str]) -> Iterator[PlanItem]:
+    """
+    Yields the plan of an SSML document arriving in pieces, as soon as each item is complete.
+
+    Raises:
+        ValueError: If the document is not well-formed XML.
+    """
+    planner = SsmlPlanner()
+    for piece in pieces:
+        yield from planner.feed(piece)
+    yield from planner.close()
+
+
+def plan_text(text: str) -> SynthesisPlan:
+    """
+    Plans plain text: one segment per sentence, with sentence and paragraph pauses between them.
+    """
+    items: List[PlanItem] = []
+    for chunk in project.text_segmentation.split_text(text):
+        if items:
+            items.append(Silence(pause_ms))
+        items.append(SpeechSegment(chunk.text))
+        pause_ms = chunk.pause_ms
+    return tuple(items)
+
+
+def plan_ssml(ssml: str) -> SynthesisPlan:
+    """
+    Plans an SSML document.
+
+    Raises:
+        ValueError: If the document is not well-formed XML.
+    """
+    return tuple(iter_ssml_plan([ssml]))
+
+
+def plan_input(text_input: Optional[str], ssml_input: Optional[str]) -> SynthesisPlan:
+    """
+    Returns the synthesis plan of a request, from the plan cache when the same document was
+    planned recently.
+
+    Args:
+        text_input (Optional[str]): Plain text input, preferred when present.
+        ssml_input (Optional[str]): SSML input, used when there is no plain text.
+
+    Returns:
+        SynthesisPlan: Segments and pauses in reading order, empty if there is nothing to say.
+
+    Raises:
+        ValueError: If the SSML input is not well-formed XML.
+    """
+    kind, document = ("text", text_input) if text_input else ("ssml", ssml_input)
+    if not document:
+        return ()
+    key = (kind, hashlib.sha256(document.encode("utf-8")).hexdigest())
+    plan = plan_cache.get(key)
+    if plan is None:
+        plan = plan_text(document) if kind == "text" else plan_ssml(document)
+        plan_cache.set(key, plan)
+    return plan
+
+
+def segments(plan: SynthesisPlan) -> List[SpeechSegment]:
+    """
+    Returns the speech segments of a plan, the parts that need the engine.
+    """
+    return [item for item in plan if isinstance(item, SpeechSegment)]
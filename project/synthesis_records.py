@@ -0,0 +1,123 @@
+from typing import Any, Dict, List, Tuple
+
+import prisma
+import prisma.enums
+import prisma.models
+import project.clip_bundles
+import project.speech_rendering
+import project.tracing
+
+# (model, action, keyword arguments) of one pending write.
+_Write = Tuple[str, str, Dict[str, Any]]
+
+
+class SynthesisRecords:
+    """
+    The TTSRequest and AudioOutput writes that recording a synthesis needs, collected while the
+    work runs and written together by `commit`.
+
+    Several writes go out as one Prisma batch, which reaches the database in a single round trip
+    and runs as one transaction, so a request is never marked DONE without its AudioOutput row
+    and a batch never records half of its items.
+    """
+
+    def __init__(self) -> None:
+        self._writes: List[_Write] = []
+
+    def __len__(self) -> int:
+        return len(self._writes)
+
+    def create_requests(self, rows: List[Dict[str, Any]]) -> None:
+        if rows:
+            self._writes.append(("TTSRequest", "create_many", {"data": rows}))
+
+    def create_outputs(self, rows: List[Dict[str, Any]]) -> None:
+        if rows:
+            self._writes.append(("AudioOutput", "create_many", {"data": rows}))
+
+    def finish_request(
+        self, request_id: str, rendered: project.speech_rendering.RenderedAudio
+    ) -> None:
+        """
+        Records the audio of a queued request and marks it DONE.
+        """
+        self._writes.append(
+            (
+                "AudioOutput",
+                "create",
+                {"data": output_row(request_id, rendered)},
+            )
+        )
+        self._writes.append(
+            (
+                "TTSRequest",
+                "update",
+                {
+                    "where": {"id": request_id},
+                    "data": {"status": prisma.enums.TTSRequestStatus.DONE},
+                },
+            )
+        )
+
+    def fail_request(self, request_id: str, message: str) -> None:
+        self._writes.append(
+            (
+                "TTSRequest",
+                "update",
+                {
+                    "where": {"id": request_id},
+                    "data": {
+                        "status": prisma.enums.TTSRequestStatus.FAILED,
+                        "errorMessage": message,
+                    },
+                },
+            )
+        )
+
+    async def commit(self) -> None:
+        """
+        Writes everything recorded so far in one transaction and starts a new record.
+        """
+        writes, self._writes = self._writes, []
+        if not writes:
+            return
+        operation = "+".join(f"{model}.{action}" for model, action, _ in writes)
+        with project.tracing.query(operation):
+            if len(writes) == 1:
+                model, action, arguments = writes[0]
+                actions = getattr(prisma.models, model).prisma()
+                await getattr(actions, action)(**arguments)
+                return
+            async with prisma.get_client().batch_() as batcher:
+                for model, action, arguments in writes:
+                    getattr(getattr(batcher, model.lower()), action)(**arguments)
+
+
+def output_row(
+    request_id: str, rendered: project.speech_rendering.RenderedAudio
+) -> Dict[str, Any]:
+    """
+    Builds the AudioOutput row recording where the audio of `request_id` was stored.
+    """
+    return {
+        "ttsRequestId": request_id,
+        "fileType": prisma.enums.AudioFileType(rendered.file_type),
+        "filePath": rendered.name,
+    }
+
+
+def bundled_output_row(
+    request_id: str, bundle_id: str, index: int, file_type: str
+) -> Dict[str, Any]:
+    """
+    Builds the AudioOutput row recording that the audio of `request_id` is clip `index` of the
+    bundle `bundle_id`.
+    """
+    return {
+        "ttsRequestId": request_id,
+        "fileType": prisma.enums.AudioFileType(file_type),
+        "filePath": project.clip_bundles.clip_ref(
+            project.clip_bundles.bundle_name(bundle_id), index
+        ),
+        "bundleId": bundle_id,
+    }
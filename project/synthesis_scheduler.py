@@ -0,0 +1,317 @@
+import asyncio
+import contextlib
+import contextvars
+import heapq
+import itertools
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import project.auth
+import project.config
+import project.metrics
+
+wait_seconds = project.metrics.registry.histogram(
+    "tts_scheduler_wait_seconds",
+    "Time engine jobs wait for a worker, by role and kind of work.",
+    labels=("role", "kind"),
+)
+
+deadline_misses = project.metrics.registry.counter(
+    "tts_scheduler_deadline_misses_total",
+    "Engine jobs dropped because their request could not finish before its deadline.",
+    labels=("role", "kind"),
+)
+
+# Number of idle flows kept before their finish tags are dropped.
+_MAX_IDLE_FLOWS = 10_000
+
+
+class SynthesisDeadlineError(Exception):
+    """
+    Raised when a render cannot finish before the deadline of its request.
+    """
+
+
+@dataclass(frozen=True)
+class Workload:
+    """
+    Who an engine job is rendered for, which decides its share of the engines.
+
+    `deadline` is a `time.monotonic()` time by which the request must be answered.
+    """
+
+    user_id: str = ""
+    role: str = "USER"
+    interactive: bool = True
+    deadline: Optional[float] = None
+
+    @property
+    def kind(self) -> str:
+        return "interactive" if self.interactive else "background"
+
+
+_DEFAULT_WORKLOAD = Workload()
+
+_current_workload: contextvars.ContextVar[Optional[Workload]] = contextvars.ContextVar(
+    "tts_workload", default=None
+)
+
+
+def current() -> Optional[Workload]:
+    """
+    Returns the workload renders of the current request are scheduled as, if one was set.
+    """
+    return _current_workload.get()
+
+
+def assign(
+    user: project.auth.AuthenticatedUser,
+    interactive: bool = True,
+    deadline_ms: Optional[int] = None,
+) -> None:
+    """
+    Schedules the renders made for the rest of the current request as the caller's.
+
+    Like the request trace, the workload is kept in a context variable, which the tasks and
+    threads the request starts inherit.
+
+    Args:
+        user (project.auth.AuthenticatedUser): The caller.
+        interactive (bool): Whether a client is waiting on the renders.
+        deadline_ms (Optional[int]): Milliseconds from now by which the audio is needed.
+    """
+    _current_workload.set(
+        Workload(
+            user_id=user.user_id,
+            role=user.role,
+            interactive=interactive,
+            deadline=(
+                time.monotonic() + deadline_ms / 1000
+                if deadline_ms is not None
+                else None
+            ),
+        )
+    )
+
+
+@contextlib.contextmanager
+def running_as(workload: Workload) -> Iterator[None]:
+    """
+    Schedules the renders made inside the block as `workload`.
+    """
+    token = _current_workload.set(workload)
+    try:
+        yield
+    finally:
+        _current_workload.reset(token)
+
+
+class CostModel:
+    """
+    Estimates the engine time of a job from the length of its text, learning the time per
+    character from measured renders.
+    """
+
+    def __init__(self, seconds_per_char: float, smoothing: float = 0.05):
+        self.seconds_per_char = seconds_per_char
+        self._smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def estimate(self, chars: int) -> float:
+        return max(1, chars) * self.seconds_per_char
+
+    def observe(self, chars: int, seconds: float) -> None:
+        with self._lock:
+            self.seconds_per_char += self._smoothing * (
+                seconds / max(1, chars) - self.seconds_per_char
+            )
+
+
+cost_model = CostModel(project.config.TTS_SCHEDULER_SECONDS_PER_CHAR)
+
+
+def check_deadline(job: Any) -> None:
+    """
+    Fails a job whose request can no longer be answered in time, before it takes an engine.
+
+    Args:
+        job (project.engine_pool.SynthesisJob): The job about to be queued or rendered.
+
+    Raises:
+        SynthesisDeadlineError: If the job's estimated render would end after its deadline.
+    """
+    workload = job.workload
+    if workload is None or workload.deadline is None:
+        return
+    if time.monotonic() + cost_model.estimate(len(job.text)) > workload.deadline:
+        deadline_misses.inc(role=workload.role, kind=workload.kind)
+        raise SynthesisDeadlineError(
+            "Speech synthesis could not finish before the requested deadline"
+        )
+
+
+class _Entry:
+    __slots__ = ("item", "start", "taken")
+
+    def __init__(self, item: Tuple[Any, Any, float], start: float):
+        self.item = item
+        self.start = start
+        self.taken = False
+
+
+class FairScheduler:
+    """
+    Orders engine jobs by weighted fair queueing, cost-based and per user.
+
+    Every user is a flow weighted by their role, and their background work a second flow whose
+    weight is scaled by `background_share`. A job's cost is the length of its text, so it is due once its flow has been
+    served that many characters divided by its weight (start-time fair queueing): short
+    interactive jobs slip in between the sentences of long ones, and a long document, whose
+    sentences are separate jobs, is interleaved with everyone else's work at sentence
+    boundaries. A job whose deadline leaves less than `urgent_slack` seconds beyond its
+    estimated render time is served first, earliest deadline first.
+
+    Items are the `(job, future, queued_at)` tuples of the engine pools, and `None` to stop a
+    worker, which is only handed out once no job is left. Not thread-safe by itself; the queues
+    below hold the lock.
+    """
+
+    def __init__(
+        self,
+        weights: Dict[str, float],
+        background_share: float,
+        urgent_slack: float,
+        costs: CostModel,
+    ):
+        self.weights = weights
+        self.background_share = background_share
+        self.urgent_slack = urgent_slack
+        self.costs = costs
+        self._order: List[Tuple[float, int, _Entry]] = []
+        self._deadlines: List[Tuple[float, int, _Entry]] = []
+        # (user id, interactive) -> finish tag of the flow's last queued job.
+        self._finish: Dict[Tuple[str, bool], float] = {}
+        self._virtual_time = 0.0
+        self._sequence = itertools.count()
+        self._jobs = 0
+        self._stops = 0
+
+    def __len__(self) -> int:
+        return self._jobs + self._stops
+
+    def weight(self, workload: Workload) -> float:
+        weight = self.weights.get(workload.role, self.weights.get("USER", 1.0))
+        if not workload.interactive:
+            weight *= self.background_share
+        return max(weight, 1e-6)
+
+    def push(self, item: Optional[Tuple[Any, Any, float]]) -> None:
+        if item is None:
+            self._stops += 1
+            return
+        workload = item[0].workload or _DEFAULT_WORKLOAD
+        flow = (workload.user_id, workload.interactive)
+        start = max(self._virtual_time, self._finish.get(flow, 0.0))
+        finish = start + max(1, len(item[0].text)) / self.weight(workload)
+        self._finish[flow] = finish
+        entry = _Entry(item, start)
+        sequence = next(self._sequence)
+        heapq.heappush(self._order, (finish, sequence, entry))
+        if workload.deadline is not None:
+            heapq.heappush(self._deadlines, (workload.deadline, sequence, entry))
+        self._jobs += 1
+
+    def pop(self) -> Optional[Tuple[Any, Any, float]]:
+        if not self._jobs:
+            self._stops -= 1
+            return None
+        entry = self._urgent() or self._next()
+        entry.taken = True
+        self._jobs -= 1
+        self._virtual_time = max(self._virtual_time, entry.start)
+        if len(self._finish) > _MAX_IDLE_FLOWS:
+            self._finish = {
+                flow: finish
+                for flow, finish in self._finish.items()
+                if finish > self._virtual_time
+            }
+        job, _, queued_at = entry.item
+        workload = job.workload or _DEFAULT_WORKLOAD
+        wait_seconds.observe(
+            time.perf_counter() - queued_at, role=workload.role, kind=workload.kind
+        )
+        return entry.item
+
+    def _urgent(self) -> Optional[_Entry]:
+        while self._deadlines and self._deadlines[0][2].taken:
+            heapq.heappop(self._deadlines)
+        if not self._deadlines:
+            return None
+        deadline, _, entry = self._deadlines[0]
+        estimate = self.costs.estimate(len(entry.item[0].text))
+        if deadline - time.monotonic() - estimate > self.urgent_slack:
+            return None
+        return heapq.heappop(self._deadlines)[2]
+
+    def _next(self) -> _Entry:
+        while self._order[0][2].taken:
+            heapq.heappop(self._order)
+        return heapq.heappop(self._order)[2]
+
+
+def create_scheduler() -> FairScheduler:
+    """
+    Builds a scheduler with the configured weights.
+    """
+    return FairScheduler(
+        weights=project.config.TTS_SCHEDULER_WEIGHTS,
+        background_share=project.config.TTS_SCHEDULER_BACKGROUND_SHARE,
+        urgent_slack=project.config.TTS_SCHEDULER_URGENT_SLACK_SECONDS,
+        costs=cost_model,
+    )
+
+
+class FairJobQueue(queue.Queue):
+    """
+    A bounded `queue.Queue`, for engine worker threads, that hands out jobs in the order of a
+    `FairScheduler`.
+    """
+
+    def __init__(self, maxsize: int, scheduler: FairScheduler):
+        self.scheduler = scheduler
+        super().__init__(maxsize)
+
+    def _init(self, maxsize: int) -> None:
+        pass
+
+    def _qsize(self) -> int:
+        return len(self.scheduler)
+
+    def _put(self, item: Any) -> None:
+        self.scheduler.push(item)
+
+    def _get(self) -> Any:
+        return self.scheduler.pop()
+
+
+class AsyncFairJobQueue(asyncio.Queue):
+    """
+    A bounded `asyncio.Queue`, for engine worker processes, that hands out jobs in the order of
+    a `FairScheduler`.
+    """
+
+    def __init__(self, maxsize: int, scheduler: FairScheduler):
+        self.scheduler = scheduler
+        super().__init__(maxsize)
+
+    def _init(self, maxsize: int) -> None:
+        self._queue = self.scheduler
+
+    def _put(self, item: Any) -> None:
+        self.scheduler.push(item)
+
+    def _get(self) -> Any:
+        return self.scheduler.pop()
@@ -1,7 +1,15 @@
-import os
 from typing import Optional
 
-import pyttsx3
+import prisma
+import prisma.enums
+import prisma.models
+import project.audio_storage
+import project.fragment_cache
+import project.speech_rendering
+import project.synthesis_jobs
+import project.synthesis_scheduler
+import project.tracing
+import project.voice_profiles
 from pydantic import BaseModel
 
 
@@ -13,9 +21,14 @@ class SynthesizeSpeechResponse(BaseModel):
     success: bool
     message: str
     audio_file_path: str
+    request_id: Optional[str] = None
+    status: Optional[str] = None
+    file_type: Optional[str] = None
+    file_url: Optional[str] = None
+    fragment_cache: Optional[project.fragment_cache.FragmentCacheReport] = None
 
 
-def synthesize_speech(
+async def synthesize_speech(
     user_id: str,
     text_input: str,
     ssml_input: Optional[str],
@@ -23,10 +36,16 @@ def synthesize_speech(
     speed: Optional[float],
     pitch: Optional[float],
     volume: Optional[float],
+    asynchronous: bool = False,
 ) -> SynthesizeSpeechResponse:
     """
     Converts text input to speech audio with customized voice parameters.
 
+    In asynchronous mode a TTSRequest row is created and the render is queued for the background
+    scheduler; the response carries the request id to poll `GET /audio/{id}` with. Voice
+    parameters left out of the request are taken from the user's voice profile. SSML input is
+    rendered through its synthesis plan, so breaks, prosody and say-as markup take effect.
+
     Args:
     user_id (str): The unique identifier for the user making the request.
     text_input (str): The plain text input to be converted into speech.
@@ -35,33 +54,92 @@ def synthesize_speech(
     speed (Optional[float]): Defines the rate of speech output.
     pitch (Optional[float]): Adjusts the pitch of the speech output.
     volume (Optional[float]): Controls the volume of the generated speech.
+    asynchronous (bool): Queue the render and return immediately instead of waiting for the audio.
 
     Returns:
     SynthesizeSpeechResponse: Response model providing details about the task result, including the path to the generated audio file.
     """
+    text = text_input if text_input else ssml_input
+    voice_type, speed, pitch, volume = await project.voice_profiles.resolve_voice(
+        user_id, voice_type, speed, pitch, volume
+    )
+    if asynchronous:
+        return await _enqueue_speech(
+            user_id, text, text_input, ssml_input, voice_type, speed, pitch, volume
+        )
     try:
-        engine = pyttsx3.init()
-        if voice_type:
-            voices = engine.getProperty("voices")
-            engine.setProperty(
-                "voice", voices[0].id if voice_type == "male" else voices[1].id
-            )
-        if speed:
-            engine.setProperty("rate", int(speed))
-        if pitch:
-            engine.setProperty("pitch", pitch)
-        if volume:
-            engine.setProperty("volume", volume)
-        file_name = f"{user_id}.mp3"
-        audio_file_path = os.path.join("speech_outputs", file_name)
-        engine.save_to_file(text_input if text_input else ssml_input, audio_file_path)
-        engine.runAndWait()
+        rendered = await project.speech_rendering.render_speech(
+            text, voice_type, speed, pitch, volume, ssml=not text_input
+        )
         return SynthesizeSpeechResponse(
             success=True,
             message="Speech synthesis succeeded",
-            audio_file_path=audio_file_path,
+            audio_file_path=rendered.name,
+            file_type=rendered.file_type,
+            file_url=project.audio_storage.audio_storage.url_for(rendered.name),
+            fragment_cache=rendered.fragments,
         )
     except Exception as e:
         return SynthesizeSpeechResponse(
             success=False, message=str(e), audio_file_path=""
         )
+
+
+async def _enqueue_speech(
+    user_id: str,
+    text: str,
+    text_input: str,
+    ssml_input: Optional[str],
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+) -> SynthesizeSpeechResponse:
+    profile = await project.voice_profiles.get_voice_profile(user_id)
+    workload = project.synthesis_scheduler.current()
+    with project.tracing.query("TTSRequest.create"):
+        tts_request = await prisma.models.TTSRequest.prisma().create(
+            data={
+                "userId": user_id,
+                "textInput": text_input or "",
+                "ssmlInput": ssml_input,
+                "voiceProfileId": profile.profile_id if profile else None,
+            }
+        )
+    try:
+        await project.synthesis_jobs.job_scheduler.enqueue(
+            project.synthesis_jobs.QueuedSynthesis(
+                request_id=tts_request.id,
+                text=text,
+                voice_type=voice_type,
+                speed=speed,
+                pitch=pitch,
+                volume=volume,
+                ssml=not text_input,
+                user_id=user_id,
+                role=workload.role if workload else "USER",
+            )
+        )
+    except project.synthesis_jobs.JobQueueError as e:
+        with project.tracing.query("TTSRequest.update"):
+            await prisma.models.TTSRequest.prisma().update(
+                where={"id": tts_request.id},
+                data={
+                    "status": prisma.enums.TTSRequestStatus.FAILED,
+                    "errorMessage": str(e),
+                },
+            )
+        return SynthesizeSpeechResponse(
+            success=False,
+            message=str(e),
+            audio_file_path="",
+            request_id=tts_request.id,
+            status="failed",
+        )
+    return SynthesizeSpeechResponse(
+        success=True,
+        message="Speech synthesis queued",
+        audio_file_path="",
+        request_id=tts_request.id,
+        status="pending",
+    )
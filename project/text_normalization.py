@@ -0,0 +1,388 @@
+import functools
+import io
+import re
+from typing import Callable, Dict, Iterable, Iterator
+
+import project.config
+import project.metrics
+import project.text_segmentation
+
+_ONES = (
+    "zero one two three four five six seven eight nine ten eleven twelve thirteen "
+    "fourteen fifteen sixteen seventeen eighteen nineteen"
+).split()
+
+_TENS = "_ _ twenty thirty forty fifty sixty seventy eighty ninety".split()
+
+_SCALES = (
+    (10**12, "trillion"),
+    (10**9, "billion"),
+    (10**6, "million"),
+    (1000, "thousand"),
+)
+
+_ORDINAL_WORDS = {
+    "one": "first",
+    "two": "second",
+    "three": "third",
+    "five": "fifth",
+    "eight": "eighth",
+    "nine": "ninth",
+    "twelve": "twelfth",
+}
+
+_MONTHS = (
+    "January February March April May June July August September October November December"
+).split()
+
+# Currency symbol: (unit, units, subunit, subunits).
+_CURRENCIES = {
+    "$": ("dollar", "dollars", "cent", "cents"),
+    "€": ("euro", "euros", "cent", "cents"),
+    "£": ("pound", "pounds", "penny", "pence"),
+    "¥": ("yen", "yen", None, None),
+}
+
+_ABBREVIATIONS = {
+    "dr": "Doctor",
+    "mr": "Mister",
+    "mrs": "Missus",
+    "ms": "Miz",
+    "prof": "Professor",
+    "st": "Saint",
+    "jr": "Junior",
+    "sr": "Senior",
+    "vs": "versus",
+    "etc": "et cetera",
+    "approx": "approximately",
+    "no": "number",
+    "e.g": "for example",
+    "i.e": "that is",
+}
+
+_URL_SYMBOLS = {
+    ".": " dot ",
+    "/": " slash ",
+    "-": " dash ",
+    "_": " underscore ",
+    "@": " at ",
+    ":": " colon ",
+    "?": " question mark ",
+    "=": " equals ",
+    "&": " and ",
+    "#": " hash ",
+    "~": " tilde ",
+    "+": " plus ",
+}
+
+_URL_PART = re.compile(r"[./\-_@:?=&#~+]|\d+|[^./\-_@:?=&#~+\d]+")
+
+_TIME = re.compile(r"(\d+):(\d+)\s?(.*)")
+
+_CLOCK = re.compile(r"(\d+)\s?(.*)")
+
+_DECIMAL = re.compile(r"^(-?)([\d,]+)(?:\.(\d+))?$")
+
+_AMPM = re.compile(r"^([ap])\.?m\.?$", re.IGNORECASE)
+
+# Rules as one alternation, most specific first, so a sentence is rewritten by a single scan;
+# the group name selects the expansion. Rules starting with a digit sit behind one shared
+# lookahead, so the scan tests them only where a digit is.
+_RULE_PATTERN = r"""
+    (?=-?\d)(?:
+        (?P<iso_date>\b\d{4}-\d{2}-\d{2}\b)
+        | (?P<us_date>\b\d{1,2}/\d{1,2}/\d{4}\b)
+        | (?P<time>\b\d{1,2}:\d{2}(?:\s?[aApP]\.?[mM]\b\.?)?)
+        | (?P<clock>\b\d{1,2}\s?[aApP]\.?[mM]\b\.?)
+        | (?P<percent>(?<![\w.,])-?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?%)
+        | (?P<ordinal>\b\d+(?:st|nd|rd|th)\b)
+        | (?P<year_range>(?<![\w.,])(?<!\d-)(?:1[1-9]\d\d|20[1-9]\d)-(?:1[1-9]\d\d|20[1-9]\d)
+            (?![\w-]|[.,]\d))
+        | (?P<phone>(?<![\w.,])(?<!\d-)(?:\d{3}-)?\d{3}-\d{4}(?![\w-]|[.,]\d))
+        | (?P<year>(?<![\w.,])(?<!\d-)(?:1[1-9]\d\d|20[1-9]\d)\b(?![.,-]\d))
+        | (?P<number>(?<![\w.,])-?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?\b(?![.,]\d))
+    )
+    | (?P<currency>[$€£¥]\s?(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d+)?\b(?![.,]\d))
+    | (?P<url>\b(?:https?://|www\.)[^\s<>"]+?(?=[.,;:!?)\]'"]*(?:\s|$)))
+    | (?P<abbreviation>\b(?:[eE]\.g|[iI]\.e|[Dd]r|Mrs?|Ms|Prof|St|Jr|Sr|vs|etc|approx)\.
+        |\bNo\.(?=\s*\d))
+    | (?P<ampersand>\s&\s)
+"""
+
+_RULES = re.compile(_RULE_PATTERN, re.VERBOSE)
+
+# An address can start at any word, which makes its rule the costliest to scan for, so it is
+# only used on sentences containing an "@".
+_RULES_WITH_EMAIL = re.compile(
+    r"(?P<email>\b[\w.+-]+@[\w-]+(?:\.[\w-]+)+\b) |" + _RULE_PATTERN, re.VERBOSE
+)
+
+
+def cardinal(number: int) -> str:
+    """
+    Spells out an integer, e.g. 1205 as "one thousand two hundred five".
+    """
+    if number < 0:
+        return "minus " + cardinal(-number)
+    if number < 20:
+        return _ONES[number]
+    if number < 100:
+        tens, ones = divmod(number, 10)
+        return _TENS[tens] + (f"-{_ONES[ones]}" if ones else "")
+    if number < 1000:
+        hundreds, rest = divmod(number, 100)
+        return f"{_ONES[hundreds]} hundred" + (f" {cardinal(rest)}" if rest else "")
+    if number >= 1000 * _SCALES[0][0]:
+        return _digits(str(number))
+    for scale, name in _SCALES:
+        if number >= scale:
+            count, rest = divmod(number, scale)
+            return f"{cardinal(count)} {name}" + (f" {cardinal(rest)}" if rest else "")
+    raise AssertionError(number)
+
+
+def ordinal(number: int) -> str:
+    """
+    Spells out an integer as an ordinal, e.g. 21 as "twenty-first".
+    """
+    words = cardinal(number)
+    head, separator, last = max(
+        words.rpartition(" "), words.rpartition("-"), key=lambda p: len(p[0])
+    )
+    if last in _ORDINAL_WORDS:
+        last = _ORDINAL_WORDS[last]
+    elif last.endswith("y"):
+        last = last[:-1] + "ieth"
+    else:
+        last += "th"
+    return head + separator + last
+
+
+def _digits(text: str) -> str:
+    return " ".join(_ONES[int(digit)] for digit in text)
+
+
+def _year(year: int) -> str:
+    if 2000 <= year < 2010 or year % 1000 == 0:
+        return cardinal(year)
+    century, rest = divmod(year, 100)
+    if rest == 0:
+        return f"{cardinal(century)} hundred"
+    if rest < 10:
+        return f"{cardinal(century)} oh {cardinal(rest)}"
+    return f"{cardinal(century)} {cardinal(rest)}"
+
+
+def _decimal(text: str) -> str:
+    match = _DECIMAL.match(text)
+    if not match:
+        return text
+    sign, whole, fraction = match.groups()
+    words = cardinal(int(whole.replace(",", "")))
+    if fraction:
+        words += " point " + _digits(fraction)
+    return ("minus " if sign else "") + words
+
+
+def _date(year: int, month: int, day: int) -> str:
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return f"{cardinal(year)} {cardinal(month)} {cardinal(day)}"
+    return f"{_MONTHS[month - 1]} {ordinal(day)}, {_year(year)}"
+
+
+def _hour_suffix(suffix: str) -> str:
+    match = _AMPM.match(suffix.strip())
+    return f" {match.group(1).lower()} m" if match else ""
+
+
+def _expand_url(token: str) -> str:
+    token = re.sub(r"^https?://", "", token)
+    words = []
+    for part in _URL_PART.findall(token):
+        if part in _URL_SYMBOLS:
+            words.append(_URL_SYMBOLS[part])
+        elif part.isdigit():
+            words.append(f" {cardinal(int(part)) if len(part) < 5 else _digits(part)} ")
+        else:
+            words.append(part)
+    return " ".join("".join(words).split())
+
+
+def _expand_iso_date(token: str) -> str:
+    year, month, day = (int(part) for part in token.split("-"))
+    return _date(year, month, day)
+
+
+def _expand_us_date(token: str) -> str:
+    month, day, year = (int(part) for part in token.split("/"))
+    return _date(year, month, day)
+
+
+def _expand_time(token: str) -> str:
+    match = _TIME.match(token)
+    hours, minutes = int(match.group(1)), int(match.group(2))
+    suffix = _hour_suffix(match.group(3))
+    if minutes == 0:
+        spoken = f"{cardinal(hours)} hundred" if hours > 12 else cardinal(hours)
+        if not suffix and hours <= 12:
+            spoken += " o'clock"
+    elif minutes < 10:
+        spoken = f"{cardinal(hours)} oh {cardinal(minutes)}"
+    else:
+        spoken = f"{cardinal(hours)} {cardinal(minutes)}"
+    return spoken + suffix
+
+
+def _expand_clock(token: str) -> str:
+    match = _CLOCK.match(token)
+    return cardinal(int(match.group(1))) + _hour_suffix(match.group(2))
+
+
+def _expand_currency(token: str) -> str:
+    unit, units, subunit, subunits = _CURRENCIES[token[0]]
+    amount = token[1:].strip().replace(",", "")
+    whole, _, fraction = amount.partition(".")
+    whole_value = int(whole)
+    spoken = f"{cardinal(whole_value)} {unit if whole_value == 1 else units}"
+    if fraction and subunit is not None and len(fraction) <= 2:
+        cents = int(fraction.ljust(2, "0"))
+        if cents:
+            spoken += f" and {cardinal(cents)} {subunit if cents == 1 else subunits}"
+    elif fraction:
+        spoken = f"{_decimal(amount)} {units}"
+    return spoken
+
+
+def _expand_percent(token: str) -> str:
+    return f"{_decimal(token[:-1])} percent"
+
+
+def _expand_ordinal(token: str) -> str:
+    return ordinal(int(token[:-2]))
+
+
+def _expand_year(token: str) -> str:
+    return _year(int(token))
+
+
+def _expand_year_range(token: str) -> str:
+    start, end = token.split("-")
+    if int(end) <= int(start):
+        # Not a span of years but a code, such as a phone number, spoken digit by digit.
+        return _expand_phone(token)
+    return f"{_year(int(start))} to {_year(int(end))}"
+
+
+def _expand_phone(token: str) -> str:
+    return ", ".join(_digits(group) for group in token.split("-"))
+
+
+def _expand_abbreviation(token: str) -> str:
+    return _ABBREVIATIONS.get(token[:-1].lower(), token)
+
+
+_EXPANSIONS: Dict[str, Callable[[str], str]] = {
+    "url": _expand_url,
+    "email": _expand_url,
+    "iso_date": _expand_iso_date,
+    "us_date": _expand_us_date,
+    "time": _expand_time,
+    "clock": _expand_clock,
+    "currency": _expand_currency,
+    "percent": _expand_percent,
+    "ordinal": _expand_ordinal,
+    "year": _expand_year,
+    "year_range": _expand_year_range,
+    "phone": _expand_phone,
+    "number": _decimal,
+    "abbreviation": _expand_abbreviation,
+    "ampersand": lambda token: " and ",
+}
+
+
+@functools.lru_cache(maxsize=project.config.TEXT_NORMALIZATION_CACHE_SIZE)
+def expand(rule: str, token: str) -> str:
+    """
+    Returns the spoken form of a token matched by one of the normalization rules.
+
+    Results are memoized, since the same numbers, dates and abbreviations recur throughout a
+    document and across requests.
+    """
+    return _EXPANSIONS[rule](token)
+
+
+def _expansion_counters() -> project.metrics.CacheCounters:
+    info = expand.cache_info()
+    return project.metrics.CacheCounters(
+        hits=info.hits, misses=info.misses, entries=info.currsize
+    )
+
+
+project.metrics.register_cache("text_normalization", _expansion_counters)
+
+
+def _replace(match: re.Match) -> str:
+    token = match.group()
+    spoken = expand(match.lastgroup, token)
+    if (
+        token.endswith(".")
+        and match.end() == len(match.string)
+        and not spoken.endswith(".")
+    ):
+        # The period also ended the sentence.
+        spoken += "."
+    return spoken
+
+
+def normalize_sentence(sentence: str) -> str:
+    """
+    Expands numbers, dates, times, currencies, percentages, abbreviations, URLs and e-mail
+    addresses in one sentence into the words a speaker would say.
+    """
+    rules = _RULES_WITH_EMAIL if "@" in sentence else _RULES
+    return rules.sub(_replace, sentence)
+
+
+def iter_normalized_chunks(
+    text: str,
+) -> Iterator[project.text_segmentation.TextChunk]:
+    """
+    Splits plain text into sentences and normalizes each of them, lazily and in one pass.
+
+    Each stage is a generator, so only the sentence being worked on is held in memory besides
+    the input itself, however large the input is.
+
+    Args:
+        text (str): Plain text of any length.
+
+    Yields:
+        project.text_segmentation.TextChunk: Normalized sentences in reading order.
+    """
+    for chunk in project.text_segmentation.iter_chunks(text):
+        chunk.text = normalize_sentence(chunk.text)
+        yield chunk
+
+
+def join_chunks(chunks: Iterable[project.text_segmentation.TextChunk]) -> str:
+    """
+    Joins sentences into one text for a single engine call, keeping paragraph breaks.
+    """
+    output = io.StringIO()
+    separator = ""
+    for chunk in chunks:
+        output.write(separator)
+        output.write(chunk.text)
+        separator = (
+            "\n\n"
+            if chunk.pause_ms >= project.text_segmentation.PARAGRAPH_PAUSE_MS
+            else " "
+        )
+    return output.getvalue()
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes plain text for the engine: sentences expanded by `normalize_sentence`, whitespace
+    collapsed, and paragraphs separated by blank lines.
+    """
+    return join_chunks(iter_normalized_chunks(text))
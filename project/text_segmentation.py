@@ -0,0 +1,239 @@
+import re
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+# Silence inserted after a chunk, by the kind of boundary that ends it.
+SENTENCE_PAUSE_MS = 250
+
+PARAGRAPH_PAUSE_MS = 600
+
+# Sentences longer than this are split again at clause or word boundaries so that the first
+# chunk of a long run-on input still renders quickly.
+MAX_CHUNK_CHARS = 400
+
+_PARAGRAPH_BOUNDARY = re.compile(r"\n\s*\n")
+
+_SENTENCE_END = re.compile(r"([.!?…]+[\"'”’)\]]*)\s+")
+
+_CLAUSE_END = re.compile(r"[,;:—]\s+")
+
+_ABBREVIATIONS = frozenset(
+    {
+        "dr",
+        "mr",
+        "mrs",
+        "ms",
+        "prof",
+        "sr",
+        "jr",
+        "st",
+        "vs",
+        "etc",
+        "e.g",
+        "i.e",
+        "no",
+        "approx",
+        "inc",
+        "ltd",
+        "co",
+    }
+)
+
+
+@dataclass
+class TextChunk:
+    """
+    A piece of input that can be rendered on its own, followed by a pause of `pause_ms`.
+    """
+
+    text: str
+    pause_ms: int
+
+
+def split_text(text: str) -> List[TextChunk]:
+    """
+    Splits plain text at paragraph (blank line) and sentence boundaries.
+    """
+    return list(iter_chunks(text))
+
+
+def iter_chunks(text: str) -> Iterator[TextChunk]:
+    """
+    Lazily splits plain text at paragraph (blank line) and sentence boundaries, in one pass
+    over the input. Chunks are collapsed to single spaces; the input is never copied whole.
+    """
+    for paragraph in _paragraphs(text):
+        yield from _paragraph_chunks(paragraph, PARAGRAPH_PAUSE_MS)
+
+
+class SentenceSplitter:
+    """
+    Splits plain text that arrives in pieces, such as the tokens of generated text, at the same
+    boundaries as `iter_chunks`.
+
+    A chunk is returned as soon as the punctuation and whitespace ending it have arrived, or,
+    for a run-on sentence, as soon as it is long enough to be cut. The pause after a chunk
+    depends on all the whitespace that follows it, which may still be arriving, so it is
+    returned with the next chunk instead: `pause_ms` of a returned chunk is the pause that
+    comes before it, 0 for the first one.
+
+    With `max_buffer_chars` set, text held back beyond that length is cut where it stands, even
+    in the middle of a word, so a sender can never make the splitter hold more than that.
+    """
+
+    def __init__(self, max_buffer_chars: Optional[int] = None):
+        self.max_buffer_chars = max_buffer_chars
+        self._buffer = ""
+        # Pause after the last returned chunk unless a paragraph boundary follows it.
+        self._pause_ms = 0
+        self._started = False
+
+    def feed(self, text: str) -> List[TextChunk]:
+        """
+        Adds the next piece of text and returns the chunks it completes.
+        """
+        self._buffer += text
+        chunks: List[TextChunk] = []
+        while True:
+            completed = self._take(final=False)
+            if not completed:
+                break
+            chunks.extend(completed)
+        if self.max_buffer_chars and len(self._buffer) > self.max_buffer_chars:
+            chunks.extend(self._take_all())
+        return chunks
+
+    def close(self) -> List[TextChunk]:
+        """
+        Returns the chunks of the text still held back, as the end of the input.
+        """
+        chunks = self._take(final=True)
+        self._buffer = ""
+        return chunks
+
+    def _take(self, final: bool) -> List[TextChunk]:
+        buffer = self._buffer
+        start = len(buffer) - len(buffer.lstrip())
+        if start == len(buffer):
+            return []
+        paragraph = _PARAGRAPH_BOUNDARY.search(buffer, start)
+        limit = paragraph.start() if paragraph else len(buffer)
+        end = None
+        for match in _SENTENCE_END.finditer(buffer, start, limit):
+            if not _ends_with_abbreviation(buffer[start : match.end(1)]):
+                end = match.end(1)
+                break
+        if end is None and paragraph:
+            end = limit
+        if end is None and final:
+            end = len(buffer)
+        if end is None:
+            return self._take_run_on(start)
+        pieces = list(_limit_length(" ".join(buffer[start:end].split())))
+        chunks = self._chunks(buffer[:start], pieces)
+        self._buffer = buffer[end:]
+        self._pause_ms = SENTENCE_PAUSE_MS
+        return chunks
+
+    def _take_run_on(self, start: int) -> List[TextChunk]:
+        # The last word may still be arriving, so only whole words are cut.
+        words_end = max(self._buffer.rfind(" "), self._buffer.rfind("\n"))
+        if words_end - start <= MAX_CHUNK_CHARS:
+            return []
+        pieces = list(_limit_length(" ".join(self._buffer[start:words_end].split())))
+        if len(pieces) < 2:
+            return []
+        chunks = self._chunks(self._buffer[:start], pieces[:-1])
+        self._buffer = pieces[-1] + self._buffer[words_end:]
+        self._pause_ms = 0
+        return chunks
+
+    def _take_all(self) -> List[TextChunk]:
+        buffer = self._buffer
+        start = len(buffer) - len(buffer.lstrip())
+        if start == len(buffer):
+            # All that matters of leading whitespace is whether it ends a paragraph.
+            if _PARAGRAPH_BOUNDARY.search(buffer):
+                self._buffer = "\n\n"
+            else:
+                self._buffer = "\n" if "\n" in buffer else " "
+            return []
+        pieces = list(_limit_length(" ".join(buffer[start:].split())))
+        chunks = self._chunks(buffer[:start], pieces)
+        self._buffer = ""
+        self._pause_ms = 0
+        return chunks
+
+    def _chunks(self, whitespace: str, pieces: List[str]) -> List[TextChunk]:
+        if not self._started:
+            pause_ms = 0
+        elif _PARAGRAPH_BOUNDARY.search(whitespace):
+            pause_ms = PARAGRAPH_PAUSE_MS
+        else:
+            pause_ms = self._pause_ms
+        self._started = True
+        return [
+            TextChunk(text=piece, pause_ms=pause_ms if index == 0 else 0)
+            for index, piece in enumerate(pieces)
+        ]
+
+
+def _paragraphs(text: str) -> Iterator[str]:
+    start = 0
+    for match in _PARAGRAPH_BOUNDARY.finditer(text):
+        yield text[start : match.start()]
+        start = match.end()
+    yield text[start:]
+
+
+def _paragraph_chunks(paragraph: str, pause_ms: int) -> Iterator[TextChunk]:
+    # Each chunk is held back until the next sentence shows whether it ends the paragraph.
+    previous: Optional[TextChunk] = None
+    for sentence in _sentences(paragraph):
+        if previous is not None:
+            previous.pause_ms = SENTENCE_PAUSE_MS
+            yield previous
+        pieces = list(_limit_length(" ".join(sentence.split())))
+        for piece in pieces[:-1]:
+            yield TextChunk(text=piece, pause_ms=0)
+        previous = TextChunk(text=pieces[-1], pause_ms=0)
+    if previous is not None:
+        previous.pause_ms = pause_ms
+        yield previous
+
+
+def _sentences(paragraph: str) -> Iterator[str]:
+    start = 0
+    for match in _SENTENCE_END.finditer(paragraph):
+        candidate = paragraph[start : match.end(1)]
+        if _ends_with_abbreviation(candidate):
+            continue
+        yield candidate
+        start = match.end()
+    rest = paragraph[start:].strip()
+    if rest:
+        yield rest
+
+
+def _ends_with_abbreviation(sentence: str) -> bool:
+    if not sentence.endswith("."):
+        return False
+    words = sentence[:-1].rsplit(None, 1)
+    if not words:
+        return False
+    word = words[-1].lower()
+    return word in _ABBREVIATIONS or len(word) == 1
+
+
+def _limit_length(sentence: str) -> Iterator[str]:
+    while len(sentence) > MAX_CHUNK_CHARS:
+        window = sentence[:MAX_CHUNK_CHARS]
+        cut = None
+        for match in _CLAUSE_END.finditer(window):
+            cut = match.end()
+        if cut is None:
+            cut = window.rfind(" ") + 1 or MAX_CHUNK_CHARS
+        yield sentence[:cut].strip()
+        sentence = sentence[cut:].strip()
+    if sentence:
+        yield sentence
@@ -0,0 +1,334 @@
+import collections
+import contextlib
+import contextvars
+import logging
+import re
+import sys
+import threading
+import time
+import uuid
+from typing import Dict, Iterator, List, Optional
+
+import project.config
+import project.metrics
+from pydantic import BaseModel
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# Request ids accepted from the `X-Request-ID` header; anything else gets a generated id.
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+
+stage_duration = project.metrics.registry.histogram(
+    "tts_stage_duration_seconds",
+    "Time spent in each stage of the synthesis pipeline.",
+    labels=("stage",),
+)
+
+query_duration = project.metrics.registry.histogram(
+    "tts_db_query_duration_seconds",
+    "Duration of Prisma queries, by model and operation.",
+    labels=("operation",),
+)
+
+request_duration = project.metrics.registry.histogram(
+    "tts_http_request_duration_seconds",
+    "Time from receiving a request to sending the end of its response.",
+    labels=("handler", "method", "status"),
+)
+
+_in_flight = 0
+
+project.metrics.registry.gauge_callback(
+    "tts_http_requests_in_flight",
+    "Requests currently being handled.",
+    lambda: {(): _in_flight},
+)
+
+
+class RequestTrace:
+    """
+    The time one request spent in each pipeline stage, reported in its `Server-Timing` header.
+
+    A stage entered several times, such as rendering each sentence of a document, accumulates
+    its durations and the number of times it ran. Stages that run concurrently each count their
+    own time, so the stages of a request can add up to more than its total.
+    """
+
+    def __init__(self, request_id: str):
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        # Stage -> [seconds, calls], in the order the stages were first entered.
+        self._stages: Dict[str, List[float]] = {}
+        # Stages can be recorded from threads the request handed work to.
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            entry = self._stages.setdefault(stage, [0.0, 0])
+            entry[0] += seconds
+            entry[1] += 1
+
+    def server_timing(self) -> str:
+        """
+        Renders the stages so far, and the time since the request started, as a
+        `Server-Timing` header value in milliseconds.
+        """
+        with self._lock:
+            stages = [
+                (stage, entry[0], entry[1]) for stage, entry in self._stages.items()
+            ]
+        metrics = []
+        for stage, seconds, calls in stages:
+            metric = f"{stage};dur={seconds * 1000:.1f}"
+            if calls > 1:
+                metric += f';desc="{calls} calls"'
+            metrics.append(metric)
+        metrics.append(f"total;dur={(time.perf_counter() - self.started) * 1000:.1f}")
+        return ", ".join(metrics)
+
+
+_current_trace: contextvars.ContextVar[Optional[RequestTrace]] = contextvars.ContextVar(
+    "tts_request_trace", default=None
+)
+
+
+def current_trace() -> Optional[RequestTrace]:
+    """
+    Returns the trace of the request being handled, or None outside of a request.
+    """
+    return _current_trace.get()
+
+
+def record(stage: str, seconds: float) -> None:
+    """
+    Adds a stage duration measured elsewhere, such as on an engine worker, to the stage
+    histogram and to the current request's trace.
+    """
+    stage_duration.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextlib.contextmanager
+def stage(name: str) -> Iterator[None]:
+    """
+    Times the enclosed block as pipeline stage `name`.
+
+    The current request is found through a context variable, which `asyncio.to_thread` and new
+    tasks inherit, so the block may run on the event loop or on a thread the request started.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+@contextlib.contextmanager
+def query(operation: str) -> Iterator[None]:
+    """
+    Times the enclosed Prisma call, exported by `operation` such as "TTSRequest.create" and
+    counted as the "db" stage of the current request.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        query_duration.observe(seconds, operation=operation)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add("db", seconds)
+
+
+class ProfileArmResponse(BaseModel):
+    """
+    Confirms that the next request with `request_id` will be profiled.
+    """
+
+    request_id: str
+    interval_ms: float
+    max_seconds: float
+
+
+class SamplingProfiler:
+    """
+    Samples the Python stacks of every thread at a fixed interval from a background thread.
+
+    All threads are sampled, including the event loop thread, which also serves other requests
+    while the profiled one runs; stacks are prefixed with their thread's name to tell the event
+    loop, engine workers and encoder threads apart. Sampling stops on `stop`, or by itself after
+    `max_seconds`.
+    """
+
+    def __init__(self, interval_seconds: float, max_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.max_seconds = max_seconds
+        self.samples = 0
+        self._stacks: "collections.Counter[str]" = collections.Counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="tts-profiler", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> str:
+        """
+        Stops sampling and returns the stacks in the folded format read by flame graph tools:
+        one line per distinct stack, frames separated by ";", followed by its sample count.
+        """
+        self._stopped.set()
+        self._thread.join()
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self._stacks.most_common()
+        )
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        deadline = time.monotonic() + self.max_seconds
+        while not self._stopped.wait(self.interval_seconds):
+            if time.monotonic() > deadline:
+                break
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                frames = []
+                while frame is not None:
+                    code = frame.f_code
+                    frames.append(
+                        f"{code.co_name} ({code.co_filename}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                frames.append(names.get(ident, str(ident)))
+                self._stacks[";".join(reversed(frames))] += 1
+            self.samples += 1
+
+
+class RequestProfiles:
+    """
+    Profiles switched on at runtime for single request ids.
+
+    An operator arms a request id; the request that arrives with it in `X-Request-ID` is then
+    sampled from start to finish and its folded stacks are kept for download. One profile runs
+    at a time, as the sampler sees every thread anyway.
+    """
+
+    def __init__(self, interval_ms: float, max_seconds: float, keep: int):
+        self.interval_ms = interval_ms
+        self.max_seconds = max_seconds
+        self.keep = keep
+        self._armed: "collections.OrderedDict[str, None]" = collections.OrderedDict()
+        self._results: "collections.OrderedDict[str, str]" = collections.OrderedDict()
+        self._running: Optional[str] = None
+
+    def arm(self, request_id: str) -> ProfileArmResponse:
+        self._armed[request_id] = None
+        while len(self._armed) > self.keep:
+            self._armed.popitem(last=False)
+        return ProfileArmResponse(
+            request_id=request_id,
+            interval_ms=self.interval_ms,
+            max_seconds=self.max_seconds,
+        )
+
+    def start(self, request_id: str) -> Optional[SamplingProfiler]:
+        """
+        Starts profiling `request_id` if it is armed and no other profile is running.
+        """
+        if request_id not in self._armed or self._running is not None:
+            return None
+        del self._armed[request_id]
+        self._running = request_id
+        profiler = SamplingProfiler(self.interval_ms / 1000, self.max_seconds)
+        profiler.start()
+        return profiler
+
+    def finish(self, request_id: str, profiler: SamplingProfiler) -> None:
+        folded = profiler.stop()
+        self._running = None
+        self._results[request_id] = folded
+        while len(self._results) > self.keep:
+            self._results.popitem(last=False)
+        logger.info("Profiled request %s with %d samples", request_id, profiler.samples)
+
+    def result(self, request_id: str) -> Optional[str]:
+        """
+        Returns the folded stacks recorded for `request_id`, or None if there are none.
+        """
+        return self._results.get(request_id)
+
+
+request_profiles = RequestProfiles(
+    interval_ms=project.config.PROFILER_INTERVAL_MS,
+    max_seconds=project.config.PROFILER_MAX_SECONDS,
+    keep=project.config.PROFILER_KEEP,
+)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware that traces every HTTP request.
+
+    Each request gets an id, taken from `X-Request-ID` when the client sends a usable one, and a
+    `RequestTrace` that the pipeline stages record into. The response carries the id back in
+    `X-Request-ID` and the stage timings in `Server-Timing`; for streamed responses the timings
+    cover the work done before the first byte. Requests whose id was armed with
+    `request_profiles` are run under the sampling profiler.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        global _in_flight
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_id = _request_id(scope)
+        trace = RequestTrace(request_id)
+        status_code = 500
+
+        async def send_traced(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("X-Request-ID", request_id)
+                headers.append("Server-Timing", trace.server_timing())
+            await send(message)
+
+        token = _current_trace.set(trace)
+        profiler = request_profiles.start(request_id)
+        _in_flight += 1
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            _in_flight -= 1
+            _current_trace.reset(token)
+            if profiler is not None:
+                request_profiles.finish(request_id, profiler)
+            # The router leaves the matched endpoint in the scope; using its name rather than
+            # the path keeps ids out of the label values.
+            endpoint = scope.get("endpoint")
+            request_duration.observe(
+                time.perf_counter() - trace.started,
+                handler=getattr(endpoint, "__name__", "unmatched"),
+                method=scope["method"],
+                status=str(status_code),
+            )
+
+
+def _request_id(scope: Scope) -> str:
+    for name, value in scope["headers"]:
+        if name == b"x-request-id":
+            candidate = value.decode("latin-1")
+            if _REQUEST_ID.match(candidate):
+                return candidate
+            break
+    return uuid.uuid4().hex
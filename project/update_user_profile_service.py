@@ -2,6 +2,9 @@ from typing import Optional
 
 import prisma
 import prisma.models
+import project.password_hashing
+import project.tracing
+import project.voice_profiles
 from pydantic import BaseModel
 
 
@@ -46,7 +49,7 @@ async def update_user_profile(
         UserProfileUpdateResponse: Contains the result of the update operation including success status and user info.
 
     This function will return a user profile update response object. It checks each argument, and if provided, it updates
-    the corresponding field in the user's profile.
+    the corresponding field in the user's profile. A new password is hashed like at registration.
     """
     update_data = {}
     if email:
@@ -54,21 +57,21 @@ async def update_user_profile(
     if username:
         update_data["username"] = username
     if password:
-        update_data["password"] = password
+        update_data["password"] = await project.password_hashing.hash_password(password)
     if voice_profile:
-        update_data["VoiceProfiles"] = {"connect": {"id": voice_profile}}
-    updated_user = await prisma.models.User.prisma().update(
-        where={"id": id}, data=update_data, include={"VoiceProfiles": True}
-    )
-    voice_profile_id = (
-        updated_user.voice_profile_id if voice_profile else None
-    )  # TODO(autogpt): Cannot access member "voice_profile_id" for type "User"
-    #     Member "voice_profile_id" is unknown. reportAttributeAccessIssue
+        update_data["VoiceProfile"] = {"connect": {"id": voice_profile}}
+    # The response only echoes the connected profile id, so no relation is read back.
+    with project.tracing.query("User.update"):
+        updated_user = await prisma.models.User.prisma().update(
+            where={"id": id}, data=update_data
+        )
+    if voice_profile:
+        project.voice_profiles.voice_profile_cache.invalidate(id)
     user_info = User(
         id=updated_user.id,
         email=updated_user.email,
         username=updated_user.username,
-        voice_profile_id=voice_profile_id,
+        voice_profile_id=voice_profile or None,
     )  # TODO(autogpt): Cannot access member "username" for type "User"
     #     Member "username" is unknown. reportAttributeAccessIssue
     return UserProfileUpdateResponse(success=True, user=user_info)
@@ -1,5 +1,7 @@
 import prisma
 import prisma.models
+import project.tracing
+import project.voice_profiles
 from pydantic import BaseModel
 
 
@@ -29,9 +31,9 @@ async def update_voice_profile(
     """
     Saves or updates a user's voice customization preferences.
 
-    The function checks if an existing voice profile for the given user ID exists.
-    If it does, it updates the voice profile with the new settings.
-    If it does not, it creates a new voice profile for the user with the provided settings.
+    The profile is written with a single upsert on the user's unique profile: an existing one is
+    updated with the new settings, otherwise one is created with them.
+    The cached profile used to resolve synthesis requests is replaced with the written row.
     Finally, it constructs and returns a response indicating the success of the operation and the updated preferences.
 
     Args:
@@ -44,29 +46,18 @@ async def update_voice_profile(
     Returns:
         VoiceCustomizationResponse: Confirms the successful update of voice customization preferences and returns the updated preferences for the user.
     """
-    existing_profile = await prisma.models.VoiceProfile.prisma().find_unique(
-        where={"userId": user_id}
-    )
-    if existing_profile:
-        updated_profile = await prisma.models.VoiceProfile.prisma().update(
-            where={"id": existing_profile.id},
-            data={
-                "voiceType": voice_type,
-                "speed": speed,
-                "pitch": pitch,
-                "volume": volume,
-            },
-        )
-    else:
-        updated_profile = await prisma.models.VoiceProfile.prisma().create(
-            data={
-                "userId": user_id,
-                "voiceType": voice_type,
-                "speed": speed,
-                "pitch": pitch,
-                "volume": volume,
-            }
+    settings = {
+        "voiceType": voice_type,
+        "speed": speed,
+        "pitch": pitch,
+        "volume": volume,
+    }
+    with project.tracing.query("VoiceProfile.upsert"):
+        updated_profile = await prisma.models.VoiceProfile.prisma().upsert(
+            where={"userId": user_id},
+            data={"create": {"userId": user_id, **settings}, "update": settings},
         )
+    project.voice_profiles.remember_voice_profile(user_id, updated_profile)
     response = VoiceCustomizationResponse(
         success=True,
         updated_preferences=VoiceProfile(
@@ -0,0 +1,83 @@
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+_GENDERS = ("female", "male", "neutral")
+
+
+def _gender(value: Any) -> Optional[str]:
+    # Drivers report genders differently, e.g. "male" (espeak) or "VoiceGenderMale" (nsss).
+    text = str(value or "").lower()
+    for gender in _GENDERS:
+        if gender in text:
+            return gender
+    return None
+
+
+def _language(value: Any) -> str:
+    # espeak reports languages as bytes prefixed with a priority byte, e.g. b"\x05en-gb".
+    if isinstance(value, bytes):
+        value = (
+            value[1:].decode(errors="ignore")
+            if value[:1] < b" "
+            else value.decode(errors="ignore")
+        )
+    return str(value).strip().lower().replace("_", "-")
+
+
+class VoiceCatalog:
+    """
+    The voices an engine offers, indexed by id, name, gender and language.
+
+    Built once when an engine starts, so requests never enumerate voices again.
+    """
+
+    def __init__(self, voices: Iterable[Any]):
+        self.voices: List[Any] = list(voices)
+        self._by_id: Dict[str, Any] = {}
+        self._by_name: Dict[str, Any] = {}
+        self._by_gender: Dict[str, List[Any]] = defaultdict(list)
+        self._by_language: Dict[str, List[Any]] = defaultdict(list)
+        for voice in self.voices:
+            self._by_id.setdefault(str(voice.id), voice)
+            if voice.name:
+                self._by_name.setdefault(str(voice.name).lower(), voice)
+            gender = _gender(getattr(voice, "gender", None))
+            if gender:
+                self._by_gender[gender].append(voice)
+            for language in getattr(voice, "languages", None) or []:
+                code = _language(language)
+                if not code:
+                    continue
+                self._by_language[code].append(voice)
+                primary = code.split("-", 1)[0]
+                if primary != code:
+                    self._by_language[primary].append(voice)
+
+    def resolve(self, voice_type: Optional[str]) -> Optional[Any]:
+        """
+        Finds the voice a request's `voice_type` asks for.
+
+        `voice_type` is matched against voice ids, then names, then genders, then language
+        tags such as `en-gb` or `en`. Values matching none of them keep the historical choice
+        of the first voice for "male" and the second voice otherwise.
+
+        Args:
+            voice_type (Optional[str]): The requested voice, or None for the engine default.
+
+        Returns:
+            Optional[Any]: The driver's voice object, or None to keep the engine default.
+        """
+        if not voice_type or not self.voices:
+            return None
+        key = voice_type.strip()
+        voice = self._by_id.get(key) or self._by_name.get(key.lower())
+        if voice is not None:
+            return voice
+        lowered = key.lower()
+        for index in (self._by_gender, self._by_language):
+            candidates = index.get(lowered.replace("_", "-"))
+            if candidates:
+                return candidates[0]
+        if lowered == "male":
+            return self.voices[0]
+        return self.voices[min(1, len(self.voices) - 1)]
@@ -0,0 +1,117 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import prisma
+import prisma.models
+import project.config
+import project.metrics
+import project.tracing
+import project.ttl_cache
+
+
+@dataclass(frozen=True)
+class VoiceSettings:
+    """
+    A user's stored voice preferences, as read from their VoiceProfile row.
+    """
+
+    profile_id: str
+    voice_type: str
+    speed: float
+    pitch: float
+    volume: float
+
+
+# Users without a profile are cached too, as None, so requests from them skip the database as
+# well. Writes through `update_voice_profile` replace the entry; the TTL bounds how long other
+# server processes can keep serving an outdated profile.
+voice_profile_cache: project.ttl_cache.TTLCache[Optional[VoiceSettings]] = (
+    project.ttl_cache.TTLCache(
+        maxsize=project.config.VOICE_PROFILE_CACHE_SIZE,
+        ttl=project.config.VOICE_PROFILE_CACHE_TTL_SECONDS,
+    )
+)
+
+project.metrics.register_cache("voice_profile", voice_profile_cache.counters)
+
+_MISSING = object()
+
+
+def remember_voice_profile(
+    user_id: str, profile: Optional[prisma.models.VoiceProfile]
+) -> Optional[VoiceSettings]:
+    """
+    Stores a freshly read or written VoiceProfile row as the cached profile of `user_id`.
+    """
+    settings = (
+        VoiceSettings(
+            profile_id=profile.id,
+            voice_type=profile.voiceType,
+            speed=profile.speed,
+            pitch=profile.pitch,
+            volume=profile.volume,
+        )
+        if profile is not None
+        else None
+    )
+    voice_profile_cache.set(user_id, settings)
+    return settings
+
+
+async def get_voice_profile(user_id: str) -> Optional[VoiceSettings]:
+    """
+    Returns the voice preferences of a user, from memory when they were read recently.
+
+    Args:
+        user_id (str): The user whose profile to read.
+
+    Returns:
+        Optional[VoiceSettings]: The stored preferences, or None if the user has none.
+    """
+    settings = voice_profile_cache.get(user_id, _MISSING)
+    if settings is not _MISSING:
+        return settings
+    with project.tracing.query("VoiceProfile.find_unique"):
+        profile = await prisma.models.VoiceProfile.prisma().find_unique(
+            where={"userId": user_id}
+        )
+    return remember_voice_profile(user_id, profile)
+
+
+def apply_voice_profile(
+    settings: Optional[VoiceSettings],
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+) -> Tuple[Optional[str], Optional[float], Optional[float], Optional[float]]:
+    """
+    Fills the voice parameters a request left out from the user's stored preferences.
+    """
+    if settings is None:
+        return voice_type, speed, pitch, volume
+    return (
+        voice_type if voice_type is not None else settings.voice_type,
+        speed if speed is not None else settings.speed,
+        pitch if pitch is not None else settings.pitch,
+        volume if volume is not None else settings.volume,
+    )
+
+
+async def resolve_voice(
+    user_id: str,
+    voice_type: Optional[str],
+    speed: Optional[float],
+    pitch: Optional[float],
+    volume: Optional[float],
+) -> Tuple[Optional[str], Optional[float], Optional[float], Optional[float]]:
+    """
+    Returns the voice parameters to render a request with: those given explicitly, and the
+    user's stored preferences for the rest. The profile is only looked up when a parameter is
+    missing, and then usually from memory.
+    """
+    if None not in (voice_type, speed, pitch, volume):
+        return voice_type, speed, pitch, volume
+    with project.tracing.stage("voice_lookup"):
+        settings = await get_voice_profile(user_id)
+    return apply_voice_profile(settings, voice_type, speed, pitch, volume)
@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+import pytest
+
+# Configuration is read at import time, so it is set before the project is imported.
+os.environ.setdefault(
+    "SPEECH_OUTPUT_DIR", os.path.join(tempfile.mkdtemp(), "speech_outputs")
+)
+os.environ.setdefault("JWT_SECRET_KEY", "test-secret-key")
+os.environ.setdefault("TTS_ENGINE_FACTORY", "benchmarks.fake_tts:FakeEngine")
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("RATE_LIMIT_BACKEND", "memory")
+
+import benchmarks.prisma_standin  # noqa: E402
+
+# The tests run against the in-memory stand-in of the Prisma client, without Postgres.
+_database = benchmarks.prisma_standin.install(
+    os.path.join(os.path.dirname(os.path.dirname(__file__)), "schema.prisma")
+)
+
+
+@pytest.fixture
+def database():
+    import project.database
+
+    project.database.create_client()
+    yield _database
+    _database.clear()
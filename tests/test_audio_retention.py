@@ -0,0 +1,149 @@
+import asyncio
+import os
+import shutil
+import tempfile
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import prisma.enums
+import prisma.models
+import project.audio_encoding
+import project.audio_retention
+import project.audio_storage
+import project.synthesis_cache
+
+Status = prisma.enums.TTSRequestStatus
+
+
+class _CopyEncoder(project.audio_encoding.AudioEncoder):
+    """
+    Stands in for a compressed format without needing ffmpeg.
+    """
+
+    format = "test-archive"
+    file_type = "MP3"
+    extension = ".mp3"
+    mime_type = "audio/mpeg"
+
+    def encode_file(self, source_path, dest_path):
+        shutil.move(source_path, dest_path)
+
+    def transcode_stream(self, pcm_format, pcm_chunks):
+        raise NotImplementedError
+
+
+project.audio_encoding.register_encoder(_CopyEncoder())
+
+
+def _task(**options) -> project.audio_retention.RetentionTask:
+    settings = dict(
+        storage=project.audio_storage.audio_storage,
+        cache=project.synthesis_cache.synthesis_cache,
+        retention_seconds=0,
+        user_quota_bytes=0,
+        interval_seconds=0,
+        batch_size=10,
+        grace_seconds=3600,
+    )
+    return project.audio_retention.RetentionTask(**{**settings, **options})
+
+
+def _store(size: int) -> str:
+    key = uuid.uuid4().hex
+    path = os.path.join(tempfile.mkdtemp(), f"{key}.wav")
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    return project.audio_storage.audio_storage.store(
+        path, project.audio_storage.shard_name(key, ".wav")
+    ).name
+
+
+async def _finished_request(
+    user_id: str, name: str, created_at: datetime
+) -> prisma.models.TTSRequest:
+    request = await prisma.models.TTSRequest.prisma().create(
+        data={
+            "userId": user_id,
+            "textInput": "Hello there.",
+            "status": Status.DONE,
+            "createdAt": created_at,
+        }
+    )
+    await prisma.models.AudioOutput.prisma().create(
+        data={
+            "ttsRequestId": request.id,
+            "fileType": prisma.enums.AudioFileType.WAV,
+            "filePath": name,
+            "createdAt": created_at,
+        }
+    )
+    return request
+
+
+def test_quota_only_reads_the_history_of_users_over_it(database, monkeypatch):
+    task = _task(user_quota_bytes=250)
+    checked = []
+    over_quota = task._over_quota
+
+    async def spy(user_id):
+        checked.append(user_id)
+        return await over_quota(user_id)
+
+    monkeypatch.setattr(task, "_over_quota", spy)
+
+    async def run():
+        start = datetime.now(timezone.utc) - timedelta(hours=1)
+        requests = {}
+        for email, count in (("over@example.com", 3), ("under@example.com", 2)):
+            user = await prisma.models.User.prisma().create(
+                data={"email": email, "password": "hash"}
+            )
+            requests[user.id] = [
+                await _finished_request(
+                    user.id, _store(100), start + timedelta(minutes=index)
+                )
+                for index in range(count)
+            ]
+        report = await task.run_pass()
+        remaining = {
+            request.id
+            for request in await prisma.models.TTSRequest.prisma().find_many()
+        }
+        return requests, report, remaining
+
+    requests, report, remaining = asyncio.run(run())
+
+    (over, oldest), (under, _) = [
+        (user_id, user_requests[0]) for user_id, user_requests in requests.items()
+    ]
+    assert checked == [over]
+    assert report.quota_requests == 1
+    assert oldest.id not in remaining
+    assert all(request.id in remaining for request in requests[under])
+
+
+def test_transcoded_wav_is_deleted_after_the_grace_period(database):
+    task = _task(cold_format=_CopyEncoder.format, cold_after_seconds=0)
+    storage = project.audio_storage.audio_storage
+
+    async def run():
+        name = _store(100)
+        request = await _finished_request(
+            "user", name, datetime.now(timezone.utc) - timedelta(days=30)
+        )
+        report = await task.run_pass()
+        output = await prisma.models.AudioOutput.prisma().find_unique(
+            where={"ttsRequestId": request.id}
+        )
+        kept = storage.stat(name) is not None
+        task.grace_seconds = 0
+        await task.run_pass()
+        return report, output, kept, storage.stat(name) is None
+
+    report, output, kept, deleted = asyncio.run(run())
+
+    assert report.transcoded_files == 1
+    assert output.fileType == prisma.enums.AudioFileType.MP3
+    assert storage.stat(output.filePath) is not None
+    assert kept
+    assert deleted
@@ -0,0 +1,28 @@
+import asyncio
+
+import prisma.models
+import project.list_tts_history_service
+
+
+def test_history_flags_only_ssml_requests_as_ssml(database):
+    async def run():
+        for data in (
+            {"textInput": "Plain text.", "ssmlInput": ""},
+            {"textInput": "Legacy plain text."},
+            {"textInput": "", "ssmlInput": "<speak>Marked up.</speak>"},
+        ):
+            await prisma.models.TTSRequest.prisma().create(
+                data={"userId": "user", **data}
+            )
+        return await project.list_tts_history_service.list_tts_history(
+            "user", None, None
+        )
+
+    history = asyncio.run(run())
+
+    flags = {entry.text_preview: entry.ssml for entry in history.entries}
+    assert flags == {
+        "Plain text.": False,
+        "Legacy plain text.": False,
+        "<speak>Marked up.</speak>": True,
+    }
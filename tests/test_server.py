@@ -0,0 +1,121 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import httpx
+import project.server
+import project.speech_rendering
+import project.update_voice_profile_service
+
+
+@asynccontextmanager
+async def _client():
+    async with project.server.lifespan(project.server.app):
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=project.server.app),
+            base_url="http://test",
+        ) as client:
+            yield client
+
+
+async def _register(client: httpx.AsyncClient, email: str):
+    """
+    Registers and logs in a user, returning their id and the headers authenticating them.
+    """
+    credentials = {"email": email, "password": "correct horse battery"}
+    response = await client.post("/users/register", params=credentials)
+    response.raise_for_status()
+    user_id = response.json()["user_id"]
+    response = await client.post("/users/login", params=credentials)
+    response.raise_for_status()
+    token = response.json()["access_token"]
+    return user_id, {"Authorization": f"Bearer {token}"}
+
+
+def test_synthesize_with_only_text_uses_the_voice_profile(database, monkeypatch):
+    voices = []
+
+    async def render(text, voice_type, speed, pitch, volume, **kwargs):
+        voices.append((voice_type, speed, pitch, volume))
+        return project.speech_rendering.RenderedAudio(
+            name="ab/cd/abcd.wav", file_type="WAV", mime_type="audio/wav"
+        )
+
+    monkeypatch.setattr(project.speech_rendering, "render_speech", render)
+
+    async def run():
+        async with _client() as client:
+            user_id, headers = await _register(client, "profile@example.com")
+            response = await client.post(
+                "/voice/customize",
+                params={
+                    "user_id": user_id,
+                    "voice_type": "female",
+                    "speed": 1.5,
+                    "pitch": 0.8,
+                    "volume": 0.6,
+                },
+                headers=headers,
+            )
+            response.raise_for_status()
+            return await client.post(
+                "/tts/synthesize",
+                params={"user_id": user_id, "text_input": "Hello there."},
+                headers=headers,
+            )
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 200
+    assert response.json()["success"] is True
+    assert voices == [("female", 1.5, 0.8, 0.6)]
+
+
+def test_stream_rejects_an_unknown_output_format(database):
+    async def run():
+        async with _client() as client:
+            user_id, headers = await _register(client, "flac@example.com")
+            return await client.post(
+                "/tts/synthesize/stream",
+                params={
+                    "user_id": user_id,
+                    "text_input": "Hello there.",
+                    "output_format": "flac",
+                },
+                headers=headers,
+            )
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 400
+    assert "Unsupported output format 'flac'" in response.json()["error"]
+
+
+def test_unexpected_errors_are_reported_as_json(database, monkeypatch):
+    async def update_voice_profile(*args):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(
+        project.update_voice_profile_service,
+        "update_voice_profile",
+        update_voice_profile,
+    )
+
+    async def run():
+        async with _client() as client:
+            user_id, headers = await _register(client, "down@example.com")
+            return await client.post(
+                "/voice/customize",
+                params={
+                    "user_id": user_id,
+                    "voice_type": "female",
+                    "speed": 1.0,
+                    "pitch": 1.0,
+                    "volume": 1.0,
+                },
+                headers=headers,
+            )
+
+    response = asyncio.run(run())
+
+    assert response.status_code == 500
+    assert response.json() == {"error": "database is down"}
@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import prisma.enums
+import prisma.models
+import project.speech_rendering
+import project.synthesis_jobs
+
+Status = prisma.enums.TTSRequestStatus
+
+
+async def _status(request_id: str) -> Status:
+    request = await prisma.models.TTSRequest.prisma().find_unique(
+        where={"id": request_id}
+    )
+    return request.status
+
+
+def _scheduler() -> project.synthesis_jobs.SynthesisJobScheduler:
+    return project.synthesis_jobs.SynthesisJobScheduler(
+        backend=project.synthesis_jobs.InMemoryJobQueueBackend(maxsize=4),
+        concurrency=1,
+        heartbeat_seconds=15,
+        lease_seconds=60,
+    )
+
+
+async def _run_job() -> prisma.models.TTSRequest:
+    """
+    Queues one job through the in-process backend and returns its request once the scheduler
+    has recorded the outcome.
+    """
+    scheduler = _scheduler()
+    await scheduler.start()
+    try:
+        request = await prisma.models.TTSRequest.prisma().create(
+            data={"textInput": "Hello there."}
+        )
+        assert request.status == Status.PENDING
+        await scheduler.enqueue(
+            project.synthesis_jobs.QueuedSynthesis(
+                request_id=request.id, text=request.textInput, user_id="user"
+            )
+        )
+        async with asyncio.timeout(5):
+            while await _status(request.id) in (Status.PENDING, Status.RUNNING):
+                await asyncio.sleep(0.01)
+    finally:
+        await scheduler.stop()
+    return await prisma.models.TTSRequest.prisma().find_unique(
+        where={"id": request.id}, include={"AudioOutput": True}
+    )
+
+
+def test_job_moves_from_pending_through_running_to_done(database, monkeypatch):
+    seen = []
+
+    async def render(text, *args, **kwargs):
+        (request,) = await prisma.models.TTSRequest.prisma().find_many(
+            where={"textInput": text}
+        )
+        seen.append(request.status)
+        return project.speech_rendering.RenderedAudio(
+            name="ab/cd/abcd.wav", file_type="WAV", mime_type="audio/wav"
+        )
+
+    monkeypatch.setattr(project.speech_rendering, "render_speech", render)
+    request = asyncio.run(_run_job())
+
+    assert seen == [Status.RUNNING]
+    assert request.status == Status.DONE
+    assert request.errorMessage is None
+    assert request.AudioOutput.filePath == "ab/cd/abcd.wav"
+    assert request.AudioOutput.fileType == prisma.enums.AudioFileType.WAV
+
+
+def test_job_moves_from_pending_through_running_to_failed(database, monkeypatch):
+    seen = []
+
+    async def render(text, *args, **kwargs):
+        (request,) = await prisma.models.TTSRequest.prisma().find_many(
+            where={"textInput": text}
+        )
+        seen.append(request.status)
+        raise RuntimeError("engine crashed")
+
+    monkeypatch.setattr(project.speech_rendering, "render_speech", render)
+    request = asyncio.run(_run_job())
+
+    assert seen == [Status.RUNNING]
+    assert request.status == Status.FAILED
+    assert request.errorMessage == "engine crashed"
+    assert request.AudioOutput is None
+
+
+def test_start_fails_only_jobs_whose_lease_expired(database):
+    async def run():
+        stale = await prisma.models.TTSRequest.prisma().create(
+            data={
+                "textInput": "Left behind.",
+                "status": Status.RUNNING,
+                "heartbeatAt": datetime.now(timezone.utc) - timedelta(minutes=5),
+            }
+        )
+        # Held by another process that is still alive and refreshing its heartbeat.
+        live = await prisma.models.TTSRequest.prisma().create(
+            data={"textInput": "Still queued elsewhere."}
+        )
+        scheduler = _scheduler()
+        await scheduler.start()
+        await scheduler.stop()
+        return await _status(stale.id), await _status(live.id)
+
+    stale_status, live_status = asyncio.run(run())
+
+    assert stale_status == Status.FAILED
+    assert live_status == Status.PENDING
@@ -0,0 +1,28 @@
+import project.text_normalization
+import pytest
+
+
+@pytest.mark.parametrize(
+    "sentence, spoken",
+    [
+        # A version number is not a decimal followed by stray digits.
+        ("Version 3.14.15 is out.", "Version 3.14.15 is out."),
+        ("Pi is 3.14.", "Pi is three point one four."),
+        # A phone number is not a year.
+        ("Call 555-1234 now.", "Call five five five, one two three four now."),
+        ("Call 2015-1234 now.", "Call two zero one five, one two three four now."),
+        ("It ran 1990-1995.", "It ran nineteen ninety to nineteen ninety-five."),
+        ("Born in 1984, she left.", "Born in nineteen eighty-four, she left."),
+        # A currency amount does not swallow the comma after it.
+        ("It costs $1, roughly.", "It costs one dollar, roughly."),
+        ("Pay $1,000 now.", "Pay one thousand dollars now."),
+        # Thousands separators are followed by exactly three digits.
+        ("It was 10,00 euros.", "It was 10,00 euros."),
+        (
+            "Count 1,234 items.",
+            "Count one thousand two hundred thirty-four items.",
+        ),
+    ],
+)
+def test_normalize_sentence(sentence, spoken):
+    assert project.text_normalization.normalize_sentence(sentence) == spoken